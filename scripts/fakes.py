@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+################################################################################
+# GARDEN AUTOMATION MONITOR FAKES
+# Local stand-ins for Home Assistant, the ESP32 fleet, notify services and
+# the MQTT broker, shared by the tests and the benchmarks
+# By Brian Kuzdas - 03/02/2024 - Copyright (c) 2024 Brian Kuzdas
+################################################################################
+#
+# PSEUDO CODE OVERVIEW:
+# 1. Each fake listens on a free localhost port (threads, no real network)
+# 2. Tests and benchmarks point a monitor component at it
+# 3. They read back what the fake received or change what it answers
+#
+# COMMON LANGUAGE EXPLANATION:
+# Pretend versions of Home Assistant, the ESP32 nodes and Mosquitto, small
+# enough to start in a test and fast enough to stand in for hundreds of nodes.
+#
+# USAGE:
+#   from fakes import FakeFleetServer
+#   server = FakeFleetServer(["esp32-garden-zone-a"])
+#   ... SystemMonitor(server.url, ...) ...
+#   server.close()
+#
+################################################################################
+
+import base64
+import contextlib
+import hashlib
+import json
+import random
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+################################################################################
+# FAKE FLEET SERVER
+# PSEUDO CODE:
+#   GET /api/               -> API running
+#   GET /api/states         -> one status entity per fake ESP32 node
+#   GET /api/states/<id>    -> single entity or 404
+#   GET /device/<name>/     -> node web server, answers after `latency`
+#   EVERY /api/ request     -> recorded in `paths`, waits `api_latency`, fails
+#                              with 503 at `error_rate`
+#                              (and always while `fail_next` > 0, counting down)
+#   set_state()             -> add or change one entity (sensors, switches, ...)
+#   PATHS in `stalls`       -> wait that many seconds first (a stuck upstream)
+#   PATHS in `trickles`     -> send one body byte per second for that many
+#                              seconds (no read timeout ever fires)
+################################################################################
+
+class _FleetHTTPServer(ThreadingHTTPServer):
+    """Threaded server with a listen backlog big enough for a whole fleet"""
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        """Clients gone mid-response (killed check workers) are expected, not errors"""
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class FakeFleetServer:
+    """
+    Local HTTP server standing in for Home Assistant and the ESP32 fleet
+
+    Pseudo Code:
+    GENERATE one online status entity per device
+    SERVE HA REST endpoints and per-device web pages on one port
+    SLEEP `latency` seconds before answering device requests
+    SLEEP `api_latency`, then fail `error_rate` of HA API requests with 503
+    SLEEP `stalls[path]` seconds before answering a stalled path
+    DRIP a trickled path's answer one byte per second for `trickles[path]` seconds
+    """
+
+    def __init__(self, devices: List[str], latency: float = 0.05,
+                 api_latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        now = datetime.now().isoformat()
+        self.latency = latency
+        self.api_latency = api_latency
+        self.error_rate = error_rate
+        self.api_requests = 0
+        self.api_errors = 0
+        self.paths: List[str] = []
+        self.fail_next = 0
+        self.stalls: Dict[str, float] = {}
+        self.trickles: Dict[str, float] = {}
+        self._random = random.Random(seed)
+        self.states: Dict[str, Dict] = {}
+        for device in devices:
+            entity_id = f"binary_sensor.{device.replace('-', '_')}_status"
+            self.states[entity_id] = {
+                "entity_id": entity_id,
+                "state": "on",
+                "last_updated": now,
+                "attributes": {}
+            }
+
+        fleet = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, code, body):
+                payload = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _trickle(self, seconds):
+                self.send_response(200)
+                self.send_header("Content-Length", str(int(seconds)))
+                self.end_headers()
+                for _ in range(int(seconds)):
+                    self.wfile.write(b" ")
+                    time.sleep(1)
+
+            def do_GET(self):
+                if self.path in fleet.trickles:
+                    return self._trickle(fleet.trickles[self.path])
+                if self.path in fleet.stalls:
+                    time.sleep(fleet.stalls[self.path])
+                if self.path.startswith("/device/"):
+                    time.sleep(fleet.latency)
+                    return self._send_json(200, {"status": "ok"})
+                fleet.api_requests += 1
+                fleet.paths.append(self.path)
+                if fleet.api_latency:
+                    time.sleep(fleet.api_latency)
+                if fleet.fail_next or (fleet.error_rate and fleet._random.random() < fleet.error_rate):
+                    fleet.fail_next = max(fleet.fail_next - 1, 0)
+                    fleet.api_errors += 1
+                    return self._send_json(503, {"message": "Service unavailable (injected)"})
+                if self.path == "/api/":
+                    return self._send_json(200, {"message": "API running."})
+                if self.path == "/api/states":
+                    return self._send_json(200, list(fleet.states.values()))
+                if self.path.startswith("/api/states/"):
+                    state = fleet.states.get(self.path[len("/api/states/"):])
+                    if state:
+                        return self._send_json(200, state)
+                return self._send_json(404, {"message": "Entity not found."})
+
+        self.server = _FleetHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def set_state(self, entity_id: str, state: str, **attributes):
+        """Add or change one entity, updated now"""
+        now = datetime.now().isoformat()
+        self.states[entity_id] = {
+            "entity_id": entity_id,
+            "state": state,
+            "last_updated": now,
+            "last_changed": now,
+            "attributes": attributes
+        }
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+################################################################################
+# FAKE HOME ASSISTANT WEBSOCKET SERVER
+# PSEUDO CODE:
+#   HTTP upgrade handshake -> auth_required -> auth -> auth_ok
+#   subscribe_events        -> result, remember subscription id
+#   get_states              -> result with all states
+#   push_state()            -> state_changed event to every subscriber
+#   drop_connections()      -> close sockets (client must reconnect)
+################################################################################
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def _ws_recv(sock) -> str:
+    """Read one (masked) client text frame, returns '' on close"""
+    header = sock.recv(2)
+    if len(header) < 2:
+        return ""
+    opcode, length = header[0] & 0x0F, header[1] & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", sock.recv(2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", sock.recv(8))[0]
+    mask = sock.recv(4) if header[1] & 0x80 else b"\0\0\0\0"
+    payload = b""
+    while len(payload) < length:
+        chunk = sock.recv(length - len(payload))
+        if not chunk:
+            return ""
+        payload += chunk
+    if opcode == 0x8:
+        return ""
+    return bytes(b ^ mask[i % 4] for i, b in enumerate(payload)).decode()
+
+
+def _ws_frame(text: str) -> bytes:
+    """Build one unmasked server text frame"""
+    payload = text.encode()
+    if len(payload) < 126:
+        header = struct.pack(">BB", 0x81, len(payload))
+    elif len(payload) < 65536:
+        header = struct.pack(">BBH", 0x81, 126, len(payload))
+    else:
+        header = struct.pack(">BBQ", 0x81, 127, len(payload))
+    return header + payload
+
+
+class FakeHAWebSocketServer:
+    """
+    Local stand-in for the Home Assistant WebSocket API
+
+    Pseudo Code:
+    ACCEPT connections, complete handshake and auth
+    ANSWER subscribe_events and get_states from self.states
+    BROADCAST state_changed events on push_state()
+    """
+
+    def __init__(self, states: Dict[str, Dict], token: str = "bench-token"):
+        self.states = {entity_id: dict(state) for entity_id, state in states.items()}
+        self.token = token
+        self.lock = threading.Lock()
+        self.clients: Dict[socket.socket, int] = {}
+        self.connections = 0
+        self.get_states_calls = 0
+
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                sock = self.request
+                request = b""
+                while b"\r\n\r\n" not in request:
+                    chunk = sock.recv(1024)
+                    if not chunk:
+                        return
+                    request += chunk
+                headers = dict(
+                    line.split(": ", 1) for line in request.decode().split("\r\n")[1:] if ": " in line
+                )
+                accept = base64.b64encode(hashlib.sha1(
+                    (headers.get("Sec-WebSocket-Key", "") + _WS_GUID).encode()).digest()).decode()
+                sock.sendall((
+                    "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                    f"Connection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+                server.connections += 1
+
+                server._send(sock, {"type": "auth_required"})
+                auth = json.loads(_ws_recv(sock) or "{}")
+                if auth.get("access_token") != server.token:
+                    server._send(sock, {"type": "auth_invalid", "message": "Invalid access token"})
+                    return
+                server._send(sock, {"type": "auth_ok"})
+
+                while True:
+                    try:
+                        raw = _ws_recv(sock)
+                    except OSError:
+                        break
+                    if not raw:
+                        break
+                    message = json.loads(raw)
+                    reply = {"id": message["id"], "type": "result", "success": True, "result": None}
+                    if message["type"] == "subscribe_events":
+                        with server.lock:
+                            server.clients[sock] = message["id"]
+                    elif message["type"] == "get_states":
+                        server.get_states_calls += 1
+                        with server.lock:
+                            reply["result"] = list(server.states.values())
+                    elif message["type"] == "ping":
+                        reply = {"id": message["id"], "type": "pong"}
+                    server._send(sock, reply)
+
+                with server.lock:
+                    server.clients.pop(sock, None)
+
+        self.server = _FleetTCPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _send(self, sock, message: Dict):
+        with self.lock:
+            sock.sendall(_ws_frame(json.dumps(message)))
+
+    def push_state(self, entity_id: str, state: str):
+        """Change one entity and broadcast a state_changed event"""
+        with self.lock:
+            old_state = self.states.get(entity_id)
+            new_state = dict(old_state or {"entity_id": entity_id, "attributes": {}},
+                             state=state, last_updated=datetime.now().isoformat())
+            self.states[entity_id] = new_state
+            subscribers = list(self.clients.items())
+        for sock, subscription_id in subscribers:
+            event = {"id": subscription_id, "type": "event", "event": {
+                "event_type": "state_changed",
+                "data": {"entity_id": entity_id, "old_state": old_state, "new_state": new_state}
+            }}
+            try:
+                self._send(sock, event)
+            except OSError:
+                pass
+
+    def drop_connections(self):
+        """Close every client socket, as an HA restart would"""
+        with self.lock:
+            sockets = list(self.clients)
+            self.clients.clear()
+        for sock in sockets:
+            with contextlib.suppress(OSError):
+                sock.shutdown(socket.SHUT_RDWR)
+
+    def close(self):
+        self.drop_connections()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _FleetTCPServer(socketserver.ThreadingTCPServer):
+    """Threaded TCP server for the fake WebSocket API"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+################################################################################
+# FAKE NOTIFY ENDPOINT
+# PSEUDO CODE:
+#   POST /api/services/notify/<service> -> sleep `latency`, record body, 200
+################################################################################
+
+class FakeNotifyServer:
+    """Local stand-in for Home Assistant notify services (slow on purpose)"""
+
+    def __init__(self, latency: float = 1.0):
+        self.latency = latency
+        self.received: List[Dict] = []
+        notify = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                time.sleep(notify.latency)
+                notify.received.append({"path": self.path, **body})
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"[]")
+
+        self.server = _FleetHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+################################################################################
+# FAKE MQTT BROKER
+# PSEUDO CODE:
+#   MQTT 3.1.1 subset over TCP, one thread per client
+#   CONNECT -> CONNACK, SUBSCRIBE -> SUBACK (QoS 0), PINGREQ -> PINGRESP
+#   PUBLISH -> PUBACK for QoS 1, forward to every matching subscription
+#   RETAINED messages replayed to new subscribers
+#   drop_connections() -> close sockets (clients must reconnect)
+################################################################################
+
+def _recv_exact(sock, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("client closed connection")
+        data += chunk
+    return data
+
+
+def _mqtt_remaining_length(sock) -> int:
+    """Decode MQTT variable-length 'remaining length' field"""
+    multiplier, value = 1, 0
+    while True:
+        byte = _recv_exact(sock, 1)[0]
+        value += (byte & 0x7F) * multiplier
+        multiplier *= 128
+        if not byte & 0x80:
+            return value
+
+
+def _mqtt_packet(first_byte: int, body: bytes) -> bytes:
+    length, encoded = len(body), bytearray()
+    while True:
+        digit, length = length % 128, length // 128
+        encoded.append(digit | (0x80 if length else 0))
+        if not length:
+            return bytes([first_byte]) + bytes(encoded) + body
+
+
+def _topic_matches(topic_filter: str, topic: str) -> bool:
+    """MQTT wildcard match (+ one level, # the rest)"""
+    filter_parts, topic_parts = topic_filter.split("/"), topic.split("/")
+    for index, part in enumerate(filter_parts):
+        if part == "#":
+            return True
+        if index >= len(topic_parts) or part not in ("+", topic_parts[index]):
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+class FakeMqttBroker:
+    """
+    Local stand-in for Mosquitto, enough for the monitor's MQTT check
+
+    Pseudo Code:
+    ACCEPT clients, answer CONNECT/SUBSCRIBE/PINGREQ
+    ROUTE each PUBLISH to matching subscribers (QoS 0 delivery)
+    KEEP retained messages per topic
+    """
+
+    def __init__(self, port: int = 0):
+        self.lock = threading.Lock()
+        self.connections = set()
+        self.subscriptions: Dict[socket.socket, List[str]] = {}
+        self.retained: Dict[str, bytes] = {}
+        self.messages_routed = 0
+        broker = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                sock = self.request
+                with broker.lock:
+                    broker.connections.add(sock)
+                try:
+                    while True:
+                        header = _recv_exact(sock, 1)[0]
+                        length = _mqtt_remaining_length(sock)
+                        body = _recv_exact(sock, length) if length else b""
+                        packet_type = header >> 4
+                        if packet_type == 1:      # CONNECT
+                            sock.sendall(b"\x20\x02\x00\x00")
+                        elif packet_type == 3:    # PUBLISH
+                            topic_length = struct.unpack("!H", body[:2])[0]
+                            topic = body[2:2 + topic_length].decode()
+                            offset, qos = 2 + topic_length, (header >> 1) & 3
+                            if qos:
+                                sock.sendall((b"\x40\x02" if qos == 1 else b"\x50\x02") + body[offset:offset + 2])
+                                offset += 2
+                            broker.publish(topic, body[offset:], retain=bool(header & 1))
+                        elif packet_type == 8:    # SUBSCRIBE
+                            filters, index = [], 2
+                            while index < len(body):
+                                filter_length = struct.unpack("!H", body[index:index + 2])[0]
+                                filters.append(body[index + 2:index + 2 + filter_length].decode())
+                                index += 3 + filter_length
+                            with broker.lock:
+                                broker.subscriptions.setdefault(sock, []).extend(filters)
+                                retained = list(broker.retained.items())
+                            sock.sendall(_mqtt_packet(0x90, body[:2] + bytes(len(filters))))
+                            for topic, payload in retained:
+                                if any(_topic_matches(topic_filter, topic) for topic_filter in filters):
+                                    encoded = topic.encode()
+                                    sock.sendall(_mqtt_packet(0x31, struct.pack("!H", len(encoded)) + encoded + payload))
+                        elif packet_type == 12:   # PINGREQ
+                            sock.sendall(b"\xd0\x00")
+                        elif packet_type == 14:   # DISCONNECT
+                            break
+                except (ConnectionError, OSError):
+                    pass
+                finally:
+                    with broker.lock:
+                        broker.connections.discard(sock)
+                        broker.subscriptions.pop(sock, None)
+
+        self.server = _FleetTCPServer(("127.0.0.1", port), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def publish(self, topic: str, payload: bytes, retain: bool = False):
+        """Deliver one message to every matching subscriber"""
+        encoded = topic.encode()
+        packet = _mqtt_packet(0x30, struct.pack("!H", len(encoded)) + encoded + payload)
+        with self.lock:
+            if retain:
+                self.retained[topic] = payload
+            targets = [sock for sock, filters in self.subscriptions.items()
+                       if any(_topic_matches(topic_filter, topic) for topic_filter in filters)]
+        for sock in targets:
+            with contextlib.suppress(OSError):
+                sock.sendall(packet)
+                self.messages_routed += 1
+
+    def drop_connections(self):
+        """Close every client socket, as a broker restart would"""
+        with self.lock:
+            sockets = list(self.connections)
+        for sock in sockets:
+            with contextlib.suppress(OSError):
+                sock.shutdown(socket.SHUT_RDWR)
+
+    def close(self):
+        self.drop_connections()
+        self.server.shutdown()
+        self.server.server_close()
+
+################################################################################
+# HELPERS
+################################################################################
+
+def wait_for(condition, timeout: float) -> bool:
+    """Poll condition until it is true or timeout seconds pass (returns its last value)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return condition()
+
+
+def alert_results(zone_a_online: bool = True, tank_status: str = "OK") -> Dict:
+    """Synthetic results dict shaped like SystemMonitor.results"""
+    sensor_status = "OK" if zone_a_online else "STALE"
+    return {
+        "overall_status": "HEALTHY" if zone_a_online and tank_status == "OK" else "DEGRADED",
+        "checks": {
+            "home_assistant": {"status": "OK"},
+            "esp32_devices": {"status": "OK", "devices": {
+                "esp32-garden-zone-a": {"online": zone_a_online},
+                "esp32-utility-control": {"online": True}
+            }},
+            "sensors": {"status": "OK", "sensors": {
+                "sensor.zone_a_soil_moisture": {"value": "42", "status": sensor_status},
+                "sensor.zone_a_flow_rate": {"value": "0", "status": sensor_status},
+                "sensor.water_tank_level": {"value": "80", "status": tank_status}
+            }},
+            "switches": {"status": "OK", "switches": {
+                "switch.zone_a_valve": {"state": "off", "status": "OK" if zone_a_online else "ERROR"}
+            }}
+        }
+    }
@@ -24,25 +24,102 @@
 #   python3 monitor.py              # Run once, print report
 #   python3 monitor.py --continuous # Run forever, check every 5 minutes
 #   python3 monitor.py --json       # Output JSON for logging systems
+#   python3 monitor.py --engine async # Run all checks concurrently
+#   python3 monitor.py --stream     # Watch MQTT in real time (no HA polling)
+#   python3 monitor.py history sensor.zone_a_soil_moisture --since 7d
+#   python3 monitor.py --discover ha --probe-devices  # Whole ESP32 fleet
+#   python3 monitor.py --continuous --scheduler adaptive  # Per-check intervals
+#   python3 monitor.py --serve-metrics 9105  # Prometheus /metrics endpoint (localhost)
+#   python3 monitor.py --trace cycles.json   # Timing spans for chrome://tracing
+#   python3 monitor.py --websocket --continuous  # Push-based state tracking
+#   python3 monitor.py analyze --since 30d   # Irrigation efficiency (needs numpy)
+#   python3 monitor.py --continuous --alert-notify notify.email  # Alert on changes
+#   python3 monitor.py --sites sites.yaml --continuous  # Many gardens, one process
+#   python3 monitor.py --checks sensors,devices --state-dir  # Fast cron runs, report changes
+#   python3 monitor.py --continuous --changes-only --json  # JSON Lines of changed entities
+#   python3 monitor.py --stream --water-db garden_water.db  # Liters per zone per day/season
+#   python3 monitor.py --rules health_rules.yaml  # Per-entity limits from YAML (needs pyyaml)
+#   python3 monitor.py --audit automations.yaml --state-dir  # Missed/late/failed automation runs
+#   python3 monitor.py mqtt-bench --qos 0 1 --clients 1 10  # Broker throughput + latency percentiles
+#   python3 monitor.py --continuous --isolation process  # Hung checks cut off, cycles end on time
 #
 ################################################################################
 
 import argparse
+import bisect
+import contextlib
+import faulthandler
+import fnmatch
+import importlib.util
+import io
 import json
+import heapq
+import math
+import multiprocessing
+import os
+import queue
+import random
+import re
+import signal
+import sqlite3
 import sys
+import threading
 import time
-from datetime import datetime, timedelta
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
 from typing import Dict, List, Optional
 
+
+def _lazy_import(name: str):
+    """
+    Import a module on first attribute access
+    
+    Pseudo Code:
+    FIND module (fails now if the package is not installed)
+    REGISTER a module object whose code runs the first time it is used
+    
+    COMMON LANGUAGE:
+    Cron starts this script over and over. Loading requests, paho and
+    asyncio takes longer than a cached check, so they are only loaded
+    by the checks that actually use them.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'")
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+_LAZY_IMPORT_LOCK = threading.Lock()
+
+
+def _ensure_loaded(module):
+    """Finish a lazy import under a lock (LazyLoader is not thread-safe before Python 3.12)"""
+    with _LAZY_IMPORT_LOCK:
+        getattr(module, "__name__")   # First attribute access runs the real import
+    return module
+
+
 # Third-party imports (install with: pip3 install requests paho-mqtt)
 try:
-    import requests
-    import paho.mqtt.client as mqtt
+    requests = _lazy_import("requests")
+    mqtt = _lazy_import("paho.mqtt.client")
 except ImportError:
     print("ERROR: Required packages not installed")
     print("Install with: pip3 install requests paho-mqtt")
     sys.exit(1)
 
+# Only needed by the async engine
+asyncio = _lazy_import("asyncio")
+
 ################################################################################
 # CONFIGURATION
 ################################################################################
@@ -56,12 +133,222 @@ MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
 MQTT_USERNAME = ""
 MQTT_PASSWORD = ""
+MQTT_PING_TOPIC = "garden/monitor/ping"  # Monitor-owned round-trip topic
+MQTT_CONNECT_TIMEOUT = 5     # Seconds to wait for CONNACK
+MQTT_PING_TIMEOUT = 2        # Seconds to wait for ping echo
+MQTT_SLOW_PING_MS = 500      # Ping RTT above this marks broker DEGRADED
+
+# MQTT Broker Benchmark (mqtt-bench) and $SYS Statistics
+MQTT_BENCH_TOPIC = "garden/monitor/bench"  # Bench messages go to <topic>/<run id>/<publisher>
+MQTT_BENCH_TIMEOUT = 30      # Seconds per scenario before undelivered messages count as lost
+MQTT_SYS_SECONDS = 12        # Wait for one $SYS round (Mosquitto sys_interval defaults to 10s)
+MQTT_SYS_STATS = {           # Report name -> Mosquitto $SYS topic
+    "version": "$SYS/broker/version",
+    "uptime_seconds": "$SYS/broker/uptime",
+    "clients_connected": "$SYS/broker/clients/connected",
+    "clients_maximum": "$SYS/broker/clients/maximum",
+    "subscriptions": "$SYS/broker/subscriptions/count",
+    "received_per_min": "$SYS/broker/load/messages/received/1min",
+    "sent_per_min": "$SYS/broker/load/messages/sent/1min",
+    "dropped_per_min": "$SYS/broker/load/publish/dropped/1min",
+    "dropped_total": "$SYS/broker/publish/messages/dropped",
+    "stored_messages": "$SYS/broker/store/messages/count",
+    "heap_current": "$SYS/broker/heap/current",
+    "heap_maximum": "$SYS/broker/heap/maximum"
+}
 
 # Monitoring Thresholds
 SENSOR_TIMEOUT_MINUTES = 15  # Alert if sensor hasn't updated in 15 min
 EXPECTED_ESP32_COUNT = 3     # Number of ESP32 devices expected
 EXPECTED_AUTOMATIONS = 8     # Number of critical automations
 
+# WebSocket State Tracking (--websocket)
+HA_WS_RECV_TIMEOUT = 30      # Seconds of silence before sending a ping
+HA_WS_SYNC_TIMEOUT = 10      # Seconds to wait for the first get_states at startup
+HA_WS_RECONNECT_MAX = 60     # Longest wait between reconnect attempts
+
+# Async Engine Settings
+CHECK_TIMEOUT_SECONDS = 15   # Deadline for any single check (async engine)
+HTTP_POOL_SIZE = 10          # Shared HTTP connections / worker threads
+ASYNC_ABANDONED_LIMIT = 5    # Timed-out checks still holding workers before the pool is replaced
+
+# HA HTTP Client Settings
+HTTP_CONNECT_TIMEOUT = 3.05  # Seconds to open a connection (HA down = fail fast)
+HTTP_READ_TIMEOUT = 10       # Seconds to wait for a response once connected
+HTTP_RETRIES = 2             # Extra attempts for GET requests (idempotent only)
+HTTP_RETRY_BACKOFF = 0.25    # Base retry delay, doubled per attempt, full jitter
+HTTP_RETRY_STATUSES = [502, 503, 504]  # Proxy / restart responses worth retrying
+BREAKER_FAILURE_THRESHOLD = 3  # Consecutive failures before HA is treated as down
+BREAKER_RESET_SECONDS = 30   # Wait before letting one trial request through
+
+# Check registry: short name -> (SystemMonitor method, results["checks"] key)
+CHECKS = {
+    "ha": ("check_home_assistant_connection", "home_assistant"),
+    "mqtt": ("check_mqtt_connection", "mqtt"),
+    "devices": ("check_esp32_devices", "esp32_devices"),
+    "sensors": ("check_sensors", "sensors"),
+    "switches": ("check_switches", "switches"),
+    "automations": ("check_automations", "automations"),
+    "rules": ("check_rules", "rules"),   # Only runs with --rules FILE
+    "audit": ("check_automation_audit", "automation_audit"),   # Only runs with --audit
+}
+ENTITY_CHECKS = ["devices", "sensors", "switches", "automations", "rules", "audit"]  # Need HA state snapshot
+
+# Adaptive Scheduler Settings (--scheduler adaptive)
+CHECK_INTERVALS = {          # Normal interval per check, in seconds
+    "ha": 60,
+    "mqtt": 60,
+    "devices": 300,
+    "sensors": 300,
+    "switches": 900,
+    "automations": 900,
+    "rules": 300,
+    "audit": 600
+}
+SCHEDULE_MIN_INTERVAL = 30   # Fastest any check is re-run
+SCHEDULE_DEGRADED_FACTOR = 0.25  # Degraded checks re-run at 1/4 of normal interval
+SCHEDULE_MAX_BACKOFF = 1800  # Longest wait between retries of unreachable endpoints
+
+# Check Isolation Settings (--isolation)
+CHECK_GROUPS = {             # One worker per group; entity checks in a group share one state snapshot
+    "ha": ["ha"],
+    "mqtt": ["mqtt"],
+    "devices": ["devices"],  # Node probes can stall on mDNS; kept apart from the sensor checks
+    "entities": ["sensors", "switches", "automations", "rules", "audit"]
+}
+SUPERVISOR_CHECKS = ["sensors", "switches", "automations", "rules", "audit"]  # Judged by the supervisor's engines; workers only fetch
+CYCLE_BUDGET_SECONDS = 60    # Whole-cycle deadline; checks still running then are cut off as TIMEOUT
+WATCHDOG_GRACE_SECONDS = 30  # Continuous mode: exit (for the service manager to restart) this long past the budget
+WORKER_JOIN_SECONDS = 1      # Wait for a stopped worker process to exit before killing it
+
+# Streaming Mode Settings
+STREAM_MAX_ENTITIES = 2000   # Max non-critical entities kept in last-seen table
+STREAM_CHECKS = ["ha", "devices", "sensors", "switches"]  # Checks --stream answers from MQTT (+ rules stage)
+STREAM_TICK_SECONDS = 1.0    # Timer wheel resolution
+STREAM_WHEEL_SLOTS = 1024    # Timer wheel size (slots x tick = one rotation)
+HA_STATUS_TOPIC = "homeassistant/status"  # HA birth/will messages
+
+# ESPHome object ids that differ from the entity ids HA uses
+STREAM_ENTITY_ALIASES = {
+    "sensor.main_line_flow_rate": "sensor.main_flow_rate",
+}
+
+# Leak Detection Settings (streaming mode)
+LEAK_FLOW_SENSOR = "sensor.main_flow_rate"
+LEAK_ZONE_VALVES = ["switch.zone_a_valve", "switch.zone_b_valve"]
+LEAK_SHUTOFF_ENTITIES = [    # Same targets as leak_detection_emergency_shutoff
+    "switch.main_water_valve",
+    "switch.zone_a_valve",
+    "switch.zone_b_valve",
+    "switch.water_pump"
+]
+LEAK_IDLE_FLOW_LPM = 1.0     # Flow with all zone valves closed (ESPHome leak lambda)
+LEAK_MAX_FLOW_LPM = 25.0     # Absolute flow ceiling (HA leak automation)
+LEAK_BASELINE_FACTOR = 1.5   # Flow above baseline x factor is abnormal
+LEAK_STEP_LPM = 10.0         # Sample-to-sample jump treated as a burst
+LEAK_CONFIRM_SAMPLES = 2     # Consecutive abnormal samples before shutoff
+LEAK_WINDOW_SAMPLES = 24     # Rolling baseline window (24 x 5 s = 2 min)
+LEAK_VALVE_SETTLE_SECONDS = 15  # Ignore flow transients after valve changes
+
+# Water Accounting Settings (streaming mode, zones from ANALYZE_ZONES)
+WATER_DB = "garden_water.db"  # SQLite file for daily totals (--water-db)
+WATER_SAMPLE_SECONDS = 5     # Flow rate update_interval in the zone ESPHome configs
+WATER_LATE_FACTOR = 1.5      # Gap above sample x factor = missed sample(s), interpolated
+WATER_MAX_GAP_SECONDS = 300  # Longer gaps are still bridged but the interval is marked estimated
+WATER_FLUSH_SECONDS = 60     # How often pending totals are written to the database
+WATER_INTERVAL_HISTORY = 20  # Finished valve-open intervals kept for the report
+WATER_TOTAL_SENSORS = {      # Pulse counter totals (cross-check, resets when the node reboots)
+    "zone_a": "sensor.zone_a_total_water_used",
+    "zone_b": "sensor.zone_b_total_water_used",
+}
+
+# Anomaly Detection Settings (see docs/CALIBRATION.md "Anomaly Detection Limits")
+# range:    physically possible values (outside = broken sensor or wiring)
+# band:     normal operating values; a slow average stuck outside = drift
+# step:     largest believable change between two samples (None = no spike rule)
+# flatline: hours a reporting sensor may repeat the same value (None = never)
+ANOMALY_LIMITS = {
+    "sensor.zone_a_soil_moisture": {"range": (0, 100), "band": (5, 95), "step": 15, "flatline": 12},
+    "sensor.zone_b_soil_moisture": {"range": (0, 100), "band": (5, 95), "step": 15, "flatline": 12},
+    "sensor.water_tank_level": {"range": (0, 100), "band": None, "step": 20, "flatline": 48},
+    "sensor.main_flow_rate": {"range": (0, 30), "band": None, "step": None, "flatline": None},
+    "sensor.nws_weather_temperature": {"range": (-40, 120), "band": (-30, 105), "step": 15, "flatline": 12},
+}
+ANOMALY_WARMUP_SAMPLES = 10   # Samples before the spike rule is trusted
+ANOMALY_FAST_ALPHA = 0.2      # EWMA weight for the spike baseline (~5 samples)
+ANOMALY_SLOW_ALPHA = 0.01     # EWMA weight for the drift average (~100 samples)
+ANOMALY_SPIKE_SIGMA = 4.0     # Spike = beyond this many EW standard deviations
+ANOMALY_DRIFT_HOURS = 6       # Slow average outside the band this long = drift
+
+# Device Probe Settings
+DEVICE_PROBE_WORKERS = 128   # Max devices probed at the same time
+DEVICE_PROBE_TIMEOUT = 3     # Seconds per device probe
+DEVICE_URL_TEMPLATE = "http://{device}.local/"  # ESPHome web_server (port 80)
+DEVICE_STATUS_PATTERN = r"binary_sensor\.(esp32_\w+)_status"  # HA discovery
+MQTT_DISCOVERY_TOPIC = "homeassistant/+/+/+/config"  # MQTT discovery configs
+MQTT_DISCOVERY_SECONDS = 2   # Longest wait for SUBACK + retained discovery messages
+MQTT_DISCOVERY_QUIET_SECONDS = 0.25  # Retained burst is over once nothing arrived for this long
+
+# Metrics Exporter Settings (--serve-metrics)
+METRICS_LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]  # Seconds
+METRICS_BIND = "127.0.0.1"   # Listen address (0.0.0.0 lets other hosts scrape, unauthenticated)
+
+# Multi-Site Settings (--sites, needs: pip3 install pyyaml)
+FLEET_WORKERS = 16           # Sites checked at the same time
+FLEET_SITE_TIMEOUT = 60      # Seconds before a site's cycle is reported as TIMEOUT
+
+# Alert Settings (--alert-notify / --alert-mqtt-topic)
+ALERT_RATE_LIMIT = 6          # Notifications per channel per hour (burst size too)
+ALERT_QUEUE_SIZE = 100        # Pending notifications before the oldest are dropped
+ALERT_SEND_TIMEOUT = 10       # Seconds per notify call / MQTT publish
+ALERT_MQTT_TOPIC = "garden/monitor/alerts"
+ALERT_ROLLUP_CHECKS = ["esp32_devices", "sensors", "switches", "automations"]  # Alert per entity instead
+ALERT_DEVICE_ENTITIES = {     # Entity id prefixes that go down with each node
+    "esp32-garden-zone-a": ["sensor.zone_a_", "switch.zone_a_"],
+    "esp32-garden-zone-b": ["sensor.zone_b_", "switch.zone_b_"],
+    "esp32-utility-control": ["sensor.water_tank_", "sensor.main_", "switch.water_pump", "switch.main_water_valve"],
+}
+
+# History Store Settings
+HISTORY_DB = "garden_monitor_history.db"  # SQLite file for check history
+HISTORY_RETENTION_DAYS = 90  # Samples older than this are compacted away
+HISTORY_COMPACT_HOURS = 24   # How often retention compaction runs
+HISTORY_MMAP_BYTES = 64 * 1024 * 1024  # Memory-map reads up to 64 MB
+
+# Analytics Settings (analyze subcommand, needs: pip3 install numpy)
+ANALYZE_ZONES = {
+    "zone_a": {"valve": "switch.zone_a_valve", "flow": "sensor.zone_a_flow_rate",
+               "moisture": "sensor.zone_a_soil_moisture"},
+    "zone_b": {"valve": "switch.zone_b_valve", "flow": "sensor.zone_b_flow_rate",
+               "moisture": "sensor.zone_b_soil_moisture"},
+}
+ANALYZE_CHUNK_HOURS = 24      # History is fetched one day at a time
+ANALYZE_ENTITY_BATCH = 50     # Entities per /api/history/period request
+ANALYZE_STEP_SECONDS = 60     # Resolution of the common time grid
+ANALYZE_RECOVERY_HOURS = 6    # Look-ahead for soil moisture response after watering
+ANALYZE_RECOVERY_FRACTION = 0.9  # "Recovered" = 90% of the post-watering rise
+RECORDER_DB = "/config/home-assistant_v2.db"  # HA recorder (copy it, don't read it live)
+
+# Single-Shot State Cache (--state-dir)
+STATE_DIR = "~/.local/state/garden_monitor"  # Default when --state-dir has no value
+STATE_FILE = "last_cycle.json"  # Previous cycle's results, replaced atomically
+STATE_CACHE_TTL = 0          # Seconds a healthy check result may be reused (0 = always re-check)
+
+# Health Rules (--rules, needs: pip3 install pyyaml; see health_rules.yaml.example)
+RULE_SEVERITIES = ["DEGRADED", "ERROR"]  # Check status when a rule fails (default DEGRADED)
+RULE_INVALID_STATES = ["unknown", "unavailable", "none", "nan", ""]  # Fail every rule unless listed in state:
+
+# Automation Audit (--audit, needs: pip3 install pyyaml)
+AUDIT_AUTOMATIONS_FILE = "/config/automations.yaml"  # Default when --audit has no value
+AUDIT_STATE_FILE = "automation_audit.json"  # Logbook cursor + timeline, kept in --state-dir
+AUDIT_LOOKBACK_HOURS = 26    # First audit (no cursor yet) reads this much logbook
+AUDIT_REPORT_HOURS = 24      # Missed/late/failed runs stay in the report this long
+AUDIT_EARLY_SECONDS = 60     # A run this early still counts for its scheduled time
+AUDIT_LATE_SECONDS = 120     # Run later than this after its scheduled time = LATE
+AUDIT_MISS_SECONDS = 1800    # No run this long after its scheduled time = MISSED
+AUDIT_EFFECT_SECONDS = 60    # Entities an automation turns on/off must follow within this long
+AUDIT_RECORDER_LAG_SECONDS = 10  # Newest logbook seconds not read yet (recorder commits every 5s)
+
 # Component Names (adjust to match your configuration)
 ESP32_DEVICES = [
     "esp32-garden-zone-a",
@@ -91,6 +378,588 @@ CRITICAL_AUTOMATIONS = [
     "automation.low_water_tank_alert"
 ]
 
+################################################################################
+# CLASS: CircuitBreaker
+# PSEUDO CODE:
+#   CLOSED:    requests flow; N consecutive failures -> OPEN
+#   OPEN:      requests skipped immediately; after reset time -> HALF_OPEN
+#   HALF_OPEN: ONE trial request; success -> CLOSED, failure -> OPEN
+################################################################################
+
+class UpstreamDownError(ConnectionError):
+    """Raised instead of sending a request while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Stops calling Home Assistant once it is clearly unreachable
+    
+    COMMON LANGUAGE:
+    If three requests to Home Assistant fail in a row (each after its
+    retries) we stop asking for a while and report the remaining checks as
+    skipped, instead of waiting out a timeout for every single sensor.
+    """
+    
+    CLOSED, OPEN, HALF_OPEN = "CLOSED", "OPEN", "HALF_OPEN"
+    
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_total = 0
+        self.short_circuited = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        """True if a request may be sent now"""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.short_circuited += 1
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened_total += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+    
+    def is_open(self) -> bool:
+        return self.state != self.CLOSED
+    
+    def replay(self, outcomes: List[bool], short_circuited: int = 0):
+        """Apply outcomes a check worker's copy recorded (--isolation), in order"""
+        for ok in outcomes:
+            if ok:
+                self.record_success()
+            else:
+                self.record_failure()
+        with self._lock:
+            self.short_circuited += short_circuited
+    
+    def status(self) -> Dict:
+        """Breaker section for the report"""
+        retry_in = None
+        if self.state == self.OPEN:
+            retry_in = round(max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at)), 1)
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opened_total": self.opened_total,
+            "short_circuited_total": self.short_circuited,
+            "retry_in_seconds": retry_in
+        }
+
+################################################################################
+# CLASS: CycleTrace
+# PSEUDO CODE:
+#   ONE trace per monitoring cycle
+#   EACH check, HTTP request and MQTT operation records a span:
+#     name, category, start, duration, thread, details (bytes, status, ...)
+#   EXPORT spans in the report (timings.spans) or as Chrome trace events
+################################################################################
+
+class CycleTrace:
+    """
+    Lightweight span recorder for one monitoring cycle
+    
+    Pseudo Code:
+    WITH trace.span(name, category, details...) AS args:
+      DO work (may add details to args)
+    ON EXIT: record start, duration, thread; note exception type if raised
+    
+    COMMON LANGUAGE:
+    A stopwatch on every step of a check cycle, so when a cycle takes 30
+    seconds we can see exactly which request was waiting on what.
+    """
+    
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.wall_origin = time.time()
+        self.spans: List[Dict] = []
+        self._lock = threading.Lock()
+    
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, **args):
+        started = time.perf_counter()
+        try:
+            yield args
+        except BaseException as e:
+            args["error"] = type(e).__name__
+            raise
+        finally:
+            finished = time.perf_counter()
+            record = {
+                "name": name,
+                "cat": category,
+                "start_ms": round((started - self.origin) * 1000, 3),
+                "duration_ms": round((finished - started) * 1000, 3),
+                "thread": threading.current_thread().name,
+                "tid": threading.get_native_id(),
+                "args": args
+            }
+            with self._lock:
+                self.spans.append(record)
+    
+    def report(self) -> List[Dict]:
+        """Spans for the JSON report, in start order"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start_ms"])
+        return [{key: span[key] for key in ("name", "cat", "start_ms", "duration_ms", "thread", "args")}
+                for span in spans]
+    
+    def chrome_events(self) -> List[Dict]:
+        """Spans as Chrome trace-event 'complete' events (chrome://tracing, Perfetto)"""
+        origin_us = self.wall_origin * 1_000_000
+        with self._lock:
+            spans = list(self.spans)
+        return [
+            {
+                "name": span["name"],
+                "cat": span["cat"],
+                "ph": "X",
+                "ts": round(origin_us + span["start_ms"] * 1000),
+                "dur": round(span["duration_ms"] * 1000),
+                "pid": os.getpid(),
+                "tid": span["tid"],
+                "args": span["args"]
+            }
+            for span in spans
+        ]
+
+
+class TraceFileWriter:
+    """
+    Append each cycle's spans to a Chrome trace file
+    
+    Pseudo Code:
+    FIRST write opens the JSON array: [event, event, ...
+    LATER writes continue it: , event, event ...
+    (The closing ] is optional in the trace-event format, so the file
+     stays loadable while the monitor keeps appending.)
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+    
+    def write(self, events: List[Dict]):
+        if not events:
+            return
+        started = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        with open(self.path, "a") as trace_file:
+            trace_file.write(",\n" if started else "[\n")
+            trace_file.write(",\n".join(json.dumps(event) for event in events))
+
+################################################################################
+# CLASS: MqttProbe
+# PSEUDO CODE:
+#   Keep ONE MQTT connection open for the life of the monitor
+#   SIGNAL connected as soon as the broker sends CONNACK
+#   RECONNECT automatically if the broker drops us
+#   MEASURE round-trip time with a publish/subscribe ping
+################################################################################
+
+def _new_mqtt_client(client_id: str = ""):
+    """
+    Create a paho client whose callbacks take the paho-mqtt 2.x (VERSION2) arguments
+    
+    Pseudo Code:
+    paho 2.x -> client with CallbackAPIVersion.VERSION2
+    paho 1.x -> client whose callback setters translate the 1.x arguments
+    CALLBACKS in this file:
+      on_connect(client, userdata, flags, reason_code, properties)
+      on_subscribe(client, userdata, mid, reason_codes, properties)
+      on_disconnect(client, userdata, flags, reason_code, properties)
+      on_message(client, userdata, message)   (unchanged)
+    """
+    _ensure_loaded(mqtt)
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+    return _paho1_client_class()(client_id=client_id)
+
+
+# paho 1.x callback arguments -> VERSION2 arguments (reason codes stay plain ints)
+_PAHO1_CALLBACK_ADAPTERS = {
+    "on_connect": lambda callback: lambda client, userdata, flags, rc:
+        callback(client, userdata, flags, rc, None),
+    "on_subscribe": lambda callback: lambda client, userdata, mid, granted_qos:
+        callback(client, userdata, mid, list(granted_qos), None),
+    "on_disconnect": lambda callback: lambda client, userdata, rc:
+        callback(client, userdata, None, rc, None),
+}
+_PAHO1_CLIENT = None
+
+
+def _paho1_client_class():
+    """paho-mqtt 1.x Client whose on_connect/on_subscribe/on_disconnect accept VERSION2 callbacks"""
+    global _PAHO1_CLIENT
+    if _PAHO1_CLIENT is None:
+        def adapted(name, adapter):
+            setting = getattr(mqtt.Client, name)
+            return property(setting.fget,
+                            lambda client, callback: setting.fset(client, callback and adapter(callback)))
+        
+        _PAHO1_CLIENT = type("Paho1Client", (mqtt.Client,),
+                             {name: adapted(name, adapter) for name, adapter in _PAHO1_CALLBACK_ADAPTERS.items()})
+    return _PAHO1_CLIENT
+
+
+class MqttProbe:
+    """
+    Persistent, reconnecting MQTT connection used for broker health checks
+    
+    Pseudo Code:
+    START background network loop once
+    ON CONNACK: record connect latency, subscribe to ping topic + $SYS stats, SET connected
+    ON disconnect: CLEAR connected, paho reconnects with backoff
+    PING: publish unique token, wait for it to come back
+    
+    COMMON LANGUAGE:
+    Rather than dialing the broker from scratch every check and waiting a
+    fixed 2 seconds, we stay connected. A check then takes only as long as
+    the broker needs to answer.
+    """
+    
+    def __init__(self, broker: str, port: int, username: str = "", password: str = ""):
+        self.broker = broker
+        self.port = port
+        self.username = username
+        self.password = password
+        
+        self.client_id = f"garden-monitor-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.ping_topic = f"{MQTT_PING_TOPIC}/{self.client_id}"
+        
+        self.connected = threading.Event()
+        self._attempt_done = threading.Event()  # Set after CONNACK or connect failure
+        self._subscribed = threading.Event()
+        self._pong = threading.Event()
+        self._ping_token = None
+        self._connect_started = None
+        
+        self.connect_latency = None  # Seconds from connect attempt to CONNACK
+        self.last_error = None
+        self.client = None
+        self._sys_topics = {topic: name for name, topic in MQTT_SYS_STATS.items()}
+        self.broker_stats: Dict = {}  # Latest $SYS values (empty if the broker sends none)
+    
+    def start(self):
+        """
+        Begin connecting in the background
+        
+        Pseudo Code:
+        CREATE client with callbacks
+        CONNECT asynchronously (DNS and TCP happen on the loop thread)
+        START network loop thread
+        """
+        client = _new_mqtt_client(self.client_id)
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_subscribe = self._on_subscribe
+        client.on_message = self._on_message
+        client.on_connect_fail = self._on_connect_fail
+        
+        if self.username and self.password:
+            client.username_pw_set(self.username, self.password)
+        
+        client.reconnect_delay_set(min_delay=1, max_delay=30)
+        
+        self.client = client
+        self._connect_started = time.perf_counter()
+        client.connect_async(self.broker, self.port, keepalive=30)
+        client.loop_start()
+    
+    def stop(self):
+        """Disconnect and stop the network loop"""
+        if self.client is not None:
+            self.client.disconnect()
+            self.client.loop_stop()
+            self.client = None
+        self.connected.clear()
+        self._attempt_done.clear()
+        self._subscribed.clear()
+    
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code == 0:
+            if self._connect_started is not None:
+                self.connect_latency = time.perf_counter() - self._connect_started
+            self.last_error = None
+            # One SUBACK for ping + $SYS, so "subscribed" still means the ping topic is live
+            client.subscribe([(self.ping_topic, 0)] + [(topic, 0) for topic in self._sys_topics])
+            self.connected.set()
+        else:
+            self.last_error = mqtt.connack_string(reason_code)
+        self._attempt_done.set()
+    
+    def _on_connect_fail(self, client, userdata):
+        self.last_error = "Connection failed"
+        self._attempt_done.set()
+    
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        self.connected.clear()
+        self._subscribed.clear()
+        self._attempt_done.clear()
+        # Next CONNACK measures reconnect latency from this point
+        self._connect_started = time.perf_counter()
+        if reason_code != 0:
+            self.last_error = f"Disconnected unexpectedly ({reason_code})"
+    
+    def _on_subscribe(self, client, userdata, mid, reason_codes, properties):
+        self._subscribed.set()
+    
+    def _on_message(self, client, userdata, message):
+        if message.topic == self.ping_topic and message.payload.decode(errors="replace") == self._ping_token:
+            self._pong.set()
+        elif message.topic in self._sys_topics:
+            self.broker_stats[self._sys_topics[message.topic]] = _sys_value(message.payload)
+    
+    def wait_connected(self, timeout: float) -> bool:
+        """Block until CONNACK or a failed attempt (or timeout), return connected"""
+        if self.connected.is_set():
+            return True
+        self._attempt_done.wait(timeout)
+        return self.connected.is_set()
+    
+    def ping(self, timeout: float) -> Optional[float]:
+        """
+        Measure publish/subscribe round-trip time
+        
+        Pseudo Code:
+        WAIT for ping subscription to be active
+        PUBLISH unique token to ping topic
+        WAIT for broker to deliver it back to us
+        RETURN round-trip seconds (None if it never arrived)
+        """
+        started = time.perf_counter()
+        if not self._subscribed.wait(timeout):
+            return None
+        
+        self._ping_token = uuid.uuid4().hex
+        self._pong.clear()
+        sent = time.perf_counter()
+        self.client.publish(self.ping_topic, self._ping_token, qos=0)
+        
+        remaining = max(0.0, timeout - (sent - started))
+        if self._pong.wait(remaining):
+            return time.perf_counter() - sent
+        return None
+
+################################################################################
+# CLASS: HAStateStream
+# PSEUDO CODE:
+#   CONNECT to HA WebSocket API, authenticate with the same token
+#   SUBSCRIBE to state_changed events
+#   RESYNC full state with get_states (after every (re)connect)
+#   APPLY each event to an in-memory state cache (tracked entities only)
+#   ON DISCONNECT: reconnect with backoff, resync again
+################################################################################
+
+class HAStateStream:
+    """
+    Push-based Home Assistant state cache over the WebSocket API
+    
+    Pseudo Code:
+    BACKGROUND THREAD:
+      LOOP until stopped:
+        CONNECT + AUTH
+        SUBSCRIBE state_changed, THEN get_states (no gap between them)
+        FOR EACH message:
+          get_states result -> replace cache, mark synced
+          state_changed     -> update one cache entry
+        ON ERROR: mark unsynced, wait (backoff with jitter), retry
+    
+    COMMON LANGUAGE:
+    Home Assistant tells us the moment anything changes, so the monitor
+    always has fresh states without re-downloading them every cycle.
+    """
+    
+    SUBSCRIBE_ID = 1
+    
+    def __init__(self, ha_url: str, ha_token: str, entity_ids: Optional[List[str]] = None):
+        """
+        Pseudo Code:
+        BUILD ws:// (or wss://) URL from HA URL
+        SET tracked entities (None = track everything)
+        """
+        base = ha_url.rstrip("/")
+        if base.startswith("https://"):
+            self.ws_url = "wss://" + base[len("https://"):] + "/api/websocket"
+        else:
+            self.ws_url = "ws://" + base[len("http://"):] + "/api/websocket" if base.startswith("http://") \
+                else base + "/api/websocket"
+        self.ha_token = ha_token
+        self.tracked = set(entity_ids) if entity_ids is not None else None
+        
+        self.states: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self.synced = threading.Event()
+        self._stop = threading.Event()
+        self._ws = None
+        self._thread = None
+        self._next_id = self.SUBSCRIBE_ID
+        self._resync_id = None
+        
+        self.events_received = 0
+        self.resyncs = 0
+        self.reconnects = 0
+        self.last_event_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+    
+    def start(self):
+        """Start background connection thread"""
+        self._thread = threading.Thread(target=self._run, name="ha-websocket", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Close connection and stop reconnecting"""
+        self._stop.set()
+        if self._ws is not None:
+            try:
+                self._ws.close()
+            except Exception:
+                pass
+    
+    def snapshot(self) -> Dict[str, Dict]:
+        """Copy of the cache (entity_id -> state object)"""
+        with self._lock:
+            return dict(self.states)
+    
+    def status(self) -> Dict:
+        """Connection statistics for the report"""
+        return {
+            "connected": self.synced.is_set(),
+            "tracked_entities": len(self.states),
+            "events_received": self.events_received,
+            "resyncs": self.resyncs,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error
+        }
+    
+    def _send(self, message: Dict) -> int:
+        self._next_id += 1
+        message = dict(message, id=self._next_id)
+        self._ws.send(json.dumps(message))
+        return self._next_id
+    
+    def _run(self):
+        """Connect, process messages, reconnect on failure"""
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                self._session()
+                backoff = 1
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+            self.synced.clear()
+            if self._stop.is_set():
+                break
+            self.reconnects += 1
+            self._stop.wait(random.uniform(backoff / 2, backoff))
+            backoff = min(backoff * 2, HA_WS_RECONNECT_MAX)
+    
+    def _session(self):
+        """
+        One WebSocket connection lifetime
+        
+        Pseudo Code:
+        EXPECT auth_required, SEND auth, EXPECT auth_ok
+        SUBSCRIBE state_changed (id 1), REQUEST get_states
+        LOOP: dispatch messages; on silence send ping
+        """
+        try:
+            import websocket
+        except ImportError:
+            self._stop.set()
+            raise RuntimeError("websocket-client not installed (pip3 install websocket-client)")
+        
+        self._ws = websocket.create_connection(self.ws_url, timeout=10)
+        try:
+            hello = json.loads(self._ws.recv())
+            if hello.get("type") != "auth_required":
+                raise ValueError(f"Unexpected greeting: {hello.get('type')}")
+            self._ws.send(json.dumps({"type": "auth", "access_token": self.ha_token}))
+            reply = json.loads(self._ws.recv())
+            if reply.get("type") != "auth_ok":
+                raise PermissionError(reply.get("message", "Authentication failed"))
+            
+            self._next_id = 0
+            self._send({"type": "subscribe_events", "event_type": "state_changed"})
+            self._resync_id = self._send({"type": "get_states"})
+            
+            self._ws.settimeout(HA_WS_RECV_TIMEOUT)
+            while not self._stop.is_set():
+                try:
+                    raw = self._ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    self._send({"type": "ping"})
+                    continue
+                if not raw:
+                    raise ConnectionError("Connection closed by Home Assistant")
+                self._handle(json.loads(raw))
+        finally:
+            self._ws.close()
+    
+    def _handle(self, message: Dict):
+        """
+        Apply one message to the cache
+        
+        Pseudo Code:
+        IF result of get_states THEN replace cache with tracked entities
+        IF state_changed event THEN update (or remove) one tracked entity
+        """
+        kind = message.get("type")
+        
+        if kind == "result" and message.get("id") == self._resync_id:
+            if not message.get("success"):
+                raise ValueError(f"get_states failed: {message.get('error')}")
+            states = {
+                state["entity_id"]: state for state in message.get("result") or []
+                if self.tracked is None or state.get("entity_id") in self.tracked
+            }
+            with self._lock:
+                self.states = states
+            self.resyncs += 1
+            self.synced.set()
+        
+        elif kind == "event" and message.get("id") == self.SUBSCRIBE_ID:
+            data = message.get("event", {}).get("data", {})
+            entity_id = data.get("entity_id")
+            if self.tracked is not None and entity_id not in self.tracked:
+                return
+            new_state = data.get("new_state")
+            with self._lock:
+                if new_state is None:
+                    self.states.pop(entity_id, None)
+                else:
+                    self.states[entity_id] = new_state
+            self.events_received += 1
+            self.last_event_at = time.time()
+
+
+def _in_check_order(checks: Dict) -> Dict:
+    """Check results in CHECKS registry order (other keys, e.g. stream stages, after)"""
+    order = {key: index for index, (_, key) in enumerate(CHECKS.values())}
+    return dict(sorted(checks.items(), key=lambda item: order.get(item[0], len(order))))
+
 ################################################################################
 # CLASS: SystemMonitor
 # PSEUDO CODE:
@@ -102,6 +971,8 @@ CRITICAL_AUTOMATIONS = [
 #     - check_sensors()
 #     - check_switches()
 #     - check_automations()
+#     - load_state_snapshot()
+#     - run_checks()
 #     - check_system_health()
 #     - generate_report()
 ################################################################################
@@ -118,12 +989,17 @@ class SystemMonitor:
     """
     
     def __init__(self, ha_url: str, ha_token: str, mqtt_broker: str, 
-                 mqtt_port: int, mqtt_user: str = "", mqtt_pass: str = ""):
+                 mqtt_port: int, mqtt_user: str = "", mqtt_pass: str = "",
+                 esp32_devices: Optional[List[str]] = None,
+                 critical_sensors: Optional[List[str]] = None,
+                 critical_switches: Optional[List[str]] = None,
+                 critical_automations: Optional[List[str]] = None):
         """
         Initialize system monitor
         
         Pseudo Code:
         SET connection parameters
+        SET entity lists (module defaults unless given, e.g. per site)
         INITIALIZE result storage
         CREATE HTTP session for HA
         """
@@ -134,18 +1010,103 @@ class SystemMonitor:
         self.mqtt_user = mqtt_user
         self.mqtt_pass = mqtt_pass
         
+        self.critical_sensors: List[str] = list(critical_sensors if critical_sensors is not None
+                                                else CRITICAL_SENSORS)
+        self.critical_switches: List[str] = list(critical_switches if critical_switches is not None
+                                                 else CRITICAL_SWITCHES)
+        self.critical_automations: List[str] = list(critical_automations if critical_automations is not None
+                                                    else CRITICAL_AUTOMATIONS)
+        
+        # Async engine: a check on a worker thread writes into its own staging dict
+        self._staging = threading.local()
         self.results = {
             "timestamp": datetime.now().isoformat(),
             "overall_status": "UNKNOWN",
+            "http_calls": 0,
             "checks": {}
         }
         
-        # Create HTTP session with HA authentication
-        self.session = requests.Session()
-        self.session.headers.update({
-            "Authorization": f"Bearer {self.ha_token}",
-            "Content-Type": "application/json"
-        })
+        # Per-cycle state snapshot: entity_id -> state object from /api/states
+        self._state_index: Dict[str, Dict] = {}
+        self.http_calls = 0
+        self.http_errors = 0
+        self.http_retries = 0
+        self._counter_lock = threading.Lock()
+        self._cycle_started = time.perf_counter()
+        self._check_seconds: Dict[str, float] = {}
+        self.trace = CycleTrace()
+        
+        # MQTT connection is created on first check and kept across cycles
+        self._mqtt_probe: Optional[MqttProbe] = None
+        
+        # Optional push-based state cache (--websocket); replaces /api/states
+        self.state_stream: Optional[HAStateStream] = None
+        
+        # Rolling per-sensor statistics, kept across cycles in continuous mode
+        self.anomaly_engine = AnomalyEngine()
+        
+        # Compiled per-entity rules from --rules (None = rules check not configured)
+        self.rule_engine: Optional[RuleEngine] = None
+        
+        # Logbook audit of scheduled vs. actual automation runs from --audit (None = not configured)
+        self.automation_auditor: Optional[AutomationAuditor] = None
+        
+        # Called with the results dict after each report (history, exporters, ...)
+        self.cycle_hooks: List = []
+        
+        # Immutable view of the last finished cycle and what changed since the one before
+        self.snapshot: Optional[CycleSnapshot] = None
+        self.changes: List[Dict] = []
+        
+        # Optional notification pipeline, drained on close()
+        self.alert_dispatcher: Optional[AlertDispatcher] = None
+        
+        # ESP32 fleet: configured list, optionally extended by discovery
+        self.esp32_devices: List[str] = list(esp32_devices if esp32_devices is not None else ESP32_DEVICES)
+        self.device_discovery = "static"   # static | ha | mqtt
+        self.probe_devices = False         # Also probe each node's web server
+        self.device_url_template = DEVICE_URL_TEMPLATE
+        self._device_session = None
+        self._device_executor: Optional[ThreadPoolExecutor] = None
+        
+        # HTTP session is created on first request (cached runs never load requests)
+        self._session = None
+        self._session_lock = threading.Lock()
+        self.breaker = CircuitBreaker()
+    
+    @property
+    def results(self) -> Dict:
+        """This cycle's results (a staged async check sees only its own dict)"""
+        staged = getattr(self._staging, "results", None)
+        return self._results if staged is None else staged
+    
+    @results.setter
+    def results(self, value: Dict):
+        self._results = value
+    
+    @property
+    def session(self):
+        """
+        HTTP session with HA authentication
+        
+        Pseudo Code:
+        IF no session yet THEN (one thread at a time):
+          CREATE session with auth headers
+          MOUNT connection pool sized for the async engine and device discovery
+        RETURN session
+        """
+        with self._session_lock:
+            if self._session is None:
+                session = _ensure_loaded(requests).Session()
+                session.headers.update({
+                    "Authorization": f"Bearer {self.ha_token}",
+                    "Content-Type": "application/json"
+                })
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
     
     def _api_get(self, endpoint: str) -> Optional[Dict]:
         """
@@ -160,102 +1121,316 @@ class SystemMonitor:
           RETURN None
         """
         try:
-            response = self.session.get(f"{self.ha_url}/api/{endpoint}", timeout=10)
+            response = self._http("get", f"/api/{endpoint}")
             response.raise_for_status()
             return response.json()
+        except UpstreamDownError:
+            return None   # Breaker open: caller reports "skipped: upstream down"
         except requests.exceptions.RequestException as e:
+            self._count_http_error()
             print(f"ERROR: API request failed: {e}")
             return None
     
-    def check_home_assistant_connection(self) -> bool:
+    def _http(self, method: str, path: str, **kwargs):
         """
-        Verify Home Assistant is accessible
+        Send one HTTP request to Home Assistant inside a trace span
         
         Pseudo Code:
-        TRY:
-          GET /api/ endpoint
-          IF status 200 THEN HA is online
-          RETURN True
-        CATCH:
-          HA is offline or unreachable
-          RETURN False
+        IF circuit breaker is open THEN raise UpstreamDownError (no request)
+        COUNT call
+        SEND request (split connect/read timeouts)
+        IF GET failed to connect, timed out or got 502/503/504:
+          RETRY up to HTTP_RETRIES times after a jittered, doubling delay
+        TELL breaker the outcome once per request (retries are one request,
+          so one transient failure cannot open it)
+        RECORD status, response bytes, retries in span
+        RETURN response (exceptions propagate to caller)
         """
-        print("Checking Home Assistant connection...")
+        kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        attempts = 1 + (HTTP_RETRIES if method.lower() == "get" else 0)
         
+        with self.trace.span(f"{method.upper()} {path}", "http") as span:
+            span["retries"] = 0
+            if not self.breaker.allow():
+                span["skipped"] = "upstream down"
+                raise UpstreamDownError(f"skipped: upstream down (circuit breaker {self.breaker.state})")
+            for attempt in range(attempts):
+                if attempt:
+                    span["retries"] = attempt
+                    with self._counter_lock:
+                        self.http_retries += 1
+                self._count_http_call()
+                
+                try:
+                    response = self.session.request(method, f"{self.ha_url}{path}", **kwargs)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                    if attempt == attempts - 1:
+                        self.breaker.record_failure()
+                        raise
+                else:
+                    if response.status_code not in HTTP_RETRY_STATUSES:
+                        self.breaker.record_success()
+                        span["status"] = response.status_code
+                        span["bytes"] = len(response.content)
+                        return response
+                    if attempt == attempts - 1:
+                        self.breaker.record_failure()
+                        span["status"] = response.status_code
+                        span["bytes"] = len(response.content)
+                        return response
+                
+                time.sleep(random.uniform(0, HTTP_RETRY_BACKOFF * 2 ** attempt))
+    
+    def _count_http_call(self):
+        """Increment the per-cycle HTTP call counter (safe across threads)"""
+        with self._counter_lock:
+            self.http_calls += 1
+    
+    def _count_http_error(self):
+        """Increment the per-cycle HTTP error counter (safe across threads)"""
+        with self._counter_lock:
+            self.http_errors += 1
+    
+    def _timed(self, key: str, func):
+        """Run func in a trace span and record its duration under timings.checks[key]"""
+        started = time.perf_counter()
         try:
-            response = self.session.get(f"{self.ha_url}/api/", timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                self.results["checks"]["home_assistant"] = {
-                    "status": "ONLINE",
-                    "message": data.get("message", "API is running")
-                }
-                print("✓ Home Assistant is online")
-                return True
-            else:
-                self.results["checks"]["home_assistant"] = {
-                    "status": "ERROR",
-                    "message": f"HTTP {response.status_code}"
-                }
-                print(f"✗ Home Assistant returned HTTP {response.status_code}")
-                return False
-        except requests.exceptions.RequestException as e:
-            self.results["checks"]["home_assistant"] = {
-                "status": "OFFLINE",
-                "message": str(e)
-            }
-            print(f"✗ Home Assistant is offline: {e}")
-            return False
+            with self.trace.span(key, "check"):
+                return func()
+        finally:
+            self._check_seconds[key] = round(time.perf_counter() - started, 4)
     
-    def check_mqtt_connection(self) -> bool:
+    def _api_post(self, endpoint: str, payload: Dict) -> Optional[object]:
         """
-        Verify MQTT broker is accessible
+        Make POST request to Home Assistant API (service calls)
         
         Pseudo Code:
         TRY:
-          CONNECT to MQTT broker
-          IF connected THEN return True
-          DISCONNECT
-        CATCH:
-          MQTT broker offline
-          RETURN False
+          SEND POST request with JSON payload
+          IF successful THEN return JSON response
+        CATCH error:
+          LOG error
+          RETURN None
         """
-        print("Checking MQTT broker connection...")
-        
-        mqtt_connected = False
-        
-        def on_connect(client, userdata, flags, rc):
-            nonlocal mqtt_connected
-            if rc == 0:
-                mqtt_connected = True
-        
         try:
-            client = mqtt.Client()
-            client.on_connect = on_connect
-            
-            if self.mqtt_user and self.mqtt_pass:
-                client.username_pw_set(self.mqtt_user, self.mqtt_pass)
-            
-            client.connect(self.mqtt_broker, self.mqtt_port, 10)
-            client.loop_start()
-            time.sleep(2)  # Wait for connection
-            client.loop_stop()
-            client.disconnect()
-            
-            if mqtt_connected:
-                self.results["checks"]["mqtt"] = {
+            response = self._http("post", f"/api/{endpoint}", json=payload)
+            response.raise_for_status()
+            return response.json()
+        except (requests.exceptions.RequestException, UpstreamDownError, ValueError) as e:
+            self._count_http_error()
+            print(f"ERROR: API request failed: {e}")
+            return None
+    
+    def begin_cycle(self, checks: Optional[List[str]] = None):
+        """
+        Reset per-cycle state before running checks
+        
+        Pseudo Code:
+        START a new results dictionary stamped with cycle start time
+          (last cycle's dictionary is never modified again)
+        CARRY OVER results of checks not run this cycle (adaptive scheduler)
+        RESET HTTP call counter
+        DROP previous state snapshot
+        """
+        carried = {}
+        if checks is not None:
+            running = {CHECKS[name][1] for name in checks}
+            carried = {key: data for key, data in self.results["checks"].items() if key not in running}
+        self.results = {
+            "timestamp": datetime.now().isoformat(),
+            "overall_status": "UNKNOWN",
+            "http_calls": 0,
+            "checks": carried
+        }
+        self.http_calls = 0
+        self.http_errors = 0
+        self.http_retries = 0
+        self._state_index = {}
+        self._cycle_started = time.perf_counter()
+        self._check_seconds = {}
+        self.trace = CycleTrace()
+    
+    def end_cycle(self):
+        """
+        Record per-cycle counters and timings in results
+        
+        Pseudo Code:
+        SORT check results into registry order (async/adaptive finish in any order)
+        COPY HTTP call, error and retry counts and breaker state into results
+        RECORD cycle duration, per-check durations and spans under "timings"
+        """
+        self.results["checks"] = _in_check_order(self.results["checks"])
+        self.results["http_calls"] = self.http_calls
+        self.results["http_errors"] = self.http_errors
+        self.results["http_retries"] = self.http_retries
+        self.results["circuit_breaker"] = self.breaker.status()
+        self.results["timings"] = {
+            "cycle_seconds": round(time.perf_counter() - self._cycle_started, 4),
+            "checks": dict(self._check_seconds),
+            "spans": self.trace.report()
+        }
+    
+    def load_state_snapshot(self) -> int:
+        """
+        Fetch every entity state in one request and index it by entity_id
+        
+        Pseudo Code:
+        IF WebSocket cache is synced THEN use it (no HTTP request)
+        GET /api/states (one request for all entities)
+        IF successful THEN:
+          BUILD dictionary entity_id -> state object
+        ELSE:
+          LEAVE snapshot empty (checks fall back to per-entity requests)
+        RETURN number of indexed entities
+        
+        COMMON LANGUAGE:
+        Instead of asking Home Assistant about each sensor one at a time,
+        we ask for everything at once and look entities up locally.
+        With --websocket the states are already here, pushed by HA.
+        """
+        self._state_index = self.fetch_states()
+        return len(self._state_index)
+    
+    def fetch_states(self) -> Dict[str, Dict]:
+        """Every entity state (WebSocket cache or one /api/states request), {} if unavailable"""
+        if self.state_stream is not None:
+            self.results["state_stream"] = self.state_stream.status()
+            if self.state_stream.synced.is_set():
+                with self.trace.span("websocket.snapshot", "cache"):
+                    return self.state_stream.snapshot()
+        
+        states = self._api_get("states")
+        if not isinstance(states, list):
+            return {}
+        return {state["entity_id"]: state for state in states if "entity_id" in state}
+    
+    def _get_state(self, entity_id: str) -> Optional[Dict]:
+        """
+        Look up entity state from the snapshot
+        
+        Pseudo Code:
+        IF entity in snapshot THEN return it (no HTTP request)
+        ELSE fetch /api/states/<entity> individually
+        """
+        state = self._state_index.get(entity_id)
+        if state is not None:
+            return state
+        return self._api_get(f"states/{entity_id}")
+    
+    def _missing_entity(self) -> Dict:
+        """Result entry for an entity we could not read (skipped if HA is known down)"""
+        if self.breaker.is_open():
+            return {"error": "skipped: upstream down", "status": "SKIPPED"}
+        return {"error": "Entity not found", "status": "ERROR"}
+    
+    @staticmethod
+    def _missing_label(entry: Dict) -> str:
+        return "SKIPPED (upstream down)" if entry.get("error", "").startswith("skipped") else "NOT FOUND"
+    
+    def check_home_assistant_connection(self) -> bool:
+        """
+        Verify Home Assistant is accessible
+        
+        Pseudo Code:
+        TRY:
+          GET /api/ endpoint
+          IF status 200 THEN HA is online
+          RETURN True
+        CATCH:
+          HA is offline or unreachable
+          RETURN False
+        """
+        print("Checking Home Assistant connection...")
+        
+        try:
+            response = self._http("get", "/api/")
+            if response.status_code == 200:
+                data = response.json()
+                self.results["checks"]["home_assistant"] = {
                     "status": "ONLINE",
-                    "message": "Connected successfully"
+                    "message": data.get("message", "API is running")
                 }
-                print("✓ MQTT broker is online")
+                print("✓ Home Assistant is online")
                 return True
             else:
-                self.results["checks"]["mqtt"] = {
+                self.results["checks"]["home_assistant"] = {
                     "status": "ERROR",
-                    "message": "Connection failed"
+                    "message": f"HTTP {response.status_code}"
+                }
+                print(f"✗ Home Assistant returned HTTP {response.status_code}")
+                return False
+        except (requests.exceptions.RequestException, UpstreamDownError) as e:
+            self._count_http_error()
+            self.results["checks"]["home_assistant"] = {
+                "status": "OFFLINE",
+                "message": str(e)
+            }
+            print(f"✗ Home Assistant is offline: {e}")
+            return False
+    
+    def check_mqtt_connection(self) -> bool:
+        """
+        Verify MQTT broker is accessible and responsive
+        
+        Pseudo Code:
+        IF no persistent MQTT connection THEN start one
+        WAIT for CONNACK (returns immediately if already connected)
+        IF connected THEN:
+          PING broker via publish/subscribe round trip
+          RECORD connect latency and ping RTT
+          IF ping slow or lost THEN mark DEGRADED
+        ELSE:
+          MQTT broker offline
+        """
+        print("Checking MQTT broker connection...")
+        
+        try:
+            if self._mqtt_probe is None:
+                self._mqtt_probe = MqttProbe(self.mqtt_broker, self.mqtt_port,
+                                             self.mqtt_user, self.mqtt_pass)
+                self._mqtt_probe.start()
+            probe = self._mqtt_probe
+            
+            with self.trace.span("mqtt.wait_connected", "mqtt") as span:
+                connected = probe.wait_connected(MQTT_CONNECT_TIMEOUT)
+                span["connected"] = connected
+            
+            if not connected:
+                message = probe.last_error or f"No CONNACK within {MQTT_CONNECT_TIMEOUT}s"
+                self.results["checks"]["mqtt"] = {
+                    "status": "OFFLINE",
+                    "message": message
                 }
-                print("✗ MQTT broker connection failed")
+                print(f"✗ MQTT broker is offline: {message}")
                 return False
+            
+            with self.trace.span("mqtt.ping", "mqtt", topic=probe.ping_topic) as span:
+                rtt = probe.ping(MQTT_PING_TIMEOUT)
+                span["echoed"] = rtt is not None
+            connect_ms = round(probe.connect_latency * 1000, 1) if probe.connect_latency is not None else None
+            ping_ms = round(rtt * 1000, 1) if rtt is not None else None
+            
+            if ping_ms is None:
+                status, message = "DEGRADED", f"Connected but ping not echoed within {MQTT_PING_TIMEOUT}s"
+            elif ping_ms > MQTT_SLOW_PING_MS:
+                status, message = "DEGRADED", f"Broker slow: ping {ping_ms} ms"
+            else:
+                status, message = "ONLINE", "Connected successfully"
+            
+            self.results["checks"]["mqtt"] = {
+                "status": status,
+                "message": message,
+                "connect_latency_ms": connect_ms,
+                "ping_rtt_ms": ping_ms
+            }
+            if probe.broker_stats:
+                self.results["checks"]["mqtt"]["broker"] = dict(probe.broker_stats)
+            
+            if status == "ONLINE":
+                print(f"✓ MQTT broker is online (ping {ping_ms} ms)")
+                return True
+            print(f"✗ MQTT broker: {message}")
+            return False
         except Exception as e:
             self.results["checks"]["mqtt"] = {
                 "status": "OFFLINE",
@@ -264,52 +1439,229 @@ class SystemMonitor:
             print(f"✗ MQTT broker is offline: {e}")
             return False
     
+    def close(self):
+        """
+        Release network resources held across cycles
+        
+        Pseudo Code:
+        FLUSH queued alerts
+        STOP persistent MQTT connection
+        CLOSE HTTP session
+        """
+        if self.alert_dispatcher is not None:
+            self.alert_dispatcher.close()
+            self.alert_dispatcher = None
+        if self._mqtt_probe is not None:
+            self._mqtt_probe.stop()
+            self._mqtt_probe = None
+        if self.state_stream is not None:
+            self.state_stream.stop()
+            self.state_stream = None
+        if self._device_executor is not None:
+            self._device_executor.shutdown(wait=False)
+            self._device_executor = None
+            self._device_session.close()
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+    
+    def discover_devices_from_snapshot(self) -> List[str]:
+        """
+        Find ESP32 nodes in the current state snapshot
+        
+        Pseudo Code:
+        FOR EACH entity in snapshot:
+          IF entity looks like binary_sensor.esp32_<node>_status THEN
+            ADD <node> (underscores back to dashes)
+        RETURN sorted node names
+        """
+        pattern = re.compile(DEVICE_STATUS_PATTERN)
+        found = set()
+        for entity_id in self._state_index:
+            match = pattern.fullmatch(entity_id)
+            if match:
+                found.add(match.group(1).replace("_", "-"))
+        return sorted(found)
+    
+    def discover_devices_from_mqtt(self, seconds: float = MQTT_DISCOVERY_SECONDS) -> List[str]:
+        """
+        Find ESP32 nodes from retained MQTT discovery messages
+        
+        Pseudo Code:
+        SUBSCRIBE to homeassistant/<component>/<node>/<object>/config
+        WAIT for SUBACK (the broker sends retained messages right after it)
+        COLLECT retained messages until none arrived for the quiet period
+          (never longer than `seconds` in total)
+        RETURN node ids (or device names) that look like ESP32 nodes
+        """
+        found = set()
+        subscribed = threading.Event()
+        last_message = [0.0]
+        
+        def on_connect(client, userdata, flags, reason_code, properties):
+            if reason_code == 0:
+                client.subscribe(MQTT_DISCOVERY_TOPIC)
+        
+        def on_subscribe(client, userdata, mid, reason_codes, properties):
+            last_message[0] = time.monotonic()
+            subscribed.set()
+        
+        def on_message(client, userdata, message):
+            last_message[0] = time.monotonic()
+            node_id = message.topic.split("/")[2]
+            try:
+                device = json.loads(message.payload or b"{}").get("device", {})
+            except ValueError:
+                device = {}
+            name = device.get("name") or node_id
+            if name.startswith("esp32"):
+                found.add(name.replace("_", "-"))
+        
+        client = _new_mqtt_client(f"garden-monitor-discovery-{os.getpid()}")
+        client.on_connect = on_connect
+        client.on_subscribe = on_subscribe
+        client.on_message = on_message
+        if self.mqtt_user and self.mqtt_pass:
+            client.username_pw_set(self.mqtt_user, self.mqtt_pass)
+        deadline = time.monotonic() + seconds
+        try:
+            client.connect(self.mqtt_broker, self.mqtt_port, keepalive=30)
+            client.loop_start()
+            if not subscribed.wait(max(deadline - time.monotonic(), 0)):
+                print(f"⚠ MQTT discovery: not subscribed within {seconds:g}s")
+            while subscribed.is_set() and time.monotonic() < deadline:
+                quiet = time.monotonic() - last_message[0]
+                if quiet >= MQTT_DISCOVERY_QUIET_SECONDS:
+                    break
+                time.sleep(min(MQTT_DISCOVERY_QUIET_SECONDS - quiet, max(deadline - time.monotonic(), 0)))
+        except OSError as e:
+            print(f"ERROR: MQTT discovery failed: {e}")
+        finally:
+            client.loop_stop()
+            client.disconnect()
+        return sorted(found)
+    
+    def _probe_device(self, device: str) -> Dict:
+        """
+        Check one ESP32 node
+        
+        Pseudo Code:
+        LOOK UP binary_sensor.<node>_status (snapshot, else HTTP)
+        IF probing enabled THEN GET node web server with short timeout
+        RETURN device status entry
+        """
+        status_entity = f"binary_sensor.{device.replace('-', '_')}_status"
+        state = self._get_state(status_entity)
+        
+        if state:
+            entry = {
+                "online": state.get("state") == "on",
+                "last_updated": state.get("last_updated", "")
+            }
+        else:
+            entry = {
+                "online": False,
+                "last_updated": "N/A",
+                "error": self._missing_entity()["error"]
+            }
+        
+        if self.probe_devices:
+            started = time.perf_counter()
+            try:
+                with self.trace.span(f"probe {device}", "device") as span:
+                    response = self._device_session.get(self.device_url_template.format(device=device),
+                                                        timeout=DEVICE_PROBE_TIMEOUT)
+                    span["status"] = response.status_code
+                    span["bytes"] = len(response.content)
+                entry["reachable"] = response.status_code < 500
+            except requests.exceptions.RequestException as e:
+                entry["reachable"] = False
+                entry["probe_error"] = type(e).__name__
+            entry["probe_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        
+        return entry
+    
+    def device_probe_deadline(self, count: int) -> float:
+        """
+        Overall wait for `count` device probes
+        
+        Pseudo Code:
+        LOOKUP = one HA GET in the worst case (not in the snapshot): every
+          attempt hits connect + read timeout, plus the longest retry delays
+        PROBE = node web server connect + read timeouts (if probing)
+        WAVES = probes queue behind DEVICE_PROBE_WORKERS
+        RETURN waves x (lookup + probe)
+        """
+        lookup = ((1 + HTTP_RETRIES) * (HTTP_CONNECT_TIMEOUT + HTTP_READ_TIMEOUT)
+                  + sum(HTTP_RETRY_BACKOFF * 2 ** attempt for attempt in range(HTTP_RETRIES)))
+        probe = 2 * DEVICE_PROBE_TIMEOUT if self.probe_devices else 0
+        waves = max(1, math.ceil(count / DEVICE_PROBE_WORKERS))
+        return waves * (lookup + probe)
+    
     def check_esp32_devices(self) -> bool:
         """
-        Check status of all ESP32 controllers
+        Check status of all ESP32 controllers in parallel
         
         Pseudo Code:
-        FOR EACH expected ESP32 device:
-          GET device state from HA
-          CHECK last_updated timestamp
-          IF updated recently THEN device online
-          ELSE device offline or stale
+        IF discovery from HA THEN add nodes found in snapshot
+        FOR EACH device (in parallel, bounded worker pool):
+          LOOK UP status entity
+          OPTIONALLY probe node web server
         END FOR
+        WAIT for all probes (overall deadline)
+        MARK probes that did not finish as TIMEOUT
         RETURN all_devices_ok
+        
+        COMMON LANGUAGE:
+        Every controller is checked at the same time, so checking 300 of
+        them takes about as long as checking 3.
         """
-        print(f"Checking {len(ESP32_DEVICES)} ESP32 device(s)...")
+        if self.device_discovery == "ha":
+            for device in self.discover_devices_from_snapshot():
+                if device not in self.esp32_devices:
+                    self.esp32_devices.append(device)
+        
+        devices = list(self.esp32_devices)
+        print(f"Checking {len(devices)} ESP32 device(s)...")
+        
+        if self._device_executor is None:
+            self._device_executor = ThreadPoolExecutor(max_workers=DEVICE_PROBE_WORKERS,
+                                                       thread_name_prefix="device-probe")
+            self._device_session = _ensure_loaded(requests).Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=DEVICE_PROBE_WORKERS,
+                                                    pool_maxsize=4)
+            self._device_session.mount("http://", adapter)
+            self._device_session.mount("https://", adapter)
+        
+        futures = {device: self._device_executor.submit(self._probe_device, device)
+                   for device in devices}
+        wait_futures(futures.values(), timeout=self.device_probe_deadline(len(devices)))
         
         all_ok = True
         device_statuses = {}
         
-        for device in ESP32_DEVICES:
-            # Convert device name to status entity
-            status_entity = f"binary_sensor.{device.replace('-', '_')}_status"
-            
-            state = self._api_get(f"states/{status_entity}")
-            
-            if state:
-                is_online = state.get("state") == "on"
-                last_updated = state.get("last_updated", "")
-                
-                device_statuses[device] = {
-                    "online": is_online,
-                    "last_updated": last_updated
-                }
-                
-                if is_online:
-                    print(f"  ✓ {device}: ONLINE")
-                else:
-                    print(f"  ✗ {device}: OFFLINE")
-                    all_ok = False
+        for device, future in futures.items():
+            if not future.done():
+                entry = {"online": False, "last_updated": "N/A", "error": "Probe timed out"}
+                label = "TIMEOUT"
+            elif future.exception() is not None:
+                entry = {"online": False, "last_updated": "N/A", "error": str(future.exception())}
+                label = "ERROR"
             else:
-                device_statuses[device] = {
-                    "online": False,
-                    "last_updated": "N/A",
-                    "error": "Entity not found"
-                }
-                print(f"  ✗ {device}: NOT FOUND")
-                all_ok = False
+                entry = future.result()
+                if "error" in entry:
+                    label = self._missing_label(entry)
+                elif not entry["online"]:
+                    label = "OFFLINE"
+                elif entry.get("reachable") is False:
+                    label = "ONLINE (web server unreachable)"
+                else:
+                    label = "ONLINE"
+            
+            device_statuses[device] = entry
+            device_ok = entry["online"] and entry.get("reachable", True)
+            print(f"  {'✓' if device_ok else '✗'} {device}: {label}")
+            all_ok = all_ok and device_ok
         
         self.results["checks"]["esp32_devices"] = {
             "status": "OK" if all_ok else "DEGRADED",
@@ -328,18 +1680,19 @@ class SystemMonitor:
           CHECK last_updated timestamp
           IF timestamp > timeout THEN sensor stale
           CHECK value is reasonable (not unknown/unavailable)
+          FEED value to anomaly engine (range, flatline, spike, drift)
           RECORD status
         END FOR
         """
-        print(f"Checking {len(CRITICAL_SENSORS)} critical sensor(s)...")
+        print(f"Checking {len(self.critical_sensors)} critical sensor(s)...")
         
         all_ok = True
         sensor_statuses = {}
         now = datetime.now()
         timeout = timedelta(minutes=SENSOR_TIMEOUT_MINUTES)
         
-        for sensor in CRITICAL_SENSORS:
-            state = self._api_get(f"states/{sensor}")
+        for sensor in self.critical_sensors:
+            state = self._get_state(sensor)
             
             if state:
                 value = state.get("state")
@@ -366,17 +1719,28 @@ class SystemMonitor:
                     "status": "OK" if sensor_ok else "STALE"
                 }
                 
+                # HA's last_changed tells us how long the value has been frozen
+                anomalies = {}
                 if sensor_ok:
+                    try:
+                        changed_at = datetime.fromisoformat(
+                            state.get("last_changed", "").replace("Z", "+00:00")).timestamp()
+                    except ValueError:
+                        changed_at = None
+                    anomalies = self.anomaly_engine.observe(sensor, value, time.time(), changed_at)
+                if anomalies:
+                    sensor_statuses[sensor]["status"] = "ANOMALY"
+                    sensor_statuses[sensor]["anomalies"] = anomalies
+                    print(f"  ✗ {sensor}: {value} ({'; '.join(anomalies.values())})")
+                    all_ok = False
+                elif sensor_ok:
                     print(f"  ✓ {sensor}: {value}")
                 else:
                     print(f"  ✗ {sensor}: STALE or INVALID")
                     all_ok = False
             else:
-                sensor_statuses[sensor] = {
-                    "error": "Entity not found",
-                    "status": "ERROR"
-                }
-                print(f"  ✗ {sensor}: NOT FOUND")
+                sensor_statuses[sensor] = self._missing_entity()
+                print(f"  ✗ {sensor}: {self._missing_label(sensor_statuses[sensor])}")
                 all_ok = False
         
         self.results["checks"]["sensors"] = {
@@ -396,13 +1760,13 @@ class SystemMonitor:
           VERIFY entity exists and is controllable
         END FOR
         """
-        print(f"Checking {len(CRITICAL_SWITCHES)} critical switch(es)...")
+        print(f"Checking {len(self.critical_switches)} critical switch(es)...")
         
         all_ok = True
         switch_statuses = {}
         
-        for switch in CRITICAL_SWITCHES:
-            state = self._api_get(f"states/{switch}")
+        for switch in self.critical_switches:
+            state = self._get_state(switch)
             
             if state:
                 value = state.get("state")
@@ -412,11 +1776,8 @@ class SystemMonitor:
                 }
                 print(f"  ✓ {switch}: {value}")
             else:
-                switch_statuses[switch] = {
-                    "error": "Entity not found",
-                    "status": "ERROR"
-                }
-                print(f"  ✗ {switch}: NOT FOUND")
+                switch_statuses[switch] = self._missing_entity()
+                print(f"  ✗ {switch}: {self._missing_label(switch_statuses[switch])}")
                 all_ok = False
         
         self.results["checks"]["switches"] = {
@@ -437,13 +1798,13 @@ class SystemMonitor:
           VERIFY last_triggered is present
         END FOR
         """
-        print(f"Checking {len(CRITICAL_AUTOMATIONS)} critical automation(s)...")
+        print(f"Checking {len(self.critical_automations)} critical automation(s)...")
         
         all_ok = True
         automation_statuses = {}
         
-        for automation in CRITICAL_AUTOMATIONS:
-            state = self._api_get(f"states/{automation}")
+        for automation in self.critical_automations:
+            state = self._get_state(automation)
             
             if state:
                 is_on = state.get("state") == "on"
@@ -461,11 +1822,8 @@ class SystemMonitor:
                     print(f"  ⚠ {automation}: DISABLED")
                     # Not necessarily an error, but worth noting
             else:
-                automation_statuses[automation] = {
-                    "error": "Entity not found",
-                    "status": "ERROR"
-                }
-                print(f"  ✗ {automation}: NOT FOUND")
+                automation_statuses[automation] = self._missing_entity()
+                print(f"  ✗ {automation}: {self._missing_label(automation_statuses[automation])}")
                 all_ok = False
         
         self.results["checks"]["automations"] = {
@@ -475,6 +1833,155 @@ class SystemMonitor:
         
         return all_ok
     
+    def check_rules(self) -> bool:
+        """
+        Evaluate the --rules file against the state snapshot
+        
+        Pseudo Code:
+        IF snapshot is empty THEN fetch ruled entities one by one (like other checks)
+        UPDATE rule engine: only changed entities and expired age rules are evaluated
+        RECORD per-entity results, print failures
+        """
+        engine = self.rule_engine
+        states = self._state_index
+        if not states:
+            states = {}
+            for entity_id in engine.index:
+                state = self._get_state(entity_id)
+                if state:
+                    states[entity_id] = state
+        
+        print(f"Checking {engine.rule_count} health rule(s)...")
+        evaluated = engine.update(states, time.time())
+        result = engine.report(self._missing_entity, states)
+        result["evaluated"] = evaluated
+        self.results["checks"]["rules"] = result
+        
+        passing = 0
+        for entity_id, entry in result["entities"].items():
+            if entry["status"] == "OK":
+                passing += 1
+            elif "failures" in entry:
+                print(f"  ✗ {entity_id}: {'; '.join(entry['failures'])}")
+            else:
+                print(f"  ✗ {entity_id}: {self._missing_label(entry)}")
+        print(f"  ✓ {passing} entit(ies) passing ({evaluated} re-evaluated)")
+        
+        return result["status"] == "OK"
+    
+    def fetch_logbook(self, entities: List[str], start: float, end: float) -> List[Dict]:
+        """
+        Logbook entries of some entities between two times
+        
+        Pseudo Code:
+        GET /api/logbook/<start>?end_time=<end>&entity=a,b,c (ONE request)
+        RETURN entries (errors propagate: the caller keeps its cursor)
+        """
+        response = self._http(
+            "GET", f"/api/logbook/{datetime.fromtimestamp(start, timezone.utc).isoformat()}",
+            params={"end_time": datetime.fromtimestamp(end, timezone.utc).isoformat(),
+                    "entity": ",".join(entities)},
+            timeout=(HTTP_CONNECT_TIMEOUT, 60)
+        )
+        response.raise_for_status()
+        return response.json()
+    
+    def check_automation_audit(self, now: Optional[float] = None) -> bool:
+        """
+        Compare scheduled and actual automation runs using the HA logbook
+        
+        Pseudo Code:
+        READ logbook entries since the last audit, judge what is due (as of now, default: current time)
+        RECORD per-automation results, print problems
+        IF logbook unreachable THEN keep cursor (next audit reads the gap), at least DEGRADED
+        """
+        auditor = self.automation_auditor
+        print(f"Auditing {len(auditor.schedule)} automation(s) against the logbook...")
+        
+        error = None
+        try:
+            entries = auditor.audit(self.fetch_logbook, time.time() if now is None else now, self._state_index)
+        except UpstreamDownError as e:
+            error = str(e)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self._count_http_error()
+            error = f"logbook request failed: {e}"
+        
+        result = auditor.report()
+        if error is None:
+            result["logbook_entries"] = entries
+        else:
+            result["error"] = error
+            if result["status"] == "OK":
+                result["status"] = "DEGRADED"
+            print(f"  ✗ {error}")
+        self.results["checks"]["automation_audit"] = result
+        
+        for automation, entry in result["automations"].items():
+            if entry["status"] == "OK":
+                print(f"  ✓ {automation}: {entry['runs']} run(s) in {AUDIT_REPORT_HOURS}h")
+                continue
+            for event in entry["events"]:
+                if event["status"] in _AUDIT_PROBLEMS:
+                    print(f"  ✗ {automation}: {event['status']} at {event['time']} ({event['detail']})")
+        
+        return result["status"] == "OK"
+    
+    def selected_checks(self, checks: Optional[List[str]] = None) -> List[str]:
+        """Registry names to run: the given ones, else every configured check"""
+        if checks is not None:
+            return [name for name in CHECKS if name in checks]
+        optional = {"rules": self.rule_engine, "audit": self.automation_auditor}
+        return [name for name in CHECKS if optional.get(name, True) is not None]
+    
+    def run_checks(self, checks: Optional[List[str]] = None) -> Dict:
+        """
+        Run health checks for one monitoring cycle
+        
+        Pseudo Code:
+        RESET per-cycle counters
+        FOR EACH selected check (all configured by default), in registry order:
+          IF first entity check THEN load state snapshot (one request)
+          RUN check
+        RECORD HTTP calls and timings for this cycle
+        RETURN results dictionary
+        """
+        self.begin_cycle(checks)
+        snapshot_loaded = False
+        
+        for name in self.selected_checks(checks):
+            method, key = CHECKS[name]
+            if name in ENTITY_CHECKS and not snapshot_loaded:
+                self._timed("state_snapshot", self.load_state_snapshot)
+                snapshot_loaded = True
+            self._timed(key, getattr(self, method))
+        
+        self.end_cycle()
+        return self.results
+    
+    def finish_cycle(self):
+        """
+        Close the cycle: snapshot it, diff it, hand it to every registered hook
+        
+        Pseudo Code:
+        DERIVE overall status
+        BUILD immutable snapshot (unchanged entities shared with the last one)
+        DIFF against last snapshot -> changes
+        FOR EACH hook (history store, exporters, ...):
+          CALL hook with results
+          IF hook fails THEN log and keep going
+        """
+        self.update_overall_status()
+        previous = self.snapshot
+        self.snapshot = CycleSnapshot.from_results(self.results, previous)
+        self.changes = self.snapshot.diff(previous)
+        
+        for hook in self.cycle_hooks:
+            try:
+                hook(self.results)
+            except Exception as e:
+                print(f"ERROR: cycle hook failed: {e}")
+    
     def generate_report(self, format: str = "text") -> str:
         """
         Generate health report
@@ -482,25 +1989,42 @@ class SystemMonitor:
         Pseudo Code:
         AGGREGATE all check results
         DETERMINE overall system status
-        FORMAT report as text or JSON
+        FORMAT report as text or JSON (full report)
+          OR changes/jsonl (only what changed, call after finish_cycle)
         RETURN report string
         """
-        # Determine overall status
+        self.update_overall_status()
+        
+        if format == "json":
+            return json.dumps(self.results, indent=2)
+        elif format == "jsonl":
+            return "\n".join(json.dumps(change) for change in self.changes)
+        elif format == "changes":
+            return "\n".join(CycleSnapshot.format_change(change) for change in self.changes)
+        else:
+            return self._format_text_report()
+    
+    def update_overall_status(self) -> str:
+        """
+        Derive overall system status from the check results
+        
+        Pseudo Code:
+        IF every check is OK/ONLINE THEN HEALTHY
+        ELSE IF any check is ERROR/LEAK THEN ERROR
+        ELSE IF any check is DEGRADED/OFFLINE/TIMEOUT THEN DEGRADED
+        ELSE UNKNOWN
+        """
         check_statuses = [check.get("status") for check in self.results["checks"].values()]
         
-        if all(status == "OK" for status in check_statuses):
+        if all(status in ["OK", "ONLINE"] for status in check_statuses):
             self.results["overall_status"] = "HEALTHY"
-        elif any(status == "ERROR" for status in check_statuses):
+        elif any(status in ["ERROR", "LEAK"] for status in check_statuses):
             self.results["overall_status"] = "ERROR"
-        elif any(status in ["DEGRADED", "OFFLINE"] for status in check_statuses):
+        elif any(status in ["DEGRADED", "OFFLINE", "TIMEOUT"] for status in check_statuses):
             self.results["overall_status"] = "DEGRADED"
         else:
             self.results["overall_status"] = "UNKNOWN"
-        
-        if format == "json":
-            return json.dumps(self.results, indent=2)
-        else:
-            return self._format_text_report()
+        return self.results["overall_status"]
     
     def _format_text_report(self) -> str:
         """Format results as human-readable text"""
@@ -510,10 +2034,23 @@ class SystemMonitor:
         lines.append("=" * 60)
         lines.append(f"Timestamp: {self.results['timestamp']}")
         lines.append(f"Overall Status: {self.results['overall_status']}")
+        breaker = self.results.get("circuit_breaker", {})
+        if breaker.get("state", "CLOSED") != "CLOSED" or self.results.get("http_retries"):
+            lines.append(f"HA Connection: circuit breaker {breaker.get('state')}, "
+                         f"{self.results.get('http_retries', 0)} retried request(s), "
+                         f"{breaker.get('short_circuited_total', 0)} skipped call(s)")
+        restarted = {group: worker["restarts"] for group, worker in
+                     self.results.get("supervisor", {}).get("workers", {}).items() if worker["restarts"]}
+        if restarted:
+            lines.append("Check Workers: " + ", ".join(f"{group} restarted {count}x"
+                                                       for group, count in restarted.items()))
         lines.append("")
         
         for check_name, check_data in self.results["checks"].items():
             status = check_data.get("status", "UNKNOWN")
+            if "cached_seconds" in check_data:
+                age = check_data["cached_seconds"]
+                status += f" (cached, checked {age}s ago)" if age < 120 else f" (cached, checked {age // 60}m ago)"
             lines.append(f"{check_name.upper()}: {status}")
             
             if check_name in ["sensors", "switches", "automations", "esp32_devices"]:
@@ -522,82 +2059,5173 @@ class SystemMonitor:
                     if item_name != "status" and isinstance(item_data, dict):
                         item_status = item_data.get("status", "OK")
                         lines.append(f"  - {item_name}: {item_status}")
+            elif check_name == "rules":
+                for entity_id, entry in check_data.get("entities", {}).items():
+                    if entry.get("status") != "OK":
+                        reason = "; ".join(entry.get("failures", [])) or entry.get("error", "")
+                        lines.append(f"  - {entity_id}: {entry.get('status')} ({reason})")
+            elif check_name == "automation_audit":
+                for automation, entry in check_data.get("automations", {}).items():
+                    lines.append(f"  - {automation}: {entry['status']} ({entry['runs']} run(s), "
+                                 f"last {entry['last_run'] or 'not in logbook'})")
+                    for event in entry.get("events", []):
+                        lines.append(f"      {event['time']} {event['status']}: {event['detail']}")
             
             lines.append("")
         
+        transitions = self.results.get("transitions")
+        if transitions is not None:
+            lines.append(f"CHANGES SINCE LAST RUN: {len(transitions)}")
+            for change in transitions:
+                lines.append(f"  - {change['entity']}: {change['from'] or 'NEW'} -> {change['to']}")
+            lines.append("")
+        
         lines.append("=" * 60)
         return "\n".join(lines)
 
 ################################################################################
-# MAIN EXECUTION
+# CLASS: AsyncSystemMonitor
+# PSEUDO CODE:
+#   Same checks as SystemMonitor, run concurrently on one event loop
+#   ALL checks share one HTTP connection pool
+#   EACH check gets its own deadline
+#   CYCLE time = slowest check, not the sum of all checks
+#   TIMED-OUT checks keep their worker thread until the call returns;
+#     too many stuck at once -> retire the pool, start a fresh one
 ################################################################################
 
-def main():
+class AsyncSystemMonitor(SystemMonitor):
     """
-    Main execution flow
+    Garden Automation System Monitor (concurrent engine)
     
     Pseudo Code:
-    PARSE command line arguments
-    INITIALIZE system monitor
-    IF continuous mode THEN:
-      LOOP forever:
-        RUN all checks
-        GENERATE report
-        SEND alerts if needed
-        WAIT interval
-    ELSE:
-      RUN all checks once
-      GENERATE report
-      EXIT
-    END IF
+    INITIALIZE like SystemMonitor
+    SIZE shared HTTP connection pool
+    RUN all checks at the same time, each with a deadline
+    PRODUCE the same results dictionary as SystemMonitor
+    
+    COMMON LANGUAGE:
+    Instead of waiting for each check to finish before starting the next,
+    all checks start together. A slow or hung check can only cost its own
+    deadline, not delay everything behind it.
     """
-    parser = argparse.ArgumentParser(description="Garden Automation System Monitor")
-    parser.add_argument("--ha-url", default=HA_URL, help="Home Assistant URL")
-    parser.add_argument("--ha-token", required=True, help="Home Assistant long-lived access token")
-    parser.add_argument("--continuous", action="store_true", help="Run continuously")
-    parser.add_argument("--interval", type=int, default=300, help="Check interval in seconds (default: 300)")
-    parser.add_argument("--json", action="store_true", help="Output JSON format")
     
-    args = parser.parse_args()
+    def __init__(self, *args, check_timeout: float = CHECK_TIMEOUT_SECONDS, **kwargs):
+        """
+        Initialize concurrent monitor
+        
+        Pseudo Code:
+        INITIALIZE base monitor (pooled HTTP session)
+        CREATE worker threads for blocking network calls
+        EVENT loop is created on the first cycle and kept
+        """
+        super().__init__(*args, **kwargs)
+        self.check_timeout = check_timeout
+        
+        self._executor = self._new_executor()
+        self._abandoned: List = []   # Worker futures of checks past their deadline, still running
+        self.executors_replaced = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
     
-    monitor = SystemMonitor(
-        ha_url=args.ha_url,
+    @staticmethod
+    def _new_executor() -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE, thread_name_prefix="monitor-check")
+    
+    def _reclaim_workers(self):
+        """
+        Keep timed-out checks from draining the worker pool
+        
+        Pseudo Code:
+        FORGET abandoned workers that have finished since
+        IF ASYNC_ABANDONED_LIMIT or more are still stuck THEN:
+          RETIRE the pool (stuck threads end with their call, results discarded)
+          START a fresh pool for this and later cycles
+        
+        COMMON LANGUAGE:
+        A thread cannot be killed, so a check stuck on a hung server keeps
+        its worker after we stop waiting for it. Enough of those and new
+        checks would queue behind them and time out too; a fresh pool
+        gives every cycle free workers again.
+        """
+        self._abandoned = [future for future in self._abandoned if not future.done()]
+        if len(self._abandoned) >= ASYNC_ABANDONED_LIMIT:
+            print(f"⚠ {len(self._abandoned)} timed-out checks still hold workers, starting a fresh pool")
+            self._executor.shutdown(wait=False)
+            self._executor = self._new_executor()
+            self._abandoned = []
+            self.executors_replaced += 1
+    
+    def _staged(self, key: str, func) -> Dict:
+        """
+        Run one blocking step on a worker thread against a private results dict
+        
+        Pseudo Code:
+        POINT self.results (this thread only) at an empty staging dict
+        RUN step in a trace span, time it
+        RETURN staged results, step's return value and duration
+          (the event loop merges them only if the step beat its deadline,
+          so a check finishing late cannot touch this or the next cycle)
+        """
+        staged = {"checks": {}}
+        self._staging.results = staged
+        started = time.perf_counter()
+        try:
+            with self.trace.span(key, "check"):
+                value = func()
+        finally:
+            self._staging.results = None
+        return {"results": staged, "value": value, "seconds": round(time.perf_counter() - started, 4)}
+    
+    def _merge_staged(self, key: str, staged: Dict):
+        """Copy a step's staged results and duration into this cycle (event loop thread only)"""
+        for name, value in staged["results"].items():
+            if name == "checks":
+                self.results["checks"].update(value)
+            else:
+                self.results[name] = value
+        self._check_seconds[key] = staged["seconds"]
+    
+    async def _run_step(self, key: str, func) -> Optional[Dict]:
+        """Run func staged on the worker pool; None if it missed check_timeout (worker remembered)"""
+        future = self._executor.submit(self._staged, key, func)
+        try:
+            staged = await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.check_timeout)
+        except asyncio.TimeoutError:
+            self._abandoned.append(future)
+            return None
+        self._merge_staged(key, staged)
+        return staged
+    
+    async def _run_check(self, name: str, check) -> bool:
+        """
+        Run one blocking check in the worker pool with a deadline
+        
+        Pseudo Code:
+        START check on a worker thread (staged)
+        WAIT up to check_timeout seconds
+        IF deadline passed THEN record TIMEOUT for this check
+          (whatever the thread writes later is discarded with its staging dict)
+        """
+        started = time.perf_counter()
+        staged = await self._run_step(name, check)
+        if staged is not None:
+            return staged["value"]
+        self.results["checks"][name] = {
+            "status": "TIMEOUT",
+            "message": f"Check exceeded {self.check_timeout}s deadline"
+        }
+        print(f"✗ {name}: TIMEOUT after {self.check_timeout}s")
+        self._check_seconds[name] = round(time.perf_counter() - started, 4)
+        return False
+    
+    async def _run_entity_checks(self, names: List[str]):
+        """
+        Load the state snapshot, then run entity checks concurrently
+        
+        Pseudo Code:
+        FETCH snapshot (entity checks depend on it), index it here
+        RUN selected device, sensor, switch and automation checks together
+        """
+        staged = await self._run_step("state_snapshot", self.fetch_states)
+        if staged is None:
+            print("✗ State snapshot: TIMEOUT (falling back to per-entity requests)")
+        else:
+            self._state_index = staged["value"]
+        
+        await asyncio.gather(*[
+            self._run_check(CHECKS[name][1], getattr(self, CHECKS[name][0]))
+            for name in names
+        ])
+    
+    async def run_checks_async(self, checks: Optional[List[str]] = None) -> Dict:
+        """
+        Run health checks concurrently
+        
+        Pseudo Code:
+        RESET per-cycle counters
+        REPLACE the worker pool if timed-out checks still hold too much of it
+        RUN HA ping, MQTT check and entity checks at the same time
+        RECORD number of HTTP calls made this cycle
+        RETURN results dictionary
+        """
+        self.begin_cycle(checks)
+        self._reclaim_workers()
+        selected = self.selected_checks(checks)
+        entity_checks = [name for name in selected if name in ENTITY_CHECKS]
+        
+        tasks = [
+            self._run_check(CHECKS[name][1], getattr(self, CHECKS[name][0]))
+            for name in selected if name not in ENTITY_CHECKS
+        ]
+        if entity_checks:
+            tasks.append(self._run_entity_checks(entity_checks))
+        await asyncio.gather(*tasks)
+        
+        self.end_cycle()
+        return self.results
+    
+    def run_checks(self, checks: Optional[List[str]] = None) -> Dict:
+        """Run one concurrent monitoring cycle from synchronous code (same event loop every cycle)"""
+        if self._loop is None:
+            self._loop = _ensure_loaded(asyncio).new_event_loop()
+        return self._loop.run_until_complete(self.run_checks_async(checks))
+    
+    def close(self):
+        """Release the worker pool and event loop, then the base monitor's resources"""
+        self._executor.shutdown(wait=False)
+        if self._loop is not None:
+            self._loop.close()
+            self._loop = None
+        super().close()
+
+################################################################################
+# CLASS: IsolatedSystemMonitor
+# PSEUDO CODE:
+#   Checks run in long-lived workers, one per check group (CHECK_GROUPS)
+#   WORKER = spawned child process (killed on timeout) or thread (abandoned on timeout)
+#   WORKERS fetch and probe; breaker and stateful engines stay in the supervisor
+#   EACH step reports back: per-check budget counts from the last report
+#   WHOLE cycle has its own budget
+#   WEDGED worker -> its checks are TIMEOUT, a fresh worker serves the next cycle
+################################################################################
+
+_WORKER_EXITED = "exited"   # Reader-thread message: worker process closed its pipe
+_HA_STEPS = ("home_assistant", "state_snapshot", "logbook")   # Worker steps waiting on HA
+
+
+def _worker_monitor(config: Dict) -> "SystemMonitor":
+    """Fresh monitor for one worker, built from the supervisor's settings (nothing shared or inherited)"""
+    settings = dict(config)
+    extras = {name: settings.pop(name) for name in ("device_discovery", "probe_devices", "device_url_template")}
+    monitor = SystemMonitor(**settings)
+    for name, value in extras.items():
+        setattr(monitor, name, value)
+    return monitor
+
+
+class _WorkerBreaker(CircuitBreaker):
+    """
+    A worker's copy of the supervisor's circuit breaker, for one cycle
+    
+    Pseudo Code:
+    START in the supervisor's state (an open breaker stays open for the time it has left)
+    DECIDE like the real breaker, LOG every outcome for the supervisor to replay
+    """
+    
+    def __init__(self, status: Dict):
+        super().__init__()
+        self.state = status["state"]
+        self.failures = status["consecutive_failures"]
+        if self.state == self.OPEN:
+            self.opened_at = time.monotonic() - (self.reset_seconds - status["retry_in_seconds"])
+        self.outcomes: List[bool] = []
+    
+    def record_success(self):
+        self.outcomes.append(True)
+        super().record_success()
+    
+    def record_failure(self):
+        self.outcomes.append(False)
+        super().record_failure()
+
+
+def _check_worker_loop(monitor: "SystemMonitor", receive, send):
+    """
+    Serve check requests for one group until told to stop (runs in the worker)
+    
+    Pseudo Code:
+    LOOP:
+      WAIT for a request; None = stop
+      RESET per-cycle state, COPY the supervisor's breaker
+      IF the checks or the supervisor need states:
+        USE pushed states or load snapshot (entity by entity if it failed and
+          the supervisor listed entities), REPORT step (+ states if asked for)
+      IF the supervisor asked for logbook entries THEN fetch them, REPORT entries or error
+      FOR EACH check:
+        RUN check (an exception becomes an ERROR result), REPORT result + duration
+      REPORT HTTP counters, breaker outcomes and trace spans
+    """
+    while True:
+        request = receive()
+        if request is None:
+            return
+        cycle, names, fetch = request["cycle"], request["checks"], request["fetch"]
+        monitor.begin_cycle(names)
+        monitor.breaker = _WorkerBreaker(request["breaker"])
+        
+        def load_states():
+            monitor.load_state_snapshot()
+            if not monitor._state_index and fetch["states"]:
+                for entity_id in fetch["states"]:   # Snapshot failed: read entities one by one
+                    state = monitor._api_get(f"states/{entity_id}")
+                    if state:
+                        monitor._state_index[entity_id] = state
+        
+        def read_logbook():
+            try:
+                return {"entries": monitor.fetch_logbook(*fetch["logbook"])}
+            except UpstreamDownError as e:
+                return {"error": str(e), "upstream_down": True}
+            except (requests.exceptions.RequestException, ValueError) as e:
+                return {"error": str(e), "upstream_down": False}
+        
+        if fetch["states"] is not None or any(name in ENTITY_CHECKS for name in names):
+            if request["states"] is not None:
+                monitor._state_index = request["states"]
+            else:
+                monitor._timed("state_snapshot", load_states)
+            send((cycle, "state_snapshot", None if fetch["states"] is None else monitor._state_index,
+                  monitor._check_seconds.get("state_snapshot")))
+        if fetch["logbook"] is not None:
+            send((cycle, "logbook", monitor._timed("logbook", read_logbook), monitor._check_seconds["logbook"]))
+        
+        for name in names:
+            method, key = CHECKS[name]
+            try:
+                monitor._timed(key, getattr(monitor, method))
+            except Exception as e:
+                monitor.results["checks"][key] = {"status": "ERROR", "message": f"Check failed: {e}"}
+                print(f"✗ {key}: {e}")
+            send((cycle, key, monitor.results["checks"].get(key), monitor._check_seconds.get(key)))
+        
+        send((cycle, None, {
+            "http_calls": monitor.http_calls,
+            "http_errors": monitor.http_errors,
+            "http_retries": monitor.http_retries,
+            "breaker_outcomes": monitor.breaker.outcomes,
+            "short_circuited": monitor.breaker.short_circuited,
+            "trace_origin": monitor.trace.origin,
+            "spans": list(monitor.trace.spans)
+        }, None))
+
+
+def _check_worker_process(config: Dict, conn):
+    """
+    Child process entry (spawned, so it holds none of the parent's locks or connections)
+    
+    Pseudo Code:
+    IGNORE Ctrl+C (the parent stops us)
+    BUILD own monitor from the settings
+    SERVE requests over the pipe; each message carries what was printed since the last
+    STOP when the pipe closes or the parent is gone
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    output = io.StringIO()
+    sys.stdout = output   # The parent prints it, wherever its own output goes
+    parent = os.getppid()
+    
+    def receive():
+        try:
+            while not conn.poll(1.0):
+                if os.getppid() != parent:
+                    return None   # Parent died without stopping us (e.g. watchdog exit)
+            return conn.recv()
+        except (EOFError, OSError):
+            return None   # Parent closed the pipe
+    
+    def send(message):
+        conn.send((output.getvalue(), message))
+        output.seek(0)
+        output.truncate()
+    
+    _check_worker_loop(_worker_monitor(config), receive, send)
+
+
+class CheckWorker:
+    """
+    One check group's worker: a child process or a thread with its own monitor
+    
+    Pseudo Code:
+    START: spawn a process with a pipe (process) or start a thread (thread),
+      handing it the monitor's settings (never the monitor itself)
+    EVERY message it sends goes to the supervisor's inbox, tagged with
+      the worker and its generation
+    KILL: process -> SIGKILL; thread -> abandon it (Python cannot stop a
+      thread) and bump the generation so its late messages are ignored
+    
+    COMMON LANGUAGE:
+    A process stuck in DNS or TLS is simply killed. A stuck thread cannot be
+    killed, so it is left to finish on its own while a new one takes over.
+    """
+    
+    def __init__(self, group: str, isolation: str, inbox: "queue.Queue"):
+        self.group = group
+        self.isolation = isolation
+        self.inbox = inbox
+        self.generation = 0
+        self.restarts = 0        # Workers replaced after a timeout or crash
+        self.process = None
+        self.thread: Optional[threading.Thread] = None
+        self._conn = None
+        self._requests: Optional[queue.Queue] = None
+    
+    @property
+    def alive(self) -> bool:
+        if self.isolation == "process":
+            return self.process is not None and self.process.is_alive()
+        return self.thread is not None and self.thread.is_alive()
+    
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process is not None else None
+    
+    def start(self, config: Dict):
+        """Start a fresh worker serving this group with a monitor built from config"""
+        self.generation += 1
+        generation = self.generation
+        
+        if self.isolation == "process":
+            context = multiprocessing.get_context("spawn")
+            self._conn, child = context.Pipe()
+            self.process = context.Process(target=_check_worker_process, args=(config, child),
+                                           name=f"monitor-{self.group}", daemon=True)
+            self.process.start()
+            child.close()
+            threading.Thread(target=self._read, args=(self._conn, generation),
+                             name=f"monitor-{self.group}-reader", daemon=True).start()
+        else:
+            self._requests = queue.Queue()
+            self.thread = threading.Thread(
+                target=_check_worker_loop,
+                args=(_worker_monitor(config), self._requests.get,
+                      lambda message: self.inbox.put((self, generation, message))),
+                name=f"monitor-{self.group}", daemon=True)
+            self.thread.start()
+    
+    def _read(self, conn, generation: int):
+        """Print the worker process's output and forward its messages to the inbox until its pipe closes"""
+        while True:
+            try:
+                output, message = conn.recv()
+            except (EOFError, OSError):
+                self.inbox.put((self, generation, _WORKER_EXITED))
+                return
+            if output:
+                sys.stdout.write(output)
+            self.inbox.put((self, generation, message))
+    
+    def submit(self, request):
+        """Send a request (see IsolatedSystemMonitor._request), or None to stop"""
+        if self.isolation == "process":
+            self._conn.send(request)
+        else:
+            self._requests.put(request)
+    
+    def kill(self):
+        """Stop a wedged worker now"""
+        self.generation += 1
+        if self.process is not None:
+            self.process.kill()
+            self.process.join(WORKER_JOIN_SECONDS)
+            self._conn.close()
+            self.process = None
+        elif self.thread is not None:
+            self._requests.put(None)   # Leaves once its stuck call returns
+            self.thread = None
+    
+    def stop(self):
+        """Ask an idle worker to exit, kill it if it does not"""
+        if not self.alive:
+            self.kill()
+            return
+        self.submit(None)
+        if self.process is not None:
+            self.process.join(WORKER_JOIN_SECONDS)
+        self.kill()
+
+
+class IsolatedSystemMonitor(SystemMonitor):
+    """
+    Garden Automation System Monitor (supervised engine)
+    
+    Pseudo Code:
+    INITIALIZE like SystemMonitor, plus a worker per check group
+    EACH cycle:
+      SEND every group its selected checks (groups run at the same time)
+      COLLECT results as they arrive
+      CUT OFF any step over its check budget, and everything at the cycle budget
+      REPLACE cut-off workers
+    KEEP what must outlive a worker here: the circuit breaker (workers replay
+      their outcomes into it) and the anomaly, rule and audit engines (workers
+      only fetch states and logbook entries, SUPERVISOR_CHECKS are judged here)
+    PRODUCE the same results dictionary as SystemMonitor, plus "supervisor"
+    
+    COMMON LANGUAGE:
+    An MQTT connect hanging in DNS or an HA request stuck in TLS used to
+    freeze the whole cycle. Now the check that hangs is reported as TIMEOUT,
+    its worker is replaced, and the cycle still ends within its budget.
+    Replacing a worker loses nothing: sensor history, rule state, the audit
+    cursor and "HA is down" all live in the supervisor.
+    """
+    
+    def __init__(self, *args, isolation: str = "process", check_timeout: float = CHECK_TIMEOUT_SECONDS,
+                 cycle_budget: float = CYCLE_BUDGET_SECONDS, **kwargs):
+        """
+        Initialize supervised monitor
+        
+        Pseudo Code:
+        INITIALIZE base monitor (its settings are handed to the workers)
+        PREPARE one worker per check group (started on first use)
+        """
+        super().__init__(*args, **kwargs)
+        self.isolation = isolation
+        self.check_timeout = check_timeout
+        self.cycle_budget = cycle_budget
+        self._inbox: queue.Queue = queue.Queue()
+        self._workers = {group: CheckWorker(group, isolation, self._inbox) for group in CHECK_GROUPS}
+        self._cycle = 0
+        self._logbook: Optional[Dict] = None   # What the entities worker read for the audit
+    
+    def _worker_config(self) -> Dict:
+        """Settings a worker builds its own monitor from (plain values, safe to pickle)"""
+        return {
+            "ha_url": self.ha_url,
+            "ha_token": self.ha_token,
+            "mqtt_broker": self.mqtt_broker,
+            "mqtt_port": self.mqtt_port,
+            "mqtt_user": self.mqtt_user,
+            "mqtt_pass": self.mqtt_pass,
+            "esp32_devices": list(self.esp32_devices),
+            "critical_sensors": list(self.critical_sensors),
+            "critical_switches": list(self.critical_switches),
+            "critical_automations": list(self.critical_automations),
+            "device_discovery": self.device_discovery,
+            "probe_devices": self.probe_devices,
+            "device_url_template": self.device_url_template
+        }
+    
+    def _request(self, names: List[str], states: Optional[Dict[str, Dict]], now: float) -> Optional[Dict]:
+        """
+        What one group's worker does this cycle (None = nothing, the supervisor has all it needs)
+        
+        Pseudo Code:
+        CHECKS not in SUPERVISOR_CHECKS -> run in the worker (pushed states if any)
+        SUPERVISOR_CHECKS without pushed states -> worker fetches the states, with
+          the entities to read one by one if the snapshot fails
+        AUDIT -> worker fetches the logbook window the auditor reads at `now`
+        """
+        run = [name for name in names if name not in SUPERVISOR_CHECKS]
+        judged = [name for name in names if name in SUPERVISOR_CHECKS]
+        fetch = {"states": None, "logbook": None}
+        
+        if judged and states is None:
+            wanted = {
+                "sensors": self.critical_sensors,
+                "switches": self.critical_switches,
+                "automations": self.critical_automations,
+                "rules": list(self.rule_engine.index) if self.rule_engine is not None else []
+            }
+            fetch["states"] = [entity_id for name in judged for entity_id in wanted.get(name, [])]
+        if "audit" in judged:
+            start, end = self.automation_auditor.window(now)
+            if end > start:
+                fetch["logbook"] = (self.automation_auditor.watched, start, end)
+        
+        if not run and fetch["states"] is None and fetch["logbook"] is None:
+            return None
+        return {
+            "cycle": self._cycle,
+            "checks": run,
+            "states": states if any(name in ENTITY_CHECKS for name in run) else None,
+            "fetch": fetch,
+            "breaker": self.breaker.status()
+        }
+    
+    def _judge(self, names: List[str], fetched: Dict, now: float):
+        """
+        Run SUPERVISOR_CHECKS here, on what a worker fetched (or the WebSocket cache)
+        
+        Pseudo Code:
+        USE fetched states as the snapshot (lookups never fall back to HTTP here)
+        RUN each check; the audit judges as of `now`, the time its logbook window was fixed
+        """
+        self._state_index = fetched.get("state_snapshot") or {}
+        self._logbook = fetched.get("logbook")
+        for name in names:
+            method, key = CHECKS[name]
+            check = getattr(self, method)
+            try:
+                self._timed(key, (lambda: check(now)) if name == "audit" else check)
+            except Exception as e:
+                self.results["checks"][key] = {"status": "ERROR", "message": f"Check failed: {e}"}
+                print(f"✗ {key}: {e}")
+    
+    def _get_state(self, entity_id: str) -> Optional[Dict]:
+        """Entity state from what the workers fetched (the supervisor itself sends no requests)"""
+        return self._state_index.get(entity_id)
+    
+    def fetch_logbook(self, entities: List[str], start: float, end: float) -> List[Dict]:
+        """Logbook entries the entities worker read for this window (its error is raised here)"""
+        logbook = self._logbook
+        if logbook is None:
+            raise ValueError("logbook was not read this cycle")
+        if "error" in logbook:
+            raise (UpstreamDownError if logbook["upstream_down"] else ValueError)(logbook["error"])
+        return logbook["entries"]
+    
+    def _cut_off(self, worker: CheckWorker, steps: List[str], reason: str, waited: float):
+        """
+        Report a worker's unfinished steps as TIMEOUT and kill it
+        
+        Pseudo Code:
+        STEP that was running -> TIMEOUT with reason and time waited
+        STEPS queued behind it -> TIMEOUT (not run)
+        IF the running step was waiting on HA THEN count one breaker failure
+        KILL worker (a new one starts next cycle)
+        """
+        running = steps[0]
+        for key in steps:
+            if key in ("state_snapshot", "logbook"):
+                continue
+            if key == running:
+                message = reason
+                self._check_seconds[key] = round(waited, 4)
+            else:
+                message = f"Not run: {running} timed out first in the {worker.group} worker"
+            self.results["checks"][key] = {"status": "TIMEOUT", "message": message}
+        if running in _HA_STEPS:
+            self.breaker.record_failure()
+        print(f"✗ {running}: TIMEOUT after {waited:.1f}s ({reason}), restarting {worker.group} worker")
+        worker.kill()
+        worker.restarts += 1
+    
+    def _merge(self, summary: Dict):
+        """Add a worker's HTTP counters, breaker outcomes and trace spans to this cycle"""
+        self.http_calls += summary["http_calls"]
+        self.http_errors += summary["http_errors"]
+        self.http_retries += summary["http_retries"]
+        self.breaker.replay(summary["breaker_outcomes"], summary["short_circuited"])
+        offset_ms = (summary["trace_origin"] - self.trace.origin) * 1000
+        with self.trace._lock:
+            self.trace.spans.extend(dict(span, start_ms=round(span["start_ms"] + offset_ms, 3))
+                                    for span in summary["spans"])
+    
+    def run_checks(self, checks: Optional[List[str]] = None) -> Dict:
+        """
+        Run one supervised monitoring cycle
+        
+        Pseudo Code:
+        RESET per-cycle counters
+        IF WebSocket cache is synced THEN use its states (pushed to workers that need them)
+        FOR EACH group with selected checks:
+          IF the supervisor has all it needs THEN judge its checks now
+          ELSE START worker if not running (first cycle, or replaced), SEND request
+        UNTIL every group has reported or been cut off:
+          WAIT for the next message, at most until the nearest deadline
+            (last progress + check budget, or the cycle budget)
+          RECORD check results and fetched states / logbook entries
+          WHEN a group finishes: MERGE counters, replay breaker, judge its SUPERVISOR_CHECKS
+          IF a worker died THEN its unfinished checks are ERROR
+          IF a deadline passed THEN cut off that worker (TIMEOUT)
+        RECORD timings and breaker state
+        RETURN results dictionary
+        """
+        self.begin_cycle(checks)
+        selected = self.selected_checks(checks)
+        self._cycle += 1
+        cycle_deadline = time.monotonic() + self.cycle_budget
+        now = time.time()
+        
+        states = None
+        if self.state_stream is not None and any(name in ENTITY_CHECKS for name in selected):
+            self.results["state_stream"] = self.state_stream.status()
+            if self.state_stream.synced.is_set():
+                with self.trace.span("websocket.snapshot", "cache"):
+                    states = self.state_stream.snapshot()
+        pushed = {} if states is None else {"state_snapshot": states}
+        
+        running = {}   # worker -> [steps not yet reported, time of last report]
+        judged = {}    # worker -> [SUPERVISOR_CHECKS waiting on it, what it fetched]
+        for group, members in CHECK_GROUPS.items():
+            names = [name for name in selected if name in members]
+            if not names:
+                continue
+            local = [name for name in names if name in SUPERVISOR_CHECKS]
+            request = self._request(names, states, now)
+            if request is None:
+                self._judge(local, pushed, now)
+                continue
+            
+            worker = self._workers[group]
+            if not worker.alive:
+                worker.start(self._worker_config())
+            worker.submit(request)
+            steps = [CHECKS[name][1] for name in names]
+            if request["fetch"]["logbook"] is not None:
+                steps.insert(0, "logbook")
+            if request["fetch"]["states"] is not None or any(name in ENTITY_CHECKS for name in request["checks"]):
+                steps.insert(0, "state_snapshot")
+            running[worker] = [steps, time.monotonic()]
+            judged[worker] = [local, dict(pushed)]
+        
+        while running:
+            now_monotonic = time.monotonic()
+            for worker, (steps, since) in list(running.items()):
+                if now_monotonic >= cycle_deadline:
+                    self._cut_off(worker, steps, f"Cycle exceeded {self.cycle_budget}s budget",
+                                  now_monotonic - since)
+                    del running[worker]
+                elif now_monotonic >= since + self.check_timeout:
+                    self._cut_off(worker, steps, f"Check exceeded {self.check_timeout}s deadline",
+                                  now_monotonic - since)
+                    del running[worker]
+            if not running:
+                break
+            
+            deadline = min([cycle_deadline] + [since + self.check_timeout for _, since in running.values()])
+            try:
+                worker, generation, message = self._inbox.get(timeout=max(deadline - now_monotonic, 0))
+            except queue.Empty:
+                continue
+            if worker not in running or generation != worker.generation:
+                continue   # Late message from a worker already cut off
+            steps = running[worker][0]
+            
+            if message == _WORKER_EXITED:
+                for key in steps:
+                    if key not in ("state_snapshot", "logbook"):
+                        self.results["checks"][key] = {"status": "ERROR",
+                                                       "message": f"{worker.group} worker exited"}
+                worker.process.join(WORKER_JOIN_SECONDS)
+                print(f"✗ {worker.group} worker exited (code {worker.process.exitcode}), restarting")
+                worker.kill()
+                worker.restarts += 1
+                del running[worker]
+                continue
+            
+            cycle, key, result, seconds = message
+            if cycle != self._cycle:
+                continue
+            if key is None:
+                self._merge(result)
+                del running[worker]
+                self._judge(*judged[worker], now)
+                continue
+            if key in ("state_snapshot", "logbook"):
+                if result is not None:
+                    judged[worker][1][key] = result
+            elif result is not None:
+                self.results["checks"][key] = result
+            if seconds is not None:
+                self._check_seconds[key] = seconds
+            if key in steps:
+                steps.remove(key)
+            running[worker][1] = time.monotonic()
+        
+        self.end_cycle()
+        self.results["supervisor"] = {
+            "isolation": self.isolation,
+            "check_timeout": self.check_timeout,
+            "cycle_budget": self.cycle_budget,
+            "workers": {
+                group: {"alive": worker.alive, "pid": worker.pid, "restarts": worker.restarts}
+                for group, worker in self._workers.items()
+                if worker.alive or worker.restarts
+            }
+        }
+        return self.results
+    
+    def close(self):
+        """Stop the workers, then release this process's own resources"""
+        for worker in self._workers.values():
+            worker.stop()
+        super().close()
+
+################################################################################
+# CLASS: CheckScheduler
+# PSEUDO CODE:
+#   Priority queue of (next due time, check name)
+#   AFTER each check, pick its next interval from the result:
+#     OK           -> normal interval
+#     DEGRADED     -> tightened interval (look again sooner)
+#     UNREACHABLE  -> exponential backoff with jitter (don't hammer it)
+################################################################################
+
+class CheckScheduler:
+    """
+    Adaptive per-check scheduler for continuous monitoring
+    
+    Pseudo Code:
+    PUSH every check as due now
+    DUE(now): pop all checks whose time has come
+    COMPLETE(check, status): compute next interval, push back on queue
+    
+    COMMON LANGUAGE:
+    Cheap, important checks (is HA up?) run often; slow-changing ones
+    (are automations enabled?) run rarely. When something looks wrong we
+    check it more often; when a server is down we wait longer and longer
+    between attempts instead of sitting through timeouts every cycle.
+    """
+    
+    HEALTHY = ["OK", "ONLINE", "HEALTHY"]
+    DEGRADED = ["DEGRADED", "STALE", "DISABLED", "INVALID", "ANOMALY"]
+    
+    def __init__(self, intervals: Optional[Dict[str, float]] = None, now: Optional[float] = None):
+        self.intervals = dict(intervals or CHECK_INTERVALS)
+        self.failures: Dict[str, int] = {name: 0 for name in self.intervals}
+        self.next_interval: Dict[str, float] = dict(self.intervals)
+        self._queue: List = []
+        self._sequence = 0
+        
+        start = now if now is not None else time.time()
+        for name in self.intervals:
+            self._push(name, start)
+    
+    def _push(self, name: str, due: float):
+        self._sequence += 1
+        heapq.heappush(self._queue, (due, self._sequence, name))
+    
+    def next_due(self) -> float:
+        """Time the earliest check is due"""
+        return self._queue[0][0] if self._queue else float("inf")
+    
+    def due(self, now: float) -> List[str]:
+        """Pop every check that is due"""
+        names = []
+        while self._queue and self._queue[0][0] <= now:
+            names.append(heapq.heappop(self._queue)[2])
+        return names
+    
+    def scheduled_at(self, name: str) -> float:
+        """Time a queued check is next due"""
+        return min((due for due, _, queued in self._queue if queued == name), default=float("inf"))
+    
+    def defer(self, name: str, until: float):
+        """Re-queue a check without running it (e.g. HA is down)"""
+        self._push(name, until)
+    
+    def hold_entity_checks(self, names: List[str], ha_status: Optional[str]) -> List[str]:
+        """
+        Keep entity checks from running while HA is known to be down
+        
+        Pseudo Code:
+        IF HA check is not scheduled (--checks without ha) THEN run them all:
+          nothing will re-check HA, the circuit breaker skips their requests
+        ELSE IF HA was down at its last check and is not due now:
+          DEFER entity checks to just after the next HA check
+        RETURN checks to run now
+        """
+        if "ha" not in self.intervals or "ha" in names or ha_status not in ["OFFLINE", "ERROR", "TIMEOUT"]:
+            return names
+        ha_due = self.scheduled_at("ha")
+        for name in [name for name in names if name in ENTITY_CHECKS]:
+            names.remove(name)
+            self.defer(name, ha_due + 1)
+        return names
+    
+    def complete(self, name: str, status: Optional[str], now: float) -> float:
+        """
+        Schedule the next run of a check from its latest status
+        
+        Pseudo Code:
+        IF healthy THEN reset failures, use normal interval
+        ELSE IF degraded THEN use tightened interval
+        ELSE (offline / error / timeout):
+          failures += 1
+          backoff = min_interval x 2^(failures-1), capped
+          interval = random point in [backoff/2, backoff] (jitter)
+        PUSH next due time
+        RETURN interval
+        """
+        base = self.intervals[name]
+        
+        if status in self.HEALTHY:
+            self.failures[name] = 0
+            interval = base
+        elif status in self.DEGRADED:
+            self.failures[name] = 0
+            interval = max(SCHEDULE_MIN_INTERVAL, base * SCHEDULE_DEGRADED_FACTOR)
+        else:
+            self.failures[name] += 1
+            backoff = min(SCHEDULE_MAX_BACKOFF,
+                          SCHEDULE_MIN_INTERVAL * 2 ** (self.failures[name] - 1))
+            interval = random.uniform(backoff / 2, backoff)
+        
+        self.next_interval[name] = interval
+        self._push(name, now + interval)
+        return interval
+
+
+def _arm_watchdog(seconds: Optional[float]):
+    """
+    Exit the process if not disarmed within seconds (None disarms)
+    
+    COMMON LANGUAGE:
+    Last line of defence for --continuous: if a cycle is stuck somewhere no
+    budget covers, print where every thread is and exit with an error, so
+    systemd (Restart=on-failure) or Docker starts the monitor again.
+    """
+    if seconds:
+        faulthandler.dump_traceback_later(seconds, exit=True)
+    else:
+        faulthandler.cancel_dump_traceback_later()
+
+
+def run_adaptive_loop(monitor: SystemMonitor, report, intervals: Optional[Dict[str, float]] = None,
+                      watchdog: Optional[float] = None):
+    """
+    Continuous monitoring driven by CheckScheduler
+    
+    Pseudo Code:
+    SCHEDULE configured checks only (rules needs --rules, audit needs --audit)
+    LOOP forever:
+      SLEEP until the next check is due
+      POP due checks
+      IF HA is known down THEN defer entity checks until HA is re-checked
+        (only when ha is scheduled; see CheckScheduler.hold_entity_checks)
+      ARM watchdog (if given): exit if the checks + report take longer
+      RUN due checks (entity checks share one snapshot)
+      RESCHEDULE each from its status
+      PRINT report
+    """
+    configured = monitor.selected_checks()
+    scheduler = CheckScheduler({name: seconds for name, seconds in (intervals or CHECK_INTERVALS).items()
+                                if name in configured})
+    
+    while True:
+        delay = scheduler.next_due() - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        
+        now = time.time()
+        names = scheduler.due(now)
+        
+        ha_status = monitor.results["checks"].get("home_assistant", {}).get("status")
+        names = scheduler.hold_entity_checks(names, ha_status)
+        
+        if not names:
+            continue
+        
+        print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Running: {', '.join(names)}\n")
+        _arm_watchdog(watchdog)
+        monitor.run_checks(names)
+        
+        finished = time.time()
+        for name in names:
+            status = monitor.results["checks"].get(CHECKS[name][1], {}).get("status")
+            scheduler.complete(name, status, finished)
+        
+        report()
+        _arm_watchdog(None)
+        
+        upcoming = ", ".join(f"{name} in {interval:.0f}s" for name, interval in scheduler.next_interval.items()
+                             if name in names)
+        print(f"\nNext: {upcoming}\n")
+
+################################################################################
+# CLASS: TimerWheel
+# PSEUDO CODE:
+#   Hashed timer wheel: deadlines are dropped into slot (deadline / tick)
+#   RESCHEDULE is O(1): bump the key's generation, old entries are ignored
+#   ADVANCE visits only the slots between the last tick and now
+################################################################################
+
+class TimerWheel:
+    """
+    O(1) timeout tracking for many entities
+    
+    Pseudo Code:
+    SCHEDULE(key, deadline): append to slot, remember generation
+    ADVANCE(now):
+      FOR EACH slot passed since last advance:
+        FOR EACH entry in slot:
+          IF entry is latest for its key AND deadline <= now THEN expired
+          ELSE IF deadline still in future THEN keep for next rotation
+      RETURN expired keys
+    
+    COMMON LANGUAGE:
+    Like a clock face with a bucket at every second. Each sensor drops a
+    note in the bucket for when it should next be heard from. As the clock
+    ticks, we only look in the buckets we pass.
+    """
+    
+    def __init__(self, tick: float = STREAM_TICK_SECONDS, slots: int = STREAM_WHEEL_SLOTS,
+                 now: Optional[float] = None):
+        self.tick = tick
+        self.slots: List[List] = [[] for _ in range(slots)]
+        self._generation: Dict[str, int] = {}
+        self._cursor = int((now if now is not None else time.time()) / tick)
+    
+    def schedule(self, key: str, deadline: float):
+        """Set (or replace) the deadline for key"""
+        generation = self._generation.get(key, 0) + 1
+        self._generation[key] = generation
+        slot = int(deadline / self.tick) % len(self.slots)
+        self.slots[slot].append((deadline, key, generation))
+    
+    def cancel(self, key: str):
+        """Forget key; any pending entries become stale"""
+        self._generation.pop(key, None)
+    
+    def advance(self, now: float) -> List[str]:
+        """Return keys whose latest deadline has passed"""
+        expired = []
+        target = int(now / self.tick)
+        steps = min(target - self._cursor + 1, len(self.slots))
+        
+        for offset in range(max(steps, 0)):
+            slot_index = (self._cursor + offset) % len(self.slots)
+            pending = []
+            for entry in self.slots[slot_index]:
+                deadline, key, generation = entry
+                if self._generation.get(key) != generation:
+                    continue  # Superseded by a later schedule()
+                if deadline <= now:
+                    del self._generation[key]
+                    expired.append(key)
+                else:
+                    pending.append(entry)  # Due in a later rotation (or later this tick)
+            self.slots[slot_index] = pending
+        
+        self._cursor = max(self._cursor, target)
+        return expired
+
+################################################################################
+# CLASS: StreamMonitor
+# PSEUDO CODE:
+#   SUBSCRIBE to ESPHome state topics and homeassistant/status
+#   ON EACH MESSAGE: update last-seen table, check validity, re-arm timeout
+#   ON EACH TICK: expire entities that went quiet (timer wheel)
+#   EVERY interval: print health report built from the table (no HTTP)
+################################################################################
+
+class StreamMonitor(SystemMonitor):
+    """
+    Garden Automation System Monitor (MQTT streaming mode)
+    
+    Pseudo Code:
+    INITIALIZE like SystemMonitor
+    KEEP last-seen entry for every critical entity (always)
+    KEEP bounded LRU of other entities seen on the bus
+    EVALUATE staleness and validity incrementally as messages arrive
+    
+    COMMON LANGUAGE:
+    Instead of asking Home Assistant every 5 minutes "when did this sensor
+    last report?", we listen to the sensors directly. The moment one goes
+    quiet for too long, or reports garbage, we know.
+    
+    TOPICS (ESPHome MQTT convention):
+      <node-name>/<component>/<object_id>/state  ->  <component>.<object_id>
+      <node-name>/status                         ->  online / offline
+    """
+    
+    def __init__(self, *args, max_entities: int = STREAM_MAX_ENTITIES, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_entities = max_entities
+        self.sensor_timeout = SENSOR_TIMEOUT_MINUTES * 60
+        
+        self.critical_entities = set(self.critical_sensors) | set(self.critical_switches)
+        self.critical_table: Dict[str, Dict] = {}
+        self.observed_table: "OrderedDict[str, Dict]" = OrderedDict()
+        self.node_status: Dict[str, Dict] = {}
+        self.ha_status: Optional[Dict] = None
+        
+        self.wheel = TimerWheel()
+        self.messages_received = 0
+        self.evictions = 0
+        self.client = None
+        
+        # Per-message consumers (leak detection, anomaly detection, ...)
+        # Each provides name, on_state(entity_id, value, timestamp),
+        # on_tick(now) and report() -> results["checks"][name]
+        self.stages: List = [self.anomaly_engine]
+    
+    def topic_filters(self) -> List[str]:
+        """MQTT subscriptions covering every known ESP32 node"""
+        filters = [HA_STATUS_TOPIC]
+        for device in self.esp32_devices:
+            filters.append(f"{device}/+/+/state")
+            filters.append(f"{device}/status")
+        return filters
+    
+    def connect(self):
+        """
+        Connect streaming client to the broker
+        
+        Pseudo Code:
+        CREATE MQTT client
+        ON CONNECT: subscribe to all state topics (again after reconnect)
+        CONNECT (messages are processed on the calling thread via loop())
+        """
+        client = _new_mqtt_client(f"garden-monitor-stream-{os.getpid()}")
+        client.on_connect = self._on_stream_connect
+        client.on_message = self._on_stream_message
+        if self.mqtt_user and self.mqtt_pass:
+            client.username_pw_set(self.mqtt_user, self.mqtt_pass)
+        client.connect(self.mqtt_broker, self.mqtt_port, keepalive=30)
+        self.client = client
+    
+    def _on_stream_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code == 0:
+            client.subscribe([(topic, 0) for topic in self.topic_filters()])
+            print(f"✓ Streaming from MQTT broker {self.mqtt_broker}:{self.mqtt_port}")
+        else:
+            print(f"✗ MQTT stream connection refused: {mqtt.connack_string(reason_code)}")
+    
+    def _on_stream_message(self, client, userdata, message):
+        self.handle_message(message.topic, message.payload.decode(errors="replace"), time.time())
+    
+    def handle_message(self, topic: str, payload: str, now: float):
+        """
+        Process one MQTT message
+        
+        Pseudo Code:
+        IF homeassistant/status THEN record HA online/offline
+        ELSE IF <node>/status THEN record device online/offline
+        ELSE IF <node>/<component>/<object_id>/state THEN:
+          MAP to entity_id
+          UPDATE last-seen entry and validity
+          RE-ARM staleness timer
+          PASS value to downstream stages
+        """
+        self.messages_received += 1
+        parts = topic.split("/")
+        
+        if topic == HA_STATUS_TOPIC:
+            self.ha_status = {"state": payload, "last_seen": now}
+            return
+        
+        if len(parts) == 2 and parts[1] == "status":
+            previous = self.node_status.get(parts[0], {}).get("state")
+            self.node_status[parts[0]] = {"state": payload, "last_seen": now}
+            if previous is not None and previous != payload:
+                print(f"  {'✓' if payload == 'online' else '✗'} {parts[0]}: {payload.upper()}")
+            return
+        
+        if len(parts) != 4 or parts[3] != "state":
+            return
+        
+        entity_id = f"{parts[1]}.{parts[2]}"
+        entity_id = STREAM_ENTITY_ALIASES.get(entity_id, entity_id)
+        if parts[1] in ("switch", "binary_sensor"):
+            payload = payload.lower()
+        self.update_entity(entity_id, payload, now)
+    
+    def update_entity(self, entity_id: str, value: str, now: float):
+        """
+        Record a new value for entity_id and evaluate it
+        
+        Pseudo Code:
+        FIND entry (critical table, else bounded LRU)
+        IF LRU full THEN evict least recently seen entity
+        SET value, last_seen, valid
+        IF status changed THEN print transition
+        RE-ARM timeout in timer wheel (sensors only)
+        """
+        if entity_id in self.critical_entities:
+            entry = self.critical_table.setdefault(entity_id, {"status": None})
+        else:
+            entry = self.observed_table.get(entity_id)
+            if entry is None:
+                if len(self.observed_table) >= self.max_entities:
+                    evicted, _ = self.observed_table.popitem(last=False)
+                    self.wheel.cancel(evicted)
+                    self.evictions += 1
+                entry = {"status": None}
+                self.observed_table[entity_id] = entry
+            else:
+                self.observed_table.move_to_end(entity_id)
+        
+        is_valid = value.lower() not in ["unknown", "unavailable", "none", "nan", ""]
+        self._set_status(entity_id, entry, "OK" if is_valid else "INVALID")
+        entry["value"] = value
+        entry["last_seen"] = now
+        
+        # Switches only publish on change, so only sensors are expected to go stale
+        if entity_id.startswith("sensor."):
+            self.wheel.schedule(entity_id, now + self.sensor_timeout)
+        
+        for stage in self.stages:
+            stage.on_state(entity_id, value, now)
+    
+    def _set_status(self, entity_id: str, entry: Dict, status: str):
+        """Update entry status, printing transitions for critical entities"""
+        previous = entry.get("status")
+        entry["status"] = status
+        if previous is not None and previous != status and entity_id in self.critical_entities:
+            symbol = "✓" if status == "OK" else "✗"
+            print(f"  {symbol} {entity_id}: {previous} -> {status}")
+    
+    def tick(self, now: float):
+        """
+        Expire entities that have gone quiet
+        
+        Pseudo Code:
+        FOR EACH entity whose timer fired:
+          MARK STALE
+        LET downstream stages run time-based logic
+        """
+        for entity_id in self.wheel.advance(now):
+            entry = self.critical_table.get(entity_id) or self.observed_table.get(entity_id)
+            if entry is not None:
+                self._set_status(entity_id, entry, "STALE")
+        
+        for stage in self.stages:
+            stage.on_tick(now)
+    
+    def check_home_assistant_connection(self) -> bool:
+        """Report HA status from its MQTT birth/will messages (no HTTP)"""
+        if self.ha_status is None:
+            self.results["checks"]["home_assistant"] = {
+                "status": "UNKNOWN",
+                "message": f"No message on {HA_STATUS_TOPIC} yet"
+            }
+            return False
+        
+        is_online = self.ha_status["state"] == "online"
+        self.results["checks"]["home_assistant"] = {
+            "status": "ONLINE" if is_online else "OFFLINE",
+            "message": f"{HA_STATUS_TOPIC}: {self.ha_status['state']}"
+        }
+        return is_online
+    
+    def check_esp32_devices(self) -> bool:
+        """Report device availability from <node>/status messages"""
+        all_ok = True
+        device_statuses = {}
+        
+        for device in self.esp32_devices:
+            status = self.node_status.get(device)
+            if status:
+                is_online = status["state"] == "online"
+                device_statuses[device] = {
+                    "online": is_online,
+                    "last_updated": datetime.fromtimestamp(status["last_seen"]).isoformat()
+                }
+            else:
+                is_online = False
+                device_statuses[device] = {
+                    "online": False,
+                    "last_updated": "N/A",
+                    "error": "No status message received"
+                }
+            all_ok = all_ok and is_online
+        
+        self.results["checks"]["esp32_devices"] = {
+            "status": "OK" if all_ok else "DEGRADED",
+            "devices": device_statuses
+        }
+        return all_ok
+    
+    def check_sensors(self) -> bool:
+        """Report critical sensors from the last-seen table"""
+        all_ok = True
+        sensor_statuses = {}
+        now = time.time()
+        
+        for sensor in self.critical_sensors:
+            entry = self.critical_table.get(sensor)
+            if entry is None:
+                sensor_statuses[sensor] = {
+                    "error": "No message received",
+                    "status": "ERROR"
+                }
+                all_ok = False
+                continue
+            
+            sensor_ok = entry["status"] == "OK"
+            sensor_statuses[sensor] = {
+                "value": entry["value"],
+                "last_updated": datetime.fromtimestamp(entry["last_seen"]).isoformat(),
+                "age_seconds": round(now - entry["last_seen"], 1),
+                "status": "OK" if sensor_ok else "STALE"
+            }
+            all_ok = all_ok and sensor_ok
+        
+        self.results["checks"]["sensors"] = {
+            "status": "OK" if all_ok else "DEGRADED",
+            "sensors": sensor_statuses
+        }
+        return all_ok
+    
+    def check_switches(self) -> bool:
+        """Report critical switches from the last-seen table"""
+        all_ok = True
+        switch_statuses = {}
+        
+        for switch in self.critical_switches:
+            entry = self.critical_table.get(switch)
+            if entry is None:
+                switch_statuses[switch] = {
+                    "error": "No message received",
+                    "status": "ERROR"
+                }
+                all_ok = False
+            else:
+                switch_statuses[switch] = {
+                    "state": entry["value"],
+                    "status": "OK"
+                }
+        
+        self.results["checks"]["switches"] = {
+            "status": "OK" if all_ok else "DEGRADED",
+            "switches": switch_statuses
+        }
+        return all_ok
+    
+    def run_checks(self, checks: Optional[List[str]] = None) -> Dict:
+        """
+        Build results from the streaming state (no HTTP requests)
+        
+        Pseudo Code:
+        REPORT selected STREAM_CHECKS (all by default) from in-memory tables
+        RECORD stream statistics and every stage's report
+        """
+        self.begin_cycle()
+        
+        for name in STREAM_CHECKS:
+            if checks is None or name in checks:
+                getattr(self, CHECKS[name][0])()
+        
+        self.results["checks"]["stream"] = {
+            "status": "OK" if self.client is not None and self.client.is_connected() else "OFFLINE",
+            "messages_received": self.messages_received,
+            "tracked_entities": len(self.critical_table) + len(self.observed_table),
+            "evictions": self.evictions
+        }
+        for stage in self.stages:
+            self.results["checks"][stage.name] = stage.report()
+        
+        self.end_cycle()
+        return self.results
+    
+    def run_forever(self, interval: int, report_format: str = "text", report=None,
+                    checks: Optional[List[str]] = None):
+        """
+        Main streaming loop
+        
+        Pseudo Code:
+        TRY to connect to broker (unreachable is not fatal)
+        LOOP forever:
+          PROCESS incoming MQTT messages (up to one tick)
+          IF never connected or disconnected THEN (re)connect with backoff
+          ADVANCE timer wheel
+          IF report interval elapsed THEN run selected checks, close cycle,
+            print report (or call report() if given)
+        """
+        try:
+            self.connect()
+        except (OSError, ValueError) as e:
+            print(f"✗ MQTT broker {self.mqtt_broker}:{self.mqtt_port} unreachable: {e}")
+        next_report = time.time() + interval
+        backoff = 1
+        
+        while True:
+            rc = self.client.loop(timeout=self.wheel.tick) if self.client is not None else None
+            if rc != mqtt.MQTT_ERR_SUCCESS:
+                print(f"✗ MQTT stream disconnected, reconnecting in {backoff}s")
+                time.sleep(backoff)
+                try:
+                    if self.client is None:
+                        self.connect()
+                    else:
+                        self.client.reconnect()
+                    backoff = 1
+                except (OSError, ValueError):
+                    backoff = min(backoff * 2, 60)
+            
+            now = time.time()
+            self.tick(now)
+            
+            if now >= next_report:
+                self.run_checks(checks)
+                if report is not None:
+                    report()
+                else:
+                    self.finish_cycle()
+                    print("\n" + self.generate_report(format=report_format))
+                next_report = now + interval
+
+################################################################################
+# CLASS: LeakDetector
+# PSEUDO CODE:
+#   CONSUME flow rate and valve state messages from the stream
+#   ON EACH FLOW SAMPLE:
+#     IF all zone valves closed AND flow > idle limit    -> abnormal
+#     IF flow > max(ceiling, baseline x factor)          -> abnormal
+#     IF flow jumped by more than step limit             -> abnormal
+#     IF abnormal for N consecutive samples THEN:
+#       CALL switch.turn_off on main valve, zone valves, pump
+#       MEASURE detection -> shutoff latency
+################################################################################
+
+class LeakDetector:
+    """
+    Rolling-window leak detector for the streaming monitor
+    
+    Pseudo Code:
+    KEEP last N flow samples taken while watering (baseline)
+    TRACK open/closed state of each zone valve
+    EVALUATE each flow sample in O(1)
+    FIRE shutoff once per leak (re-arms when flow returns to idle)
+    
+    COMMON LANGUAGE:
+    The ESP32 reports flow every 5 seconds. As soon as two readings in a
+    row look wrong (water running with every valve shut, flow far above
+    normal, or a sudden jump like a burst pipe) we shut the water off
+    ourselves instead of waiting for Home Assistant's 10-second timer.
+    """
+    
+    name = "leak_detection"
+    
+    def __init__(self, shutoff=None, flow_sensor: str = LEAK_FLOW_SENSOR,
+                 zone_valves: Optional[List[str]] = None):
+        """
+        Pseudo Code:
+        SET shutoff callback (called with reason, returns True if HA accepted)
+        INITIALIZE rolling baseline window and valve table
+        """
+        self.shutoff = shutoff
+        self.flow_sensor = flow_sensor
+        self.valve_states = {valve: None for valve in (zone_valves or LEAK_ZONE_VALVES)}
+        self.last_valve_change = 0.0
+        
+        self.window: deque = deque(maxlen=LEAK_WINDOW_SAMPLES)
+        self.window_sum = 0.0
+        self.last_flow: Optional[float] = None
+        self.abnormal_count = 0
+        self.tripped = False
+        self.pending_confirmation: Optional[Dict] = None
+        
+        self.events: deque = deque(maxlen=10)
+    
+    def baseline(self) -> Optional[float]:
+        """Mean flow over the rolling watering window"""
+        if not self.window:
+            return None
+        return self.window_sum / len(self.window)
+    
+    def on_state(self, entity_id: str, value: str, now: float):
+        if entity_id in self.valve_states:
+            state = value.lower()
+            if self.valve_states[entity_id] != state:
+                self.valve_states[entity_id] = state
+                self.last_valve_change = now
+            return
+        
+        if entity_id == LEAK_SHUTOFF_ENTITIES[0] and value.lower() == "off":
+            self._confirm_valve_closed(now)
+            return
+        
+        if entity_id != self.flow_sensor:
+            return
+        
+        try:
+            flow = float(value)
+        except ValueError:
+            return
+        self._evaluate(flow, now)
+    
+    def on_tick(self, now: float):
+        pass
+    
+    def _evaluate(self, flow: float, now: float):
+        """
+        Evaluate one flow sample
+        
+        Pseudo Code:
+        DETERMINE which rule (if any) this sample breaks
+          ("all valves closed" only once every valve has reported on/off;
+          a valve not heard from yet is unknown, not closed)
+        IF no rule broken THEN reset counter, update baseline if watering
+        ELSE count consecutive abnormal samples and fire at threshold
+        """
+        any_open = any(state == "on" for state in self.valve_states.values())
+        valves_known = all(state in ("on", "off") for state in self.valve_states.values())
+        settling = now - self.last_valve_change < LEAK_VALVE_SETTLE_SECONDS
+        baseline = self.baseline()
+        
+        reason = None
+        if valves_known and not any_open and not settling and flow > LEAK_IDLE_FLOW_LPM:
+            reason = f"flow {flow:.1f} L/min with all zone valves closed"
+        elif flow > LEAK_MAX_FLOW_LPM:
+            reason = f"flow {flow:.1f} L/min above {LEAK_MAX_FLOW_LPM} L/min ceiling"
+        elif baseline and not settling and flow > baseline * LEAK_BASELINE_FACTOR \
+                and len(self.window) == self.window.maxlen:
+            reason = f"flow {flow:.1f} L/min above baseline {baseline:.1f} L/min"
+        elif self.last_flow is not None and not settling and flow - self.last_flow > LEAK_STEP_LPM:
+            reason = f"flow jumped {flow - self.last_flow:.1f} L/min in one sample"
+        
+        self.last_flow = flow
+        
+        if reason is None:
+            self.abnormal_count = 0
+            if flow <= LEAK_IDLE_FLOW_LPM:
+                self.tripped = False  # Re-arm once water has stopped
+            if any_open and not settling:
+                if len(self.window) == self.window.maxlen:
+                    self.window_sum -= self.window[0]
+                self.window.append(flow)
+                self.window_sum += flow
+            return
+        
+        self.abnormal_count += 1
+        if self.abnormal_count >= LEAK_CONFIRM_SAMPLES and not self.tripped:
+            self.tripped = True
+            self._fire(reason, flow, now)
+    
+    def _fire(self, reason: str, flow: float, detected_at: float):
+        """
+        Shut the water off and record latency
+        
+        Pseudo Code:
+        PRINT alert
+        CALL shutoff (HA switch.turn_off)
+        RECORD detection -> service call accepted latency
+        WAIT for main valve 'off' on the stream to record confirmation latency
+        """
+        print(f"  🚨 LEAK DETECTED: {reason}")
+        event = {
+            "detected_at": datetime.fromtimestamp(detected_at).isoformat(),
+            "reason": reason,
+            "flow_lpm": flow,
+            "shutoff_sent": False,
+            "shutoff_latency_ms": None,
+            "valve_confirmed_latency_ms": None
+        }
+        self.events.append(event)
+        
+        if self.shutoff is None:
+            return
+        
+        event["shutoff_sent"] = bool(self.shutoff(reason))
+        event["shutoff_latency_ms"] = round((time.time() - detected_at) * 1000, 1)
+        if event["shutoff_sent"]:
+            print(f"  🚨 Water shut off {event['shutoff_latency_ms']} ms after detection")
+            self.pending_confirmation = {"event": event, "detected_at": detected_at}
+        else:
+            print("  🚨 SHUTOFF FAILED - close the main valve manually!")
+    
+    def _confirm_valve_closed(self, now: float):
+        """Record when the main valve actually reports closed"""
+        if self.pending_confirmation is None:
+            return
+        pending = self.pending_confirmation
+        pending["event"]["valve_confirmed_latency_ms"] = round((now - pending["detected_at"]) * 1000, 1)
+        self.pending_confirmation = None
+    
+    def report(self) -> Dict:
+        """Leak detection section for the health report"""
+        last_event = self.events[-1] if self.events else None
+        if self.tripped:
+            status = "LEAK" if last_event and last_event["shutoff_sent"] else "ERROR"
+        else:
+            status = "OK"
+        return {
+            "status": status,
+            "baseline_lpm": round(self.baseline(), 2) if self.baseline() is not None else None,
+            "last_flow_lpm": self.last_flow,
+            "valves": dict(self.valve_states),
+            "events": list(self.events)
+        }
+
+################################################################################
+# CLASS: WaterAccountant
+# PSEUDO CODE:
+#   CONSUME zone flow rate, zone valve and pulse total messages from the stream
+#   ON EACH FLOW SAMPLE (O(1), nothing kept per sample):
+#     ADD trapezoid area since the previous sample (L/min x seconds)
+#     IF gap > sample interval x late factor -> count missed samples,
+#       the straight line between the two samples fills the gap
+#     CREDIT the valve-open interval if the valve was open in the segment,
+#       ELSE count as untracked water
+#   ON VALVE OPEN: start interval   ON VALVE CLOSE: finish once drained (settle time)
+#   EVERY minute: add pending per-day deltas to the SQLite totals
+################################################################################
+
+# Per-zone, per-day counters kept in memory and in the water_daily table
+WATER_COUNTERS = ("liters", "watering_seconds", "intervals", "untracked_liters",
+                  "interpolated_seconds", "missed_samples")
+
+
+def _water_season(day: str) -> str:
+    """
+    Meteorological season for a YYYY-MM-DD day, e.g. 2026-summer
+    
+    Pseudo Code:
+    MAR-MAY spring, JUN-AUG summer, SEP-NOV autumn
+    DEC-FEB winter (named after the year it starts in)
+    """
+    year, month = int(day[:4]), int(day[5:7])
+    if month == 12:
+        return f"{year}-winter"
+    if month <= 2:
+        return f"{year - 1}-winter"
+    return f"{year}-{'spring' if month <= 5 else 'summer' if month <= 8 else 'autumn'}"
+
+
+def _season_day_range(season: str) -> tuple:
+    """First day of season and first day after it (YYYY-MM-DD strings)"""
+    year, name = int(season[:4]), season[5:]
+    starts = {"spring": (3, 6), "summer": (6, 9), "autumn": (9, 12)}
+    if name == "winter":
+        return f"{year}-12-01", f"{year + 1}-03-01"
+    first, after = starts[name]
+    return f"{year}-{first:02d}-01", f"{year}-{after:02d}-01"
+
+
+class WaterStore:
+    """
+    Daily water totals per zone
+    
+    Pseudo Code:
+    OPEN (or create) SQLite database
+    ADD(deltas): upsert per (zone, day) -> one transaction
+    DAY / SEASON: primary key range reads (zone, day)
+    
+    COMMON LANGUAGE:
+    One small row per zone per day (about 365 rows per zone per year), so
+    a whole season's total is a read of 90-odd rows. Readings are never
+    stored, only the running totals.
+    """
+    
+    def __init__(self, path: str = WATER_DB):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS water_daily (
+                zone TEXT NOT NULL,
+                day TEXT NOT NULL,
+                liters REAL NOT NULL DEFAULT 0,
+                watering_seconds REAL NOT NULL DEFAULT 0,
+                intervals INTEGER NOT NULL DEFAULT 0,
+                untracked_liters REAL NOT NULL DEFAULT 0,
+                interpolated_seconds REAL NOT NULL DEFAULT 0,
+                missed_samples INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (zone, day)
+            ) WITHOUT ROWID
+        """)
+    
+    def close(self):
+        self.db.close()
+    
+    def add(self, deltas: Dict[tuple, Dict[str, float]]):
+        """
+        Add counter deltas keyed by (zone, day)
+        
+        Pseudo Code:
+        FOR EACH (zone, day): INSERT row, or add to the existing one
+        ALL in one transaction
+        """
+        columns = ", ".join(WATER_COUNTERS)
+        updates = ", ".join(f"{name} = {name} + excluded.{name}" for name in WATER_COUNTERS)
+        with self.db:
+            self.db.executemany(
+                f"INSERT INTO water_daily (zone, day, {columns}) "
+                f"VALUES (?, ?{', ?' * len(WATER_COUNTERS)}) "
+                f"ON CONFLICT (zone, day) DO UPDATE SET {updates}",
+                [(zone, day, *(counts[name] for name in WATER_COUNTERS))
+                 for (zone, day), counts in deltas.items()]
+            )
+    
+    def day(self, zone: str, day: str) -> Dict[str, float]:
+        """Counters for one zone and day (zeros if nothing recorded)"""
+        row = self.db.execute(
+            f"SELECT {', '.join(WATER_COUNTERS)} FROM water_daily WHERE zone = ? AND day = ?",
+            (zone, day)
+        ).fetchone()
+        return dict(zip(WATER_COUNTERS, row or (0,) * len(WATER_COUNTERS)))
+    
+    def season_liters(self, zone: str, season: str) -> float:
+        """Total liters for one zone over a season"""
+        first, after = _season_day_range(season)
+        row = self.db.execute(
+            "SELECT SUM(liters) FROM water_daily WHERE zone = ? AND day >= ? AND day < ?",
+            (zone, first, after)
+        ).fetchone()
+        return row[0] or 0.0
+    
+    def daily(self, since: str, until: Optional[str] = None) -> List[Dict]:
+        """Daily rows for every zone from since to until (inclusive), oldest first"""
+        cursor = self.db.execute(
+            f"SELECT zone, day, {', '.join(WATER_COUNTERS)} FROM water_daily "
+            "WHERE day BETWEEN ? AND ? ORDER BY day, zone",
+            (since, until or "9999-12-31")
+        )
+        return [dict(zip(("zone", "day") + WATER_COUNTERS, row)) for row in cursor]
+    
+    def seasons(self) -> List[Dict]:
+        """Liters and watering time per zone per season, oldest first"""
+        totals: Dict[tuple, Dict] = {}
+        cursor = self.db.execute("SELECT zone, day, liters, watering_seconds, untracked_liters FROM water_daily")
+        for zone, day, liters, seconds, untracked in cursor:
+            season = _water_season(day)
+            entry = totals.setdefault((season, zone), {"season": season, "zone": zone, "days": 0, "liters": 0.0,
+                                                       "watering_seconds": 0.0, "untracked_liters": 0.0})
+            entry["days"] += 1
+            entry["liters"] += liters
+            entry["watering_seconds"] += seconds
+            entry["untracked_liters"] += untracked
+        return [totals[key] for key in sorted(totals, key=lambda key: (_season_day_range(key[0])[0], key[1]))]
+
+
+class ZoneWaterState:
+    """Running integration state for one zone (fixed size)"""
+    
+    __slots__ = ("name", "valve_open", "segment_open", "last_time", "last_flow", "last_total",
+                 "opened_at", "closed_at", "total_at_open", "interval_liters", "interval_missed",
+                 "interval_estimated", "today", "season_liters")
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.valve_open: Optional[bool] = None
+        self.segment_open = False       # Valve open (or draining) since the last flow sample
+        self.last_time: Optional[float] = None
+        self.last_flow = 0.0
+        self.last_total: Optional[float] = None
+        self.opened_at: Optional[float] = None
+        self.closed_at: Optional[float] = None  # Set while the pipe drains after the valve closed
+        self.total_at_open: Optional[float] = None
+        self.interval_liters = 0.0
+        self.interval_missed = 0
+        self.interval_estimated = False
+        self.today = dict.fromkeys(WATER_COUNTERS, 0)
+        self.season_liters = 0.0
+
+
+class WaterAccountant:
+    """
+    Per-zone water use from the flow rate stream
+    
+    Pseudo Code:
+    MAP flow, valve and total entity ids to their zone (one dict lookup)
+    INTEGRATE each flow sample against the previous one (trapezoid rule)
+    SPLIT water into valve-open intervals and untracked flow
+    COUNT missed/late samples, interpolate across them
+    KEEP today's and this season's totals in memory, flush deltas to store
+    
+    COMMON LANGUAGE:
+    Each zone's ESP32 reports its flow rate every 5 seconds. Multiplying
+    each reading by the time since the last one gives liters. Between a
+    valve opening and closing that water belongs to one watering run; if
+    a few readings go missing we draw a straight line between the ones we
+    did get. Totals are added up per day and per season, and only those
+    totals are saved, so memory and disk use stay flat all season.
+    """
+    
+    name = "water_accounting"
+    
+    def __init__(self, store: Optional[WaterStore] = None, zones: Optional[Dict[str, Dict]] = None,
+                 total_sensors: Optional[Dict[str, str]] = None,
+                 sample_seconds: float = WATER_SAMPLE_SECONDS):
+        """
+        Pseudo Code:
+        CREATE state per zone (zones default to ANALYZE_ZONES valve + flow)
+        BUILD entity_id -> (zone state, kind) lookup
+        """
+        zones = ANALYZE_ZONES if zones is None else zones
+        total_sensors = WATER_TOTAL_SENSORS if total_sensors is None else total_sensors
+        self.store = store
+        self.sample_seconds = sample_seconds
+        self.late_seconds = sample_seconds * WATER_LATE_FACTOR
+        
+        self.zones = {name: ZoneWaterState(name) for name in zones}
+        self.entities: Dict[str, tuple] = {}
+        for name, zone in zones.items():
+            self.entities[zone["valve"]] = (self.zones[name], "valve")
+            self.entities[zone["flow"]] = (self.zones[name], "flow")
+            if name in total_sensors:
+                self.entities[total_sensors[name]] = (self.zones[name], "total")
+        
+        self.day: Optional[str] = None
+        self.day_end = 0.0
+        self.season: Optional[str] = None
+        self.pending: Dict[tuple, Dict[str, float]] = {}
+        self.last_flush = 0.0
+        self.clock = 0.0
+        self.samples = 0
+        self.intervals: deque = deque(maxlen=WATER_INTERVAL_HISTORY)
+    
+    def on_state(self, entity_id: str, value: str, now: float):
+        target = self.entities.get(entity_id)
+        if target is None:
+            return
+        zone, kind = target
+        self.clock = now
+        if now >= self.day_end:
+            self._roll_day(now)
+        
+        if kind == "valve":
+            self._valve_change(zone, value.lower() == "on", now)
+            return
+        
+        try:
+            number = float(value)
+        except ValueError:
+            return
+        if math.isnan(number):
+            return
+        if kind == "flow":
+            self._flow_sample(zone, number, now)
+        else:
+            zone.last_total = number
+    
+    def on_tick(self, now: float):
+        """
+        Pseudo Code:
+        ROLL day at midnight
+        FINISH intervals whose valve closed and no flow sample followed in time
+        FLUSH pending totals every WATER_FLUSH_SECONDS
+        """
+        self.clock = now
+        if now >= self.day_end:
+            self._roll_day(now)
+        for zone in self.zones.values():
+            if zone.closed_at is not None and now - zone.closed_at > WATER_MAX_GAP_SECONDS:
+                zone.segment_open = bool(zone.valve_open)
+                self._finish_interval(zone)
+        if self.store is not None and now - self.last_flush >= WATER_FLUSH_SECONDS:
+            self.flush(now)
+    
+    def _count(self, zone: ZoneWaterState, counter: str, amount: float):
+        """Add to today's counter, the season total and the pending store delta"""
+        zone.today[counter] += amount
+        if counter == "liters":
+            zone.season_liters += amount
+        if self.store is not None:
+            key = (zone.name, self.day)
+            pending = self.pending.get(key)
+            if pending is None:
+                pending = self.pending[key] = dict.fromkeys(WATER_COUNTERS, 0)
+            pending[counter] += amount
+    
+    def _flow_sample(self, zone: ZoneWaterState, flow: float, now: float):
+        """
+        Integrate one flow sample
+        
+        Pseudo Code:
+        IF first sample THEN remember it and return
+        LITERS = (previous + current) / 2 x elapsed seconds / 60
+        IF elapsed > late limit THEN count missed samples + interpolated time
+        CREDIT interval (valve open or draining during segment) or untracked water
+        IF valve closed and settle time passed THEN finish interval
+        """
+        self.samples += 1
+        if zone.last_time is not None:
+            elapsed = now - zone.last_time
+            if elapsed <= 0:
+                return  # Duplicate or out-of-order sample
+            liters = (zone.last_flow + flow) * elapsed / 120.0
+            
+            if elapsed > self.late_seconds:
+                missed = max(1, round(elapsed / self.sample_seconds) - 1)
+                self._count(zone, "missed_samples", missed)
+                self._count(zone, "interpolated_seconds", elapsed - self.sample_seconds)
+                if zone.segment_open:
+                    zone.interval_missed += missed
+                    if elapsed > WATER_MAX_GAP_SECONDS:
+                        zone.interval_estimated = True
+            
+            if zone.segment_open:
+                zone.interval_liters += liters
+                self._count(zone, "liters", liters)
+            else:
+                self._count(zone, "untracked_liters", liters)
+        
+        zone.last_time = now
+        zone.last_flow = flow
+        if zone.closed_at is not None and now - zone.closed_at >= LEAK_VALVE_SETTLE_SECONDS:
+            self._finish_interval(zone)
+        zone.segment_open = bool(zone.valve_open) or zone.closed_at is not None
+    
+    def _valve_change(self, zone: ZoneWaterState, is_open: bool, now: float):
+        """
+        Pseudo Code:
+        IGNORE repeats of the current state
+        ON OPEN: finish any interval still waiting for its last sample, start a new one
+          (valve already open when the monitor started -> interval marked estimated)
+        ON CLOSE: remember close time, the pipe keeps draining into this interval
+          until the first flow sample after LEAK_VALVE_SETTLE_SECONDS
+        """
+        was_open = zone.valve_open
+        if was_open == is_open:
+            return
+        zone.valve_open = is_open
+        
+        if is_open:
+            if zone.closed_at is not None:
+                self._finish_interval(zone)
+            zone.opened_at = now
+            zone.total_at_open = zone.last_total
+            zone.interval_liters = 0.0
+            zone.interval_missed = 0
+            zone.interval_estimated = was_open is None
+            zone.segment_open = True
+        elif was_open and zone.opened_at is not None:
+            zone.closed_at = now
+    
+    def _finish_interval(self, zone: ZoneWaterState):
+        """Record a finished valve-open interval"""
+        duration = zone.closed_at - zone.opened_at
+        pulse_liters = None
+        if zone.total_at_open is not None and zone.last_total is not None \
+                and zone.last_total >= zone.total_at_open:
+            pulse_liters = round(zone.last_total - zone.total_at_open, 2)
+        
+        self._count(zone, "watering_seconds", duration)
+        self._count(zone, "intervals", 1)
+        self.intervals.append({
+            "zone": zone.name,
+            "started": datetime.fromtimestamp(zone.opened_at).isoformat(),
+            "ended": datetime.fromtimestamp(zone.closed_at).isoformat(),
+            "minutes": round(duration / 60, 1),
+            "liters": round(zone.interval_liters, 2),
+            "pulse_liters": pulse_liters,
+            "avg_lpm": round(zone.interval_liters / duration * 60, 2) if duration > 0 else None,
+            "missed_samples": zone.interval_missed,
+            "estimated": zone.interval_estimated
+        })
+        zone.opened_at = zone.closed_at = None
+    
+    def _roll_day(self, now: float):
+        """
+        Start a new day (and season) of totals
+        
+        Pseudo Code:
+        FLUSH pending deltas (they belong to the old day)
+        COMPUTE day key and next local midnight
+        LOAD today's / this season's totals from the store (restart mid-day)
+        """
+        if self.store is not None:
+            self.flush(now)
+        moment = datetime.fromtimestamp(now)
+        self.day = moment.strftime("%Y-%m-%d")
+        self.day_end = datetime.combine(moment.date() + timedelta(days=1), datetime.min.time()).timestamp()
+        season = _water_season(self.day)
+        
+        for zone in self.zones.values():
+            zone.today = self.store.day(zone.name, self.day) if self.store else dict.fromkeys(WATER_COUNTERS, 0)
+            if season != self.season:
+                zone.season_liters = self.store.season_liters(zone.name, season) if self.store else 0.0
+        self.season = season
+    
+    def flush(self, now: Optional[float] = None):
+        """Write pending per-day deltas to the store (kept for the next try on error)"""
+        self.last_flush = time.time() if now is None else now
+        if self.store is None or not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        try:
+            self.store.add(pending)
+        except sqlite3.Error as e:
+            print(f"ERROR: water totals not saved: {e}")
+            for key, counts in pending.items():
+                merged = self.pending.setdefault(key, dict.fromkeys(WATER_COUNTERS, 0))
+                for counter, amount in counts.items():
+                    merged[counter] += amount
+    
+    def report(self) -> Dict:
+        """Water accounting section for the health report"""
+        status = "OK"
+        zones = {}
+        for zone in self.zones.values():
+            watering = zone.opened_at is not None and zone.closed_at is None
+            today = zone.today
+            entry = {
+                "valve": None if zone.valve_open is None else ("on" if zone.valve_open else "off"),
+                "watering": watering,
+                "interval_liters": round(zone.interval_liters, 2) if watering else None,
+                "last_flow_lpm": zone.last_flow if zone.last_time is not None else None,
+                "today_liters": round(today["liters"], 1),
+                "today_watering_minutes": round(today["watering_seconds"] / 60, 1),
+                "today_intervals": today["intervals"],
+                "today_untracked_liters": round(today["untracked_liters"], 2),
+                "today_missed_samples": today["missed_samples"],
+                "season": self.season,
+                "season_liters": round(zone.season_liters, 1)
+            }
+            silent = self.clock - max(zone.last_time or 0.0, zone.opened_at or 0.0)
+            if watering and silent > WATER_MAX_GAP_SECONDS:
+                entry["error"] = f"valve open, no flow reading for {silent:.0f}s"
+                status = "DEGRADED"
+            zones[zone.name] = entry
+        
+        return {
+            "status": status,
+            "day": self.day,
+            "samples": self.samples,
+            "zones": zones,
+            "intervals": list(self.intervals)
+        }
+
+################################################################################
+# CLASS: AnomalyEngine
+# PSEUDO CODE:
+#   FOR EACH sample of a sensor listed in ANOMALY_LIMITS (O(1), no history kept):
+#     RANGE:    outside physical range -> anomaly
+#     FLATLINE: same value for longer than allowed while still reporting
+#     SPIKE:    jump larger than step AND beyond N EW standard deviations
+#     DRIFT:    slow EWMA outside normal operating band for hours
+#   UPDATE Welford (lifetime) and EWMA (recent) statistics
+################################################################################
+
+class SensorStats:
+    """
+    Constant-memory statistics for one sensor
+    
+    Pseudo Code:
+    WELFORD: count, mean, M2 over every sample (lifetime mean/stddev)
+    EWMA:    fast mean + variance (spike baseline), slow mean (drift)
+    RUN:     value and start time of the current unchanged run (flatline)
+    """
+    
+    __slots__ = ("count", "mean", "m2", "fast_mean", "fast_var", "slow_mean",
+                 "last_value", "run_value", "run_start", "run_samples",
+                 "drift_since", "anomalies")
+    
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.fast_mean = 0.0
+        self.fast_var = 0.0
+        self.slow_mean = 0.0
+        self.last_value: Optional[float] = None
+        self.run_value: Optional[float] = None
+        self.run_start = 0.0
+        self.run_samples = 0
+        self.drift_since: Optional[float] = None
+        self.anomalies: Dict[str, str] = {}
+    
+    def update(self, value: float):
+        """Fold one sample into Welford and EWMA statistics"""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        
+        if self.count == 1:
+            self.fast_mean = self.slow_mean = value
+            return
+        diff = value - self.fast_mean
+        increment = ANOMALY_FAST_ALPHA * diff
+        self.fast_mean += increment
+        self.fast_var = (1 - ANOMALY_FAST_ALPHA) * (self.fast_var + diff * increment)
+        self.slow_mean += ANOMALY_SLOW_ALPHA * (value - self.slow_mean)
+    
+    def stddev(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+
+class AnomalyEngine:
+    """
+    Detects stuck, impossible, spiking and drifting sensor readings
+    
+    Pseudo Code:
+    observe(entity, value, timestamp) -> {rule: message} for this sample
+    Only entities with calibration limits are tracked
+    Runs as a streaming stage (every reading) or from check_sensors (each cycle)
+    
+    COMMON LANGUAGE:
+    A soil probe that says 42% for a whole day is probably not measuring
+    anything, even though it keeps reporting. This watches each sensor's
+    recent behaviour and flags readings that don't look like real soil,
+    water or weather.
+    """
+    
+    name = "anomalies"
+    
+    def __init__(self, limits: Optional[Dict[str, Dict]] = None):
+        self.limits = limits if limits is not None else ANOMALY_LIMITS
+        self.stats: Dict[str, SensorStats] = {}
+    
+    def observe(self, entity_id: str, value, now: float,
+                changed_at: Optional[float] = None) -> Dict[str, str]:
+        """
+        Evaluate one sample
+        
+        Pseudo Code:
+        IF entity has no limits or value is not numeric THEN skip
+        CHECK range, flatline, spike (against stats BEFORE this sample)
+        UPDATE stats, THEN check drift on the slow average
+        """
+        limits = self.limits.get(entity_id)
+        if limits is None:
+            return {}
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return {}
+        if math.isnan(value):
+            return {}
+        
+        stats = self.stats.get(entity_id)
+        if stats is None:
+            stats = self.stats[entity_id] = SensorStats()
+        anomalies = {}
+        
+        low, high = limits["range"]
+        if not low <= value <= high:
+            anomalies["range"] = f"{value:g} outside physical range {low:g}..{high:g}"
+        
+        # Flatline: track how long the current value has been repeating
+        if value != stats.run_value:
+            stats.run_value = value
+            stats.run_start = now
+            stats.run_samples = 0
+        stats.run_samples += 1
+        if changed_at is not None:
+            stats.run_start = min(stats.run_start, changed_at)
+        flatline_hours = limits.get("flatline")
+        frozen_hours = (now - stats.run_start) / 3600
+        if flatline_hours and frozen_hours >= flatline_hours \
+                and (changed_at is not None or stats.run_samples > 1):
+            anomalies["flatline"] = f"unchanged at {value:g} for {frozen_hours:.1f} h"
+        
+        step = limits.get("step")
+        if step and stats.last_value is not None and stats.count >= ANOMALY_WARMUP_SAMPLES:
+            jump = abs(value - stats.last_value)
+            sigma = math.sqrt(stats.fast_var)
+            if jump > step and abs(value - stats.fast_mean) > ANOMALY_SPIKE_SIGMA * sigma:
+                anomalies["spike"] = f"jumped {jump:g} from {stats.last_value:g}"
+        
+        stats.update(value)
+        stats.last_value = value
+        
+        band = limits.get("band")
+        if band and stats.count >= ANOMALY_WARMUP_SAMPLES and not band[0] <= stats.slow_mean <= band[1]:
+            if stats.drift_since is None:
+                stats.drift_since = now
+            drift_hours = (now - stats.drift_since) / 3600
+            if drift_hours >= ANOMALY_DRIFT_HOURS:
+                anomalies["drift"] = (f"average {stats.slow_mean:.1f} outside normal "
+                                      f"{band[0]:g}..{band[1]:g} for {drift_hours:.1f} h")
+        else:
+            stats.drift_since = None
+        
+        stats.anomalies = anomalies
+        return anomalies
+    
+    def on_state(self, entity_id: str, value: str, now: float):
+        self.observe(entity_id, value, now)
+    
+    def on_tick(self, now: float):
+        pass
+    
+    def report(self) -> Dict:
+        """Anomaly section for the health report"""
+        sensors = {}
+        for entity_id, stats in self.stats.items():
+            sensors[entity_id] = {
+                "samples": stats.count,
+                "mean": round(stats.mean, 2),
+                "stddev": round(stats.stddev(), 2),
+                "recent_mean": round(stats.fast_mean, 2),
+                "slow_mean": round(stats.slow_mean, 2),
+                "anomalies": stats.anomalies
+            }
+        flagged = any(stats.anomalies for stats in self.stats.values())
+        return {"status": "DEGRADED" if flagged else "OK", "sensors": sensors}
+
+################################################################################
+# CLASS: RuleEngine
+# PSEUDO CODE:
+#   LOAD rule file (YAML, see health_rules.yaml.example)
+#   COMPILE each rule once: durations, numbers and allowed states parsed,
+#     one small predicate function per condition
+#   INDEX compiled rules by entity_id (wildcard rules resolved on first sight)
+#   EACH CYCLE / EACH MESSAGE:
+#     ONLY entities whose state changed are evaluated, against their own rules
+#     PLUS entities whose age/trigger deadline has passed (min-heap)
+################################################################################
+
+_RULE_KEYS = ["entity_id", "name", "severity", "attribute", "state", "not_state", "min", "max",
+              "max_age", "changed_within", "triggered_within"]
+
+
+def load_rules_config(path: str) -> List[Dict]:
+    """
+    Read a rule file (see health_rules.yaml.example)
+    
+    Pseudo Code:
+    PARSE YAML: optional "defaults" mapping + "rules" list
+    MERGE defaults into each rule
+    CHECK every rule is a mapping with entity_id(s) and only known keys
+    ANY problem -> ValueError naming it (reported as a --rules error, no traceback)
+    """
+    try:
+        import yaml
+    except ImportError:
+        raise ValueError("pyyaml not installed (pip3 install pyyaml)")
+    
+    with open(path) as handle:
+        try:
+            config = yaml.safe_load(handle) or {}
+        except yaml.YAMLError as e:
+            raise ValueError(f"invalid YAML: {e}")
+    if not isinstance(config, dict):
+        raise ValueError("expected a mapping with a 'rules' list")
+    defaults = config.get("defaults") or {}
+    
+    rules = []
+    for index, entry in enumerate(config.get("rules") or []):
+        if not isinstance(entry or {}, dict):
+            raise ValueError(f"rule #{index + 1}: expected a mapping, got {entry!r}")
+        rule = {**defaults, **(entry or {})}
+        unknown = set(rule) - set(_RULE_KEYS)
+        if unknown:
+            raise ValueError(f"rule #{index + 1}: unknown key(s) {', '.join(sorted(unknown))}")
+        if not rule.get("entity_id"):
+            raise ValueError(f"rule #{index + 1}: missing entity_id")
+        rules.append(rule)
+    
+    if not rules:
+        raise ValueError(f"no rules listed in {path}")
+    return rules
+
+
+def _state_timestamp(value) -> Optional[float]:
+    """Epoch seconds from an HA ISO timestamp (or a number already in seconds)"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def _format_age(seconds: float) -> str:
+    """Short duration for messages: 45s, 12m, 27.5h, 3.2d"""
+    if seconds < 120:
+        return f"{seconds:.0f}s"
+    if seconds < 7200:
+        return f"{seconds / 60:.0f}m"
+    if seconds < 172800:
+        return f"{seconds / 3600:.1f}h"
+    return f"{seconds / 86400:.1f}d"
+
+
+def _rule_seconds(value, key: str) -> float:
+    """Rule duration (number of seconds, or 15m / 26h / 7d)"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    try:
+        return _parse_duration(str(value)).total_seconds()
+    except ValueError:
+        raise ValueError(f"{key}: invalid duration '{value}' (use e.g. 15m, 26h)")
+
+
+def _rule_states(value) -> frozenset:
+    """Allowed states as lowercase strings (YAML turns bare on/off into booleans)"""
+    values = value if isinstance(value, list) else [value]
+    return frozenset(("on" if item else "off") if isinstance(item, bool) else str(item).lower()
+                     for item in values)
+
+
+class RuleEngine:
+    """
+    Declarative per-entity health rules, compiled and indexed by entity_id
+    
+    Pseudo Code:
+    COMPILE(rules): one predicate per condition, grouped per entity_id
+    UPDATE(states, now): evaluate changed entities + expired deadlines only
+    ON_STATE / ON_TICK: same, one message at a time (streaming stage)
+    REPORT(): per-entity status and failures -> results["checks"]["rules"]
+    
+    COMMON LANGUAGE:
+    Limits like "the tank must be 20-100% full" or "the morning watering
+    must have run in the last 26 hours" live in a YAML file instead of in
+    the code. Each rule is prepared once at start-up, and each cycle only
+    the entities that actually changed are looked at again.
+    """
+    
+    name = "rules"
+    
+    def __init__(self, rules: List[Dict]):
+        """
+        Pseudo Code:
+        COMPILE every rule (errors name the rule)
+        INDEX exact entity ids, keep wildcard rules aside
+        """
+        self.index: Dict[str, List[tuple]] = {}
+        self.patterns: List[tuple] = []
+        self.rule_count = len(rules)
+        
+        for number, rule in enumerate(rules, start=1):
+            entity_ids = rule["entity_id"] if isinstance(rule["entity_id"], list) else [rule["entity_id"]]
+            label = rule.get("name") or f"rule #{number}"
+            try:
+                compiled = self._compile(label, rule)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"{label}: {e}")
+            for entity_id in entity_ids:
+                if any(char in entity_id for char in "*?["):
+                    self.patterns.append((entity_id, compiled))
+                else:
+                    self.index.setdefault(entity_id, []).append(compiled)
+        
+        self._resolved: Dict[str, tuple] = {}   # entity_id -> its rules (wildcards included)
+        self._wildcard_only: set = set()        # Entities ruled only by wildcards
+        self.entries: Dict[str, Dict] = {}      # entity_id -> last evaluation
+        self._deadlines: List = []              # (time, entity_id) heap for age-based rules
+        self.evaluations = 0
+    
+    @staticmethod
+    def _compile(label: str, rule: Dict) -> tuple:
+        """
+        Turn one rule into (label, severity, predicates)
+        
+        Pseudo Code:
+        PARSE everything that does not depend on the state (once)
+        BUILD one closure per condition: (state, now) -> (failure or None, expires_at or None)
+        """
+        severity = str(rule.get("severity", "DEGRADED")).upper()
+        if severity not in RULE_SEVERITIES:
+            raise ValueError(f"severity must be one of {', '.join(RULE_SEVERITIES)}")
+        attribute = rule.get("attribute")
+        allowed = _rule_states(rule["state"]) if "state" in rule else None
+        predicates = []
+        
+        def value_of(state):
+            if attribute:
+                return state.get("attributes", {}).get(attribute)
+            return state.get("state")
+        
+        # Unknown/unavailable fails every rule unless the rule allows it by name
+        def available(state, now):
+            value = value_of(state)
+            if value is None or str(value).lower() in RULE_INVALID_STATES:
+                if allowed is None or str(value).lower() not in allowed:
+                    return f"{attribute or 'state'} is {value}", None
+            return None, None
+        predicates.append(available)
+        
+        if allowed is not None:
+            def in_states(state, now):
+                value = str(value_of(state)).lower()
+                return (None if value in allowed else f"'{value}' not in {sorted(allowed)}"), None
+            predicates.append(in_states)
+        
+        if "not_state" in rule:
+            blocked = _rule_states(rule["not_state"])
+            def not_in_states(state, now):
+                value = str(value_of(state)).lower()
+                return (f"'{value}' not allowed" if value in blocked else None), None
+            predicates.append(not_in_states)
+        
+        if "min" in rule or "max" in rule:
+            low = float(rule["min"]) if rule.get("min") is not None else -math.inf
+            high = float(rule["max"]) if rule.get("max") is not None else math.inf
+            def in_range(state, now):
+                try:
+                    number = float(value_of(state))
+                except (TypeError, ValueError):
+                    return f"'{value_of(state)}' is not a number", None
+                if low <= number <= high:
+                    return None, None
+                return f"{number:g} outside {low:g}..{high:g}", None
+            predicates.append(in_range)
+        
+        for key, field, what in [("max_age", "last_updated", "updated"),
+                                 ("changed_within", "last_changed", "changed"),
+                                 ("triggered_within", "last_triggered", "triggered")]:
+            if key not in rule:
+                continue
+            window = _rule_seconds(rule[key], key)
+            in_attributes = field == "last_triggered"
+            def recent(state, now, window=window, field=field, what=what, in_attributes=in_attributes):
+                raw = state.get("attributes", {}).get(field) if in_attributes else state.get(field)
+                at = _state_timestamp(raw)
+                if at is None:
+                    return f"never {what}", None
+                if now - at > window:
+                    return f"not {what} for {_format_age(now - at)} (limit {_format_age(window)})", None
+                return None, at + window
+            predicates.append(recent)
+        
+        return (label, severity, tuple(predicates))
+    
+    def rules_for(self, entity_id: str) -> tuple:
+        """Compiled rules for an entity (wildcards matched once, then cached)"""
+        rules = self._resolved.get(entity_id)
+        if rules is None:
+            rules = list(self.index.get(entity_id, ()))
+            matched = [compiled for pattern, compiled in self.patterns if fnmatch.fnmatchcase(entity_id, pattern)]
+            if matched and entity_id not in self.index:
+                self._wildcard_only.add(entity_id)
+            rules = self._resolved[entity_id] = tuple(rules + matched)
+        return rules
+    
+    def evaluate(self, entity_id: str, state: Dict, now: float) -> Dict:
+        """
+        Evaluate one entity against its own rules
+        
+        Pseudo Code:
+        RUN each predicate of each rule for this entity
+        STATUS = worst severity of failed rules (OK if none)
+        REMEMBER state and earliest expiry (re-evaluated then even if unchanged)
+        """
+        failures = []
+        status = "OK"
+        deadline = math.inf
+        for label, severity, predicates in self.rules_for(entity_id):
+            for predicate in predicates:
+                failure, expires_at = predicate(state, now)
+                if failure is not None:
+                    failures.append(f"{label}: {failure}")
+                    if status != "ERROR":
+                        status = severity
+                    break
+                if expires_at is not None and expires_at < deadline:
+                    deadline = expires_at
+        
+        self.evaluations += 1
+        entry = {"state": state, "updated": state.get("last_updated"), "status": status,
+                 "value": state.get("state"), "failures": failures, "deadline": deadline}
+        self.entries[entity_id] = entry
+        if deadline != math.inf:
+            heapq.heappush(self._deadlines, (deadline, entity_id))
+        return entry
+    
+    def _changed(self, entity_id: str, state: Dict) -> bool:
+        """Same object (WebSocket cache) or same last_updated (REST) -> unchanged"""
+        entry = self.entries.get(entity_id)
+        if entry is None:
+            return True
+        if entry["state"] is state:
+            return False
+        updated = state.get("last_updated")
+        return updated is None or updated != entry["updated"]
+    
+    def _expire(self, now: float, states: Optional[Dict[str, Dict]] = None) -> int:
+        """Re-evaluate entities whose age-based rules ran out (stale heap items skipped)"""
+        evaluated = 0
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, entity_id = heapq.heappop(self._deadlines)
+            entry = self.entries.get(entity_id)
+            if entry is None or entry["deadline"] != deadline:
+                continue
+            state = entry["state"] if states is None else states.get(entity_id, entry["state"])
+            self.evaluate(entity_id, state, now)
+            evaluated += 1
+        return evaluated
+    
+    def update(self, states: Dict[str, Dict], now: float) -> int:
+        """
+        Bring every ruled entity up to date with a state snapshot
+        
+        Pseudo Code:
+        FOR EACH entity with exact rules: evaluate only if its state changed
+        IF wildcard rules THEN match entity ids not seen before (once each)
+        EVALUATE entities whose age deadline passed
+        RETURN number of entities evaluated
+        """
+        evaluated = 0
+        for entity_id in self.index:
+            state = states.get(entity_id)
+            if state is not None and self._changed(entity_id, state):
+                self.evaluate(entity_id, state, now)
+                evaluated += 1
+        
+        if self.patterns:
+            for entity_id in states.keys() - self._resolved.keys():
+                self.rules_for(entity_id)
+            for entity_id in self._wildcard_only:
+                state = states.get(entity_id)
+                if state is not None and self._changed(entity_id, state):
+                    self.evaluate(entity_id, state, now)
+                    evaluated += 1
+        
+        return evaluated + self._expire(now, states)
+    
+    def on_state(self, entity_id: str, value: str, now: float):
+        """Streaming stage: evaluate one message against that entity's rules only"""
+        if not self.rules_for(entity_id):
+            return
+        previous = self.entries.get(entity_id)
+        changed_at = now
+        if previous is not None and previous["value"] == value:
+            changed_at = previous["state"].get("last_changed", now)
+        self.evaluate(entity_id, {"state": value, "last_updated": now, "last_changed": changed_at}, now)
+    
+    def on_tick(self, now: float):
+        self._expire(now)
+    
+    def report(self, missing=None, states: Optional[Dict[str, Dict]] = None) -> Dict:
+        """
+        Rules section for the health report
+        
+        Pseudo Code:
+        LIST every ruled entity: status, value and failed rules
+        ENTITY not in states (snapshot mode): missing() entry, counts against the check
+        ENTITY never seen (streaming): UNKNOWN, not counted (may not be on MQTT)
+        CHECK status = ERROR if an ERROR rule failed, else DEGRADED if anything failed
+        """
+        entities = {}
+        failed = set()
+        for entity_id in [*self.index, *sorted(self._wildcard_only)]:
+            entry = self.entries.get(entity_id)
+            if missing is not None and (entry is None or (states is not None and entity_id not in states)):
+                if entity_id in self._wildcard_only:
+                    continue   # Wildcard match that has gone away
+                entities[entity_id] = missing()
+                failed.add("DEGRADED")
+                continue
+            if entry is None:
+                entities[entity_id] = {"status": "UNKNOWN", "error": "No state received"}
+                continue
+            entities[entity_id] = {"value": entry["value"], "status": entry["status"]}
+            if entry["failures"]:
+                entities[entity_id]["failures"] = entry["failures"]
+                failed.add(entry["status"])
+        
+        status = "ERROR" if "ERROR" in failed else "DEGRADED" if failed else "OK"
+        return {
+            "status": status,
+            "rules": self.rule_count,
+            "evaluations": self.evaluations,
+            "entities": entities
+        }
+
+################################################################################
+# CLASS: AutomationAuditor
+# PSEUDO CODE:
+#   READ automations.yaml once, per automation:
+#     scheduled times (time triggers: "07:00:00" or an input_datetime)
+#     state conditions (looked at when a scheduled run is missing)
+#     entities the actions turn on/off (looked at after every run)
+#   EACH AUDIT: ONE logbook request, only entries since the last audit
+#     runs ("triggered by ...") + state changes -> sorted per-entity timeline
+#     SCHEDULED times past the miss window -> OK / LATE / MISSED / SKIPPED
+#     RUNS past the action window -> OK / FAILED (target not on/off)
+#   KEEP cursor + timeline in the state dir between cron runs
+################################################################################
+
+_AUDIT_SERVICES = {"turn_on": "on", "turn_off": "off"}  # Service -> state its targets must reach
+_AUDIT_PROBLEMS = ["FAILED", "MISSED", "LATE"]          # Worst first
+
+
+def _slugify(text: str) -> str:
+    """HA-style object id: 'Morning Watering Schedule' -> 'morning_watering_schedule'"""
+    return re.sub(r"[^a-z0-9]+", "_", str(text).lower()).strip("_")
+
+
+def _as_list(value) -> List:
+    """YAML value that may be a single item or a list"""
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _time_of_day(value) -> Optional[int]:
+    """Seconds after midnight from '07:00' / '07:00:00' (YAML reads unquoted 07:00:00 as seconds)"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value if 0 <= value < 86400 else None
+    match = re.fullmatch(r"(\d{1,2}):(\d{2})(?::(\d{2}))?", str(value).strip())
+    if not match or int(match[1]) > 23:
+        return None
+    return int(match[1]) * 3600 + int(match[2]) * 60 + int(match[3] or 0)
+
+
+def _audit_conditions(conditions, found: List[tuple]) -> bool:
+    """Collect (entity_id, allowed states) of state conditions; False if any other kind is present"""
+    checkable = True
+    for condition in _as_list(conditions):
+        if not isinstance(condition, dict):
+            checkable = False   # Template shorthand
+        elif condition.get("condition") == "and":
+            checkable = _audit_conditions(condition.get("conditions"), found) and checkable
+        elif condition.get("condition") == "state" and "state" in condition and "attribute" not in condition:
+            for entity_id in _as_list(condition.get("entity_id")):
+                found.append((entity_id, _rule_states(condition["state"])))
+        else:
+            checkable = False
+    return checkable
+
+
+def load_automation_schedule(path: str) -> Dict[str, Dict]:
+    """
+    Read automations.yaml into what the audit needs per automation
+    
+    Pseudo Code:
+    FOR EACH automation (entity id = automation.<alias as slug>, like HA):
+      TIMES: "at" of time triggers (fixed time or input_datetime entity)
+      CONDITIONS: state conditions (also inside "and"); others = not checkable
+      EFFECTS: entities the actions turn on/off
+    """
+    try:
+        import yaml
+    except ImportError:
+        raise ValueError("pyyaml not installed (pip3 install pyyaml)")
+    
+    with open(path) as handle:
+        automations = yaml.safe_load(handle) or []
+    if not isinstance(automations, list):
+        raise ValueError("expected a list of automations")
+    
+    schedule = {}
+    for index, automation in enumerate(automations):
+        name = automation.get("alias") or automation.get("id") if isinstance(automation, dict) else None
+        if not name:
+            raise ValueError(f"automation #{index + 1}: no alias or id")
+        entity_id = f"automation.{_slugify(name)}"
+        
+        times = []
+        for trigger in _as_list(automation.get("trigger", automation.get("triggers"))):
+            if not isinstance(trigger, dict) or trigger.get("platform", trigger.get("trigger")) != "time":
+                continue
+            for at in _as_list(trigger.get("at")):
+                if isinstance(at, str) and at.startswith("input_datetime."):
+                    times.append(at)
+                elif _time_of_day(at) is not None:
+                    times.append(_time_of_day(at))
+                else:
+                    raise ValueError(f"{entity_id}: unsupported time trigger '{at}'")
+        
+        conditions = []
+        checkable = _audit_conditions(automation.get("condition", automation.get("conditions")), conditions)
+        
+        effects = []
+        for action in _as_list(automation.get("action", automation.get("actions"))):
+            if not isinstance(action, dict):
+                continue
+            service = str(action.get("service", action.get("action", ""))).rpartition(".")[2]
+            if service not in _AUDIT_SERVICES:
+                continue
+            targets = ((action.get("target") or {}).get("entity_id") or action.get("entity_id")
+                       or (action.get("data") or {}).get("entity_id"))
+            for target in _as_list(targets):
+                if isinstance(target, str) and "{" not in target:
+                    effects.append((target, _AUDIT_SERVICES[service]))
+        
+        schedule[entity_id] = {"id": automation.get("id"), "alias": str(name), "times": times,
+                               "conditions": conditions, "checkable": checkable, "effects": effects}
+    return schedule
+
+
+class AutomationAuditor:
+    """
+    Scheduled vs. actual automation runs, read incrementally from the HA logbook
+    
+    Pseudo Code:
+    AUDIT(fetch, now, states): read logbook since cursor, judge what is due
+    REPORT(): per automation: status, runs, last run, problems
+    SAVE / LOAD: cursor and timeline in the state dir (cron runs)
+    
+    COMMON LANGUAGE:
+    "Enabled" does not mean "working". This looks at what Home Assistant
+    actually did: did the morning watering start at its time, and when the
+    leak shutoff ran, did the valves really close? Each audit only reads
+    the log entries written since the previous one.
+    """
+    
+    def __init__(self, schedule: Dict[str, Dict], automations: Optional[List[str]] = None,
+                 state_path: Optional[str] = None):
+        """
+        Pseudo Code:
+        KEEP the audited automations (all in the file by default),
+          found by entity id or by automation.<id from the file>
+        WATCH them + their input_datetime, condition and action entities
+        LOAD saved cursor and timeline (if any)
+        """
+        by_id = {f"automation.{plan['id']}": key for key, plan in schedule.items() if plan["id"]}
+        names = automations if automations is not None else list(schedule)
+        self.schedule = {name: schedule[name if name in schedule else by_id[name]]
+                         for name in names if name in schedule or name in by_id}
+        self.state_path = state_path
+        
+        watched = set(self.schedule)
+        for plan in self.schedule.values():
+            watched.update(at for at in plan["times"] if isinstance(at, str))
+            watched.update(entity_id for entity_id, _ in plan["conditions"] + plan["effects"])
+        self.watched = sorted(watched)
+        
+        self.cursor: Optional[float] = None        # Logbook read up to here
+        self.judged_until: Optional[float] = None  # Scheduled times judged up to here
+        self.runs: Dict[str, List[float]] = {name: [] for name in self.schedule}  # Sorted run times
+        self.timeline: Dict[str, tuple] = {}       # entity_id -> ([change times], [states])
+        self.pending: List[List] = []              # [run time, automation] awaiting action check
+        self.outcomes: List[Dict] = []             # Judged problems and skips, oldest first
+        self.load()
+    
+    def state_at(self, entity_id: str, at: float, current: Dict[str, Dict]) -> Optional[str]:
+        """State at a past time: last logged change before it, else the current state if none logged"""
+        times, states = self.timeline.get(entity_id, ((), ()))
+        index = bisect.bisect_right(times, at)
+        if index:
+            return states[index - 1]
+        if times:
+            return None   # First logged change is later; what it changed from is unknown
+        state = current.get(entity_id)
+        return None if state is None else str(state.get("state")).lower()
+    
+    @staticmethod
+    def scheduled(plan: Dict, start: float, end: float, current: Dict[str, Dict]) -> List[float]:
+        """Scheduled run times in (start, end], local time like HA's time triggers"""
+        offsets = []
+        for at in plan["times"]:
+            if isinstance(at, str):
+                at = _time_of_day((current.get(at) or {}).get("state", ""))
+            if at is not None:
+                offsets.append(at)
+        
+        times = []
+        day = datetime.fromtimestamp(start).date()
+        while offsets and day <= datetime.fromtimestamp(end).date():
+            midnight = datetime(day.year, day.month, day.day)
+            times.extend(at for at in ((midnight + timedelta(seconds=offset)).timestamp() for offset in offsets)
+                         if start < at <= end)
+            day += timedelta(days=1)
+        return sorted(times)
+    
+    def window(self, now: float) -> tuple:
+        """Logbook (start, end) the next audit at `now` reads: cursor (within the lookback) .. recorder lag"""
+        return max(self.cursor or 0, now - AUDIT_LOOKBACK_HOURS * 3600), now - AUDIT_RECORDER_LAG_SECONDS
+    
+    def audit(self, fetch, now: float, current: Dict[str, Dict]) -> int:
+        """
+        Read new logbook entries and judge everything that is due
+        
+        Pseudo Code:
+        START = cursor (never further back than the lookback)
+        FETCH logbook START .. now - recorder lag, watched entities only (ONE request)
+        ADD state changes to timeline, "triggered" entries to runs
+        IF current states known (needed for input_datetime + unchanged entities):
+          JUDGE scheduled times older than the miss window
+          JUDGE runs older than the action window
+        DROP what the report window no longer needs, SAVE
+        RETURN number of logbook entries read
+        """
+        start, end = self.window(now)
+        oldest = now - AUDIT_LOOKBACK_HOURS * 3600
+        if self.judged_until is None or self.judged_until < oldest:
+            self.judged_until = oldest
+        
+        entries = fetch(self.watched, start, end) if end > start else []
+        for entry in entries:
+            at = _state_timestamp(entry.get("when"))
+            entity_id = entry.get("entity_id")
+            if at is None or at <= start or at > end:
+                continue
+            if "state" in entry and entity_id in self.watched:
+                times, states = self.timeline.setdefault(entity_id, ([], []))
+                index = bisect.bisect_right(times, at)
+                times.insert(index, at)
+                states.insert(index, str(entry["state"]).lower())
+            elif entity_id in self.runs and str(entry.get("message", "")).startswith("triggered"):
+                bisect.insort(self.runs[entity_id], at)
+                if self.schedule[entity_id]["effects"]:
+                    self.pending.append([at, entity_id])
+        self.cursor = max(end, start)
+        
+        due = end - AUDIT_MISS_SECONDS
+        if current and due > self.judged_until:
+            for automation, plan in self.schedule.items():
+                for at in self.scheduled(plan, self.judged_until, due, current):
+                    self._judge_schedule(automation, plan, at, current)
+            self.judged_until = due
+        
+        if current:
+            waiting = []
+            for at, automation in self.pending:
+                if at + AUDIT_EFFECT_SECONDS <= end:
+                    self._judge_effects(automation, at, current)
+                else:
+                    waiting.append([at, automation])
+            self.pending = waiting
+        
+        self._prune(now)
+        self.save()
+        return len(entries)
+    
+    def _judge_schedule(self, automation: str, plan: Dict, at: float, current: Dict[str, Dict]):
+        """
+        One scheduled time
+        
+        Pseudo Code:
+        RUN found from EARLY before to MISS after -> OK, or LATE if after LATE_SECONDS
+        NO run: automation off or a state condition false then -> SKIPPED (fine)
+                conditions not all checkable -> UNVERIFIED
+                otherwise -> MISSED
+        """
+        runs = self.runs[automation]
+        index = bisect.bisect_left(runs, at - AUDIT_EARLY_SECONDS)
+        if index < len(runs) and runs[index] <= at + AUDIT_MISS_SECONDS:
+            delay = runs[index] - at
+            if delay > AUDIT_LATE_SECONDS:
+                self._outcome(automation, "LATE", at, f"ran {_format_age(delay)} after its scheduled time")
+            return
+        
+        unknown = not plan["checkable"]
+        for entity_id, allowed in [(automation, frozenset(["on"])), *plan["conditions"]]:
+            state = self.state_at(entity_id, at, current)
+            if state is None:
+                unknown = True
+            elif state not in allowed:
+                self._outcome(automation, "SKIPPED", at, f"not run, {entity_id} was {state}")
+                return
+        if unknown:
+            self._outcome(automation, "UNVERIFIED", at, "not run, conditions could not be checked")
+        else:
+            self._outcome(automation, "MISSED", at, "not run although its conditions were met")
+    
+    def _judge_effects(self, automation: str, at: float, current: Dict[str, Dict]):
+        """One run: every entity it turns on/off must be in that state by the end of the action window"""
+        failed = []
+        for entity_id, target in self.schedule[automation]["effects"]:
+            state = self.state_at(entity_id, at + AUDIT_EFFECT_SECONDS, current)
+            if state is not None and state != target:
+                failed.append(f"{entity_id} still {state}")
+        if failed:
+            self._outcome(automation, "FAILED", at, "; ".join(failed))
+    
+    def _outcome(self, automation: str, status: str, at: float, detail: str):
+        self.outcomes.append({"automation": automation, "status": status, "at": at,
+                              "time": datetime.fromtimestamp(at).isoformat(timespec="seconds"),
+                              "detail": detail})
+    
+    def _prune(self, now: float):
+        """Forget runs, changes and outcomes older than anything still needed (last change kept)"""
+        cutoff = now - AUDIT_REPORT_HOURS * 3600
+        horizon = min([cutoff, self.judged_until - AUDIT_EARLY_SECONDS] + [at for at, _ in self.pending])
+        for automation, runs in self.runs.items():
+            del runs[:bisect.bisect_left(runs, horizon)]
+        for times, states in self.timeline.values():
+            index = bisect.bisect_left(times, horizon) - 1
+            if index > 0:
+                del times[:index], states[:index]
+        self.outcomes = [outcome for outcome in self.outcomes if outcome["at"] >= cutoff]
+    
+    def report(self, now: Optional[float] = None) -> Dict:
+        """
+        Audit section for the health report
+        
+        Pseudo Code:
+        FOR EACH audited automation:
+          runs in the report window, last run, scheduled times
+          STATUS = worst problem in the window (FAILED > MISSED > LATE), else OK
+        CHECK status = ERROR if a run failed, else DEGRADED if one was missed or late
+        """
+        cutoff = (time.time() if now is None else now) - AUDIT_REPORT_HOURS * 3600
+        automations = {}
+        for automation, plan in self.schedule.items():
+            runs = self.runs[automation]
+            entry = {
+                "status": "OK",
+                "runs": len(runs) - bisect.bisect_left(runs, cutoff),
+                "last_run": datetime.fromtimestamp(runs[-1]).isoformat(timespec="seconds") if runs else None
+            }
+            if plan["times"]:
+                entry["scheduled"] = [at if isinstance(at, str) else f"{at // 3600:02d}:{at // 60 % 60:02d}"
+                                      for at in plan["times"]]
+            events = [outcome for outcome in self.outcomes
+                      if outcome["automation"] == automation and outcome["at"] >= cutoff]
+            statuses = {event["status"] for event in events}
+            entry["status"] = next((status for status in _AUDIT_PROBLEMS if status in statuses), "OK")
+            if events:
+                entry["events"] = [{"time": event["time"], "status": event["status"], "detail": event["detail"]}
+                                   for event in events]
+            automations[automation] = entry
+        
+        statuses = {entry["status"] for entry in automations.values()}
+        return {
+            "status": "ERROR" if "FAILED" in statuses else "DEGRADED" if statuses - {"OK"} else "OK",
+            "audited_until": datetime.fromtimestamp(self.cursor).isoformat(timespec="seconds")
+            if self.cursor else None,
+            "automations": automations
+        }
+    
+    def save(self):
+        """Write cursor, runs, timeline and outcomes (temp file + rename, like the result cache)"""
+        if self.state_path is None:
+            return
+        state = {"cursor": self.cursor, "judged_until": self.judged_until, "runs": self.runs,
+                 "timeline": {entity_id: [times, states] for entity_id, (times, states) in self.timeline.items()},
+                 "pending": self.pending, "outcomes": self.outcomes}
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        temp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.state_path)
+    
+    def load(self):
+        """Restore the last audit (missing or unreadable file = start from the lookback)"""
+        if self.state_path is None:
+            return
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"⚠ Ignoring unreadable audit state {self.state_path}: {e}")
+            return
+        
+        self.cursor = state.get("cursor")
+        self.judged_until = state.get("judged_until")
+        for automation, runs in state.get("runs", {}).items():
+            if automation in self.runs:
+                self.runs[automation] = sorted(runs)
+        for entity_id, (times, states) in state.get("timeline", {}).items():
+            if entity_id in self.watched:
+                self.timeline[entity_id] = (times, states)
+        self.pending = [item for item in state.get("pending", []) if item[1] in self.runs]
+        self.outcomes = [outcome for outcome in state.get("outcomes", []) if outcome["automation"] in self.runs]
+
+################################################################################
+# CLASS: MetricsExporter
+# PSEUDO CODE:
+#   AFTER each cycle: render results + self-metrics to Prometheus text ONCE
+#   STORE rendered bytes
+#   ON SCRAPE: return stored bytes (never touches Home Assistant)
+################################################################################
+
+def _metric_labels(**labels) -> str:
+    """Render {name="value",...} with Prometheus label escaping"""
+    rendered = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        rendered.append(f'{name}="{value}"')
+    return "{" + ",".join(rendered) + "}"
+
+
+class MetricsExporter:
+    """
+    Prometheus /metrics endpoint for the monitor
+    
+    Pseudo Code:
+    UPDATE(results): accumulate counters/histograms, render text, swap in
+    SERVE(port): background HTTP server answering /metrics from the cache
+    
+    COMMON LANGUAGE:
+    Lets Prometheus (or Grafana Agent, VictoriaMetrics, ...) chart the
+    garden's health. The page is prepared once per check cycle, so
+    scraping it as often as you like costs nothing.
+    """
+    
+    STATUSES = ["HEALTHY", "DEGRADED", "ERROR", "UNKNOWN"]
+    
+    def __init__(self):
+        self._body = b"# No monitoring cycle completed yet\n"
+        self.cycles_total = 0
+        self.http_calls_total = 0
+        self.http_errors_total = 0
+        self.http_retries_total = 0
+        self.check_errors_total = 0
+        # check -> [bucket counts..., +Inf count], sum
+        self._histograms: Dict[str, Dict] = {}
+        self.server = None
+    
+    def body(self) -> bytes:
+        """Latest rendered metrics (O(1), no HA requests)"""
+        return self._body
+    
+    def _observe(self, check: str, seconds: float):
+        histogram = self._histograms.setdefault(
+            check, {"buckets": [0] * (len(METRICS_LATENCY_BUCKETS) + 1), "sum": 0.0, "count": 0})
+        for index, bound in enumerate(METRICS_LATENCY_BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][index] += 1
+        histogram["buckets"][-1] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+    
+    def update(self, results: Dict):
+        """
+        Render a new metrics snapshot from one cycle's results
+        
+        Pseudo Code:
+        UPDATE running totals and latency histograms
+        WRITE gauges for every sensor, device, switch, automation
+        REPLACE cached body in one assignment (scrapers never see half a page)
+        """
+        checks = results.get("checks", {})
+        timings = results.get("timings", {})
+        
+        self.cycles_total += 1
+        self.http_calls_total += results.get("http_calls", 0)
+        self.http_errors_total += results.get("http_errors", 0)
+        self.http_retries_total += results.get("http_retries", 0)
+        self.check_errors_total += sum(
+            1 for check in checks.values() if check.get("status") in ["ERROR", "OFFLINE", "TIMEOUT"])
+        for check, seconds in timings.get("checks", {}).items():
+            self._observe(check, seconds)
+        
+        lines = []
+        
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_metric_labels(**labels) if labels else ''} {value}")
+        
+        overall = results.get("overall_status", "UNKNOWN")
+        metric("garden_overall_status", "gauge", "Overall system status (1 = current status)",
+               [({"status": status}, int(status == overall)) for status in self.STATUSES])
+        metric("garden_check_up", "gauge", "Check status is OK or ONLINE",
+               [({"check": name}, int(data.get("status") in ["OK", "ONLINE"]))
+                for name, data in checks.items()])
+        
+        sensors = checks.get("sensors", {}).get("sensors", {})
+        values = []
+        for entity_id, data in sensors.items():
+            try:
+                values.append(({"entity_id": entity_id}, float(data.get("value"))))
+            except (TypeError, ValueError):
+                pass
+        metric("garden_sensor_value", "gauge", "Latest numeric sensor state", values)
+        metric("garden_sensor_age_seconds", "gauge", "Seconds since sensor last updated",
+               [({"entity_id": entity_id}, data["age_seconds"]) for entity_id, data in sensors.items()
+                if data.get("age_seconds") is not None])
+        metric("garden_sensor_ok", "gauge", "Sensor is fresh and valid",
+               [({"entity_id": entity_id}, int(data.get("status") == "OK")) for entity_id, data in sensors.items()])
+        
+        devices = checks.get("esp32_devices", {}).get("devices", {})
+        metric("garden_device_online", "gauge", "ESP32 controller is online",
+               [({"device": device}, int(bool(data.get("online")))) for device, data in devices.items()])
+        
+        switches = checks.get("switches", {}).get("switches", {})
+        metric("garden_switch_on", "gauge", "Switch is on",
+               [({"entity_id": entity_id}, int(data.get("state") == "on")) for entity_id, data in switches.items()
+                if "state" in data])
+        
+        automations = checks.get("automations", {}).get("automations", {})
+        metric("garden_automation_enabled", "gauge", "Automation is enabled",
+               [({"entity_id": entity_id}, int(bool(data.get("enabled")))) for entity_id, data in automations.items()])
+        
+        mqtt_check = checks.get("mqtt", {})
+        if mqtt_check.get("ping_rtt_ms") is not None:
+            metric("garden_mqtt_ping_rtt_seconds", "gauge", "MQTT publish/subscribe round trip",
+                   [(None, mqtt_check["ping_rtt_ms"] / 1000)])
+        if mqtt_check.get("connect_latency_ms") is not None:
+            metric("garden_mqtt_connect_latency_seconds", "gauge", "MQTT connect to CONNACK latency",
+                   [(None, mqtt_check["connect_latency_ms"] / 1000)])
+        
+        metric("garden_monitor_cycle_duration_seconds", "gauge", "Duration of the last monitoring cycle",
+               [(None, timings.get("cycle_seconds", 0))])
+        metric("garden_monitor_last_cycle_timestamp_seconds", "gauge", "Unix time of the last cycle",
+               [(None, round(datetime.fromisoformat(results["timestamp"]).timestamp(), 3))])
+        metric("garden_monitor_cycles_total", "counter", "Monitoring cycles completed",
+               [(None, self.cycles_total)])
+        metric("garden_monitor_http_calls", "gauge", "HTTP calls to Home Assistant in the last cycle",
+               [(None, results.get("http_calls", 0))])
+        metric("garden_monitor_http_calls_total", "counter", "HTTP calls to Home Assistant",
+               [(None, self.http_calls_total)])
+        metric("garden_monitor_http_errors_total", "counter", "Failed HTTP calls to Home Assistant",
+               [(None, self.http_errors_total)])
+        metric("garden_monitor_http_retries_total", "counter", "Retried HTTP calls to Home Assistant",
+               [(None, self.http_retries_total)])
+        breaker = results.get("circuit_breaker")
+        if breaker:
+            metric("garden_monitor_circuit_breaker_open", "gauge", "HA circuit breaker is open or half-open",
+                   [(None, int(breaker["state"] != "CLOSED"))])
+            metric("garden_monitor_http_short_circuited_total", "counter", "HA calls skipped by the circuit breaker",
+                   [(None, breaker["short_circuited_total"])])
+        metric("garden_monitor_check_errors_total", "counter", "Checks that ended ERROR, OFFLINE or TIMEOUT",
+               [(None, self.check_errors_total)])
+        
+        lines.append("# HELP garden_monitor_check_duration_seconds Duration of each check")
+        lines.append("# TYPE garden_monitor_check_duration_seconds histogram")
+        for check, histogram in sorted(self._histograms.items()):
+            for bound, count in zip(METRICS_LATENCY_BUCKETS + ["+Inf"], histogram["buckets"]):
+                lines.append(f"garden_monitor_check_duration_seconds_bucket"
+                             f"{_metric_labels(check=check, le=bound)} {count}")
+            lines.append(f"garden_monitor_check_duration_seconds_sum{_metric_labels(check=check)} "
+                         f"{round(histogram['sum'], 6)}")
+            lines.append(f"garden_monitor_check_duration_seconds_count{_metric_labels(check=check)} "
+                         f"{histogram['count']}")
+        
+        self._body = ("\n".join(lines) + "\n").encode()
+    
+    def serve(self, port: int, host: str = METRICS_BIND):
+        """
+        Start /metrics HTTP server on a background thread
+        
+        Pseudo Code:
+        ON GET /metrics: return cached body
+        ON anything else: 404
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        
+        exporter = self
+        
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+            
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = exporter.body()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True).start()
+        print(f"✓ Serving metrics on http://{host}:{self.server.server_address[1]}/metrics")
+
+################################################################################
+# CLASS: AlertDispatcher
+# PSEUDO CODE:
+#   AFTER each cycle (cycle hook, never blocks):
+#     COMPARE each entity's status with last cycle -> transitions only
+#     GROUP entity problems under their ESP32 node when the node is down
+#     BATCH the cycle's transitions into ONE notification, put on queue
+#   BACKGROUND WORKER:
+#     FOR EACH channel (HA notify service, MQTT topic):
+#       IF channel has a token (rate limit) THEN send
+#       ELSE hold and merge into one digest sent when a token frees up
+################################################################################
+
+class HANotifyChannel:
+    """Send alerts through a Home Assistant notify service (notify.email, ...)"""
+    
+    def __init__(self, ha_url: str, ha_token: str, service: str):
+        self.service = service if service.startswith("notify.") else f"notify.{service}"
+        self.name = self.service
+        self.url = f"{ha_url.rstrip('/')}/api/services/notify/{self.service[len('notify.'):]}"
+        self.session = _ensure_loaded(requests).Session()
+        self.session.headers.update({"Authorization": f"Bearer {ha_token}"})
+    
+    def send(self, title: str, message: str):
+        response = self.session.post(self.url, json={"title": title, "message": message},
+                                     timeout=ALERT_SEND_TIMEOUT)
+        response.raise_for_status()
+    
+    def close(self):
+        self.session.close()
+
+
+class MqttAlertChannel:
+    """Publish alerts as JSON to an MQTT topic (QoS 1, one short connection per alert)"""
+    
+    def __init__(self, broker: str, port: int, topic: str = ALERT_MQTT_TOPIC,
+                 username: str = "", password: str = ""):
+        self.broker, self.port, self.topic = broker, port, topic
+        self.username, self.password = username, password
+        self.name = f"mqtt:{topic}"
+    
+    def send(self, title: str, message: str):
+        client = _new_mqtt_client(f"garden-monitor-alert-{os.getpid()}")
+        if self.username:
+            client.username_pw_set(self.username, self.password)
+        client.connect(self.broker, self.port, keepalive=ALERT_SEND_TIMEOUT)
+        client.loop_start()
+        try:
+            info = client.publish(self.topic, json.dumps({"title": title, "message": message}), qos=1)
+            info.wait_for_publish(timeout=ALERT_SEND_TIMEOUT)
+            if not info.is_published():
+                raise TimeoutError(f"MQTT publish to {self.topic} not acknowledged")
+        finally:
+            client.disconnect()
+            client.loop_stop()
+    
+    def close(self):
+        pass
+
+
+class AlertDispatcher:
+    """
+    Turns health check results into deduplicated, rate-limited notifications
+    
+    Pseudo Code:
+    update(results) -> compare with previous statuses, queue one batch
+    worker thread   -> deliver batches, respecting each channel's rate limit
+    close()         -> deliver what is queued, stop worker
+    
+    COMMON LANGUAGE:
+    You hear about a problem once when it starts and once when it is
+    fixed, not every five minutes. If a whole ESP32 drops off WiFi you
+    get one message about that node instead of one per sensor, and a
+    flapping sensor can't flood your phone.
+    """
+    
+    HEALTHY = ["OK", "ONLINE", "HEALTHY"]
+    
+    def __init__(self, channels: List, rate_limit: int = ALERT_RATE_LIMIT,
+                 device_entities: Optional[Dict[str, List[str]]] = None):
+        self.channels = channels
+        self.rate_limit = rate_limit
+        self.device_entities = device_entities if device_entities is not None else ALERT_DEVICE_ENTITIES
+        self.last_status: Dict[str, str] = {}
+        
+        # Token bucket per channel: rate_limit tokens, refilled evenly over an hour
+        self._tokens = {channel.name: float(rate_limit) for channel in channels}
+        self._refilled_at = {channel.name: time.monotonic() for channel in channels}
+        self._held: Dict[str, List[str]] = {channel.name: [] for channel in channels}
+        
+        self._queue: queue.Queue = queue.Queue(maxsize=ALERT_QUEUE_SIZE)
+        self.stats = {"queued": 0, "sent": 0, "failed": 0, "rate_limited": 0,
+                      "dropped": 0, "coalesced": 0}
+        self._worker = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+        self._worker.start()
+    
+    def device_for(self, entity_id: str) -> Optional[str]:
+        """ESP32 node an entity lives on (None if not node-specific)"""
+        for device, prefixes in self.device_entities.items():
+            if any(entity_id.startswith(prefix) for prefix in prefixes):
+                return device
+        return None
+    
+    def update(self, results: Dict):
+        """
+        Cycle hook: queue one notification for this cycle's transitions
+        
+        Pseudo Code:
+        FLATTEN results to entity -> status (same rows as the history store)
+        KEEP entities whose status changed (unhealthy ones on first cycle)
+        FOLD problems of entities whose node is down into the node's line
+        BUILD title + message, put on queue without waiting
+        """
+        statuses = {}
+        for entity_id, _, _, _, status in HistoryStore.flatten(results):
+            if entity_id == "monitor.overall_status" or status in (None, "SKIPPED"):
+                continue   # SKIPPED = not observed this cycle (HA down), keep last known
+            if entity_id.startswith("check.") and entity_id[len("check."):] in ALERT_ROLLUP_CHECKS:
+                continue
+            statuses[entity_id] = status
+        
+        problems, recoveries = {}, {}
+        for entity_id, status in statuses.items():
+            previous = self.last_status.get(entity_id)
+            if status == previous:
+                continue
+            if status not in self.HEALTHY:
+                problems[entity_id] = (previous, status)
+            elif previous is not None and previous not in self.HEALTHY:
+                recoveries[entity_id] = (previous, status)
+        self.last_status.update(statuses)
+        
+        if not problems and not recoveries:
+            return
+        
+        down_devices = {device for device in self.device_entities
+                        if statuses.get(device, "ONLINE") not in self.HEALTHY}
+        problem_lines = {}
+        affected: Dict[str, List[str]] = {}
+        for entity_id, (previous, status) in problems.items():
+            device = self.device_for(entity_id)
+            if device in down_devices and entity_id != device:
+                affected.setdefault(device, []).append(f"{entity_id} {status}")
+                self.stats["coalesced"] += 1
+                continue
+            problem_lines[entity_id] = f"✗ {entity_id}: {previous or 'new'} -> {status}"
+        for device, entities in affected.items():
+            if device in problem_lines:
+                problem_lines[device] += f" (also affects {', '.join(entities)})"
+            else:
+                problem_lines[device] = f"✗ {device} still down, now also: {', '.join(entities)}"
+        lines = list(problem_lines.values())
+        for entity_id, (previous, status) in recoveries.items():
+            lines.append(f"✓ {entity_id}: {previous} -> {status}")
+        
+        failing = sum(1 for status in statuses.values() if status not in self.HEALTHY)
+        title = (f"Garden monitor: {results.get('overall_status', 'UNKNOWN')} "
+                 f"({len(problems)} new problem(s), {len(recoveries)} recovered, {failing} failing)")
+        self._enqueue(title, "\n".join(lines))
+    
+    def _enqueue(self, title: str, message: str):
+        """Queue a notification, dropping the oldest if the worker is far behind"""
+        while True:
+            try:
+                self._queue.put_nowait((title, message))
+                break
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.stats["dropped"] += 1
+                except queue.Empty:
+                    pass
+        self.stats["queued"] += 1
+        print(f"🔔 Alert queued: {title}")
+    
+    def _take_token(self, channel_name: str) -> bool:
+        """Token bucket: refill by elapsed time, take one if available"""
+        now = time.monotonic()
+        elapsed = now - self._refilled_at[channel_name]
+        self._refilled_at[channel_name] = now
+        self._tokens[channel_name] = min(float(self.rate_limit),
+                                         self._tokens[channel_name] + elapsed * self.rate_limit / 3600)
+        if self._tokens[channel_name] >= 1:
+            self._tokens[channel_name] -= 1
+            return True
+        return False
+    
+    def _deliver(self, channel, title: str, message: str):
+        try:
+            channel.send(title, message)
+            self.stats["sent"] += 1
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"ERROR: alert via {channel.name} failed: {e}")
+    
+    def _dispatch(self, title: Optional[str], message: Optional[str]):
+        """Send to every channel, or hold for later if it is rate limited"""
+        for channel in self.channels:
+            held = self._held[channel.name]
+            if title is not None:
+                if held or not self._take_token(channel.name):
+                    held.append(f"{title}\n{message}")
+                    self.stats["rate_limited"] += 1
+                    continue
+                self._deliver(channel, title, message)
+            elif held and self._take_token(channel.name):
+                digest = "\n\n".join(held)
+                self._deliver(channel, f"Garden monitor: {len(held)} alert(s) held back by rate limit", digest)
+                held.clear()
+    
+    def _run(self):
+        """Worker: deliver queued alerts, flush held digests as tokens refill"""
+        while True:
+            try:
+                item = self._queue.get(timeout=60)
+            except queue.Empty:
+                item = (None, None)
+            if item is None:
+                break
+            self._dispatch(*item)
+    
+    def close(self, timeout: float = ALERT_SEND_TIMEOUT * 2):
+        """Deliver queued alerts (bounded wait), then stop the worker"""
+        self._queue.put(None)
+        self._worker.join(timeout)
+        for channel in self.channels:
+            channel.close()
+
+################################################################################
+# CLASS: HistoryStore
+# PSEUDO CODE:
+#   SQLite file, one row per (entity, timestamp)
+#   ROWS clustered by entity then time (WITHOUT ROWID primary key)
+#     -> a range query for one entity reads only that entity's rows
+#   APPEND each cycle in a single transaction (batched insert)
+#   COMPACT: delete rows past retention, give pages back to the OS
+################################################################################
+
+# Status strings stored as small integers to keep rows compact
+HISTORY_STATUS_CODES = {
+    "OK": 0, "STALE": 1, "ERROR": 2, "DEGRADED": 3, "OFFLINE": 4, "ONLINE": 5,
+    "DISABLED": 6, "TIMEOUT": 7, "INVALID": 8, "LEAK": 9, "UNKNOWN": 10,
+    "ANOMALY": 11, "SKIPPED": 12, "HEALTHY": 13   # New codes go at the end: stored rows keep theirs
+}
+HISTORY_STATUS_NAMES = {code: name for name, code in HISTORY_STATUS_CODES.items()}
+
+
+def _parse_duration(text: str) -> timedelta:
+    """
+    Parse durations like 90s, 15m, 12h, 7d, 2w
+    
+    Pseudo Code:
+    SPLIT number and unit
+    CONVERT to timedelta
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhdw])\s*", text)
+    if not match:
+        raise ValueError(f"Invalid duration '{text}' (use e.g. 30m, 12h, 7d)")
+    amount, unit = float(match.group(1)), match.group(2)
+    seconds = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}[unit]
+    return timedelta(seconds=amount * seconds)
+
+
+def _positive_int(text: str) -> int:
+    """argparse type for counts and step sizes that must be at least 1"""
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{text}'")
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return value
+
+
+class HistoryStore:
+    """
+    Append-only time-series store for check results
+    
+    Pseudo Code:
+    OPEN (or create) SQLite database
+    APPEND(results): flatten per-entity values, ages, statuses -> one transaction
+    QUERY(entity, since, until): index range scan on (entity, ts)
+    COMPACT(): drop rows older than retention
+    
+    COMMON LANGUAGE:
+    Instead of appending a big block of JSON to a log file every cycle,
+    each reading becomes one small row. Looking up a week of one sensor's
+    history reads only that sensor's rows.
+    """
+    
+    def __init__(self, path: str = HISTORY_DB, retention_days: int = HISTORY_RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self._entity_ids: Dict[str, int] = {}
+        self._last_compact = 0.0
+        
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute(f"PRAGMA mmap_size = {HISTORY_MMAP_BYTES}")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS entities (
+                id INTEGER PRIMARY KEY,
+                entity_id TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS samples (
+                entity INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                value REAL,
+                state TEXT,
+                age REAL,
+                status INTEGER,
+                PRIMARY KEY (entity, ts)
+            ) WITHOUT ROWID;
+        """)
+        for row_id, entity_id in self.db.execute("SELECT id, entity_id FROM entities"):
+            self._entity_ids[entity_id] = row_id
+    
+    def close(self):
+        self.db.close()
+    
+    def _entity_key(self, entity_id: str) -> int:
+        """Map entity_id to its small integer key (dictionary encoding)"""
+        key = self._entity_ids.get(entity_id)
+        if key is None:
+            cursor = self.db.execute("INSERT INTO entities (entity_id) VALUES (?)", (entity_id,))
+            key = cursor.lastrowid
+            self._entity_ids[entity_id] = key
+        return key
+    
+    @staticmethod
+    def flatten(results: Dict) -> List[tuple]:
+        """
+        Turn a results dictionary into (entity_id, value, state, age, status) rows
+        
+        Pseudo Code:
+        ONE row per check (check.<name>) and overall status
+        ONE row per device, sensor, switch and automation
+        NUMERIC states stored as value, everything else as state text
+        """
+        rows = [("monitor.overall_status", None, None, None, results.get("overall_status"))]
+        
+        for check_name, check_data in results.get("checks", {}).items():
+            rows.append((f"check.{check_name}", None, None, None, check_data.get("status")))
+        
+        checks = results.get("checks", {})
+        for device, data in checks.get("esp32_devices", {}).get("devices", {}).items():
+            online = data.get("online")
+            if data.get("error", "").startswith("skipped"):
+                rows.append((device, None, None, None, "SKIPPED"))
+                continue
+            rows.append((device, 1.0 if online else 0.0, None, None, "ONLINE" if online else "OFFLINE"))
+        
+        for sensor, data in checks.get("sensors", {}).get("sensors", {}).items():
+            rows.append((sensor, None, data.get("value"), data.get("age_seconds"), data.get("status")))
+        
+        for switch, data in checks.get("switches", {}).get("switches", {}).items():
+            rows.append((switch, None, data.get("state"), None, data.get("status")))
+        
+        for automation, data in checks.get("automations", {}).get("automations", {}).items():
+            enabled = data.get("enabled")
+            rows.append((automation, None if enabled is None else float(enabled), None, None, data.get("status")))
+        
+        flattened = []
+        for entity_id, value, state, age, status in rows:
+            if value is None and state is not None:
+                try:
+                    value, state = float(state), None
+                except (TypeError, ValueError):
+                    state = str(state)
+            flattened.append((entity_id, value, state, age, status))
+        return flattened
+    
+    def append(self, results: Dict):
+        """
+        Store one cycle of results
+        
+        Pseudo Code:
+        FLATTEN results into rows
+        INSERT all rows in one transaction
+        IF compaction is due THEN compact
+        """
+        ts = int(datetime.fromisoformat(results["timestamp"]).timestamp())
+        rows = self.flatten(results)
+        
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO samples (entity, ts, value, state, age, status) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(self._entity_key(entity_id), ts, value, state, age,
+                  HISTORY_STATUS_CODES.get(status, HISTORY_STATUS_CODES["UNKNOWN"]))
+                 for entity_id, value, state, age, status in rows]
+            )
+        
+        if time.time() - self._last_compact > HISTORY_COMPACT_HOURS * 3600:
+            self.compact()
+    
+    def compact(self) -> int:
+        """
+        Apply retention
+        
+        Pseudo Code:
+        DELETE rows older than retention_days
+        RELEASE freed pages (incremental vacuum)
+        RETURN number of rows removed
+        """
+        cutoff = int(time.time() - self.retention_days * 86400)
+        with self.db:
+            removed = self.db.execute("DELETE FROM samples WHERE ts < ?", (cutoff,)).rowcount
+        self.db.execute("PRAGMA incremental_vacuum")
+        self._last_compact = time.time()
+        return removed
+    
+    def query(self, entity_id: str, since: datetime, until: Optional[datetime] = None) -> List[Dict]:
+        """
+        Range query for one entity
+        
+        Pseudo Code:
+        LOOKUP entity key
+        READ rows between since and until via (entity, ts) primary key
+        RETURN list of samples
+        """
+        key = self._entity_ids.get(entity_id)
+        if key is None:
+            return []
+        until_ts = int((until or datetime.now()).timestamp())
+        cursor = self.db.execute(
+            "SELECT ts, value, state, age, status FROM samples "
+            "WHERE entity = ? AND ts BETWEEN ? AND ? ORDER BY ts",
+            (key, int(since.timestamp()), until_ts)
+        )
+        return [
+            {
+                "timestamp": datetime.fromtimestamp(ts).isoformat(),
+                "value": value if value is not None else state,
+                "age_seconds": age,
+                "status": HISTORY_STATUS_NAMES.get(status, "UNKNOWN")
+            }
+            for ts, value, state, age, status in cursor
+        ]
+
+
+def run_history_command(args) -> int:
+    """
+    CLI: monitor.py history ENTITY --since 7d
+    
+    Pseudo Code:
+    OPEN history store
+    QUERY entity over requested range
+    PRINT samples (text table or JSON) and numeric summary
+    """
+    if not os.path.exists(args.db):
+        print(f"ERROR: history database not found: {args.db}")
+        return 1
+    
+    try:
+        since = datetime.now() - _parse_duration(args.since)
+        until = datetime.now() - _parse_duration(args.until) if args.until else None
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return 1
+    
+    store = HistoryStore(args.db)
+    samples = store.query(args.entity, since, until)
+    store.close()
+    
+    if args.json:
+        print(json.dumps(samples, indent=2))
+        return 0
+    
+    if not samples:
+        print(f"No history for {args.entity} since {since.strftime('%Y-%m-%d %H:%M')}")
+        return 0
+    
+    print(f"{'TIMESTAMP':<20} {'VALUE':>12} {'AGE (s)':>9}  STATUS")
+    for sample in samples:
+        age = f"{sample['age_seconds']:.0f}" if sample["age_seconds"] is not None else "-"
+        print(f"{sample['timestamp'][:19]:<20} {str(sample['value']):>12} {age:>9}  {sample['status']}")
+    
+    numeric = [sample["value"] for sample in samples if isinstance(sample["value"], float)]
+    if numeric:
+        print(f"\n{len(samples)} samples  min {min(numeric):g}  max {max(numeric):g}  "
+              f"avg {sum(numeric) / len(numeric):.2f}")
+    return 0
+
+
+def run_water_command(args) -> int:
+    """
+    CLI: monitor.py water --since 30d
+    
+    Pseudo Code:
+    OPEN water store
+    READ daily rows over requested range and per-season totals
+    PRINT tables (or JSON)
+    """
+    if not os.path.exists(args.db):
+        print(f"ERROR: water database not found: {args.db}")
+        return 1
+    
+    try:
+        since = (datetime.now() - _parse_duration(args.since)).strftime("%Y-%m-%d")
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return 1
+    
+    store = WaterStore(args.db)
+    days = store.daily(since)
+    seasons = store.seasons()
+    store.close()
+    
+    if args.json:
+        print(json.dumps({"days": days, "seasons": seasons}, indent=2))
+        return 0
+    
+    if not days:
+        print(f"No water use recorded since {since}")
+    else:
+        print(f"{'DAY':<11} {'ZONE':<8} {'LITERS':>9} {'MINUTES':>8} {'RUNS':>5} {'UNTRACKED':>10} {'MISSED':>7}")
+        for row in days:
+            print(f"{row['day']:<11} {row['zone']:<8} {row['liters']:>9.1f} {row['watering_seconds'] / 60:>8.1f} "
+                  f"{row['intervals']:>5} {row['untracked_liters']:>10.2f} {row['missed_samples']:>7}")
+    
+    if seasons:
+        print(f"\n{'SEASON':<14} {'ZONE':<8} {'DAYS':>5} {'LITERS':>10} {'HOURS':>7} {'UNTRACKED':>10}")
+        for row in seasons:
+            print(f"{row['season']:<14} {row['zone']:<8} {row['days']:>5} {row['liters']:>10.1f} "
+                  f"{row['watering_seconds'] / 3600:>7.1f} {row['untracked_liters']:>10.2f}")
+    return 0
+
+################################################################################
+# CLASS: CycleSnapshot
+# PSEUDO CODE:
+#   ONE read-only snapshot per finished cycle:
+#     check key -> (entity_id -> (value, state, status))
+#   BUILD from results + previous snapshot:
+#     unchanged entity  -> reuse previous tuple (same object)
+#     unchanged check   -> reuse previous check map (same object)
+#   DIFF(previous): skip shared maps/tuples by identity, compare the rest
+#     entity new -> added, gone from a check that ran -> removed, else changed
+################################################################################
+
+class CycleSnapshot:
+    """
+    Immutable, structurally shared view of one cycle's results
+    
+    Pseudo Code:
+    FROM_RESULTS(results, previous): flatten per check, share unchanged parts
+    DIFF(previous): list of changed entities only
+    TO_DICT / FROM_DICT: persist between single-shot runs (state dir)
+    
+    COMMON LANGUAGE:
+    Each cycle is frozen into a snapshot that is never edited afterwards.
+    Most readings don't change between cycles, so a new snapshot mostly
+    points at the same pieces as the last one, and comparing two of them
+    only looks at the pieces that are actually different.
+    """
+    
+    __slots__ = ("timestamp", "overall_status", "checks")
+    
+    def __init__(self, timestamp: str, overall_status: Optional[str], checks: Dict):
+        self.timestamp = timestamp
+        self.overall_status = overall_status
+        self.checks = MappingProxyType(checks)
+    
+    @classmethod
+    def from_results(cls, results: Dict, previous: Optional["CycleSnapshot"] = None) -> "CycleSnapshot":
+        """
+        Freeze a results dictionary, sharing unchanged parts with previous
+        
+        Pseudo Code:
+        FOR EACH check in results:
+          FLATTEN to entity rows (same rows as the history store)
+          FOR EACH entity: equal to previous row -> reuse previous tuple
+          IF every entity reused and none added/removed -> reuse previous check map
+        """
+        previous_checks = previous.checks if previous is not None else {}
+        checks = {}
+        
+        for key, data in results.get("checks", {}).items():
+            old = previous_checks.get(key, {})
+            entities = {}
+            shared = 0
+            for entity_id, value, state, _, status in HistoryStore.flatten({"checks": {key: data}})[1:]:
+                row = (value, state, status)
+                old_row = old.get(entity_id)
+                if old_row == row:
+                    row = old_row
+                    shared += 1
+                entities[entity_id] = row
+            checks[key] = old if old and shared == len(entities) == len(old) else MappingProxyType(entities)
+        
+        return cls(results.get("timestamp"), results.get("overall_status"), checks)
+    
+    def diff(self, previous: Optional["CycleSnapshot"]) -> List[Dict]:
+        """
+        Changed entities since previous (everything is "added" without one)
+        
+        Pseudo Code:
+        IF overall status changed THEN emit it
+        FOR EACH check in this snapshot:
+          SKIP if it is the same object as last time
+          EMIT added / changed entities (shared tuples skipped by identity)
+          EMIT removed entities (only for checks that ran this cycle)
+        """
+        changes = []
+        previous_checks = previous.checks if previous is not None else {}
+        
+        if previous is None or previous.overall_status != self.overall_status:
+            changes.append(self._change("changed" if previous is not None else "added", None,
+                                        "monitor.overall_status",
+                                        (None, None, previous.overall_status) if previous else None,
+                                        (None, None, self.overall_status)))
+        
+        for key, entities in self.checks.items():
+            old = previous_checks.get(key, {})
+            if entities is old:
+                continue
+            for entity_id, row in entities.items():
+                old_row = old.get(entity_id)
+                if old_row is row or old_row == row:
+                    continue
+                changes.append(self._change("added" if old_row is None else "changed", key, entity_id, old_row, row))
+            for entity_id, old_row in old.items():
+                if entity_id not in entities:
+                    changes.append(self._change("removed", key, entity_id, old_row, None))
+        return changes
+    
+    def _change(self, change: str, check: Optional[str], entity_id: str,
+                before: Optional[tuple], after: Optional[tuple]) -> Dict:
+        """One change record (a JSON Lines row in --changes-only --json)"""
+        record = {"timestamp": self.timestamp, "change": change, "check": check, "entity": entity_id}
+        if after is not None:
+            record["status"] = after[2]
+            record["value"] = after[0] if after[0] is not None else after[1]
+        if before is not None:
+            record["previous_status"] = before[2]
+            record["previous_value"] = before[0] if before[0] is not None else before[1]
+        return record
+    
+    @staticmethod
+    def format_change(change: Dict) -> str:
+        """One change as a log line: time, entity, status (and value) before -> after"""
+        timestamp = (change["timestamp"] or "")[:19].replace("T", " ")
+        entity_id = change["entity"]
+        if change["change"] == "removed":
+            return f"{timestamp}  - {entity_id}: was {change['previous_status']}"
+        if change["change"] == "added":
+            value = change.get("value")
+            return f"{timestamp}  + {entity_id}: {change['status']}" + (f" ({value})" if value is not None else "")
+        line = f"{timestamp}  ~ {entity_id}: {change['previous_status']} -> {change['status']}"
+        if change.get("previous_value") != change.get("value"):
+            line += f" ({change.get('previous_value')} -> {change.get('value')})"
+        return line
+    
+    def to_dict(self) -> Dict:
+        return {"timestamp": self.timestamp, "overall_status": self.overall_status,
+                "checks": {key: {entity_id: list(row) for entity_id, row in entities.items()}
+                           for key, entities in self.checks.items()}}
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "CycleSnapshot":
+        return cls(data.get("timestamp"), data.get("overall_status"),
+                   {key: MappingProxyType({entity_id: tuple(row) for entity_id, row in entities.items()})
+                    for key, entities in data.get("checks", {}).items()})
+
+################################################################################
+# CLASS: ResultCache
+# PSEUDO CODE:
+#   ONE small JSON file in the state dir holds the previous cycle
+#   PER check: last result + when it was actually checked
+#   LAST CycleSnapshot (the next run diffs against it)
+#   HEALTHY check younger than TTL -> reused, its HTTP calls skipped
+#   SAVE via temp file + rename (a killed cron run never leaves half a file)
+################################################################################
+
+class ResultCache:
+    """
+    Previous cycle's results, kept between single-shot runs
+    
+    Pseudo Code:
+    LOAD previous cycle (missing or unreadable file = empty cache)
+    FRESH(checks): checks whose last result was healthy and younger than ttl
+    REUSE(results, checks): copy those results into this cycle, marked cached
+    TRANSITIONS(changes): entities whose status changed since last cycle
+    SAVE(results, snapshot): write this cycle, keeping original check times of reused results
+    
+    COMMON LANGUAGE:
+    A cron run starts from nothing every time. This file is its memory:
+    it says what changed since the last run, and lets a run skip checks
+    that were fine a few minutes ago. Problems are always re-checked.
+    """
+    
+    HEALTHY = ["OK", "ONLINE"]
+    
+    def __init__(self, state_dir: str = STATE_DIR, ttl: float = STATE_CACHE_TTL):
+        self.path = os.path.join(os.path.expanduser(state_dir), STATE_FILE)
+        self.ttl = ttl
+        self.previous: Dict = {}
+        self._reused: Dict[str, float] = {}   # results key -> original check time
+        
+        try:
+            with open(self.path) as f:
+                self.previous = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"⚠ Ignoring unreadable state cache {self.path}: {e}")
+        
+        # Last cycle's entity states: diffed against this run's snapshot
+        self.snapshot: Optional[CycleSnapshot] = None
+        if "snapshot" in self.previous:
+            self.snapshot = CycleSnapshot.from_dict(self.previous["snapshot"])
+    
+    def fresh(self, checks: List[str], now: Optional[float] = None) -> List[str]:
+        """
+        Checks that can be reused instead of run
+        
+        Pseudo Code:
+        FOR EACH requested check:
+          IF cached result is healthy AND checked less than ttl ago THEN fresh
+        """
+        if self.ttl <= 0:
+            return []
+        now = time.time() if now is None else now
+        cached = self.previous.get("checks", {})
+        checked_at = self.previous.get("checked_at", {})
+        return [
+            name for name in checks
+            if cached.get(CHECKS[name][1], {}).get("status") in self.HEALTHY
+            and now - checked_at.get(CHECKS[name][1], 0) < self.ttl
+        ]
+    
+    def reuse(self, results: Dict, checks: List[str], now: Optional[float] = None):
+        """
+        Copy cached check results into this cycle's results
+        
+        Pseudo Code:
+        FOR EACH fresh check: copy result, add how old it is
+        KEEP checks in registry order (same report layout as a full run)
+        """
+        now = time.time() if now is None else now
+        for name in checks:
+            key = CHECKS[name][1]
+            checked_at = self.previous["checked_at"][key]
+            results["checks"][key] = dict(self.previous["checks"][key],
+                                          cached_seconds=round(now - checked_at))
+            self._reused[key] = checked_at
+        results["checks"] = _in_check_order(results["checks"])
+    
+    @staticmethod
+    def transitions(changes: List[Dict]) -> List[Dict]:
+        """
+        Status changes among a cycle's changes (value-only changes and removals dropped)
+        
+        Pseudo Code:
+        FOR EACH added/changed entity whose status differs: entity, from, to
+        """
+        return [
+            {"entity": change["entity"], "from": change.get("previous_status"), "to": change["status"]}
+            for change in changes
+            if change["change"] != "removed" and change.get("previous_status") != change["status"]
+        ]
+    
+    def save(self, results: Dict, snapshot: "CycleSnapshot", now: Optional[float] = None):
+        """
+        Persist this cycle for the next run
+        
+        Pseudo Code:
+        MERGE with previous cycle (checks not selected this run are kept)
+        STAMP each check with when it was really checked
+        WRITE temp file, then rename over the old one
+        """
+        now = time.time() if now is None else now
+        checks = dict(self.previous.get("checks", {}))
+        checked_at = dict(self.previous.get("checked_at", {}))
+        
+        for key, data in results["checks"].items():
+            checks[key] = {field: value for field, value in data.items() if field != "cached_seconds"}
+            checked_at[key] = self._reused.get(key, now)
+        if self.snapshot is not None:
+            snapshot = CycleSnapshot(snapshot.timestamp, snapshot.overall_status,
+                                     {**self.snapshot.checks, **snapshot.checks})
+        
+        state = {"timestamp": results["timestamp"], "checked_at": checked_at,
+                 "snapshot": snapshot.to_dict(), "checks": checks}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.path)
+        self.previous = state
+        self.snapshot = snapshot
+        self._reused = {}
+
+################################################################################
+# CLASS: FleetMonitor
+# PSEUDO CODE:
+#   LOAD sites file: N x (HA URL, token, broker, entity lists)
+#   ONE SystemMonitor per site (own session pool, MQTT connection, breaker)
+#   EACH cycle: run every site's checks in a shared thread pool
+#     site still busy from last cycle -> not started again, reported BUSY
+#     site slower than its deadline   -> reported TIMEOUT
+#   AGGREGATE one fleet report: status per site + everything not OK
+################################################################################
+
+_SITE_KEYS = ["name", "ha_url", "ha_token", "mqtt_broker", "mqtt_port", "mqtt_user", "mqtt_pass",
+              "esp32_devices", "critical_sensors", "critical_switches", "critical_automations"]
+
+
+def load_sites_config(path: str) -> List[Dict]:
+    """
+    Read a sites file (see sites.yaml.example)
+    
+    Pseudo Code:
+    PARSE YAML: optional "defaults" mapping + "sites" list
+    MERGE defaults into each site, expand ${ENV_VARS} in strings
+    CHECK every site has name, ha_url, ha_token and a unique name
+    """
+    try:
+        import yaml
+    except ImportError:
+        raise ValueError("pyyaml not installed (pip3 install pyyaml)")
+    
+    with open(path) as handle:
+        config = yaml.safe_load(handle) or {}
+    defaults = config.get("defaults") or {}
+    
+    sites = []
+    for index, entry in enumerate(config.get("sites") or []):
+        site = {**defaults, **(entry or {})}
+        site = {key: os.path.expandvars(value) if isinstance(value, str) else value
+                for key, value in site.items()}
+        unknown = set(site) - set(_SITE_KEYS)
+        if unknown:
+            raise ValueError(f"site #{index + 1}: unknown key(s) {', '.join(sorted(unknown))}")
+        for key in ["name", "ha_url", "ha_token"]:
+            if not site.get(key) or "${" in str(site[key]):
+                raise ValueError(f"site #{index + 1} ({site.get('name', '?')}): missing {key}")
+        sites.append(site)
+    
+    names = [site["name"] for site in sites]
+    if len(set(names)) != len(names):
+        raise ValueError("site names must be unique")
+    if not sites:
+        raise ValueError(f"no sites listed in {path}")
+    return sites
+
+
+class _ThreadOutput:
+    """
+    stdout wrapper that silences worker threads marked quiet
+    
+    COMMON LANGUAGE:
+    Fifty sites printing check progress at once would be unreadable, so
+    site threads are muted and the fleet report summarizes them instead.
+    """
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+    
+    def write(self, text):
+        if getattr(self.local, "quiet", False):
+            return len(text)
+        return self.stream.write(text)
+    
+    def flush(self):
+        self.stream.flush()
+    
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+@contextlib.contextmanager
+def _thread_output():
+    """
+    Route sys.stdout through a _ThreadOutput while the fleet runs
+    
+    Pseudo Code:
+    WRAP sys.stdout (unless already wrapped)
+    YIELD the wrapper
+    RESTORE the original stream, even on error or Ctrl+C
+    """
+    original = sys.stdout
+    output = original if isinstance(original, _ThreadOutput) else _ThreadOutput(original)
+    sys.stdout = output
+    try:
+        yield output
+    finally:
+        sys.stdout = original
+
+
+class FleetMonitor:
+    """
+    Monitors many gardens (one HA + broker each) from one process
+    
+    Pseudo Code:
+    run_cycle() -> fleet results with one summary per site
+    Site state is never shared: each has its own SystemMonitor
+    
+    COMMON LANGUAGE:
+    Instead of one cron job per property, one long-running process
+    keeps a connection open to every property and checks them all at
+    the same time, then prints a single report for the whole fleet.
+    """
+    
+    HEALTHY = ["OK", "ONLINE", "HEALTHY"]
+    
+    def __init__(self, sites: List[Dict], workers: int = FLEET_WORKERS,
+                 site_timeout: float = FLEET_SITE_TIMEOUT):
+        self.site_timeout = site_timeout
+        self.monitors: Dict[str, SystemMonitor] = {}
+        for site in sites:
+            self.monitors[site["name"]] = SystemMonitor(
+                ha_url=site["ha_url"],
+                ha_token=site["ha_token"],
+                mqtt_broker=site.get("mqtt_broker", MQTT_BROKER),
+                mqtt_port=int(site.get("mqtt_port", MQTT_PORT)),
+                mqtt_user=site.get("mqtt_user", MQTT_USERNAME),
+                mqtt_pass=site.get("mqtt_pass", MQTT_PASSWORD),
+                esp32_devices=site.get("esp32_devices"),
+                critical_sensors=site.get("critical_sensors"),
+                critical_switches=site.get("critical_switches"),
+                critical_automations=site.get("critical_automations")
+            )
+        self._executor = ThreadPoolExecutor(max_workers=min(workers, len(sites)),
+                                            thread_name_prefix="monitor-site")
+        self._running: Dict[str, object] = {}
+        
+        self.results: Dict = {"timestamp": None, "overall_status": "UNKNOWN", "sites": {}}
+    
+    def _run_site(self, monitor: SystemMonitor) -> Dict:
+        """Worker: one site's full check cycle, output muted (inside _thread_output)"""
+        output = sys.stdout
+        muted = isinstance(output, _ThreadOutput)
+        if muted:
+            output.local.quiet = True
+        try:
+            monitor.run_checks()
+            monitor.finish_cycle()   # Also derives overall_status
+            return monitor.results
+        finally:
+            if muted:
+                output.local.quiet = False
+    
+    def _summarize(self, results: Dict) -> Dict:
+        """Status, cost and every non-OK item for one site"""
+        problems, skipped = [], 0
+        for entity_id, _, _, _, status in HistoryStore.flatten(results):
+            if entity_id == "monitor.overall_status" or status in self.HEALTHY:
+                continue
+            if entity_id.startswith("check.") and entity_id[len("check."):] in ALERT_ROLLUP_CHECKS:
+                continue
+            if status == "SKIPPED":
+                skipped += 1
+                continue
+            problems.append(f"{entity_id}: {status}")
+        if skipped:
+            problems.append(f"{skipped} item(s) skipped: upstream down")
+        return {
+            "status": results.get("overall_status", "UNKNOWN"),
+            "cycle_seconds": results.get("timings", {}).get("cycle_seconds"),
+            "http_calls": results.get("http_calls", 0),
+            "circuit_breaker": results.get("circuit_breaker", {}).get("state"),
+            "problems": problems
+        }
+    
+    def run_cycle(self) -> Dict:
+        """
+        Check every site once, concurrently
+        
+        Pseudo Code:
+        SUBMIT each idle site to the thread pool
+        WAIT for all, up to site_timeout
+        SUMMARIZE finished sites; mark slow ones TIMEOUT, stuck ones BUSY
+        DERIVE fleet status from site statuses
+        """
+        started = time.perf_counter()
+        self.results["timestamp"] = datetime.now().isoformat()
+        
+        submitted = {}
+        for name, monitor in self.monitors.items():
+            if name in self._running and not self._running[name].done():
+                continue
+            submitted[name] = self._running[name] = self._executor.submit(self._run_site, monitor)
+        if submitted:
+            wait_futures(submitted.values(), timeout=self.site_timeout)
+        
+        sites = {}
+        for name in self.monitors:
+            future = submitted.get(name)
+            if future is None:
+                sites[name] = {"status": "BUSY", "problems": ["previous cycle still running"]}
+            elif not future.done():
+                sites[name] = {"status": "TIMEOUT", "problems": [f"no result within {self.site_timeout}s"]}
+            elif future.exception() is not None:
+                sites[name] = {"status": "ERROR", "problems": [f"monitor failed: {future.exception()}"]}
+            else:
+                sites[name] = self._summarize(future.result())
+        
+        statuses = [site["status"] for site in sites.values()]
+        if all(status == "HEALTHY" for status in statuses):
+            overall = "HEALTHY"
+        elif any(status == "ERROR" for status in statuses):
+            overall = "ERROR"
+        else:
+            overall = "DEGRADED"
+        
+        self.results.update({
+            "overall_status": overall,
+            "sites": sites,
+            "summary": {status: statuses.count(status) for status in sorted(set(statuses))},
+            "cycle_seconds": round(time.perf_counter() - started, 3)
+        })
+        return self.results
+    
+    def generate_report(self, format: str = "text") -> str:
+        """Fleet report: one line per site, then each site's problems"""
+        if format == "json":
+            return json.dumps(self.results, indent=2)
+        
+        lines = ["=" * 60, "GARDEN FLEET HEALTH REPORT", "=" * 60]
+        lines.append(f"Timestamp: {self.results['timestamp']}")
+        summary = ", ".join(f"{count} {status}" for status, count in self.results["summary"].items())
+        lines.append(f"Overall Status: {self.results['overall_status']} ({summary})")
+        lines.append(f"Cycle: {self.results['cycle_seconds']} s for {len(self.monitors)} site(s)")
+        lines.append("")
+        lines.append(f"{'SITE':<24} {'STATUS':<10} {'SECONDS':>8} {'HTTP':>5}  BREAKER")
+        for name, site in self.results["sites"].items():
+            seconds = site.get("cycle_seconds")
+            lines.append(f"{name:<24} {site['status']:<10} {seconds if seconds is not None else '-':>8} "
+                         f"{site.get('http_calls', '-'):>5}  {site.get('circuit_breaker') or '-'}")
+        for name, site in self.results["sites"].items():
+            if site["problems"]:
+                lines.append("")
+                lines.append(f"{name}:")
+                lines.extend(f"  ✗ {problem}" for problem in site["problems"])
+        lines.append("=" * 60)
+        return "\n".join(lines)
+    
+    def close(self):
+        self._executor.shutdown(wait=False)
+        for monitor in self.monitors.values():
+            monitor.close()
+
+
+def run_sites_command(args) -> int:
+    """
+    CLI: monitor.py --sites sites.yaml [--continuous]
+    
+    Pseudo Code:
+    LOAD sites file
+    MUTE site threads' output (stdout restored when done)
+    RUN one fleet cycle (or loop every --interval with --continuous)
+    EXIT 0 only if every site is HEALTHY (single run)
+    """
+    try:
+        sites = load_sites_config(args.sites)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}")
+        return 1
+    
+    fleet = FleetMonitor(sites)
+    report_format = "json" if args.json else "text"
+    print(f"Monitoring {len(sites)} site(s) from {args.sites}")
+    with _thread_output():
+        try:
+            while True:
+                fleet.run_cycle()
+                print("\n" + fleet.generate_report(report_format))
+                if not args.continuous:
+                    break
+                print(f"\nNext fleet check in {args.interval} seconds...\n")
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            print("\n\nMonitoring stopped by user.")
+        finally:
+            fleet.close()
+    return 0 if fleet.results["overall_status"] == "HEALTHY" else 1
+
+################################################################################
+# ANALYTICS: IRRIGATION EFFICIENCY
+# PSEUDO CODE:
+#   LOAD history one day at a time (HA REST or recorder SQLite copy)
+#   RESAMPLE each day onto a fixed time grid (last value carried forward)
+#     -> one float32 row per entity, memory set by grid size, not history size
+#   COMPUTE per zone with array operations:
+#     water used, watering time, sessions, moisture gain per liter,
+#     time from valve open until soil moisture has recovered
+################################################################################
+
+_STATE_NUMBERS = {"on": 1.0, "off": 0.0, "open": 1.0, "closed": 0.0}
+
+
+def _state_to_number(state) -> float:
+    """Convert an HA state string to a number (NaN if not numeric)"""
+    number = _STATE_NUMBERS.get(state)
+    if number is not None:
+        return number
+    try:
+        return float(state)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _ha_history_chunks(monitor: "SystemMonitor", entities: List[str], start: float, end: float):
+    """
+    Yield (chunk_start, chunk_end, {entity: (timestamps, values)}) from HA
+    
+    Pseudo Code:
+    FOR EACH day between start and end:
+      FOR EACH batch of entities:
+        GET /api/history/period/<day>?end_time=...&filter_entity_id=...
+            (minimal_response, no_attributes -> smallest payload)
+      CONVERT each entity's states to NumPy arrays
+    """
+    import numpy as np
+    
+    chunk = ANALYZE_CHUNK_HOURS * 3600
+    for chunk_start in np.arange(start, end, chunk):
+        chunk_end = min(chunk_start + chunk, end)
+        series = {}
+        for index in range(0, len(entities), ANALYZE_ENTITY_BATCH):
+            batch = entities[index:index + ANALYZE_ENTITY_BATCH]
+            begin = datetime.fromtimestamp(chunk_start, timezone.utc).isoformat()
+            response = monitor._http(
+                "GET", f"/api/history/period/{begin}",
+                params={
+                    "end_time": datetime.fromtimestamp(chunk_end, timezone.utc).isoformat(),
+                    "filter_entity_id": ",".join(batch),
+                    "minimal_response": "",
+                    "no_attributes": "",
+                    "significant_changes_only": "0"
+                },
+                timeout=(HTTP_CONNECT_TIMEOUT, 60)   # A day of history takes HA a while to build
+            )
+            response.raise_for_status()
+            for states in response.json():
+                if not states:
+                    continue
+                # HA timestamps are UTC; seconds resolution is plenty for the grid
+                timestamps = np.array([state["last_changed"][:19] for state in states],
+                                      dtype="datetime64[s]").astype(np.float64)
+                values = np.array([_state_to_number(state["state"]) for state in states])
+                series[states[0]["entity_id"]] = (timestamps, values)
+        yield float(chunk_start), float(chunk_end), series
+
+
+# Recorder states -> numbers inside SQLite (same mapping as _state_to_number)
+_RECORDER_STATE_SQL = (
+    "CASE WHEN state IN ('on', 'open') THEN 1.0 WHEN state IN ('off', 'closed') THEN 0.0 "
+    "WHEN state GLOB '[-0-9.]*' THEN CAST(state AS REAL) END"
+)
+
+
+def _recorder_history_chunks(path: str, entities: List[str], start: float, end: float):
+    """
+    Yield (chunk_start, chunk_end, {entity: (timestamps, values)}) from a recorder database
+    
+    Pseudo Code:
+    OPEN database read-only (states + states_meta schema, HA 2023.4+)
+    SEED each entity with its last state before start
+    FOR EACH day:
+      SELECT (entity, time, numeric state) ordered by entity then time
+        (HA's metadata_id/last_updated_ts index, conversion done in SQL)
+      LOAD rows into one NumPy array, SPLIT at entity boundaries
+    """
+    import numpy as np
+    
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        if "states_meta" not in tables:
+            raise ValueError(f"{path} is not a recorder database from HA 2023.4 or newer")
+        
+        placeholders = ",".join("?" * len(entities))
+        metadata = dict(connection.execute(
+            f"SELECT metadata_id, entity_id FROM states_meta WHERE entity_id IN ({placeholders})", entities))
+        ids = ",".join(str(metadata_id) for metadata_id in metadata) or "NULL"
+        
+        seed = {}
+        for metadata_id in metadata:
+            row = connection.execute(
+                f"SELECT last_updated_ts, {_RECORDER_STATE_SQL} FROM states "
+                f"WHERE metadata_id = ? AND last_updated_ts < ? "
+                f"ORDER BY last_updated_ts DESC LIMIT 1", (metadata_id, start)).fetchone()
+            if row is not None:
+                seed[metadata_id] = row
+        
+        chunk = ANALYZE_CHUNK_HOURS * 3600
+        for chunk_start in np.arange(start, end, chunk):
+            chunk_end = min(chunk_start + chunk, end)
+            rows = [(metadata_id, timestamp, value) for metadata_id, (timestamp, value) in seed.items()]
+            seed = {}
+            rows += connection.execute(
+                f"SELECT metadata_id, last_updated_ts, {_RECORDER_STATE_SQL} FROM states "
+                f"WHERE metadata_id IN ({ids}) AND last_updated_ts >= ? AND last_updated_ts < ? "
+                f"ORDER BY metadata_id, last_updated_ts", (float(chunk_start), float(chunk_end))).fetchall()
+            
+            series = {}
+            if rows:
+                table = np.array(rows, dtype=np.float64)   # None (non-numeric) -> NaN
+                table = table[np.lexsort((table[:, 1], table[:, 0]))]
+                bounds = np.flatnonzero(np.diff(table[:, 0])) + 1
+                for part in np.split(table, bounds):
+                    series[metadata[int(part[0, 0])]] = (part[:, 1], part[:, 2])
+            yield float(chunk_start), float(chunk_end), series
+    finally:
+        connection.close()
+
+
+class HistoryGrid:
+    """
+    Entity histories resampled onto one shared time grid
+    
+    Pseudo Code:
+    ALLOCATE entities x grid-points float32 matrix (NaN = no data yet)
+    FOR EACH chunk: value at grid point = last state at or before it
+    CARRY each entity's last value into the next chunk
+    
+    COMMON LANGUAGE:
+    Home Assistant only records a value when it changes. Lining every
+    sensor up on the same one-minute clock lets us compare valves, flow
+    and moisture side by side with fast array math.
+    """
+    
+    def __init__(self, entities: List[str], start: float, end: float, step: float):
+        import numpy as np
+        
+        self.entities = list(entities)
+        self.row = {entity_id: index for index, entity_id in enumerate(self.entities)}
+        self.step = step
+        self.times = np.arange(start, end, step)
+        self.values = np.full((len(self.entities), len(self.times)), np.nan, dtype=np.float32)
+        self._carry = np.full(len(self.entities), np.nan)
+    
+    def add_chunk(self, chunk_start: float, chunk_end: float, series: Dict):
+        """Resample one chunk of history (last observation carried forward)"""
+        import numpy as np
+        
+        first, last = np.searchsorted(self.times, [chunk_start, chunk_end])
+        grid = self.times[first:last]
+        for entity_id, row in self.row.items():
+            timestamps, values = series.get(entity_id, ((), ()))
+            if len(timestamps) == 0:
+                self.values[row, first:last] = self._carry[row]
+                continue
+            order = np.argsort(timestamps, kind="stable")
+            timestamps, values = timestamps[order], values[order]
+            index = np.searchsorted(timestamps, grid, side="right") - 1
+            self.values[row, first:last] = np.where(index >= 0, values[index.clip(0)], self._carry[row])
+            self._carry[row] = values[-1]
+    
+    def series(self, entity_id: str):
+        return self.values[self.row[entity_id]]
+
+
+def analyze_zone(grid: HistoryGrid, zone: Dict[str, str], period_seconds: float) -> Dict:
+    """
+    Irrigation efficiency metrics for one zone
+    
+    Pseudo Code:
+    WATERING = valve on at grid point
+    LITERS   = running sum of flow (L/min) x step
+    SESSIONS = valve off->on edges paired with on->off edges
+    PER SESSION (vectorized over all sessions at once):
+      liters used, moisture rise within look-ahead window,
+      minutes until moisture reached 90% of that rise
+    GROUP liters and watering minutes into periods (weeks)
+    """
+    import numpy as np
+    
+    step_minutes = grid.step / 60
+    valve = np.nan_to_num(grid.series(zone["valve"])) > 0.5
+    flow = np.nan_to_num(grid.series(zone["flow"])).astype(np.float64)
+    moisture = grid.series(zone["moisture"]).astype(np.float64)
+    
+    liters_per_step = np.clip(flow, 0, None) * step_minutes
+    cumulative = np.concatenate(([0.0], np.cumsum(liters_per_step)))
+    
+    edges = np.diff(valve.astype(np.int8), prepend=0, append=0)
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    session_liters = cumulative[ends] - cumulative[starts]
+    
+    gain_per_liter, recovery_minutes = [], []
+    window = int(ANALYZE_RECOVERY_HOURS * 3600 / grid.step)
+    if len(starts) and len(moisture) > window:
+        padded = np.concatenate((moisture, np.full(window, np.nan)))
+        windows = np.lib.stride_tricks.sliding_window_view(padded, window)[starts]
+        baseline = moisture[starts]
+        with np.errstate(invalid="ignore"):
+            peak = np.nanmax(np.where(np.isnan(windows), -np.inf, windows), axis=1)
+            rise = peak - baseline
+            valid = (rise > 0) & np.isfinite(rise) & (session_liters > 0)
+            reached = windows >= (baseline + ANALYZE_RECOVERY_FRACTION * rise)[:, None]
+        gain_per_liter = (rise[valid] / session_liters[valid]).tolist()
+        recovery_minutes = (reached.argmax(axis=1)[valid] * step_minutes).tolist()
+    
+    periods = ((grid.times - grid.times[0]) // period_seconds).astype(np.int64) if len(grid.times) else []
+    count = int(periods[-1]) + 1 if len(periods) else 0
+    period_liters = np.bincount(periods, weights=liters_per_step, minlength=count)
+    period_minutes = np.bincount(periods, weights=valve * step_minutes, minlength=count)
+    period_sessions = np.bincount(periods[starts], minlength=count) if len(starts) else np.zeros(count)
+    
+    return {
+        "liters": round(float(cumulative[-1]), 1),
+        "watering_minutes": round(float(valve.sum() * step_minutes), 1),
+        "sessions": int(len(starts)),
+        "moisture_gain_per_liter": round(float(np.median(gain_per_liter)), 3) if gain_per_liter else None,
+        "recovery_minutes": round(float(np.median(recovery_minutes)), 1) if recovery_minutes else None,
+        "periods": [
+            {
+                "start": datetime.fromtimestamp(grid.times[0] + index * period_seconds).isoformat(timespec="minutes"),
+                "liters": round(float(period_liters[index]), 1),
+                "watering_minutes": round(float(period_minutes[index]), 1),
+                "sessions": int(period_sessions[index])
+            }
+            for index in range(count)
+        ]
+    }
+
+
+def run_analyze_command(args) -> int:
+    """
+    CLI: monitor.py analyze --since 7d
+    
+    Pseudo Code:
+    PICK source (HA REST, or recorder SQLite copy with --recorder-db)
+    STREAM history into a HistoryGrid one chunk at a time
+    COMPUTE per-zone metrics, grouped by week
+    PRINT report (text or JSON)
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        print("ERROR: numpy not installed (pip3 install numpy)")
+        return 1
+    
+    try:
+        end = datetime.now() - (_parse_duration(args.until) if args.until else timedelta(0))
+        start = end - _parse_duration(args.since)
+        period_seconds = _parse_duration(args.period).total_seconds()
+        if period_seconds <= 0:
+            raise ValueError(f"Invalid --period '{args.period}' (must be longer than 0)")
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return 1
+    
+    entities = []
+    for zone in ANALYZE_ZONES.values():
+        entities.extend(zone.values())
+    for entity_id in CRITICAL_SENSORS + args.entity:
+        if entity_id not in entities:
+            entities.append(entity_id)
+    
+    started = time.perf_counter()
+    grid = HistoryGrid(entities, start.timestamp(), end.timestamp(), args.step)
+    
+    if args.recorder_db:
+        if not os.path.exists(args.recorder_db):
+            print(f"ERROR: recorder database not found: {args.recorder_db}")
+            return 1
+        chunks = _recorder_history_chunks(args.recorder_db, entities, start.timestamp(), end.timestamp())
+        source = args.recorder_db
+    else:
+        if not args.ha_token:
+            print("ERROR: --ha-token is required (or use --recorder-db)")
+            return 1
+        monitor = SystemMonitor(args.ha_url, args.ha_token, MQTT_BROKER, MQTT_PORT)
+        chunks = _ha_history_chunks(monitor, entities, start.timestamp(), end.timestamp())
+        source = args.ha_url
+    
+    try:
+        for chunk_start, chunk_end, series in chunks:
+            grid.add_chunk(chunk_start, chunk_end, series)
+    except (requests.RequestException, UpstreamDownError, sqlite3.Error, ValueError) as e:
+        print(f"ERROR: Could not load history: {e}")
+        return 1
+    
+    with np.errstate(invalid="ignore"):
+        coverage = (~np.isnan(grid.values)).mean(axis=1)
+    report = {
+        "source": source,
+        "start": start.isoformat(timespec="minutes"),
+        "end": end.isoformat(timespec="minutes"),
+        "step_seconds": args.step,
+        "zones": {name: analyze_zone(grid, zone, period_seconds) for name, zone in ANALYZE_ZONES.items()},
+        "coverage": {entity_id: round(float(coverage[row]), 3) for entity_id, row in grid.row.items()},
+        "seconds": round(time.perf_counter() - started, 3)
+    }
+    
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    
+    print(f"Irrigation efficiency {report['start']} -> {report['end']} ({source})\n")
+    for name, zone in report["zones"].items():
+        print(f"{name.upper()}: {zone['liters']} L in {zone['sessions']} session(s), "
+              f"{zone['watering_minutes']} min watering")
+        gain = zone["moisture_gain_per_liter"]
+        recovery = zone["recovery_minutes"]
+        print(f"  moisture gain per liter: {gain if gain is not None else '-'} %/L   "
+              f"recovery: {recovery if recovery is not None else '-'} min")
+        print(f"  {'PERIOD START':<17} {'LITERS':>8} {'MINUTES':>8} {'SESSIONS':>9}")
+        for period in zone["periods"]:
+            print(f"  {period['start']:<17} {period['liters']:>8} {period['watering_minutes']:>8} "
+                  f"{period['sessions']:>9}")
+        print()
+    
+    missing = [entity_id for entity_id, fraction in report["coverage"].items() if fraction == 0]
+    if missing:
+        print(f"No history for: {', '.join(missing)}")
+    print(f"Analyzed {len(entities)} entities x {len(grid.times)} grid points in {report['seconds']} s")
+    return 0
+
+################################################################################
+# MQTT BROKER BENCHMARK (mqtt-bench subcommand)
+# PSEUDO CODE:
+#   PASSIVE: listen to the broker's $SYS topics -> clients, msg/s, dropped, heap
+#   ACTIVE: FOR EACH QoS x payload size x client count:
+#     ONE subscriber on <bench topic>/<run id>/#
+#     N publishers, each sends M messages stamped with send time + sequence
+#     MEASURE publish rate, delivery rate, lost/duplicate messages and
+#       end-to-end latency percentiles
+#   $SYS sampled during the whole run: dropped messages / heap growth
+################################################################################
+
+def _sys_value(payload: bytes):
+    """$SYS payload as a number where possible ("1234", "5.67", "3600 seconds")"""
+    text = payload.decode(errors="replace").strip()
+    number = text.split(" ")[0]
+    try:
+        return int(number)
+    except ValueError:
+        pass
+    try:
+        return float(number)
+    except ValueError:
+        return text
+
+
+def _percentile(ordered: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list (None if empty)"""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+class BrokerStatsSampler:
+    """
+    Latest broker statistics from $SYS (Mosquitto publishes them every sys_interval)
+    
+    Pseudo Code:
+    CONNECT, subscribe to every MQTT_SYS_STATS topic
+    ON MESSAGE: store latest value, remember the first one seen too
+    WAIT_UPDATE: block until the next $SYS round arrives (or timeout)
+    
+    COMMON LANGUAGE:
+    The broker reports on itself every few seconds: how many clients are
+    connected, how many messages go through, how many it had to throw away.
+    This listens to those reports.
+    """
+    
+    def __init__(self, broker: str, port: int, username: str = "", password: str = ""):
+        self.topics = {topic: name for name, topic in MQTT_SYS_STATS.items()}
+        self.latest: Dict = {}
+        self.first: Dict = {}
+        self._updated = threading.Event()
+        self._connected = threading.Event()
+        self.client = _new_mqtt_client(f"garden-monitor-sys-{os.getpid()}-{uuid.uuid4().hex[:6]}")
+        if username and password:
+            self.client.username_pw_set(username, password)
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self.broker = broker
+        self.port = port
+    
+    def start(self, timeout: float = MQTT_CONNECT_TIMEOUT) -> bool:
+        """Connect and subscribe; False if the broker did not answer"""
+        self.client.connect_async(self.broker, self.port, keepalive=30)
+        self.client.loop_start()
+        return self._connected.wait(timeout)
+    
+    def stop(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+    
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code == 0:
+            client.subscribe([(topic, 0) for topic in self.topics])
+            self._connected.set()
+    
+    def _on_message(self, client, userdata, message):
+        name = self.topics.get(message.topic)
+        if name is not None:
+            value = _sys_value(message.payload)
+            self.first.setdefault(name, value)
+            self.latest[name] = value
+            self._updated.set()
+    
+    def wait_update(self, timeout: float) -> bool:
+        """Wait for the next $SYS message (True if one arrived)"""
+        self._updated.clear()
+        return self._updated.wait(timeout)
+    
+    def report(self) -> Dict:
+        """Latest values + per-second rates and what changed since sampling started"""
+        stats = dict(self.latest)
+        for name in ("received_per_min", "sent_per_min", "dropped_per_min"):
+            if isinstance(stats.get(name), (int, float)):
+                stats[name.replace("_per_min", "_per_sec")] = round(stats[name] / 60, 2)
+        for name in ("dropped_total", "heap_current"):
+            if isinstance(self.first.get(name), (int, float)) and isinstance(stats.get(name), (int, float)):
+                stats[f"{name}_change"] = stats[name] - self.first[name]
+        return stats
+
+
+def _bench_client(client_id: str, broker: str, port: int, username: str, password: str):
+    """Connected paho client with its network loop running (None if no CONNACK)"""
+    client = _new_mqtt_client(client_id)
+    if username and password:
+        client.username_pw_set(username, password)
+    connected = threading.Event()
+    client.on_connect = lambda client, userdata, flags, reason_code, properties: reason_code == 0 and connected.set()
+    client.connect_async(broker, port, keepalive=60)
+    client.loop_start()
+    if connected.wait(MQTT_CONNECT_TIMEOUT):
+        return client
+    client.loop_stop()
+    return None
+
+
+def mqtt_bench_scenario(broker: str, port: int, username: str, password: str, qos: int, size: int,
+                        clients: int, messages: int, rate: float = 0, timeout: float = MQTT_BENCH_TIMEOUT) -> Dict:
+    """
+    One throughput/latency measurement
+    
+    Pseudo Code:
+    SUBSCRIBE one client to this run's topics (same QoS)
+    CONNECT N publishers, then all publish at once:
+      payload = "<send time> <publisher> <sequence>" padded to size
+      (rate > 0 -> paced to rate messages/s per publisher)
+      QoS 1/2: wait until the broker acknowledged every message
+    WAIT until everything arrived or timeout
+    RETURN rates, lost/duplicates, latency percentiles (ms)
+    """
+    run_topic = f"{MQTT_BENCH_TOPIC}/{uuid.uuid4().hex[:8]}"
+    expected = clients * messages
+    latencies: List[float] = []
+    seen = set()
+    counts = {"duplicates": 0, "last": None}
+    lock = threading.Lock()
+    done = threading.Event()
+    subscribed = threading.Event()
+    
+    def on_message(client, userdata, message):
+        received = time.perf_counter()
+        try:
+            sent, publisher, sequence = message.payload.split(b" ", 3)[:3]
+            sent = float(sent)
+        except ValueError:
+            return   # Not one of ours
+        with lock:
+            if (publisher, sequence) in seen:
+                counts["duplicates"] += 1
+                return
+            seen.add((publisher, sequence))
+            latencies.append(received - sent)
+            counts["last"] = received
+            if len(seen) == expected:
+                done.set()
+    
+    subscriber = _bench_client(f"garden-bench-sub-{os.getpid()}", broker, port, username, password)
+    if subscriber is None:
+        raise ConnectionError(f"No CONNACK from {broker}:{port} within {MQTT_CONNECT_TIMEOUT}s")
+    subscriber.on_message = on_message
+    subscriber.on_subscribe = lambda client, userdata, mid, reason_codes, properties: subscribed.set()
+    subscriber.subscribe(f"{run_topic}/#", qos=qos)
+    publishers = [_bench_client(f"garden-bench-pub-{os.getpid()}-{index}", broker, port, username, password)
+                  for index in range(clients)]
+    
+    try:
+        if not subscribed.wait(MQTT_CONNECT_TIMEOUT) or None in publishers:
+            raise ConnectionError(f"{sum(client is None for client in publishers)} publisher(s) not connected")
+        
+        def publish(index: int, client):
+            topic = f"{run_topic}/{index}"
+            pending = []
+            started = time.perf_counter()
+            for sequence in range(messages):
+                if rate > 0:
+                    delay = started + sequence / rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                payload = f"{time.perf_counter():.9f} {index} {sequence} ".encode().ljust(size, b"x")
+                info = client.publish(topic, payload, qos=qos)
+                if qos:
+                    pending.append(info)
+            for info in pending:
+                info.wait_for_publish(timeout)
+        
+        threads = [threading.Thread(target=publish, args=(index, client), daemon=True)
+                   for index, client in enumerate(publishers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout)
+        published = time.perf_counter() - started
+        done.wait(max(0.0, timeout - published))
+    finally:
+        for client in [subscriber, *publishers]:
+            if client is not None:
+                client.disconnect()
+                client.loop_stop()
+    
+    with lock:
+        ordered = sorted(latencies)
+        delivered = len(seen)
+        last = counts["last"]
+    return {
+        "qos": qos,
+        "payload_bytes": size,
+        "clients": clients,
+        "sent": expected,
+        "delivered": delivered,
+        "lost": expected - delivered,
+        "duplicates": counts["duplicates"],
+        "publish_per_sec": round(expected / published, 1) if published else None,
+        "delivered_per_sec": round(delivered / (last - started), 1) if last and last > started else None,
+        "latency_ms": {name: round(_percentile(ordered, fraction) * 1000, 2) if ordered else None
+                       for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))}
+    }
+
+
+def run_mqtt_bench_command(args) -> int:
+    """
+    CLI: monitor.py mqtt-bench [--passive]
+    
+    Pseudo Code:
+    START $SYS sampler (also tells us the broker is reachable)
+    IF passive THEN wait for one $SYS round, PRINT broker stats
+    ELSE RUN every QoS x payload x clients scenario, PRINT table + broker stats
+    """
+    sampler = BrokerStatsSampler(args.broker, args.port, args.username, args.password)
+    if not sampler.start():
+        print(f"ERROR: MQTT broker {args.broker}:{args.port} did not answer within {MQTT_CONNECT_TIMEOUT}s")
+        sampler.stop()
+        return 1
+    
+    report = {"broker": f"{args.broker}:{args.port}", "scenarios": []}
+    try:
+        if args.passive:
+            deadline = time.time() + args.sys_seconds
+            while time.time() < deadline and sampler.wait_update(deadline - time.time()):
+                pass   # Keep collecting until one full $SYS round has been seen
+        else:
+            for qos in args.qos:
+                for size in args.payload:
+                    for clients in args.clients:
+                        print(f"QoS {qos}, {size} B, {clients} client(s) x {args.messages} message(s)...",
+                              file=sys.stderr)
+                        report["scenarios"].append(mqtt_bench_scenario(
+                            args.broker, args.port, args.username, args.password, qos, size, clients,
+                            args.messages, args.rate, args.timeout))
+            if args.sys_seconds > 0:
+                sampler.wait_update(args.sys_seconds)   # One more $SYS round covering the load
+    except ConnectionError as e:
+        print(f"ERROR: {e}")
+        return 1
+    finally:
+        sampler.stop()
+    report["sys"] = sampler.report()
+    
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    
+    if report["scenarios"]:
+        print(f"MQTT broker benchmark: {report['broker']}\n")
+        print(f"{'QOS':>3} {'PAYLOAD':>8} {'CLIENTS':>7} {'SENT':>7} {'LOST':>6} {'DUP':>4} {'PUB/S':>9} "
+              f"{'DELIV/S':>9} {'P50 ms':>8} {'P90 ms':>8} {'P99 ms':>8} {'MAX ms':>8}")
+        for row in report["scenarios"]:
+            latency = {name: "-" if value is None else value for name, value in row["latency_ms"].items()}
+            print(f"{row['qos']:>3} {row['payload_bytes']:>8} {row['clients']:>7} {row['sent']:>7} "
+                  f"{row['lost']:>6} {row['duplicates']:>4} {row['publish_per_sec'] or '-':>9} "
+                  f"{row['delivered_per_sec'] or '-':>9} {latency['p50']:>8} {latency['p90']:>8} "
+                  f"{latency['p99']:>8} {latency['max']:>8}")
+        print()
+    if report["sys"]:
+        print("Broker $SYS statistics:")
+        for name, value in report["sys"].items():
+            print(f"  {name:<24} {value}")
+    else:
+        print("No $SYS statistics received (broker does not publish them, or $SYS/# is not allowed)")
+    return 0
+
+################################################################################
+# MAIN EXECUTION
+################################################################################
+
+def main():
+    """
+    Main execution flow
+    
+    Pseudo Code:
+    PARSE command line arguments
+    INITIALIZE system monitor
+    IF continuous mode THEN:
+      LOOP forever:
+        ARM watchdog (--cycle-budget / --isolation)
+        RUN all checks
+        GENERATE report
+        SEND alerts if needed
+        WAIT interval
+    ELSE:
+      RUN all checks once
+      GENERATE report
+      EXIT
+    END IF
+    """
+    parser = argparse.ArgumentParser(description="Garden Automation System Monitor")
+    parser.add_argument("--ha-url", default=HA_URL, help="Home Assistant URL")
+    parser.add_argument("--ha-token", help="Home Assistant long-lived access token (required for checks)")
+    parser.add_argument("--continuous", action="store_true", help="Run continuously")
+    parser.add_argument("--interval", type=int, default=300, help="Check interval in seconds (default: 300)")
+    parser.add_argument("--json", action="store_true", help="Output JSON format")
+    parser.add_argument("--stream", action="store_true",
+                        help="Watch ESPHome MQTT topics in real time instead of polling HA")
+    parser.add_argument("--no-leak-shutoff", action="store_true",
+                        help="In --stream mode, report leaks but do not close valves")
+    parser.add_argument("--engine", choices=["sync", "async"], default="sync",
+                        help="Run checks one after another (sync) or concurrently (async)")
+    parser.add_argument("--check-timeout", type=float, default=CHECK_TIMEOUT_SECONDS,
+                        help=f"Per-check deadline for the async engine and --isolation (default: {CHECK_TIMEOUT_SECONDS})")
+    parser.add_argument("--isolation", choices=["process", "thread"],
+                        help="Run check groups in supervised workers; a hung check is cut off as TIMEOUT "
+                             "and its worker replaced (process: killed, thread: abandoned)")
+    parser.add_argument("--cycle-budget", type=float, metavar="SECONDS",
+                        help=f"Whole-cycle deadline for --isolation (default: {CYCLE_BUDGET_SECONDS}); in "
+                             f"--continuous mode the process exits if a cycle runs {WATCHDOG_GRACE_SECONDS}s past it")
+    parser.add_argument("--discover", choices=["static", "ha", "mqtt"], default="static",
+                        help="Find ESP32 nodes from HA entities or MQTT discovery topics")
+    parser.add_argument("--probe-devices", action="store_true",
+                        help="Also check each ESP32 node's web server is reachable")
+    parser.add_argument("--device-url-template", default=DEVICE_URL_TEMPLATE,
+                        help=f"URL probed per node (default: {DEVICE_URL_TEMPLATE})")
+    parser.add_argument("--scheduler", choices=["fixed", "adaptive"], default="fixed",
+                        help="Continuous mode: run everything every --interval (fixed) or "
+                             "per-check intervals with backoff (adaptive)")
+    parser.add_argument("--check-interval", action="append", default=[], metavar="CHECK=SECONDS",
+                        help="Override an adaptive interval, e.g. --check-interval sensors=120")
+    parser.add_argument("--serve-metrics", type=int, metavar="PORT",
+                        help="Expose Prometheus metrics on PORT (implies --continuous)")
+    parser.add_argument("--metrics-bind", default=METRICS_BIND, metavar="ADDRESS",
+                        help=f"Address for --serve-metrics (default: {METRICS_BIND}, "
+                             f"0.0.0.0 for remote scrapers)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="Append per-cycle timing spans to FILE as Chrome trace-event JSON")
+    parser.add_argument("--websocket", action="store_true",
+                        help="Track entity states over the HA WebSocket API instead of polling /api/states")
+    parser.add_argument("--alert-notify", action="append", default=[], metavar="SERVICE",
+                        help="Send alerts on status changes via an HA notify service (e.g. notify.email)")
+    parser.add_argument("--alert-mqtt-topic", metavar="TOPIC",
+                        help=f"Also publish alerts as JSON to an MQTT topic (e.g. {ALERT_MQTT_TOPIC})")
+    parser.add_argument("--alert-rate", type=int, default=ALERT_RATE_LIMIT,
+                        help=f"Max alerts per channel per hour (default: {ALERT_RATE_LIMIT})")
+    parser.add_argument("--sites", metavar="FILE",
+                        help="Monitor every site listed in a YAML file from one process (see sites.yaml.example)")
+    parser.add_argument("--checks", metavar="NAMES",
+                        help=f"Comma-separated checks to run (default: all of {','.join(CHECKS)})")
+    parser.add_argument("--state-dir", nargs="?", const=STATE_DIR, metavar="DIR",
+                        help=f"Keep the last cycle in DIR to report changes between runs (default: {STATE_DIR})")
+    parser.add_argument("--cache-ttl", type=float, default=STATE_CACHE_TTL, metavar="SECONDS",
+                        help="With --state-dir, reuse healthy check results younger than this "
+                             f"(default: {STATE_CACHE_TTL}, always re-check)")
+    parser.add_argument("--changes-only", action="store_true",
+                        help="Print only entities that changed since the last cycle "
+                             "(text lines, or JSON Lines with --json); progress goes to stderr")
+    parser.add_argument("--rules", metavar="FILE",
+                        help="Per-entity health rules from a YAML file, run as the 'rules' check "
+                             "(see health_rules.yaml.example)")
+    parser.add_argument("--audit", nargs="?", const=AUDIT_AUTOMATIONS_FILE, metavar="AUTOMATIONS_YAML",
+                        help="Audit scheduled vs. actual runs of the critical automations from the HA "
+                             f"logbook, run as the 'audit' check (default file: {AUDIT_AUTOMATIONS_FILE})")
+    parser.add_argument("--history-db", metavar="PATH",
+                        help=f"Record every cycle to a SQLite history store (e.g. {HISTORY_DB})")
+    parser.add_argument("--water-db", metavar="PATH",
+                        help=f"In --stream mode, keep daily/seasonal water totals per zone in PATH (e.g. {WATER_DB})")
+    
+    subparsers = parser.add_subparsers(dest="command")
+    
+    history_parser = subparsers.add_parser("history", help="Query recorded check history")
+    history_parser.add_argument("entity", help="Entity id, device name or check.<name>")
+    history_parser.add_argument("--since", default="1d", help="How far back to look (e.g. 12h, 7d)")
+    history_parser.add_argument("--until", help="Stop this long ago (default: now)")
+    history_parser.add_argument("--db", default=HISTORY_DB, help=f"History database (default: {HISTORY_DB})")
+    history_parser.add_argument("--json", action="store_true", help="Output JSON format")
+    
+    analyze_parser = subparsers.add_parser("analyze", help="Irrigation efficiency report from HA history")
+    analyze_parser.add_argument("--since", default="7d", help="How far back to analyze (default: 7d, recorder keeps 30d)")
+    analyze_parser.add_argument("--until", help="Stop this long ago (default: now)")
+    analyze_parser.add_argument("--period", default="7d", help="Report totals per period (default: 7d)")
+    analyze_parser.add_argument("--step", type=_positive_int, default=ANALYZE_STEP_SECONDS,
+                                help=f"Time grid resolution in seconds (default: {ANALYZE_STEP_SECONDS})")
+    analyze_parser.add_argument("--recorder-db", metavar="PATH",
+                                help=f"Read a copy of the recorder database (e.g. {RECORDER_DB}) instead of the REST API")
+    analyze_parser.add_argument("--entity", action="append", default=[],
+                                help="Also load this entity (coverage report), may be repeated")
+    analyze_parser.add_argument("--json", action="store_true", help="Output JSON format")
+    
+    mqtt_bench_parser = subparsers.add_parser("mqtt-bench", help="MQTT broker throughput/latency and $SYS statistics")
+    mqtt_bench_parser.add_argument("--broker", default=MQTT_BROKER, help=f"Broker host (default: {MQTT_BROKER})")
+    mqtt_bench_parser.add_argument("--port", type=int, default=MQTT_PORT, help=f"Broker port (default: {MQTT_PORT})")
+    mqtt_bench_parser.add_argument("--username", default=MQTT_USERNAME, help="Broker username")
+    mqtt_bench_parser.add_argument("--password", default=MQTT_PASSWORD, help="Broker password")
+    mqtt_bench_parser.add_argument("--qos", type=int, nargs="+", choices=[0, 1, 2], default=[0, 1],
+                                   help="QoS levels to test (default: 0 1)")
+    mqtt_bench_parser.add_argument("--payload", type=int, nargs="+", default=[64, 1024], metavar="BYTES",
+                                   help="Payload sizes (default: 64 1024)")
+    mqtt_bench_parser.add_argument("--clients", type=int, nargs="+", default=[1, 10],
+                                   help="Concurrent publishers (default: 1 10)")
+    mqtt_bench_parser.add_argument("--messages", type=int, default=1000, help="Messages per publisher (default: 1000)")
+    mqtt_bench_parser.add_argument("--rate", type=float, default=0,
+                                   help="Messages/s per publisher (default: 0 = as fast as possible)")
+    mqtt_bench_parser.add_argument("--timeout", type=float, default=MQTT_BENCH_TIMEOUT,
+                                   help=f"Seconds per scenario (default: {MQTT_BENCH_TIMEOUT})")
+    mqtt_bench_parser.add_argument("--sys-seconds", type=float, default=MQTT_SYS_SECONDS,
+                                   help=f"Wait this long for $SYS statistics, 0 = don't (default: {MQTT_SYS_SECONDS})")
+    mqtt_bench_parser.add_argument("--passive", action="store_true",
+                                   help="Only sample $SYS broker statistics, publish nothing")
+    mqtt_bench_parser.add_argument("--json", action="store_true", help="Output JSON format")
+    
+    water_parser = subparsers.add_parser("water", help="Daily and seasonal water use per zone (--water-db)")
+    water_parser.add_argument("--since", default="7d", help="Days to list (default: 7d)")
+    water_parser.add_argument("--db", default=WATER_DB, help=f"Water database (default: {WATER_DB})")
+    water_parser.add_argument("--json", action="store_true", help="Output JSON format")
+    
+    args = parser.parse_args()
+    
+    if args.command == "history":
+        sys.exit(run_history_command(args))
+    if args.command == "analyze":
+        sys.exit(run_analyze_command(args))
+    if args.command == "water":
+        sys.exit(run_water_command(args))
+    if args.command == "mqtt-bench":
+        sys.exit(run_mqtt_bench_command(args))
+    if args.sites:
+        sys.exit(run_sites_command(args))
+    
+    if not args.ha_token:
+        parser.error("--ha-token is required")
+    
+    selected_checks = None
+    if args.checks:
+        selected_checks = [name.strip() for name in args.checks.split(",") if name.strip()]
+        unknown = [name for name in selected_checks if name not in CHECKS]
+        if unknown or not selected_checks:
+            parser.error(f"invalid --checks '{args.checks}' (checks: {', '.join(CHECKS)})")
+        if "rules" in selected_checks and not args.rules:
+            parser.error("--checks rules needs --rules FILE")
+        if "audit" in selected_checks and not args.audit:
+            parser.error("--checks audit needs --audit [AUTOMATIONS_YAML]")
+    if args.audit and args.stream:
+        parser.error("--audit reads the HA logbook and cannot be used with --stream")
+    if args.stream and selected_checks:
+        polled = [name for name in selected_checks if name not in STREAM_CHECKS + ["rules"]]
+        if polled:
+            parser.error(f"--checks {','.join(polled)} cannot be used with --stream "
+                         f"(stream checks: {','.join(STREAM_CHECKS)},rules)")
+    if args.isolation and (args.stream or args.engine == "async"):
+        parser.error("--isolation is its own engine and cannot be used with --stream or --engine async")
+    
+    cache = ResultCache(args.state_dir, ttl=args.cache_ttl) if args.state_dir else None
+    
+    engine_options = {}
+    if args.stream:
+        monitor_class = StreamMonitor
+    elif args.isolation:
+        monitor_class = IsolatedSystemMonitor
+        engine_options["isolation"] = args.isolation
+        engine_options["check_timeout"] = args.check_timeout
+        engine_options["cycle_budget"] = args.cycle_budget or CYCLE_BUDGET_SECONDS
+    elif args.engine == "async":
+        monitor_class = AsyncSystemMonitor
+        engine_options["check_timeout"] = args.check_timeout
+    else:
+        monitor_class = SystemMonitor
+    
+    monitor = monitor_class(
+        ha_url=args.ha_url,
         ha_token=args.ha_token,
         mqtt_broker=MQTT_BROKER,
         mqtt_port=MQTT_PORT,
         mqtt_user=MQTT_USERNAME,
-        mqtt_pass=MQTT_PASSWORD
+        mqtt_pass=MQTT_PASSWORD,
+        **engine_options
     )
     
+    if args.rules:
+        try:
+            rule_engine = RuleEngine(load_rules_config(args.rules))
+        except (OSError, ValueError) as e:
+            parser.error(f"--rules {args.rules}: {e}")
+        if args.stream:
+            monitor.stages.append(rule_engine)   # Evaluated per message instead of per cycle
+        else:
+            monitor.rule_engine = rule_engine
+    
+    if args.audit:
+        try:
+            schedule = load_automation_schedule(args.audit)
+        except (OSError, ValueError) as e:
+            parser.error(f"--audit {args.audit}: {e}")
+        state_path = os.path.join(os.path.expanduser(args.state_dir), AUDIT_STATE_FILE) if args.state_dir else None
+        auditor = AutomationAuditor(schedule, monitor.critical_automations, state_path)
+        for name in monitor.critical_automations:
+            if name not in auditor.schedule:
+                print(f"⚠ {name} not found in {args.audit}, not audited")
+        if not auditor.schedule:
+            print(f"⚠ No critical automation found in {args.audit}, auditing all {len(schedule)}")
+            auditor = AutomationAuditor(schedule, state_path=state_path)
+        monitor.automation_auditor = auditor
+    
+    report_format = "json" if args.json else "text"
+    report_output = sys.stdout
+    if args.changes_only:
+        report_format = "jsonl" if args.json else "changes"
+        sys.stdout = sys.stderr   # Progress and errors stay out of the change stream
+    if cache is not None and cache.snapshot is not None:
+        monitor.snapshot = cache.snapshot   # First cycle diffs against the last run
+    
+    def report():
+        """Close the cycle, then print its report (full, or only what changed)"""
+        monitor.finish_cycle()
+        if cache is not None:
+            if cache.snapshot is not None:
+                monitor.results["transitions"] = cache.transitions(monitor.changes)
+            cache.save(monitor.results, monitor.snapshot)
+        
+        text = monitor.generate_report(format=report_format)
+        if args.changes_only:
+            if text:
+                print(text, file=report_output, flush=True)
+        else:
+            print("\n" + text, file=report_output)
+    
     def run_checks():
-        """Run all health checks"""
+        """Run selected health checks (reusing fresh cached results)"""
         print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Starting system health check...\n")
         
-        monitor.check_home_assistant_connection()
-        monitor.check_mqtt_connection()
-        monitor.check_esp32_devices()
-        monitor.check_sensors()
-        monitor.check_switches()
-        monitor.check_automations()
-        
-        report_format = "json" if args.json else "text"
-        report = monitor.generate_report(format=report_format)
-        print("\n" + report)
+        checks = monitor.selected_checks(selected_checks)
+        reused = cache.fresh(checks) if cache else []
+        monitor.run_checks([name for name in checks if name not in reused])
+        if cache:
+            cache.reuse(monitor.results, reused)
+        report()
         
         return monitor.results["overall_status"]
     
-    if args.continuous:
+    monitor.device_discovery = args.discover
+    monitor.probe_devices = args.probe_devices
+    monitor.device_url_template = args.device_url_template
+    if args.discover == "mqtt":
+        for device in monitor.discover_devices_from_mqtt():
+            if device not in monitor.esp32_devices:
+                monitor.esp32_devices.append(device)
+    
+    if args.websocket and not args.stream:
+        tracked = None
+        if args.discover != "ha" and not (monitor.rule_engine and monitor.rule_engine.patterns):
+            tracked = (monitor.critical_sensors + monitor.critical_switches + monitor.critical_automations +
+                       [f"binary_sensor.{device.replace('-', '_')}_status" for device in monitor.esp32_devices])
+            if monitor.rule_engine is not None:
+                tracked += list(monitor.rule_engine.index)
+            if monitor.automation_auditor is not None:
+                tracked += monitor.automation_auditor.watched
+        monitor.state_stream = HAStateStream(args.ha_url, args.ha_token, tracked)
+        monitor.state_stream.start()
+        if not monitor.state_stream.synced.wait(HA_WS_SYNC_TIMEOUT):
+            print(f"⚠ WebSocket not synced yet ({monitor.state_stream.last_error or 'waiting'}), "
+                  f"using REST until it is")
+    
+    alert_channels = [HANotifyChannel(args.ha_url, args.ha_token, service) for service in args.alert_notify]
+    if args.alert_mqtt_topic:
+        alert_channels.append(MqttAlertChannel(MQTT_BROKER, MQTT_PORT, args.alert_mqtt_topic,
+                                               MQTT_USERNAME, MQTT_PASSWORD))
+    if alert_channels:
+        monitor.alert_dispatcher = AlertDispatcher(alert_channels, rate_limit=args.alert_rate)
+        monitor.cycle_hooks.append(monitor.alert_dispatcher.update)
+    
+    if args.history_db:
+        history = HistoryStore(args.history_db)
+        monitor.cycle_hooks.append(history.append)
+    
+    if args.trace:
+        trace_writer = TraceFileWriter(args.trace)
+        monitor.cycle_hooks.append(lambda results: trace_writer.write(monitor.trace.chrome_events()))
+    
+    if args.serve_metrics:
+        exporter = MetricsExporter()
+        exporter.serve(args.serve_metrics, args.metrics_bind)
+        monitor.cycle_hooks.append(exporter.update)
+        args.continuous = True
+    
+    if args.stream:
+        def leak_shutoff(reason):
+            return monitor._api_post("services/switch/turn_off",
+                                     {"entity_id": LEAK_SHUTOFF_ENTITIES}) is not None
+        
+        monitor.stages.append(LeakDetector(shutoff=None if args.no_leak_shutoff else leak_shutoff))
+        water_store = WaterStore(args.water_db) if args.water_db else None
+        water = WaterAccountant(water_store)
+        monitor.stages.append(water)
+        
+        print("Running in streaming mode (Ctrl+C to stop)")
+        try:
+            monitor.run_forever(args.interval, report=report, checks=selected_checks)
+        except KeyboardInterrupt:
+            print("\n\nMonitoring stopped by user.")
+        if water_store is not None:
+            water.flush()
+            water_store.close()
+        return
+    
+    watchdog = None
+    if args.cycle_budget or args.isolation:
+        watchdog = (args.cycle_budget or CYCLE_BUDGET_SECONDS) + WATCHDOG_GRACE_SECONDS
+    
+    if args.continuous and args.scheduler == "adaptive":
+        intervals = dict(CHECK_INTERVALS)
+        for override in args.check_interval:
+            name, _, seconds = override.partition("=")
+            if name not in intervals or not seconds.replace(".", "", 1).isdigit():
+                parser.error(f"invalid --check-interval '{override}' (checks: {', '.join(CHECKS)})")
+            intervals[name] = float(seconds)
+        if selected_checks:
+            intervals = {name: seconds for name, seconds in intervals.items() if name in selected_checks}
+        
+        print("Running in continuous mode with adaptive scheduler (Ctrl+C to stop)")
+        try:
+            run_adaptive_loop(monitor, report, intervals, watchdog)
+        except KeyboardInterrupt:
+            print("\n\nMonitoring stopped by user.")
+            monitor.close()
+    elif args.continuous:
         print("Running in continuous mode (Ctrl+C to stop)")
         while True:
             try:
+                _arm_watchdog(watchdog)
                 run_checks()
+                _arm_watchdog(None)
                 print(f"\nNext check in {args.interval} seconds...\n")
                 time.sleep(args.interval)
             except KeyboardInterrupt:
                 print("\n\nMonitoring stopped by user.")
+                monitor.close()
                 break
     else:
         status = run_checks()
+        monitor.close()
         sys.exit(0 if status == "HEALTHY" else 1)
 
 if __name__ == "__main__":
@@ -616,8 +7244,85 @@ if __name__ == "__main__":
 # 3. JSON output for logging:
 #    python3 monitor.py --ha-token YOUR_TOKEN --json >> /var/log/garden_monitor.log
 #
-# 4. Schedule with cron (every hour):
+# 4. Run all checks concurrently (cycle time = slowest check):
+#    python3 monitor.py --ha-token YOUR_TOKEN --engine async --check-timeout 15
+#
+# 5. Real-time sensor freshness from MQTT (needs mqtt: in ESPHome configs):
+#    python3 monitor.py --ha-token YOUR_TOKEN --stream --interval 60
+#
+# 6. Record history and query it later:
+#    python3 monitor.py --ha-token YOUR_TOKEN --continuous --history-db garden_monitor_history.db
+#    python3 monitor.py history sensor.zone_a_soil_moisture --since 7d
+#    python3 monitor.py history esp32-garden-zone-a --since 2d --json
+#
+# 7. Adaptive scheduling (per-check intervals, backoff when HA is down):
+#    python3 monitor.py --ha-token YOUR_TOKEN --continuous --scheduler adaptive \
+#        --check-interval sensors=120 --check-interval automations=1800
+#
+# 8. Prometheus metrics (scrape http://monitor-host:9105/metrics; listens on
+#    localhost only unless --metrics-bind says otherwise):
+#    python3 monitor.py --ha-token YOUR_TOKEN --serve-metrics 9105 --interval 60 \
+#        --metrics-bind 0.0.0.0
+#
+# 9. Find where slow cycles spend their time (open in ui.perfetto.dev):
+#    python3 monitor.py --ha-token YOUR_TOKEN --continuous --trace /tmp/monitor_trace.json
+#
+# 10. Push-based state tracking over the HA WebSocket API
+#     (pip3 install websocket-client):
+#    python3 monitor.py --ha-token YOUR_TOKEN --continuous --websocket
+#
+# 11. Weekly irrigation efficiency from recorder history (pip3 install numpy):
+#    python3 monitor.py --ha-token YOUR_TOKEN analyze --since 30d
+#    python3 monitor.py analyze --since 30d --recorder-db /tmp/recorder_copy.db --json
+#
+# 12. Notify on status changes only (one message per cycle, max 6/hour):
+#    python3 monitor.py --ha-token YOUR_TOKEN --continuous --alert-notify notify.email \
+#        --alert-mqtt-topic garden/monitor/alerts
+#
+# 13. Several properties from one long-running process (pip3 install pyyaml):
+#    cp sites.yaml.example sites.yaml   # one entry per HA + broker
+#    python3 monitor.py --sites sites.yaml --continuous --interval 300
+#
+# 14. Schedule with cron (every hour):
 #    0 * * * * python3 /path/to/monitor.py --ha-token TOKEN --json >> /var/log/monitor.log 2>&1
 #
+# 15. Frequent cron runs: selected checks only, changes since the last run,
+#     healthy results reused for 10 minutes (state kept in ~/.local/state):
+#    */5 * * * * python3 /path/to/monitor.py --ha-token TOKEN --json --checks sensors,devices \
+#        --state-dir --cache-ttl 600 >> /var/log/monitor.log 2>&1
+#
+# 16. Stream only what changed into a log pipeline (one JSON object per line,
+#     the first cycle lists everything; progress messages go to stderr):
+#    python3 monitor.py --ha-token TOKEN --continuous --interval 60 --changes-only --json \
+#        >> /var/log/garden_changes.jsonl 2>> /var/log/garden_monitor.log
+#
+# 17. Water use per zone from the flow sensors (valve-open runs, daily and
+#     seasonal totals; needs mqtt: in the ESPHome configs):
+#    python3 monitor.py --ha-token YOUR_TOKEN --stream --water-db garden_water.db
+#    python3 monitor.py water --since 30d --db garden_water.db
+#
+# 18. Per-entity limits from a rule file instead of code (pip3 install pyyaml):
+#    cp health_rules.yaml.example health_rules.yaml   # tank 20-100%, watering within 26h, ...
+#    python3 monitor.py --ha-token YOUR_TOKEN --continuous --rules health_rules.yaml
+#    # Rules only (replaces the built-in sensor/switch/automation loops):
+#    python3 monitor.py --ha-token YOUR_TOKEN --rules health_rules.yaml --checks ha,mqtt,devices,rules
+#
+# 19. Did the automations actually run? Scheduled vs. logbook runs, and
+#     whether the valves a run closes really closed (pip3 install pyyaml):
+#    */15 * * * * python3 /path/to/monitor.py --ha-token TOKEN --checks ha,automations,audit \
+#        --audit /config/automations.yaml --state-dir >> /var/log/monitor.log 2>&1
+#
+# 20. Broker capacity before adding nodes: throughput, lost messages and
+#     latency percentiles per QoS / payload / publisher count, plus $SYS stats:
+#    python3 monitor.py mqtt-bench --qos 0 1 2 --payload 64 1024 --clients 1 10 50
+#    python3 monitor.py mqtt-bench --passive --json   # $SYS statistics only
+#
+# 21. Long-running service where a hung DNS lookup or HA request must not
+#     stall the cycle: checks in worker processes, each step at most 15s,
+#     the whole cycle at most 45s (a stuck worker is killed and replaced);
+#     if the loop itself ever hangs, the process exits for systemd to restart:
+#    python3 monitor.py --ha-token YOUR_TOKEN --continuous --interval 60 \
+#        --isolation process --check-timeout 15 --cycle-budget 45
+#
 ################################################################################
 
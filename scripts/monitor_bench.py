@@ -0,0 +1,1175 @@
+#!/usr/bin/env python3
+################################################################################
+# GARDEN AUTOMATION MONITOR BENCHMARKS
+# Measures monitor.py check performance against local stand-ins
+# By Brian Kuzdas - 03/02/2024 - Copyright (c) 2024 Brian Kuzdas
+################################################################################
+#
+# PSEUDO CODE OVERVIEW:
+# 1. Start a fake Home Assistant + ESP32 fleet HTTP server on localhost
+#    (the fakes live in fakes.py, shared with test_monitor.py)
+# 2. FOR EACH fleet size:
+#      Build a SystemMonitor pointed at the fake server
+#      Time check_esp32_devices() over several runs
+# 3. Print a table (or JSON) of wall time per fleet size
+# 4. websocket: fake HA WebSocket API, push changes, drop the connection,
+#    verify the monitor reconnects, resyncs and its cache matches HA
+# 5. alerts: slow fake HA notify endpoint, feed status changes, verify
+#    dedup, coalescing, rate limiting and that the check loop never waits
+# 6. sites: N fake Home Assistants, one FleetMonitor, time fleet cycles
+# 7. startup: time fresh `monitor.py` processes the way cron runs them,
+#    eager imports (old behaviour) vs lazy imports, --checks and the cache
+# 8. changes: many-entity cycles with a few changes each, compare full
+#    JSON reports with the --changes-only JSON Lines stream
+# 9. cycles: full run_checks() cycles against fake HA (entity count,
+#    latency, error rate) + fake MQTT broker across scales; wall time,
+#    HTTP calls, CPU and peak memory, saved as JSON and compared with a
+#    previous run to catch regressions
+# 10. water: simulated days of zone flow readings (jitter, dropped samples,
+#     outages) through WaterAccountant; liters vs. the true flow, cost per
+#     message and memory day after day
+# 11. rules: per-entity health rules evaluated by interpreting rule dicts
+#     every cycle vs. the compiled, indexed, change-driven RuleEngine
+# 12. audit: simulated days of logbook with injected missed / late /
+#     failed automation runs, audited incrementally every few minutes
+# 13. supervisor: one node's web server or HA's /api/states hangs; cycle
+#     time and TIMEOUT reporting for sync, async and isolated engines
+#
+# COMMON LANGUAGE EXPLANATION:
+# This script pretends to be Home Assistant and hundreds of ESP32 nodes,
+# each answering slowly, so we can see how long the monitor takes to check
+# the whole fleet without needing real hardware.
+#
+# USAGE:
+#   python3 monitor_bench.py devices                    # 3..300 devices
+#   python3 monitor_bench.py devices --sizes 3 300 --latency 0.2 --json
+#   python3 monitor_bench.py websocket --events 500  # needs websocket-client
+#   python3 monitor_bench.py alerts --latency 1.0
+#   python3 monitor_bench.py sites --sites 50 --latency 0.05
+#   python3 monitor_bench.py startup --runs 10
+#   python3 monitor_bench.py changes --entities 2000 --changed 10
+#   python3 monitor_bench.py cycles --output baseline.json
+#   python3 monitor_bench.py cycles --compare baseline.json --output new.json
+#   python3 monitor_bench.py cycles --entities 10000 --devices 500 --error-rate 0.05
+#   python3 monitor_bench.py water --days 14 --drop-rate 0.05 --outage 90
+#   python3 monitor_bench.py rules --entities 10000 --changed 10
+#   python3 monitor_bench.py audit --days 7 --interval 300
+#   python3 monitor_bench.py supervisor --hang 30 --check-timeout 5 --cycle-budget 10
+#
+################################################################################
+
+import argparse
+import bisect
+import contextlib
+import fnmatch
+import io
+import json
+import math
+import os
+import platform
+import py_compile
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import monitor
+from fakes import (FakeFleetServer, FakeHAWebSocketServer, FakeMqttBroker, FakeNotifyServer,
+                   alert_results, wait_for)
+
+################################################################################
+# BENCHMARK: DEVICE PROBES
+# PSEUDO CODE:
+#   FOR EACH fleet size:
+#     START fake fleet
+#     REPEAT runs: load snapshot, time check_esp32_devices()
+#     RECORD median wall time vs. serial estimate (size x latency)
+################################################################################
+
+def bench_devices(sizes: List[int], latency: float, runs: int) -> List[Dict]:
+    """Time parallel device probes for each fleet size"""
+    results = []
+
+    for size in sizes:
+        devices = [f"esp32-bench-node-{index:03d}" for index in range(size)]
+        fleet = FakeFleetServer(devices, latency=latency)
+
+        check = monitor.SystemMonitor(fleet.url, "bench-token", "127.0.0.1", 1883)
+        check.esp32_devices = devices
+        check.probe_devices = True
+        check.device_url_template = fleet.url + "/device/{device}/"
+
+        timings = []
+        for _ in range(runs):
+            with contextlib.redirect_stdout(io.StringIO()):
+                check.begin_cycle()
+                check.load_state_snapshot()
+                started = time.perf_counter()
+                all_ok = check.check_esp32_devices()
+                timings.append(time.perf_counter() - started)
+
+        check.close()
+        fleet.close()
+
+        results.append({
+            "devices": size,
+            "all_ok": all_ok,
+            "median_seconds": round(statistics.median(timings), 4),
+            "max_seconds": round(max(timings), 4),
+            "serial_estimate_seconds": round(size * latency, 2)
+        })
+
+    return results
+
+################################################################################
+# BENCHMARK: WEBSOCKET STATE TRACKING
+# PSEUDO CODE:
+#   START fake HA WebSocket server with the monitor's critical entities
+#   START HAStateStream, wait for first sync
+#   PUSH events, measure time until the cache shows the last one
+#   DROP connection, push changes while disconnected
+#   WAIT for reconnect + resync, COMPARE cache with server states
+################################################################################
+
+def bench_websocket(events: int) -> Dict:
+    """Verify push updates, reconnect and resync against a fake HA"""
+    now = datetime.now().isoformat()
+    tracked = monitor.CRITICAL_SENSORS + monitor.CRITICAL_SWITCHES
+    states = {entity_id: {"entity_id": entity_id, "state": "0", "last_updated": now, "attributes": {}}
+              for entity_id in tracked}
+    states["sensor.untracked_noise"] = {"entity_id": "sensor.untracked_noise", "state": "0",
+                                        "last_updated": now, "attributes": {}}
+    server = FakeHAWebSocketServer(states)
+
+    stream = monitor.HAStateStream(server.url, server.token, tracked)
+    stream.start()
+    synced = stream.synced.wait(5)
+
+    # Push updates and time until the last one lands in the cache
+    sensor = monitor.CRITICAL_SENSORS[0]
+    started = time.perf_counter()
+    for value in range(1, events + 1):
+        server.push_state(sensor, str(value))
+        server.push_state("sensor.untracked_noise", str(value))
+    delivered = wait_for(lambda: stream.snapshot().get(sensor, {}).get("state") == str(events), 5)
+    push_seconds = time.perf_counter() - started
+
+    # Drop connection, change state while nobody is listening
+    server.drop_connections()
+    wait_for(lambda: not stream.synced.is_set(), 2)
+    server.push_state(monitor.CRITICAL_SWITCHES[0], "on")
+    started = time.perf_counter()
+    resynced = wait_for(lambda: stream.synced.is_set() and stream.resyncs >= 2, 10)
+    resync_seconds = time.perf_counter() - started
+
+    cache = stream.snapshot()
+    cache_matches = all(cache.get(entity_id, {}).get("state") == server.states[entity_id]["state"]
+                        for entity_id in tracked)
+
+    # check_* methods read the cache without any HTTP request
+    check = monitor.SystemMonitor(server.url, server.token, "127.0.0.1", 1883)
+    check.state_stream = stream
+    with contextlib.redirect_stdout(io.StringIO()):
+        check.begin_cycle()
+        check.load_state_snapshot()
+        check.check_sensors()
+    check.close()
+    server.close()
+
+    return {
+        "synced": synced,
+        "events": events,
+        "events_delivered": delivered,
+        "push_seconds": round(push_seconds, 4),
+        "events_per_second": round(events / push_seconds, 1) if push_seconds else None,
+        "untracked_filtered": "sensor.untracked_noise" not in cache,
+        "reconnects": stream.reconnects,
+        "resynced": resynced,
+        "resync_seconds": round(resync_seconds, 3),
+        "cache_matches_server": cache_matches,
+        "http_calls_with_cache": check.http_calls,
+        "get_states_calls": server.get_states_calls
+    }
+
+################################################################################
+# BENCHMARK: ALERT DISPATCH
+# PSEUDO CODE:
+#   START slow fake notify endpoint
+#   FEED synthetic cycles: healthy, node down (+ its sensors), repeat,
+#     recovery, then a flapping sensor
+#   TIME each update() call (must not wait for the notifier)
+#   CLOSE (drain queue), CHECK what the endpoint received
+################################################################################
+
+def bench_alerts(latency: float, rate_limit: int) -> Dict:
+    """Verify alert dedup, coalescing and rate limiting against a slow notifier"""
+    notify = FakeNotifyServer(latency)
+    channel = monitor.HANotifyChannel(notify.url, "bench-token", "notify.email")
+    dispatcher = monitor.AlertDispatcher([channel], rate_limit=rate_limit)
+
+    cycles = [
+        alert_results(),                          # healthy: nothing
+        alert_results(zone_a_online=False),       # node down: ONE coalesced alert
+        alert_results(zone_a_online=False),       # unchanged: nothing
+        alert_results(),                          # recovered: one alert
+    ]
+    for index in range(6):                         # flapping tank sensor
+        cycles.append(alert_results(tank_status="STALE" if index % 2 == 0 else "OK"))
+
+    update_seconds = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for results in cycles:
+            started = time.perf_counter()
+            dispatcher.update(results)
+            update_seconds.append(time.perf_counter() - started)
+        queued_after_cycles = dict(dispatcher.stats)
+        started = time.perf_counter()
+        dispatcher.close(timeout=latency * (rate_limit + 2) + 5)
+        drain_seconds = time.perf_counter() - started
+    notify.close()
+
+    down_alert = notify.received[0] if notify.received else {}
+    return {
+        "cycles": len(cycles),
+        "alerts_queued": queued_after_cycles["queued"],
+        "notifications_received": len(notify.received),
+        "rate_limited": dispatcher.stats["rate_limited"],
+        "coalesced_entities": dispatcher.stats["coalesced"],
+        "node_down_message": down_alert.get("message"),
+        "max_update_ms": round(max(update_seconds) * 1000, 2),
+        "notifier_latency_ms": round(latency * 1000),
+        "drain_seconds": round(drain_seconds, 2),
+        "failed": dispatcher.stats["failed"]
+    }
+
+################################################################################
+# BENCHMARK: MULTI-SITE FLEET
+# PSEUDO CODE:
+#   START one fake HA per site (devices + critical entities)
+#   BUILD FleetMonitor over all sites (MQTT pointed at a closed port)
+#   TIME several fleet cycles, RECORD threads and peak memory
+################################################################################
+
+def bench_sites(site_count: int, latency: float, runs: int) -> Dict:
+    """Time concurrent fleet cycles against N fake Home Assistants"""
+    servers, sites = [], []
+    for index in range(site_count):
+        server = _critical_entity_server()
+        servers.append(server)
+        sites.append({"name": f"site-{index:02d}", "ha_url": server.url, "ha_token": "bench-token",
+                      "mqtt_broker": "127.0.0.1", "mqtt_port": 1})
+
+    # HA answers every request after `latency` (WAN round trip to each property)
+    for server in servers:
+        server.server.RequestHandlerClass.do_GET = _delayed(server.server.RequestHandlerClass.do_GET, latency)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        fleet = monitor.FleetMonitor(sites)
+        timings = []
+        for _ in range(runs):
+            results = fleet.run_cycle()
+            timings.append(results["cycle_seconds"])
+        threads = threading.active_count()
+        fleet.close()
+    for server in servers:
+        server.close()
+
+    return {
+        "sites": site_count,
+        "request_latency_seconds": latency,
+        "first_cycle_seconds": timings[0],
+        "median_cycle_seconds": round(statistics.median(timings), 3),
+        "site_statuses": results["summary"],
+        "threads": threads,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+def _delayed(handler, latency: float):
+    def do_GET(self):
+        time.sleep(latency)
+        return handler(self)
+    return do_GET
+
+
+def _critical_entity_server() -> FakeFleetServer:
+    """Fake HA with the default fleet plus every critical entity, all healthy"""
+    now = datetime.now().isoformat()
+    server = FakeFleetServer(monitor.ESP32_DEVICES, latency=0)
+    for entity_id in monitor.CRITICAL_SENSORS + monitor.CRITICAL_SWITCHES + monitor.CRITICAL_AUTOMATIONS:
+        server.states[entity_id] = {"entity_id": entity_id, "state": "on", "last_updated": now,
+                                    "last_changed": now, "attributes": {"last_triggered": now}}
+    return server
+
+################################################################################
+# BENCHMARK: SINGLE-SHOT STARTUP
+# PSEUDO CODE:
+#   COMPILE monitor.py once (cron runs use the cached bytecode)
+#   START fake HA
+#   FOR EACH scenario: spawn `runs` fresh interpreters, RECORD median wall time
+#     eager = import requests/paho/asyncio/http.server up front (old behaviour)
+#   REPORT each scenario against its "before" row
+################################################################################
+
+_EAGER_RUN = ("import sys, runpy, requests, paho.mqtt.client, asyncio, http.server; "
+              "sys.argv = ['monitor.py'] + sys.argv[1:]; runpy.run_path('monitor.py', run_name='__main__')")
+
+
+def _time_process(argv: List[str], runs: int) -> float:
+    """Median wall time in ms of `runs` fresh interpreters running argv"""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable] + argv, cwd=os.path.dirname(os.path.abspath(monitor.__file__)),
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - started)
+    return round(statistics.median(timings) * 1000, 1)
+
+
+def bench_startup(runs: int) -> List[Dict]:
+    """Time cron-style single-shot runs: eager vs lazy imports, --checks, cache"""
+    py_compile.compile(monitor.__file__)
+    server = _critical_entity_server()
+    state_dir = tempfile.mkdtemp(prefix="monitor-bench-state-")
+    # No broker in the benchmark: MQTT is left out so rows compare HA work only
+    ha_checks = ",".join(name for name in monitor.CHECKS if name != "mqtt")
+    single_shot = ["--ha-url", server.url, "--ha-token", "bench-token", "--json"]
+
+    scenarios = [
+        ("import", "eager (before)", ["-c", "import requests, paho.mqtt.client, asyncio, http.server, monitor"]),
+        ("import", "lazy", ["-c", "import monitor"]),
+        ("single-shot", "eager, all HA checks (before)", ["-c", _EAGER_RUN] + single_shot + ["--checks", ha_checks]),
+        ("single-shot", "lazy, all HA checks", ["monitor.py"] + single_shot + ["--checks", ha_checks]),
+        ("single-shot", "lazy, sensors,devices", ["monitor.py"] + single_shot + ["--checks", "sensors,devices"]),
+        ("single-shot", "lazy, sensors,devices, cached",
+         ["monitor.py"] + single_shot + ["--checks", "sensors,devices",
+                                         "--state-dir", state_dir, "--cache-ttl", "3600"]),
+    ]
+
+    results, before = [], {}
+    for scenario, variant, argv in scenarios:
+        if variant.endswith("cached"):
+            _time_process(argv, 1)   # Warm the cache
+        median_ms = _time_process(argv, runs)
+        before.setdefault(scenario, median_ms)
+        results.append({
+            "scenario": scenario,
+            "variant": variant,
+            "median_ms": median_ms,
+            "speedup": round(before[scenario] / median_ms, 2)
+        })
+
+    server.close()
+    shutil.rmtree(state_dir, ignore_errors=True)
+    return results
+
+################################################################################
+# BENCHMARK: INCREMENTAL REPORTS
+# PSEUDO CODE:
+#   BUILD results with N sensors (as check_sensors reports them)
+#   EACH cycle: change `changed` sensors, snapshot + diff, render JSON Lines
+#   COMPARE time and bytes with the full JSON report of the same cycle
+#   COUNT how much of each snapshot is shared with the one before
+################################################################################
+
+def bench_changes(entities: int, changed: int, cycles: int) -> Dict:
+    """Snapshot/diff cost and output volume vs. full JSON reports"""
+    sensors = {f"sensor.bench_{index:05d}": {"value": "20.0", "age_seconds": 30.0, "status": "OK"}
+               for index in range(entities)}
+    names = list(sensors)
+    check = monitor.SystemMonitor("http://127.0.0.1:1", "bench-token", "127.0.0.1", 1)
+
+    full_bytes = changes_bytes = emitted = shared = 0
+    full_seconds = diff_seconds = 0.0
+    for cycle in range(cycles):
+        sensors = dict(sensors)
+        for index in range(changed):
+            name = names[(cycle * changed + index) % entities]
+            sensors[name] = {"value": str(21.0 + cycle), "age_seconds": 30.0, "status": "OK"}
+        check.results = {"timestamp": datetime.now().isoformat(), "overall_status": "UNKNOWN",
+                         "checks": {"sensors": {"status": "OK", "sensors": sensors}}}
+
+        started = time.perf_counter()
+        full_bytes += len(check.generate_report(format="json"))
+        full_seconds += time.perf_counter() - started
+
+        previous = check.snapshot
+        started = time.perf_counter()
+        check.finish_cycle()
+        stream = check.generate_report(format="jsonl")
+        diff_seconds += time.perf_counter() - started
+        changes_bytes += len(stream)
+        emitted += len(check.changes)
+        if previous is not None:
+            before, after = previous.checks["sensors"], check.snapshot.checks["sensors"]
+            shared += sum(1 for entity_id, row in after.items() if before.get(entity_id) is row)
+
+    check.close()
+    return {
+        "entities": entities + 2,   # + check.sensors and overall status rows
+        "changed_per_cycle": changed,
+        "cycles": cycles,
+        "changes_emitted": emitted,
+        "full_report_kb_per_cycle": round(full_bytes / cycles / 1024, 1),
+        "changes_kb_per_cycle": round(changes_bytes / cycles / 1024, 2),
+        "volume_reduction": f"{full_bytes / max(changes_bytes, 1):.0f}x",
+        "full_report_ms": round(full_seconds / cycles * 1000, 2),
+        "snapshot_diff_ms": round(diff_seconds / cycles * 1000, 2),
+        "rows_shared_pct": round(100 * shared / max((cycles - 1) * (entities + 1), 1), 1)
+    }
+
+################################################################################
+# BENCHMARK: CHECK CYCLES AT SCALE
+# PSEUDO CODE:
+#   START fake MQTT broker (shared)
+#   FOR EACH (entity count, device count):
+#     START fake HA: devices + critical entities + filler entities,
+#       `api_latency` per request, `error_rate` of requests fail with 503
+#     BUILD monitor (sync or async engine), run one warm-up cycle
+#     TIME `runs` cycles: wall clock, process CPU, main-thread CPU, HTTP calls
+#     RUN one more cycle under tracemalloc for peak memory
+#   WRITE JSON (settings + one row per scale), COMPARE with a baseline file
+#
+# CPU and memory include the in-process fake servers; compare runs made
+# with the same settings rather than reading them as absolute costs.
+################################################################################
+
+CYCLE_METRICS = ["median_cycle_ms", "cpu_process_ms", "peak_alloc_kb", "http_calls"]
+
+
+def _cycle_server(entities: int, devices: List[str], api_latency: float, error_rate: float,
+                  device_latency: float) -> FakeFleetServer:
+    """Fake HA with `entities` states in total: fleet, critical entities, filler sensors"""
+    now = datetime.now().isoformat()
+    server = FakeFleetServer(devices, latency=device_latency, api_latency=api_latency, error_rate=error_rate)
+    for entity_id in monitor.CRITICAL_SENSORS + monitor.CRITICAL_SWITCHES + monitor.CRITICAL_AUTOMATIONS:
+        state = "20.5" if entity_id.startswith("sensor.") else "on"
+        server.states[entity_id] = {"entity_id": entity_id, "state": state, "last_updated": now,
+                                    "last_changed": now, "attributes": {"last_triggered": now}}
+    for index in range(max(entities - len(server.states), 0)):
+        entity_id = f"sensor.bench_filler_{index:05d}"
+        server.states[entity_id] = {"entity_id": entity_id, "state": str(index % 100), "last_updated": now,
+                                    "last_changed": now, "attributes": {"unit_of_measurement": "%"}}
+    return server
+
+
+def bench_cycles(entity_counts: List[int], device_counts: List[int], runs: int, engine: str = "sync",
+                 api_latency: float = 0.002, error_rate: float = 0.0,
+                 probe_devices: bool = False, device_latency: float = 0.02) -> Dict:
+    """run_checks() cost across entity and device counts"""
+    broker = FakeMqttBroker()
+    monitor_class = monitor.AsyncSystemMonitor if engine == "async" else monitor.SystemMonitor
+    rows = []
+
+    for entities in entity_counts:
+        for device_count in device_counts:
+            devices = [f"esp32-bench-node-{index:03d}" for index in range(device_count)]
+            server = _cycle_server(entities, devices, api_latency, error_rate, device_latency)
+            check = monitor_class(server.url, "bench-token", "127.0.0.1", broker.port, esp32_devices=devices)
+            check.probe_devices = probe_devices
+            check.device_url_template = server.url + "/device/{device}/"
+
+            wall, cpu, thread_cpu, calls, errors, retries = [], [], [], [], [], []
+            with contextlib.redirect_stdout(io.StringIO()):
+                started = time.perf_counter()
+                check.run_checks()
+                first_cycle = time.perf_counter() - started
+                for _ in range(runs):
+                    started, cpu_started, thread_started = time.perf_counter(), time.process_time(), time.thread_time()
+                    results = check.run_checks()
+                    wall.append(time.perf_counter() - started)
+                    cpu.append(time.process_time() - cpu_started)
+                    thread_cpu.append(time.thread_time() - thread_started)
+                    calls.append(results["http_calls"])
+                    errors.append(results["http_errors"])
+                    retries.append(results["http_retries"])
+
+                tracemalloc.start()
+                check.run_checks()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                check.update_overall_status()
+                statuses = {key: data.get("status") for key, data in check.results["checks"].items()}
+            check.close()
+            server.close()
+
+            rows.append({
+                "engine": engine,
+                "entities": len(server.states),
+                "devices": device_count,
+                "first_cycle_ms": round(first_cycle * 1000, 2),
+                "median_cycle_ms": round(statistics.median(wall) * 1000, 2),
+                "max_cycle_ms": round(max(wall) * 1000, 2),
+                "cpu_process_ms": round(statistics.median(cpu) * 1000, 2),
+                "cpu_main_thread_ms": round(statistics.median(thread_cpu) * 1000, 2),
+                "peak_alloc_kb": round(peak / 1024, 1),
+                "http_calls": statistics.median(calls),
+                "http_errors": sum(errors),
+                "http_retries": sum(retries),
+                "injected_errors": server.api_errors,
+                "overall_status": check.results["overall_status"],
+                "checks": statuses
+            })
+
+    broker.close()
+    return {
+        "benchmark": "cycles",
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"runs": runs, "engine": engine, "api_latency": api_latency, "error_rate": error_rate,
+                     "probe_devices": probe_devices, "device_latency": device_latency},
+        "results": rows
+    }
+
+
+def compare_cycles(baseline: Dict, current: Dict, threshold: float) -> List[Dict]:
+    """
+    Per-scale change vs. a baseline file
+
+    Pseudo Code:
+    MATCH rows by (engine, entities, devices)
+    FOR EACH metric: percent change, REGRESSION if worse by more than threshold %
+    """
+    previous = {(row["engine"], row["entities"], row["devices"]): row for row in baseline.get("results", [])}
+    comparison = []
+    for row in current["results"]:
+        old = previous.get((row["engine"], row["entities"], row["devices"]))
+        if old is None:
+            continue
+        deltas = {metric: round(100 * (row[metric] - old[metric]) / old[metric], 1) if old[metric] else 0.0
+                  for metric in CYCLE_METRICS}
+        comparison.append({
+            "entities": row["entities"],
+            "devices": row["devices"],
+            "change_pct": deltas,
+            "regressions": [metric for metric, delta in deltas.items() if delta > threshold]
+        })
+    return comparison
+
+################################################################################
+# BENCHMARK: WATER ACCOUNTING
+# PSEUDO CODE:
+#   SIMULATE N days, two zones watered on a schedule, "true" flow curve
+#     (ramp up, wobble, ramp down after the valve closes)
+#   SAMPLE it every 5 s with timing jitter, randomly dropped samples and
+#     one outage per zone per day in the middle of a watering run
+#   FEED valve, flow and pulse total messages to WaterAccountant + WaterStore
+#   COMPARE liters with the integrated true flow (and with counting each
+#     received reading as 5 s of flow), time per message, memory per day
+################################################################################
+
+WATER_SCHEDULE = [  # zone, start (hours after midnight), minutes, base flow L/min
+    ("zone_a", 6.0, 20, 8.0),
+    ("zone_b", 6.5, 15, 6.0),
+    ("zone_a", 19.0, 10, 8.0),
+]
+
+
+def _true_flow(runs: List[tuple], t: float) -> float:
+    """True flow at t for one zone's (open, close, base) runs"""
+    for opened, closed, base in runs:
+        if opened <= t < closed + 5:
+            running = min(t, closed) - opened
+            flow = min(1.0, running / 10) * (base + 0.8 * math.sin(2 * math.pi * running / 60))
+            return flow if t < closed else flow * (1 - (t - closed) / 5)
+    return 0.0
+
+
+def _true_liters(runs: List[tuple], start: float, end: float, step: float = 0.05) -> float:
+    """Midpoint-rule integral of the true flow, only where a run overlaps"""
+    liters = 0.0
+    for opened, closed, _ in runs:
+        low, high = max(start, opened), min(end, closed + 5)
+        t = low
+        while t < high:
+            width = min(step, high - t)
+            liters += _true_flow(runs, t + width / 2) * width / 60
+            t += width
+    return liters
+
+
+def bench_water(days: int, drop_rate: float, outage_seconds: float, jitter: float, seed: int) -> Dict:
+    """Water accounting accuracy, per-message cost and memory over many days"""
+    rng = random.Random(seed)
+    zones = {name: {"valve": f"switch.{name}_valve", "flow": f"sensor.{name}_flow_rate"} for name in ("zone_a", "zone_b")}
+    totals = {name: f"sensor.{name}_total_water_used" for name in zones}
+    first_day = datetime(2026, 6, 1).timestamp()
+    tmpdir = tempfile.mkdtemp(prefix="water_bench_")
+    store = monitor.WaterStore(os.path.join(tmpdir, "water.db"))
+    accountant = monitor.WaterAccountant(store, zones=zones, total_sensors=totals)
+
+    pulse_totals = dict.fromkeys(zones, 0.0)
+    true_total = naive_total = 0.0
+    messages = timed_messages = dropped = 0
+    feed_seconds = 0.0
+    retained = []
+    for day in range(days):
+        day_start = first_day + day * 86400
+        runs = {name: [] for name in zones}
+        events = []
+        for zone, hour, minutes, base in WATER_SCHEDULE:
+            opened = day_start + hour * 3600
+            closed = opened + minutes * 60
+            runs[zone].append((opened, closed, base))
+            events.append((opened, zones[zone]["valve"], "on"))
+            events.append((closed, zones[zone]["valve"], "off"))
+
+        for zone, zone_runs in runs.items():
+            outage_start = zone_runs[0][0] + 300
+            valve_windows = [(opened, closed) for opened, closed, _ in zone_runs]
+            previous = day_start
+            for index in range(86400 // monitor.WATER_SAMPLE_SECONDS):
+                t = day_start + index * monitor.WATER_SAMPLE_SECONDS + rng.uniform(-jitter, jitter)
+                true_liters = _true_liters(zone_runs, previous, t)
+                true_total += true_liters
+                pulse_totals[zone] += true_liters
+                previous = t
+                if rng.random() < drop_rate or outage_start <= t < outage_start + outage_seconds:
+                    dropped += 1
+                    continue
+                flow = round(_true_flow(zone_runs, t), 2)
+                if any(opened <= t < closed for opened, closed in valve_windows):
+                    naive_total += flow * monitor.WATER_SAMPLE_SECONDS / 60
+                events.append((t, zones[zone]["flow"], f"{flow:.2f}"))
+                events.append((t + 0.001, totals[zone], f"{pulse_totals[zone]:.1f}"))
+            true_liters = _true_liters(zone_runs, previous, day_start + 86400)
+            true_total += true_liters
+            pulse_totals[zone] += true_liters
+        events.sort()
+
+        if day == days // 2:
+            tracemalloc.start()   # Second half traced: memory must stay flat once warmed up
+        next_tick = events[0][0]
+        started = time.perf_counter()
+        for t, entity_id, value in events:
+            if t >= next_tick:
+                accountant.on_tick(t)
+                next_tick = t + 1
+            accountant.on_state(entity_id, value, t)
+        elapsed = time.perf_counter() - started
+        if not tracemalloc.is_tracing():
+            feed_seconds += elapsed
+            timed_messages += len(events)
+        messages += len(events)
+        del events
+        if tracemalloc.is_tracing():   # Only monitor.py allocations (bench tuples sit in free lists)
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(True, monitor.__file__)])
+            retained.append(sum(stat.size for stat in snapshot.statistics("filename")))
+    tracemalloc.stop()
+
+    accountant.on_tick(first_day + days * 86400)
+    accountant.flush()
+    rows = store.daily("0000-01-01")
+    stored_liters = sum(row["liters"] for row in rows)
+    report = accountant.report()
+    store.close()
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+    intervals = list(accountant.intervals)
+    pulse_gap = [abs(entry["liters"] - entry["pulse_liters"]) / entry["pulse_liters"]
+                 for entry in intervals if entry["pulse_liters"]]
+    return {
+        "days": days,
+        "messages": messages,
+        "flow_samples_dropped": dropped,
+        "missed_samples_detected": sum(row["missed_samples"] for row in rows),
+        "true_liters": round(true_total, 1),
+        "accounted_liters": round(stored_liters, 1),
+        "error_pct": round(100 * (stored_liters - true_total) / true_total, 3),
+        "per_reading_liters": round(naive_total, 1),
+        "per_reading_error_pct": round(100 * (naive_total - true_total) / true_total, 3),
+        "untracked_liters": round(sum(row["untracked_liters"] for row in rows), 2),
+        "intervals": int(sum(row["intervals"] for row in rows)),
+        "expected_intervals": days * len(WATER_SCHEDULE),
+        "daily_rows": len(rows),
+        "season_liters": {name: zone["season_liters"] for name, zone in report["zones"].items()},
+        "pulse_vs_flow_max_pct": round(100 * max(pulse_gap), 2) if pulse_gap else None,
+        "per_message_us": round(feed_seconds / timed_messages * 1e6, 2) if timed_messages else None,
+        "retained_kb_by_day": [round(size / 1024, 1) for size in retained]
+    }
+
+################################################################################
+# BENCHMARK: HEALTH RULES
+# PSEUDO CODE:
+#   BUILD N sensor states + one exact rule per sensor + a few wildcard rules
+#   EACH CYCLE: fresh state objects (like /api/states), `changed` of them updated
+#   TIME three ways of evaluating the same rules:
+#     interpreted: loop over rule dicts, match ids, parse limits every cycle
+#     compiled:    RuleEngine, every entity re-evaluated
+#     incremental: RuleEngine.update(), changed entities + expired deadlines only
+################################################################################
+
+def _interpret_rules(rules: List[Dict], states: Dict[str, Dict], now: float) -> int:
+    """Evaluate rule dicts directly (no compile, no index): the per-cycle loop being replaced"""
+    failures = 0
+    for rule in rules:
+        patterns = rule["entity_id"] if isinstance(rule["entity_id"], list) else [rule["entity_id"]]
+        for pattern in patterns:
+            matched = [name for name in states if fnmatch.fnmatchcase(name, pattern)] \
+                if any(char in pattern for char in "*?[") else [pattern] if pattern in states else []
+            for entity_id in matched:
+                state = states[entity_id]
+                value = state.get("state")
+                if "min" in rule or "max" in rule:
+                    try:
+                        number = float(value)
+                        failures += not float(rule.get("min", "-inf")) <= number <= float(rule.get("max", "inf"))
+                    except (TypeError, ValueError):
+                        failures += 1
+                if "max_age" in rule:
+                    updated = monitor._state_timestamp(state.get("last_updated"))
+                    failures += updated is None or now - updated > monitor._rule_seconds(rule["max_age"], "max_age")
+    return failures
+
+
+def bench_rules(entities: int, changed: int, cycles: int, wildcards: int) -> Dict:
+    """Rule evaluation cost per cycle: interpreted vs. compiled vs. incremental"""
+    now = time.time()
+    stamp = datetime.fromtimestamp(now).isoformat()
+    names = [f"sensor.bench_{index:05d}" for index in range(entities)]
+    rules = [{"entity_id": name, "min": 0, "max": 100, "max_age": "15m"} for name in names]
+    rules += [{"entity_id": f"sensor.bench_{digit}*", "max_age": "1h"} for digit in range(wildcards)]
+    states = {name: {"entity_id": name, "state": "50", "last_updated": stamp} for name in names}
+
+    started = time.perf_counter()
+    engine = monitor.RuleEngine(rules)
+    compile_ms = (time.perf_counter() - started) * 1000
+    engine.update(states, now)
+
+    timings = {"interpreted": [], "compiled": [], "incremental": []}
+    evaluated = []
+    for cycle in range(cycles):
+        states = {name: dict(state) for name, state in states.items()}   # New objects, as from REST
+        at = now + cycle + 1
+        for index in range(changed):
+            name = names[(cycle * changed + index) % entities]
+            states[name] = {"entity_id": name, "state": str(40 + cycle % 20),
+                            "last_updated": datetime.fromtimestamp(at).isoformat()}
+
+        started = time.perf_counter()
+        _interpret_rules(rules, states, at)
+        timings["interpreted"].append(time.perf_counter() - started)
+
+        full = monitor.RuleEngine.__new__(monitor.RuleEngine)
+        full.__dict__.update(engine.__dict__, entries={}, _deadlines=[])
+        started = time.perf_counter()
+        full.update(states, at)
+        timings["compiled"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        evaluated.append(engine.update(states, at))
+        timings["incremental"].append(time.perf_counter() - started)
+
+    medians = {mode: statistics.median(values) * 1000 for mode, values in timings.items()}
+    return {
+        "entities": entities,
+        "rules": len(rules),
+        "changed_per_cycle": changed,
+        "cycles": cycles,
+        "compile_ms": round(compile_ms, 1),
+        "interpreted_ms": round(medians["interpreted"], 2),
+        "compiled_full_ms": round(medians["compiled"], 2),
+        "incremental_ms": round(medians["incremental"], 3),
+        "speedup_vs_interpreted": f"{medians['interpreted'] / medians['incremental']:.0f}x",
+        "evaluated_per_cycle": round(statistics.mean(evaluated), 1),
+        "status": engine.report()["status"]
+    }
+
+################################################################################
+# BENCHMARK: AUTOMATION AUDIT
+# PSEUDO CODE:
+#   SIMULATE a logbook for days: morning watering at 06:00, valves chattering,
+#     leak shutoff runs; inject one missed, one late, one skipped (weather)
+#     watering and one shutoff that leaves the pump running
+#   EVERY interval: new AutomationAuditor from the state file (like cron),
+#     audit against a fake logbook endpoint (entries since `start` only)
+#   COMPARE entries read incrementally with re-reading the lookback window
+#   CHECK every injected fault is reported, and nothing else
+################################################################################
+
+def bench_audit(days: int, interval: int, chatter: int, seed: int) -> Dict:
+    """Incremental logbook audit: entries read, time per audit, injected faults found"""
+    rng = random.Random(seed)
+    path = os.path.join(os.path.dirname(os.path.abspath(monitor.__file__)), "..", "home-assistant", "automations.yaml")
+    schedule = monitor.load_automation_schedule(path)
+    morning, leak = "automation.morning_watering_schedule", "automation.leak_detection_emergency_shutoff"
+    first_day = datetime(2026, 6, 1).timestamp()
+
+    log = []
+    def state(at, entity_id, value):
+        log.append((at, {"when": datetime.fromtimestamp(at, timezone.utc).isoformat(), "entity_id": entity_id,
+                         "state": value}))
+    def run(at, automation):
+        log.append((at, {"when": datetime.fromtimestamp(at, timezone.utc).isoformat(), "entity_id": automation,
+                         "message": "triggered by time"}))
+
+    injected = set()
+    for day in range(-1, days):
+        day_start = first_day + day * 86400
+        if day == 1:
+            injected.add((morning, "MISSED", day_start + 6 * 3600))
+        elif day == 3:
+            run(day_start + 6 * 3600 + 900, morning)
+            injected.add((morning, "LATE", day_start + 6 * 3600))
+        elif day == 4:
+            state(day_start + 5 * 3600, "sensor.should_water_today", "false")
+            state(day_start + 8 * 3600, "sensor.should_water_today", "true")
+            injected.add((morning, "SKIPPED", day_start + 6 * 3600))
+        else:
+            run(day_start + 6 * 3600 + rng.uniform(0, 20), morning)
+        for at in range(int(day_start), int(day_start + 86400), chatter):
+            for valve in ("switch.zone_a_valve", "switch.zone_b_valve"):
+                state(at + rng.uniform(0, 5), valve, "on")
+                state(at + chatter / 2 + rng.uniform(0, 5), valve, "off")
+        if day in (2, 5):
+            shutoff = day_start + 14 * 3600 + 100
+            state(shutoff - 60, "switch.water_pump", "on")
+            run(shutoff, leak)
+            for valve in ("switch.main_water_valve", "switch.zone_a_valve", "switch.zone_b_valve"):
+                state(shutoff + 1, valve, "off")
+            state(shutoff + 1, "input_boolean.master_watering_enable", "off")
+            if day == 2:
+                state(shutoff + 2, "switch.water_pump", "off")
+            else:
+                injected.add((leak, "FAILED", shutoff))
+            state(shutoff + 3600, "input_boolean.master_watering_enable", "on")
+            state(shutoff + 3660, "switch.water_pump", "off")
+            state(shutoff + 3660, "switch.main_water_valve", "on")
+    log.sort(key=lambda item: item[0])
+    times = [at for at, _ in log]
+
+    def fetch(entities, start, end):
+        wanted = set(entities)
+        return [entry for _, entry in log[bisect.bisect_left(times, start):bisect.bisect_right(times, end)]
+                if entry["entity_id"] in wanted]
+
+    current = {entity_id: {"state": "off"} for entity_id in ("switch.zone_a_valve", "switch.zone_b_valve",
+                                                             "switch.water_pump")}
+    current.update({
+        "switch.main_water_valve": {"state": "on"},
+        "input_datetime.morning_watering_time": {"state": "06:00:00"},
+        "input_boolean.master_watering_enable": {"state": "on"},
+        "input_boolean.leak_detection_enable": {"state": "on"},
+        "binary_sensor.watering_season": {"state": "on"},
+        "sensor.should_water_today": {"state": "true"},
+        **{name: {"state": "on"} for name in monitor.CRITICAL_AUTOMATIONS}
+    })
+
+    tmpdir = tempfile.mkdtemp(prefix="audit_bench_")
+    state_path = os.path.join(tmpdir, monitor.AUDIT_STATE_FILE)
+    found = set()
+    read = full = audits = 0
+    applied = bisect.bisect_right(times, first_day)
+    audit_seconds = []
+    for now in range(int(first_day), int(first_day + days * 86400) + 1, interval):
+        for _, entry in log[applied:bisect.bisect_right(times, now)]:
+            if "state" in entry:
+                current[entry["entity_id"]] = {"state": entry["state"]}
+        applied = bisect.bisect_right(times, now)
+
+        started = time.perf_counter()
+        auditor = monitor.AutomationAuditor(schedule, monitor.CRITICAL_AUTOMATIONS, state_path)
+        read += auditor.audit(fetch, now, current)
+        audit_seconds.append(time.perf_counter() - started)
+        full += len(fetch(auditor.watched, now - monitor.AUDIT_LOOKBACK_HOURS * 3600, now))
+        audits += 1
+        found.update((outcome["automation"], outcome["status"], outcome["at"]) for outcome in auditor.outcomes)
+    report = auditor.report(now)
+    state_bytes = os.path.getsize(state_path)
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return {
+        "days": days,
+        "audits": audits,
+        "logbook_entries": len(log),
+        "entries_read": read,
+        "entries_read_full_window": full,
+        "read_reduction": f"{full / max(read, 1):.0f}x",
+        "median_audit_ms": round(statistics.median(audit_seconds) * 1000, 2),
+        "state_file_kb": round(state_bytes / 1024, 1),
+        "injected": len(injected),
+        "detected": len(injected & found),
+        "missed_faults": sorted(f"{name} {status}" for name, status, _ in injected - found),
+        "false_alarms": sorted(f"{name} {status}" for name, status, _ in found - injected),
+        "final_status": report["status"]
+    }
+
+################################################################################
+# BENCHMARK: SUPERVISED CHECKS UNDER PARTIAL FAILURE
+# PSEUDO CODE:
+#   START fake HA (critical entities + nodes) and fake MQTT broker
+#   FOR EACH scenario: healthy | node-stall (one node's web server trickles
+#     its answer for `hang` seconds, which no per-read HTTP timeout catches) |
+#     ha-stall (HA accepts /api/states but answers only after `hang` seconds)
+#     FOR EACH engine: sync, async, thread, process (IsolatedSystemMonitor)
+#       RUN `cycles` cycles, RECORD cycle time, timed-out checks, restarts
+#   A cycle is "bounded" if it ended within the cycle budget (+1s to reap)
+################################################################################
+
+SUPERVISOR_SCENARIOS = ["healthy", "node-stall", "ha-stall"]
+
+
+def bench_supervisor(engines: List[str], cycles: int, hang: float, check_timeout: float,
+                     cycle_budget: float, device_count: int) -> List[Dict]:
+    """Cycle time and reported status per engine when one upstream call hangs"""
+    broker = FakeMqttBroker()
+    devices = [f"esp32-bench-node-{index:03d}" for index in range(device_count)]
+    rows = []
+
+    # Abandoned threads (async, thread engines) keep printing after their cycle: keep it all quiet
+    with contextlib.redirect_stdout(io.StringIO()):
+        for scenario in SUPERVISOR_SCENARIOS:
+            for engine in engines:
+                rows.append(_supervised_scenario(scenario, engine, broker.port, devices, cycles, hang,
+                                                 check_timeout, cycle_budget))
+
+    broker.close()
+    return rows
+
+
+def _supervised_scenario(scenario: str, engine: str, broker_port: int, devices: List[str], cycles: int,
+                         hang: float, check_timeout: float, cycle_budget: float) -> Dict:
+    """One engine through `cycles` cycles of one failure scenario"""
+    server = _cycle_server(0, devices, 0.0, 0.0, 0.01)
+    port = server.server.server_address[1]
+    if scenario == "ha-stall":
+        server.stalls["/api/states"] = hang
+    elif scenario == "node-stall":
+        server.trickles[f"/device/{devices[-1]}/"] = hang
+
+    options = {}
+    if engine == "async":
+        monitor_class = monitor.AsyncSystemMonitor
+        options = {"check_timeout": check_timeout}
+    elif engine in ("thread", "process"):
+        monitor_class = monitor.IsolatedSystemMonitor
+        options = {"isolation": engine, "check_timeout": check_timeout, "cycle_budget": cycle_budget}
+    else:
+        monitor_class = monitor.SystemMonitor
+    check = monitor_class(f"http://127.0.0.1:{port}", "bench-token", "127.0.0.1", broker_port,
+                          esp32_devices=devices, **options)
+    check.probe_devices = True
+    check.device_url_template = f"http://127.0.0.1:{port}/device/{{device}}/"
+
+    wall, timed_out = [], set()
+    for _ in range(cycles):
+        started = time.perf_counter()
+        results = check.run_checks()
+        wall.append(time.perf_counter() - started)
+        timed_out.update(key for key, data in results["checks"].items() if data.get("status") == "TIMEOUT")
+    check.update_overall_status()
+    workers = results.get("supervisor", {}).get("workers", {})
+    check.close()
+    server.close()
+
+    return {
+        "scenario": scenario,
+        "engine": engine,
+        "cycles_s": [round(seconds, 2) for seconds in wall],
+        "max_cycle_s": round(max(wall), 2),
+        "bounded": max(wall) <= cycle_budget + 1,
+        "timed_out": sorted(timed_out),
+        "restarts": sum(worker["restarts"] for worker in workers.values()),
+        "overall_status": check.results["overall_status"]
+    }
+
+################################################################################
+# MAIN EXECUTION
+################################################################################
+
+def main():
+    """
+    Pseudo Code:
+    PARSE benchmark name and options
+    RUN benchmark
+    PRINT table or JSON
+    """
+    parser = argparse.ArgumentParser(description="Garden Automation Monitor Benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    devices_parser = subparsers.add_parser("devices", help="Parallel ESP32 device probes")
+    devices_parser.add_argument("--sizes", type=int, nargs="+", default=[3, 30, 100, 300],
+                                help="Fleet sizes to test (default: 3 30 100 300)")
+    devices_parser.add_argument("--latency", type=float, default=0.05,
+                                help="Per-device response latency in seconds (default: 0.05)")
+    devices_parser.add_argument("--runs", type=int, default=3, help="Runs per size (default: 3)")
+    devices_parser.add_argument("--json", action="store_true", help="Output JSON format")
+
+    websocket_parser = subparsers.add_parser("websocket", help="WebSocket state cache, reconnect and resync")
+    websocket_parser.add_argument("--events", type=int, default=200,
+                                  help="state_changed events to push (default: 200)")
+    websocket_parser.add_argument("--json", action="store_true", help="Output JSON format")
+
+    alerts_parser = subparsers.add_parser("alerts", help="Alert dedup, coalescing and rate limiting")
+    alerts_parser.add_argument("--latency", type=float, default=1.0,
+                               help="Fake notify service latency in seconds (default: 1.0)")
+    alerts_parser.add_argument("--rate-limit", type=int, default=3,
+                               help="Alerts per channel per hour (default: 3)")
+    alerts_parser.add_argument("--json", action="store_true", help="Output JSON format")
+
+    sites_parser = subparsers.add_parser("sites", help="Multi-site fleet cycles from one process")
+    sites_parser.add_argument("--sites", type=int, default=50, help="Number of fake sites (default: 50)")
+    sites_parser.add_argument("--latency", type=float, default=0.05,
+                              help="Per-request HA latency in seconds (default: 0.05)")
+    sites_parser.add_argument("--runs", type=int, default=3, help="Fleet cycles to time (default: 3)")
+    sites_parser.add_argument("--json", action="store_true", help="Output JSON format")
+
+    startup_parser = subparsers.add_parser("startup", help="Single-shot process start-up time")
+    startup_parser.add_argument("--runs", type=int, default=10, help="Processes per scenario (default: 10)")
+    startup_parser.add_argument("--json", action="store_true", help="Output JSON format")
+
+    changes_parser = subparsers.add_parser("changes", help="Snapshot diffs vs. full reports")
+    changes_parser.add_argument("--entities", type=int, default=2000, help="Sensors per cycle (default: 2000)")
+    changes_parser.add_argument("--changed", type=int, default=10,
+                                help="Sensors changing each cycle (default: 10)")
+    changes_parser.add_argument("--cycles", type=int, default=50, help="Cycles to run (default: 50)")
+    changes_parser.add_argument("--json", action="store_true", help="Output JSON format")
+
+    cycles_parser = subparsers.add_parser("cycles", help="Full check cycles across entity/device scales")
+    cycles_parser.add_argument("--entities", type=int, nargs="+", default=[10, 100, 1000, 10000],
+                               help="HA entity counts (default: 10 100 1000 10000)")
+    cycles_parser.add_argument("--devices", type=int, nargs="+", default=[3, 30, 100, 500],
+                               help="ESP32 node counts (default: 3 30 100 500)")
+    cycles_parser.add_argument("--runs", type=int, default=5, help="Timed cycles per scale (default: 5)")
+    cycles_parser.add_argument("--engine", choices=["sync", "async"], default="sync", help="Check engine")
+    cycles_parser.add_argument("--api-latency", type=float, default=0.002,
+                               help="Fake HA latency per request in seconds (default: 0.002)")
+    cycles_parser.add_argument("--error-rate", type=float, default=0.0,
+                               help="Fraction of HA requests answered with 503 (default: 0)")
+    cycles_parser.add_argument("--probe-devices", action="store_true", help="Also probe each node's web server")
+    cycles_parser.add_argument("--device-latency", type=float, default=0.02,
+                               help="Node web server latency with --probe-devices (default: 0.02)")
+    cycles_parser.add_argument("--output", metavar="FILE", help="Write results as JSON to FILE")
+    cycles_parser.add_argument("--compare", metavar="FILE", help="Compare with a previous --output file")
+    cycles_parser.add_argument("--threshold", type=float, default=10.0,
+                               help="Percent slowdown counted as a regression (default: 10)")
+    cycles_parser.add_argument("--json", action="store_true", help="Output JSON format")
+
+    rules_parser = subparsers.add_parser("rules", help="Compiled, indexed rule evaluation vs. interpreted loops")
+    rules_parser.add_argument("--entities", type=int, default=10000, help="Ruled sensors (default: 10000)")
+    rules_parser.add_argument("--changed", type=int, default=10, help="Sensors changing each cycle (default: 10)")
+    rules_parser.add_argument("--cycles", type=int, default=20, help="Cycles to run (default: 20)")
+    rules_parser.add_argument("--wildcards", type=int, default=3,
+                              help="Wildcard rules matching many sensors (default: 3)")
+    rules_parser.add_argument("--json", action="store_true", help="Output JSON format")
+
+    audit_parser = subparsers.add_parser("audit", help="Incremental automation audit over a simulated logbook")
+    audit_parser.add_argument("--days", type=int, default=7, help="Days to simulate (default: 7)")
+    audit_parser.add_argument("--interval", type=int, default=300, help="Seconds between audits (default: 300)")
+    audit_parser.add_argument("--chatter", type=int, default=600,
+                              help="Seconds between valve on/off pairs in the logbook (default: 600)")
+    audit_parser.add_argument("--seed", type=int, default=1, help="Random seed (default: 1)")
+    audit_parser.add_argument("--json", action="store_true", help="Output JSON format")
+
+    supervisor_parser = subparsers.add_parser("supervisor", help="Hung upstream calls vs. supervised check workers")
+    supervisor_parser.add_argument("--engines", nargs="+", choices=["sync", "async", "thread", "process"],
+                                   default=["sync", "async", "thread", "process"],
+                                   help="Engines to compare (default: all)")
+    supervisor_parser.add_argument("--cycles", type=int, default=2, help="Cycles per engine and scenario (default: 2)")
+    supervisor_parser.add_argument("--hang", type=float, default=20,
+                                   help="Seconds a stalled lookup or request hangs (default: 20)")
+    supervisor_parser.add_argument("--check-timeout", type=float, default=3, help="Per-check budget (default: 3)")
+    supervisor_parser.add_argument("--cycle-budget", type=float, default=8, help="Whole-cycle budget (default: 8)")
+    supervisor_parser.add_argument("--devices", type=int, default=10, help="ESP32 nodes probed (default: 10)")
+    supervisor_parser.add_argument("--json", action="store_true", help="Output JSON format")
+
+    water_parser = subparsers.add_parser("water", help="Water accounting accuracy and cost over many days")
+    water_parser.add_argument("--days", type=int, default=14, help="Days to simulate (default: 14)")
+    water_parser.add_argument("--drop-rate", type=float, default=0.05,
+                              help="Fraction of flow samples lost (default: 0.05)")
+    water_parser.add_argument("--outage", type=float, default=90,
+                              help="Seconds of missing samples per zone per day, mid-run (default: 90)")
+    water_parser.add_argument("--jitter", type=float, default=0.3,
+                              help="Sample timing jitter in seconds (default: 0.3)")
+    water_parser.add_argument("--seed", type=int, default=1, help="Random seed (default: 1)")
+    water_parser.add_argument("--json", action="store_true", help="Output JSON format")
+
+    args = parser.parse_args()
+
+    if args.benchmark == "devices":
+        results = bench_devices(args.sizes, args.latency, args.runs)
+        if args.json:
+            print(json.dumps(results, indent=2))
+        else:
+            print(f"{'DEVICES':>8} {'MEDIAN (s)':>11} {'MAX (s)':>9} {'SERIAL EST (s)':>15}  ALL OK")
+            for row in results:
+                print(f"{row['devices']:>8} {row['median_seconds']:>11} {row['max_seconds']:>9} "
+                      f"{row['serial_estimate_seconds']:>15}  {row['all_ok']}")
+    elif args.benchmark == "cycles":
+        report = bench_cycles(args.entities, args.devices, args.runs, args.engine, args.api_latency,
+                              args.error_rate, args.probe_devices, args.device_latency)
+        if args.compare:
+            with open(args.compare) as f:
+                report["comparison"] = compare_cycles(json.load(f), report, args.threshold)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print(f"{'ENTITIES':>8} {'DEVICES':>7} {'FIRST (ms)':>10} {'MEDIAN (ms)':>11} {'CPU (ms)':>9} "
+                  f"{'MAIN CPU':>9} {'PEAK (KB)':>10} {'HTTP':>5} {'RETRY':>5} {'ERR':>4}  STATUS")
+            for row in report["results"]:
+                print(f"{row['entities']:>8} {row['devices']:>7} {row['first_cycle_ms']:>10} "
+                      f"{row['median_cycle_ms']:>11} {row['cpu_process_ms']:>9} {row['cpu_main_thread_ms']:>9} "
+                      f"{row['peak_alloc_kb']:>10} {row['http_calls']:>5} {row['http_retries']:>5} {row['http_errors']:>4}  "
+                      f"{row['overall_status']}")
+            for row in report.get("comparison", []):
+                changes = "  ".join(f"{metric} {delta:+.1f}%" for metric, delta in row["change_pct"].items())
+                flag = f"  REGRESSION: {', '.join(row['regressions'])}" if row["regressions"] else ""
+                print(f"vs baseline {row['entities']:>6} entities {row['devices']:>4} devices: {changes}{flag}")
+        if any(row["regressions"] for row in report.get("comparison", [])):
+            sys.exit(1)
+    elif args.benchmark == "supervisor":
+        results = bench_supervisor(args.engines, args.cycles, args.hang, args.check_timeout,
+                                   args.cycle_budget, args.devices)
+        if args.json:
+            print(json.dumps(results, indent=2))
+        else:
+            print(f"{'SCENARIO':<10} {'ENGINE':<8} {'CYCLES (s)':<16} {'MAX (s)':>8} {'BOUNDED':>8} "
+                  f"{'RESTARTS':>8}  {'STATUS':<9} TIMED OUT")
+            for row in results:
+                cycles = " ".join(str(seconds) for seconds in row["cycles_s"])
+                print(f"{row['scenario']:<10} {row['engine']:<8} {cycles:<16} {row['max_cycle_s']:>8} "
+                      f"{str(row['bounded']):>8} {row['restarts']:>8}  {row['overall_status']:<9} "
+                      f"{', '.join(row['timed_out']) or '-'}")
+    elif args.benchmark == "startup":
+        results = bench_startup(args.runs)
+        if args.json:
+            print(json.dumps(results, indent=2))
+        else:
+            print(f"{'SCENARIO':<12} {'VARIANT':<32} {'MEDIAN (ms)':>12} {'SPEEDUP':>8}")
+            for row in results:
+                print(f"{row['scenario']:<12} {row['variant']:<32} {row['median_ms']:>12} {row['speedup']:>7}x")
+    elif args.benchmark in ("websocket", "alerts", "sites", "changes", "water", "rules", "audit"):
+        if args.benchmark == "websocket":
+            result = bench_websocket(args.events)
+        elif args.benchmark == "alerts":
+            result = bench_alerts(args.latency, args.rate_limit)
+        elif args.benchmark == "changes":
+            result = bench_changes(args.entities, args.changed, args.cycles)
+        elif args.benchmark == "rules":
+            result = bench_rules(args.entities, args.changed, args.cycles, args.wildcards)
+        elif args.benchmark == "audit":
+            result = bench_audit(args.days, args.interval, args.chatter, args.seed)
+        elif args.benchmark == "water":
+            result = bench_water(args.days, args.drop_rate, args.outage, args.jitter, args.seed)
+        else:
+            result = bench_sites(args.sites, args.latency, args.runs)
+        if args.json:
+            print(json.dumps(result, indent=2))
+        else:
+            for key, value in result.items():
+                print(f"{key:<24} {value}")
+
+if __name__ == "__main__":
+    main()
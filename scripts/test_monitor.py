@@ -0,0 +1,1411 @@
+#!/usr/bin/env python3
+################################################################################
+# GARDEN AUTOMATION MONITOR TESTS
+# Behaviour checks for monitor.py against the local stand-ins in fakes.py
+# By Brian Kuzdas - 03/02/2024 - Copyright (c) 2024 Brian Kuzdas
+################################################################################
+#
+# PSEUDO CODE OVERVIEW:
+# 1. Start a fake Home Assistant / broker / endpoint on localhost per test
+# 2. Point a monitor component at it
+# 3. Assert on what the component reports and what the fake received
+#
+# COMMON LANGUAGE EXPLANATION:
+# The benchmarks show how fast things are; these tests check the monitor
+# still does the right thing, without needing real hardware.
+#
+# USAGE:
+#   pip3 install pytest
+#   python3 -m pytest -q scripts/test_monitor.py
+#
+################################################################################
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import re
+import socket
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+import monitor
+import fakes
+
+################################################################################
+# TESTS: CIRCUIT BREAKER
+# PSEUDO CODE:
+#   ONE GET failing on every attempt (retries included) = one failure
+#   BREAKER opens only after BREAKER_FAILURE_THRESHOLD failed requests
+################################################################################
+
+@pytest.fixture
+def fleet(monkeypatch):
+    """Fake HA with no delay between retries"""
+    monkeypatch.setattr(monitor, "HTTP_RETRY_BACKOFF", 0)
+    server = fakes.FakeFleetServer([])
+    yield server
+    server.close()
+
+
+def test_failed_get_then_success_keeps_breaker_closed(fleet):
+    check = monitor.SystemMonitor(fleet.url, "test-token", "127.0.0.1", 1)
+    fleet.fail_next = 1 + monitor.HTTP_RETRIES   # Every attempt of the first GET fails
+
+    assert check._api_get("") is None
+    assert check.http_retries == monitor.HTTP_RETRIES
+    assert check.breaker.state == monitor.CircuitBreaker.CLOSED
+    assert check.breaker.failures == 1
+
+    assert check._api_get("") == {"message": "API running."}
+    assert check.breaker.state == monitor.CircuitBreaker.CLOSED
+    assert check.breaker.failures == 0
+    check.close()
+
+
+def test_breaker_opens_after_threshold_failed_requests(fleet):
+    check = monitor.SystemMonitor(fleet.url, "test-token", "127.0.0.1", 1)
+    fleet.fail_next = (1 + monitor.HTTP_RETRIES) * monitor.BREAKER_FAILURE_THRESHOLD
+
+    for _ in range(monitor.BREAKER_FAILURE_THRESHOLD - 1):
+        check._api_get("")
+        assert check.breaker.state == monitor.CircuitBreaker.CLOSED
+    check._api_get("")
+    assert check.breaker.state == monitor.CircuitBreaker.OPEN
+
+    requests_before = fleet.api_requests
+    with pytest.raises(monitor.UpstreamDownError):
+        check._http("get", "/api/")
+    assert fleet.api_requests == requests_before
+    check.close()
+
+################################################################################
+# TESTS: STATE SNAPSHOT
+# PSEUDO CODE:
+#   SENSOR, SWITCH and AUTOMATION checks in one cycle -> ONE GET /api/states
+#   /api/states failing -> each check falls back to GET /api/states/<entity>
+################################################################################
+
+SNAPSHOT_SENSOR = "sensor.zone_a_soil_moisture"
+SNAPSHOT_SWITCH = "switch.zone_a_valve"
+SNAPSHOT_AUTOMATION = "automation.morning_watering_schedule"
+
+
+def _snapshot_monitor(fleet) -> monitor.SystemMonitor:
+    fleet.set_state(SNAPSHOT_SENSOR, "42")
+    fleet.set_state(SNAPSHOT_SWITCH, "off")
+    fleet.set_state(SNAPSHOT_AUTOMATION, "on", last_triggered="2024-03-02T06:00:00")
+    return monitor.SystemMonitor(fleet.url, "test-token", "127.0.0.1", 1,
+                                 critical_sensors=[SNAPSHOT_SENSOR],
+                                 critical_switches=[SNAPSHOT_SWITCH],
+                                 critical_automations=[SNAPSHOT_AUTOMATION])
+
+
+def test_one_state_snapshot_serves_every_entity_check(fleet):
+    check = _snapshot_monitor(fleet)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = check.run_checks(["sensors", "switches", "automations"])
+
+    assert fleet.paths == ["/api/states"]
+    assert results["http_calls"] == 1
+    assert results["checks"]["sensors"]["sensors"][SNAPSHOT_SENSOR]["value"] == "42"
+    assert results["checks"]["switches"]["switches"][SNAPSHOT_SWITCH]["state"] == "off"
+    assert results["checks"]["automations"]["automations"][SNAPSHOT_AUTOMATION]["enabled"] is True
+    check.close()
+
+
+def test_failed_snapshot_falls_back_to_per_entity_requests(fleet):
+    check = _snapshot_monitor(fleet)
+    fleet.fail_next = 1 + monitor.HTTP_RETRIES   # Every attempt of GET /api/states fails
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = check.run_checks(["sensors", "switches", "automations"])
+
+    assert fleet.paths.count("/api/states") == 1 + monitor.HTTP_RETRIES
+    assert fleet.paths[-3:] == [f"/api/states/{SNAPSHOT_SENSOR}", f"/api/states/{SNAPSHOT_SWITCH}",
+                                f"/api/states/{SNAPSHOT_AUTOMATION}"]
+    for name in ("sensors", "switches", "automations"):
+        assert results["checks"][name]["status"] == "OK"
+    check.close()
+
+################################################################################
+# TESTS: DEVICE PROBES AND DISCOVERY
+# PSEUDO CODE:
+#   N slow node web servers -> probed in parallel (about one latency, not N)
+#   STALLED node -> its probe times out, the others are unaffected
+#   PROBE deadline -> derived from the HTTP and probe timeouts, per wave
+#   RETAINED discovery configs -> found right after SUBACK + quiet period
+################################################################################
+
+def _probing_monitor(fleet, devices) -> monitor.SystemMonitor:
+    check = monitor.SystemMonitor(fleet.url, "test-token", "127.0.0.1", 1, esp32_devices=devices)
+    check.probe_devices = True
+    check.device_url_template = fleet.url + "/device/{device}/"
+    return check
+
+
+def test_devices_are_probed_in_parallel(monkeypatch):
+    monkeypatch.setattr(monitor, "DEVICE_PROBE_TIMEOUT", 0.5)
+    devices = [f"esp32-garden-node-{index:02d}" for index in range(20)]
+    server = fakes.FakeFleetServer(devices, latency=0.2)
+    server.stalls["/device/esp32-garden-node-07/"] = 2.0
+    check = _probing_monitor(server, devices)
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = check.run_checks(["devices"])
+    elapsed = time.perf_counter() - started
+
+    statuses = results["checks"]["esp32_devices"]["devices"]
+    assert elapsed < 1.5   # Serially: 20 x 0.2 s + the stalled node
+    assert statuses["esp32-garden-node-07"]["reachable"] is False
+    assert statuses["esp32-garden-node-07"]["probe_error"] == "ReadTimeout"
+    assert all(entry["online"] and entry["reachable"] for device, entry in statuses.items()
+               if device != "esp32-garden-node-07")
+    check.close()
+    server.close()
+
+
+def test_probe_deadline_covers_http_retries_and_probe_timeouts():
+    check = monitor.SystemMonitor("http://127.0.0.1:1", "test-token", "127.0.0.1", 1)
+    lookup = ((1 + monitor.HTTP_RETRIES) * (monitor.HTTP_CONNECT_TIMEOUT + monitor.HTTP_READ_TIMEOUT)
+              + sum(monitor.HTTP_RETRY_BACKOFF * 2 ** attempt for attempt in range(monitor.HTTP_RETRIES)))
+
+    assert check.device_probe_deadline(3) == pytest.approx(lookup)
+    check.probe_devices = True
+    assert check.device_probe_deadline(3) == pytest.approx(lookup + 2 * monitor.DEVICE_PROBE_TIMEOUT)
+    assert check.device_probe_deadline(monitor.DEVICE_PROBE_WORKERS + 1) == \
+        pytest.approx(2 * check.device_probe_deadline(monitor.DEVICE_PROBE_WORKERS))
+
+
+def test_discovery_reads_retained_configs_without_waiting_out_the_timeout():
+    broker = fakes.FakeMqttBroker()
+    for node, name in [("esp32_garden_zone_c", None), ("shed_node", "esp32-shed"), ("zigbee_bridge", None)]:
+        device = {"name": name} if name else {}
+        broker.publish(f"homeassistant/binary_sensor/{node}/status/config",
+                       json.dumps({"device": device}).encode(), retain=True)
+    check = monitor.SystemMonitor("http://127.0.0.1:1", "test-token", "127.0.0.1", broker.port)
+
+    started = time.perf_counter()
+    found = check.discover_devices_from_mqtt(seconds=5)
+
+    assert found == ["esp32-garden-zone-c", "esp32-shed"]
+    assert time.perf_counter() - started < 1.5
+    broker.close()
+
+
+def test_discovery_without_broker_finds_nothing(capsys):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    check = monitor.SystemMonitor("http://127.0.0.1:1", "test-token", "127.0.0.1", port)
+
+    assert check.discover_devices_from_mqtt(seconds=1) == []
+    assert "MQTT discovery failed" in capsys.readouterr().out
+
+################################################################################
+# TESTS: MQTT PROBE
+# PSEUDO CODE:
+#   CONNECTED probe -> connect latency and a ping round trip measured
+#   BROKER drops every connection -> probe notices, reconnects, pings again
+#   PAHO 1.x callback arguments -> handed to callbacks in VERSION2 order
+################################################################################
+
+def test_probe_measures_connect_latency_and_ping_rtt():
+    broker = fakes.FakeMqttBroker()
+    probe = monitor.MqttProbe("127.0.0.1", broker.port)
+    probe.start()
+
+    assert probe.wait_connected(5)
+    rtt = probe.ping(5)
+
+    assert rtt is not None and 0 < rtt < 1
+    assert 0 < probe.connect_latency < 5
+    assert probe.last_error is None
+    probe.stop()
+    broker.close()
+
+
+def test_probe_reconnects_after_broker_drops_it():
+    broker = fakes.FakeMqttBroker()
+    probe = monitor.MqttProbe("127.0.0.1", broker.port)
+    probe.start()
+    assert probe.wait_connected(5)
+
+    broker.drop_connections()
+
+    assert fakes.wait_for(lambda: not probe.connected.is_set(), 5)
+    assert probe.last_error.startswith("Disconnected unexpectedly")
+    assert fakes.wait_for(probe.connected.is_set, 5)
+    assert probe.ping(5) is not None
+    assert probe.last_error is None
+    probe.stop()
+    broker.close()
+
+
+def test_paho1_callback_arguments_are_adapted():
+    calls = []
+    adapters = monitor._PAHO1_CALLBACK_ADAPTERS
+
+    adapters["on_connect"](lambda *args: calls.append(args))("client", None, {}, 5)
+    adapters["on_subscribe"](lambda *args: calls.append(args))("client", None, 7, (0, 128))
+    adapters["on_disconnect"](lambda *args: calls.append(args))("client", None, 7)
+
+    assert calls == [("client", None, {}, 5, None), ("client", None, 7, [0, 128], None),
+                     ("client", None, None, 7, None)]
+
+################################################################################
+# TESTS: ADAPTIVE SCHEDULER
+# PSEUDO CODE:
+#   OK -> normal interval, DEGRADED -> tightened, UNREACHABLE -> backoff
+#   BACKOFF doubles per failure, capped, jittered into [backoff/2, backoff]
+#   HA down -> entity checks deferred to just after the next HA check
+#   HA not scheduled (--checks without ha) -> entity checks keep running
+################################################################################
+
+class _StopLoop(Exception):
+    pass
+
+
+def test_interval_follows_check_status():
+    scheduler = monitor.CheckScheduler({"ha": 60, "sensors": 300}, now=0)
+
+    assert scheduler.due(0) == ["ha", "sensors"]
+    assert scheduler.complete("ha", "ONLINE", 0) == 60
+    assert scheduler.complete("sensors", "DEGRADED", 0) == max(monitor.SCHEDULE_MIN_INTERVAL,
+                                                               300 * monitor.SCHEDULE_DEGRADED_FACTOR)
+    assert scheduler.due(59) == []
+    assert scheduler.due(60) == ["ha"]
+
+
+def test_unreachable_check_backs_off_with_jitter():
+    scheduler = monitor.CheckScheduler({"ha": 60}, now=0)
+    scheduler.due(0)
+
+    intervals = []
+    for failures in range(1, 12):
+        backoff = min(monitor.SCHEDULE_MAX_BACKOFF, monitor.SCHEDULE_MIN_INTERVAL * 2 ** (failures - 1))
+        interval = scheduler.complete("ha", "OFFLINE", 0)
+        assert backoff / 2 <= interval <= backoff
+        intervals.append(interval)
+        scheduler.due(math.inf)
+
+    assert max(intervals) <= monitor.SCHEDULE_MAX_BACKOFF
+    assert len({monitor.CheckScheduler({"ha": 60}).complete("ha", "TIMEOUT", 0) for _ in range(20)}) > 1
+    assert scheduler.complete("ha", "ONLINE", 0) == 60 and scheduler.failures["ha"] == 0
+
+
+def test_entity_checks_wait_for_the_next_ha_check():
+    scheduler = monitor.CheckScheduler({"ha": 60, "mqtt": 60, "sensors": 300}, now=0)
+    scheduler.due(0)
+    scheduler.complete("ha", "OFFLINE", 0)
+
+    assert scheduler.hold_entity_checks(["mqtt", "sensors"], "ONLINE") == ["mqtt", "sensors"]
+    assert scheduler.hold_entity_checks(["ha", "sensors"], "OFFLINE") == ["ha", "sensors"]
+    assert scheduler.hold_entity_checks(["mqtt", "sensors"], "OFFLINE") == ["mqtt"]
+    assert scheduler.scheduled_at("sensors") == scheduler.scheduled_at("ha") + 1
+
+
+def test_entity_checks_run_when_ha_is_not_scheduled(fleet):
+    scheduler = monitor.CheckScheduler({"sensors": 300}, now=0)
+    scheduler.due(0)
+
+    assert scheduler.hold_entity_checks(["sensors"], "OFFLINE") == ["sensors"]
+    assert scheduler.next_due() == math.inf   # Nothing deferred to "after HA" that never comes
+
+    check = _snapshot_monitor(fleet)
+    check.results["checks"]["home_assistant"] = {"status": "OFFLINE"}   # Stale, ha not in --checks
+    cycles = []
+
+    def report():
+        cycles.append(check.results["checks"]["sensors"]["status"])
+        if len(cycles) == 2:
+            raise _StopLoop
+
+    with contextlib.redirect_stdout(io.StringIO()), pytest.raises(_StopLoop):
+        monitor.run_adaptive_loop(check, report, {"sensors": 0.01})
+    assert cycles == ["OK", "OK"]
+    check.close()
+
+################################################################################
+# TESTS: STREAMING MONITOR
+# PSEUDO CODE:
+#   TIMER WHEEL: rescheduled / cancelled keys never fire early, deadlines
+#     more than one rotation away wait for their rotation
+#   --checks with --stream: only the selected table checks are reported,
+#     polled-only checks are rejected on the command line
+#   BROKER down at startup -> retried with backoff, stream comes up later
+################################################################################
+
+def test_timer_wheel_expires_latest_deadlines_only():
+    wheel = monitor.TimerWheel(tick=1.0, slots=8, now=0)
+    wheel.schedule("a", 3)
+    wheel.schedule("b", 5)
+    wheel.schedule("a", 6)    # Rescheduled: the deadline at 3 is stale
+    wheel.schedule("c", 20)   # Same slot as 4 and 12, more than one rotation away
+    wheel.schedule("d", 4)
+    wheel.cancel("d")
+
+    assert wheel.advance(4.5) == []
+    assert wheel.advance(5) == ["b"]
+    assert wheel.advance(6) == ["a"]
+    assert wheel.advance(13) == []
+    assert wheel.advance(20) == ["c"]
+    assert wheel.advance(40) == []
+
+
+def test_stream_reports_only_selected_checks():
+    stream = monitor.StreamMonitor("http://127.0.0.1:1", "test-token", "127.0.0.1", 1)
+    stream.handle_message("esp32-garden-zone-a/sensor/zone_a_soil_moisture/state", "42", time.time())
+
+    results = stream.run_checks(["sensors"])
+
+    assert "home_assistant" not in results["checks"] and "switches" not in results["checks"]
+    assert results["checks"]["sensors"]["sensors"]["sensor.zone_a_soil_moisture"]["status"] == "OK"
+    assert results["checks"]["stream"]["messages_received"] == 1
+
+
+def test_stream_rejects_polled_checks(monkeypatch, capsys):
+    monkeypatch.setattr("sys.argv", ["monitor.py", "--ha-token", "t", "--stream", "--checks", "sensors,automations"])
+
+    with pytest.raises(SystemExit):
+        monitor.main()
+    assert "--checks automations cannot be used with --stream" in capsys.readouterr().err
+
+
+def test_stream_retries_unreachable_broker_at_startup():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    stream = monitor.StreamMonitor("http://127.0.0.1:1", "test-token", "127.0.0.1", port)
+    brokers = []
+    threading.Timer(0.3, lambda: brokers.append(fakes.FakeMqttBroker(port))).start()
+    statuses = []
+
+    def report():
+        statuses.append(stream.results["checks"]["stream"]["status"])
+        if statuses[-1] == "OK" or len(statuses) == 5:
+            raise _StopLoop
+
+    with contextlib.redirect_stdout(io.StringIO()) as output, pytest.raises(_StopLoop):
+        stream.run_forever(1, report=report, checks=["ha"])
+
+    assert statuses[-1] == "OK"
+    assert f"127.0.0.1:{port} unreachable" in output.getvalue()
+    stream.client.disconnect()
+    brokers[0].close()
+
+################################################################################
+# TESTS: LEAK DETECTOR
+# PSEUDO CODE:
+#   FLOW before any valve message -> valves unknown, no "all closed" shutoff
+#   FLOW after every valve reported off (and settled) -> shutoff
+################################################################################
+
+def _feed_flow(detector: monitor.LeakDetector, flow: float, start: float, samples: int):
+    for index in range(samples):
+        detector.on_state(monitor.LEAK_FLOW_SENSOR, str(flow), start + index * monitor.WATER_SAMPLE_SECONDS)
+
+
+def test_flow_before_valve_states_does_not_fire():
+    shutoffs = []
+    detector = monitor.LeakDetector(shutoff=lambda reason: shutoffs.append(reason) or True)
+
+    _feed_flow(detector, 8.0, 1000.0, monitor.LEAK_CONFIRM_SAMPLES + 3)
+
+    assert shutoffs == []
+    assert detector.report()["status"] == "OK"
+
+
+def test_flow_with_every_valve_closed_fires():
+    shutoffs = []
+    detector = monitor.LeakDetector(shutoff=lambda reason: shutoffs.append(reason) or True)
+    for valve in monitor.LEAK_ZONE_VALVES:
+        detector.on_state(valve, "OFF", 1000.0)
+
+    _feed_flow(detector, 8.0, 1000.0 + monitor.LEAK_VALVE_SETTLE_SECONDS, monitor.LEAK_CONFIRM_SAMPLES)
+
+    assert len(shutoffs) == 1
+    assert "all zone valves closed" in shutoffs[0]
+    assert detector.report()["status"] == "LEAK"
+
+################################################################################
+# TESTS: WATER ACCOUNTING
+# PSEUDO CODE:
+#   VALVE on, 10 L/min flow samples every WATER_SAMPLE_SECONDS, VALVE off
+#   DROPPED samples   -> interpolated, liters unchanged, interval not estimated
+#   GAP > WATER_MAX_GAP_SECONDS while watering -> interval marked estimated
+#   RUN across midnight -> liters split between the two days in WaterStore
+################################################################################
+
+WATER_ZONE = "zone_a"
+WATER_LPM = 10.0
+
+
+def _water_run(accountant: monitor.WaterAccountant, start: float, seconds: int, skip=lambda offset: False):
+    """Water WATER_ZONE for `seconds` from `start`, then let the pipe drain; returns drained liters"""
+    zone = monitor.ANALYZE_ZONES[WATER_ZONE]
+    step = monitor.WATER_SAMPLE_SECONDS
+    accountant.on_state(zone["valve"], "off", start - 60)
+    accountant.on_state(zone["valve"], "on", start)
+    for offset in range(0, seconds + 1, step):
+        if offset in (0, seconds) or not skip(offset):
+            accountant.on_state(zone["flow"], str(WATER_LPM), start + offset)
+    accountant.on_state(zone["valve"], "off", start + seconds)
+    for offset in range(step, monitor.LEAK_VALVE_SETTLE_SECONDS + 2 * step, step):
+        accountant.on_state(zone["flow"], "0", start + seconds + offset)
+    return WATER_LPM * step / 120.0   # Trapezoid from the last 10 L/min sample down to 0
+
+
+def test_dropped_samples_are_interpolated():
+    accountant = monitor.WaterAccountant()
+    start = datetime(2024, 6, 1, 10, 0).timestamp()
+    step = monitor.WATER_SAMPLE_SECONDS
+
+    drained = _water_run(accountant, start, 600, skip=lambda offset: offset // step % 7 == 3)
+
+    interval, = accountant.intervals
+    assert interval["liters"] == pytest.approx(WATER_LPM * 10 + drained, abs=0.01)
+    assert interval["missed_samples"] == 17
+    assert interval["estimated"] is False
+    assert accountant.zones[WATER_ZONE].today["missed_samples"] == 17
+
+
+def test_gap_longer_than_max_gap_marks_interval_estimated():
+    accountant = monitor.WaterAccountant()
+    start = datetime(2024, 6, 1, 10, 0).timestamp()
+    gap = (60, 60 + monitor.WATER_MAX_GAP_SECONDS + 30)
+
+    drained = _water_run(accountant, start, 600, skip=lambda offset: gap[0] < offset < gap[1])
+
+    interval, = accountant.intervals
+    assert interval["liters"] == pytest.approx(WATER_LPM * 10 + drained, abs=0.01)
+    assert interval["estimated"] is True
+
+
+def test_run_across_midnight_splits_liters_between_days(tmp_path):
+    store = monitor.WaterStore(str(tmp_path / "water.db"))
+    accountant = monitor.WaterAccountant(store)
+    midnight = datetime(2024, 6, 2).timestamp()
+    step = monitor.WATER_SAMPLE_SECONDS
+
+    drained = _water_run(accountant, midnight - 300, 600)
+    accountant.flush()
+
+    before = store.day(WATER_ZONE, "2024-06-01")
+    after = store.day(WATER_ZONE, "2024-06-02")
+    assert before["liters"] == pytest.approx(WATER_LPM * (300 - step) / 60, abs=0.01)
+    assert after["liters"] == pytest.approx(WATER_LPM * (300 + step) / 60 + drained, abs=0.01)
+    assert after["intervals"] == 1 and before["intervals"] == 0
+    assert accountant.day == "2024-06-02"
+    assert accountant.zones[WATER_ZONE].today["liters"] == pytest.approx(after["liters"])
+    assert accountant.intervals[0]["estimated"] is False
+    store.close()
+
+################################################################################
+# TESTS: SENSOR ANOMALIES
+# PSEUDO CODE:
+#   NOISY readings every 5 minutes around 40 (never a flatline)
+#   JUMP during warm-up            -> no spike (baseline not trusted yet)
+#   JUMP after warm-up             -> spike
+#   SLOW drift within the band     -> nothing flagged, however far it goes
+#   WELFORD mean/stddev            -> same as the statistics module
+################################################################################
+
+ANOMALY_SENSOR = "sensor.zone_a_soil_moisture"
+ANOMALY_START = datetime(2024, 6, 1).timestamp()
+
+
+def _observe(engine: monitor.AnomalyEngine, values, start: float = ANOMALY_START) -> list:
+    """Feed readings 5 minutes apart, returns the anomalies flagged for each"""
+    return [engine.observe(ANOMALY_SENSOR, value, start + index * 300) for index, value in enumerate(values)]
+
+
+def test_jump_during_warmup_is_not_a_spike():
+    engine = monitor.AnomalyEngine()
+    noise = [40 + index % 2 for index in range(monitor.ANOMALY_WARMUP_SAMPLES - 2)]
+
+    flagged = _observe(engine, noise + [80])
+
+    assert "spike" not in flagged[-1]
+
+
+def test_step_change_after_warmup_is_a_spike():
+    engine = monitor.AnomalyEngine()
+    noise = [40 + index % 2 for index in range(3 * monitor.ANOMALY_WARMUP_SAMPLES)]
+
+    flagged = _observe(engine, noise + [80])
+
+    assert not any(flagged[:-1])
+    assert flagged[-1]["spike"] == "jumped 39 from 41"
+    assert engine.report()["status"] == "DEGRADED"
+
+
+def test_slow_drift_within_band_is_not_flagged():
+    engine = monitor.AnomalyEngine()
+    drift = [40 + index * 0.1 + (index % 2) * 0.5 for index in range(500)]   # 40% -> 90% over ~42 hours
+
+    flagged = _observe(engine, drift)
+
+    assert not any(flagged)
+    assert engine.report()["status"] == "OK"
+
+
+def test_sensor_stats_match_statistics_module():
+    values = [40 + (index * 7919) % 13 / 3 for index in range(200)]
+    stats = monitor.SensorStats()
+
+    for value in values:
+        stats.update(value)
+
+    assert stats.mean == pytest.approx(statistics.fmean(values))
+    assert stats.stddev() == pytest.approx(statistics.stdev(values))
+
+################################################################################
+# TESTS: HEALTH RULES
+# PSEUDO CODE:
+#   EACH rule type (state, not_state, min/max, attribute, max_age,
+#     changed_within, triggered_within) passes and fails on its own
+#   WILDCARD entity_id -> every matching entity, nothing else
+#   MALFORMED rule file -> ValueError naming the problem
+################################################################################
+
+RULES_NOW = datetime(2024, 6, 1, 12, 0).timestamp()
+
+
+def _entity(state, age: float = 0.0, changed_age: float = 0.0, **attributes) -> dict:
+    return {"state": state, "last_updated": RULES_NOW - age, "last_changed": RULES_NOW - changed_age,
+            "attributes": attributes}
+
+
+@pytest.mark.parametrize("rule, passing, failing, failure", [
+    ({"state": ["on", "off"]}, _entity("off"), _entity("opening"), "not in"),
+    ({"not_state": "off"}, _entity("on"), _entity("off"), "not allowed"),
+    ({"min": 20, "max": 100}, _entity("55"), _entity("12"), "outside 20..100"),
+    ({"attribute": "battery", "min": 10}, _entity("on", battery=80), _entity("on", battery=5), "outside 10..inf"),
+    ({"max_age": "15m"}, _entity("1", age=60), _entity("1", age=3600), "not updated for 60m"),
+    ({"changed_within": "1h"}, _entity("1", changed_age=600), _entity("1", changed_age=7200), "not changed"),
+    ({"triggered_within": "26h"}, _entity("on", last_triggered=RULES_NOW - 3600),
+     _entity("on", last_triggered=RULES_NOW - 30 * 3600), "not triggered"),
+])
+def test_each_rule_type(rule, passing, failing, failure):
+    engine = monitor.RuleEngine([{"entity_id": "sensor.x", "name": "under test", **rule}])
+
+    assert engine.evaluate("sensor.x", passing, RULES_NOW)["status"] == "OK"
+    entry = engine.evaluate("sensor.x", failing, RULES_NOW)
+    assert entry["status"] == "DEGRADED"
+    assert entry["failures"][0].startswith("under test: ") and failure in entry["failures"][0]
+
+
+def test_unavailable_fails_unless_listed_and_severity_applies():
+    strict = monitor.RuleEngine([{"entity_id": "sensor.x", "min": 0, "severity": "error"}])
+    lenient = monitor.RuleEngine([{"entity_id": "sensor.x", "state": ["unavailable", "1"]}])
+
+    assert strict.evaluate("sensor.x", _entity("unavailable"), RULES_NOW)["status"] == "ERROR"
+    assert lenient.evaluate("sensor.x", _entity("unavailable"), RULES_NOW)["status"] == "OK"
+
+
+def test_wildcard_rule_matches_only_its_entities():
+    engine = monitor.RuleEngine([{"entity_id": "sensor.zone_*_soil_moisture", "min": 0, "max": 100}])
+    states = {
+        "sensor.zone_a_soil_moisture": _entity("40"),
+        "sensor.zone_b_soil_moisture": _entity("140"),
+        "sensor.zone_a_flow_rate": _entity("140"),
+    }
+
+    assert engine.update(states, RULES_NOW) == 2
+    report = engine.report()
+    assert set(report["entities"]) == {"sensor.zone_a_soil_moisture", "sensor.zone_b_soil_moisture"}
+    assert report["entities"]["sensor.zone_a_soil_moisture"]["status"] == "OK"
+    assert report["entities"]["sensor.zone_b_soil_moisture"]["status"] == "DEGRADED"
+    assert engine.update(states, RULES_NOW) == 0   # Nothing changed, nothing evaluated
+
+
+def test_example_rules_file_compiles():
+    rules = monitor.load_rules_config(str(Path(monitor.__file__).with_name("health_rules.yaml.example")))
+
+    engine = monitor.RuleEngine(rules)
+    assert engine.rule_count == len(rules) and engine.patterns
+
+
+@pytest.mark.parametrize("text, problem", [
+    ("rules: [\n  - entity_id: sensor.x\n", "invalid YAML"),
+    ("- entity_id: sensor.x\n", "expected a mapping"),
+    ("rules:\n  - sensor.x\n", "rule #1: expected a mapping"),
+    ("rules:\n  - name: no entity\n    min: 1\n", "rule #1: missing entity_id"),
+    ("rules:\n  - entity_id: sensor.x\n    maximum: 1\n", "rule #1: unknown key(s) maximum"),
+    ("rules: []\n", "no rules listed"),
+])
+def test_malformed_rule_file_is_rejected(tmp_path, text, problem):
+    path = tmp_path / "rules.yaml"
+    path.write_text(text)
+
+    with pytest.raises(ValueError, match=re.escape(problem)):
+        monitor.load_rules_config(str(path))
+
+
+def test_invalid_rule_value_names_the_rule():
+    with pytest.raises(ValueError, match="tank: max_age: invalid duration 'soon'"):
+        monitor.RuleEngine([{"entity_id": "sensor.x", "name": "tank", "max_age": "soon"}])
+    with pytest.raises(ValueError, match="rule #1: severity"):
+        monitor.RuleEngine([{"entity_id": "sensor.x", "severity": "fatal"}])
+
+################################################################################
+# TESTS: AUTOMATION AUDIT
+# PSEUDO CODE:
+#   SYNTHETIC automations.yaml + logbook: on time on May 31, then on June 1
+#   06:00 run five minutes late        -> LATE
+#   18:00 run missing, conditions met  -> MISSED
+#   LEAK shutoff ran, valve stayed on  -> FAILED
+#   SECOND auditor loads the saved state and reads on from the cursor
+################################################################################
+
+AUDIT_AUTOMATIONS = """
+- id: morning_watering
+  alias: Morning Watering Schedule
+  trigger:
+    - platform: time
+      at: ["06:00:00", "18:00:00"]
+  condition:
+    - condition: state
+      entity_id: input_boolean.watering_enabled
+      state: "on"
+  action:
+    - service: switch.turn_on
+      target:
+        entity_id: switch.zone_a_valve
+- id: leak_shutoff
+  alias: Leak Detection Emergency Shutoff
+  trigger:
+    - platform: state
+      entity_id: binary_sensor.leak
+      to: "on"
+  action:
+    - service: switch.turn_off
+      target:
+        entity_id: switch.main_water_valve
+"""
+MORNING = "automation.morning_watering_schedule"
+SHUTOFF = "automation.leak_detection_emergency_shutoff"
+
+
+def _at(hour: int, minute: int = 0, month: int = 6, day: int = 1) -> float:
+    return datetime(2024, month, day, hour, minute).timestamp()
+
+
+def _when(at: float) -> str:
+    return datetime.fromtimestamp(at).isoformat()
+
+
+def _logbook(entries):
+    """fetch() over a fixed logbook, recording every requested window"""
+    def fetch(entity_ids, start, end):
+        fetch.windows.append((start, end))
+        return [entry for entry in entries
+                if entry["entity_id"] in entity_ids and start < monitor._state_timestamp(entry["when"]) <= end]
+    fetch.windows = []
+    return fetch
+
+
+def test_audit_finds_late_missed_and_failed_runs_across_reloads(tmp_path):
+    path = tmp_path / "automations.yaml"
+    path.write_text(AUDIT_AUTOMATIONS)
+    schedule = monitor.load_automation_schedule(str(path))
+    state_path = str(tmp_path / "state" / "audit.json")
+    current = {MORNING: {"state": "on"}, SHUTOFF: {"state": "on"},
+               "input_boolean.watering_enabled": {"state": "on"},
+               "switch.zone_a_valve": {"state": "off"}, "switch.main_water_valve": {"state": "on"}}
+    fetch = _logbook([
+        *({"when": _when(_at(hour, 1, month=5, day=31)), "entity_id": MORNING,
+           "message": "triggered by time"} for hour in (6, 18)),
+        {"when": _when(_at(6, 5)), "entity_id": MORNING, "message": "triggered by time"},
+        {"when": _when(_at(6, 5)), "entity_id": "switch.zone_a_valve", "state": "on"},
+        {"when": _when(_at(11)), "entity_id": "switch.main_water_valve", "state": "on"},
+        {"when": _when(_at(12)), "entity_id": SHUTOFF, "message": "triggered by state of binary_sensor.leak"},
+    ])
+
+    first = monitor.AutomationAuditor(schedule, state_path=state_path)
+    assert first.audit(fetch, _at(7), current) == 4
+    assert first.report(_at(7))["automations"][MORNING]["status"] == "LATE"
+
+    second = monitor.AutomationAuditor(schedule, state_path=state_path)
+    assert second.cursor == first.cursor and second.outcomes == first.outcomes
+    assert second.audit(fetch, _at(20), current) == 2
+    assert fetch.windows[-1][0] == first.cursor   # Only entries since the first audit
+
+    report = second.report(_at(20))
+    morning, shutoff = report["automations"][MORNING], report["automations"][SHUTOFF]
+    assert [event["status"] for event in morning["events"]] == ["LATE", "MISSED"]
+    assert morning["status"] == "MISSED" and morning["runs"] == 1
+    assert shutoff["status"] == "FAILED"
+    assert "switch.main_water_valve still on" in shutoff["events"][0]["detail"]
+    assert report["status"] == "ERROR"
+
+
+def test_unreadable_audit_state_starts_over(tmp_path):
+    path = tmp_path / "automations.yaml"
+    path.write_text(AUDIT_AUTOMATIONS)
+    state_path = tmp_path / "audit.json"
+    state_path.write_text("{not json")
+
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        auditor = monitor.AutomationAuditor(monitor.load_automation_schedule(str(path)),
+                                            state_path=str(state_path))
+
+    assert auditor.cursor is None and auditor.outcomes == []
+    assert "Ignoring unreadable audit state" in output.getvalue()
+
+################################################################################
+# TESTS: ASYNC ENGINE DEADLINES
+# PSEUDO CODE:
+#   HA endpoint hangs longer than check_timeout
+#   CYCLE ends after about check_timeout with the check TIMEOUT
+#   THE hung call finishing later changes neither that cycle nor the next
+#   MORE hung cycles than worker threads -> the next healthy check still runs
+################################################################################
+
+def test_async_hung_check_times_out_and_late_result_is_dropped(fleet):
+    hang, timeout = 3.0, 0.5
+    fleet.stalls["/api/"] = hang
+    check = monitor.AsyncSystemMonitor(fleet.url, "test-token", "127.0.0.1", 1, check_timeout=timeout)
+
+    started = time.perf_counter()
+    first = check.run_checks(["ha"])
+    elapsed = time.perf_counter() - started
+
+    assert first["checks"]["home_assistant"]["status"] == "TIMEOUT"
+    assert timeout <= elapsed < timeout + 0.5
+    seconds = first["timings"]["checks"]["home_assistant"]
+
+    second = check.run_checks(["sensors"])   # Starts while the hung request is still running
+    time.sleep(hang)                         # Hung request returns, the check completes late
+
+    assert first["checks"]["home_assistant"]["status"] == "TIMEOUT"
+    assert first["timings"]["checks"]["home_assistant"] == seconds
+    assert second["checks"]["home_assistant"]["status"] == "TIMEOUT"   # Carried over, not overwritten
+    assert "home_assistant" not in second["timings"]["checks"]
+    check.close()
+
+def test_async_repeated_hangs_do_not_drain_the_worker_pool(fleet):
+    fleet.stalls["/api/"] = 6.0
+    check = monitor.AsyncSystemMonitor(fleet.url, "test-token", "127.0.0.1", 1, check_timeout=0.2)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(monitor.HTTP_POOL_SIZE + 1):   # Every worker of the first pool stuck
+            assert check.run_checks(["ha"])["checks"]["home_assistant"]["status"] == "TIMEOUT"
+        fleet.stalls.clear()
+        healthy = check.run_checks(["ha"])
+
+    assert healthy["checks"]["home_assistant"]["status"] == "ONLINE"
+    assert check.executors_replaced >= 1
+    check.close()
+
+################################################################################
+# TESTS: SUPERVISED CHECK WORKERS
+# PSEUDO CODE:
+#   SENSOR history lives in the supervisor: a replaced worker loses none of it
+#   FAILURES seen by any worker open the supervisor's breaker
+#   NEXT cycle's workers start with it open -> no request reaches HA
+################################################################################
+
+def test_process_workers_keep_engines_and_breaker_in_supervisor(fleet):
+    sensor = "sensor.zone_a_soil_moisture"   # Has ANOMALY_LIMITS, so the engine keeps its history
+    fleet.states[sensor] = {"entity_id": sensor, "state": "42", "attributes": {},
+                            "last_updated": datetime.now().isoformat(), "last_changed": datetime.now().isoformat()}
+    check = monitor.IsolatedSystemMonitor(fleet.url, "test-token", "127.0.0.1", 1, critical_sensors=[sensor],
+                                          isolation="process", check_timeout=10)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            check.run_checks(["ha", "sensors"])
+            check._workers["entities"].kill()   # As after a timeout: the next cycle gets a fresh worker
+            results = check.run_checks(["ha", "sensors"])
+        assert results["checks"]["sensors"]["sensors"][sensor]["status"] == "OK"
+        assert check.anomaly_engine.stats[sensor].count == 2
+        
+        fleet.fail_next = 1000
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = check.run_checks(["ha", "sensors"])
+        assert results["circuit_breaker"]["state"] == monitor.CircuitBreaker.OPEN
+        
+        requests_before = fleet.api_requests
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = check.run_checks(["ha", "sensors"])
+        assert fleet.api_requests == requests_before
+        assert results["checks"]["sensors"]["sensors"][sensor]["status"] == "SKIPPED"
+    finally:
+        check.close()
+
+################################################################################
+# TESTS: ALERT DISPATCH
+# PSEUDO CODE:
+#   SAME problem on consecutive cycles -> one notification, recovery -> one more
+#   NODE down with its sensors and switches -> one line for the node
+#   MORE transitions than the rate limit -> the rest held back, not sent
+################################################################################
+
+@pytest.fixture
+def notify():
+    server = fakes.FakeNotifyServer(latency=0)
+    yield server
+    server.close()
+
+
+def _dispatch(notify, cycles, rate_limit: int = monitor.ALERT_RATE_LIMIT) -> monitor.AlertDispatcher:
+    """Feed cycles to a dispatcher with one notify channel, then drain it"""
+    dispatcher = monitor.AlertDispatcher([monitor.HANotifyChannel(notify.url, "test-token", "notify.email")],
+                                         rate_limit=rate_limit)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for results in cycles:
+            dispatcher.update(results)
+        dispatcher.close(timeout=10)
+    return dispatcher
+
+
+def test_repeated_problem_alerts_once_and_recovery_once(notify):
+    stale = fakes.alert_results(tank_status="STALE")
+    dispatcher = _dispatch(notify, [fakes.alert_results(), stale, stale, stale,
+                                    fakes.alert_results()])
+    
+    assert [entry["path"] for entry in notify.received] == ["/api/services/notify/email"] * 2
+    assert "✗ sensor.water_tank_level: OK -> STALE" in notify.received[0]["message"]
+    assert "✓ sensor.water_tank_level: STALE -> OK" in notify.received[1]["message"]
+    assert dispatcher.stats["sent"] == 2
+
+
+def test_node_down_coalesces_its_entities_into_one_line(notify):
+    dispatcher = _dispatch(notify, [fakes.alert_results(),
+                                    fakes.alert_results(zone_a_online=False)])
+    
+    assert len(notify.received) == 1
+    lines = notify.received[0]["message"].splitlines()
+    assert len(lines) == 1
+    assert lines[0].startswith("✗ esp32-garden-zone-a: ")
+    for entity_id in ("sensor.zone_a_soil_moisture", "sensor.zone_a_flow_rate", "switch.zone_a_valve"):
+        assert entity_id in lines[0]
+    assert dispatcher.stats["coalesced"] == 3
+
+
+def test_flapping_sensor_is_rate_limited(notify):
+    cycles = [fakes.alert_results(tank_status="STALE" if index % 2 == 0 else "OK") for index in range(6)]
+    dispatcher = _dispatch(notify, cycles, rate_limit=2)
+    
+    assert len(notify.received) == 2
+    assert dispatcher.stats["rate_limited"] == 4
+    assert len(dispatcher._held["notify.email"]) == 4
+
+################################################################################
+# TESTS: WEBSOCKET STATE CACHE
+# PSEUDO CODE:
+#   CONNECT, sync via get_states, tracked changes pushed into the cache
+#   CONNECTION dropped, state changed while nobody listens
+#   RECONNECT -> get_states again -> cache matches the server
+################################################################################
+
+def test_websocket_reconnects_and_resyncs_missed_changes():
+    pytest.importorskip("websocket")
+    now = datetime.now().isoformat()
+    sensor, switch = "sensor.zone_a_soil_moisture", "switch.zone_a_valve"
+    states = {entity_id: {"entity_id": entity_id, "state": "0", "last_updated": now, "attributes": {}}
+              for entity_id in (sensor, switch, "sensor.untracked_noise")}
+    server = fakes.FakeHAWebSocketServer(states)
+    stream = monitor.HAStateStream(server.url, server.token, [sensor, switch])
+    stream.start()
+    try:
+        assert stream.synced.wait(5)
+        assert set(stream.snapshot()) == {sensor, switch}
+        
+        server.push_state(sensor, "41")
+        server.push_state("sensor.untracked_noise", "1")
+        assert fakes.wait_for(lambda: stream.snapshot()[sensor]["state"] == "41", 5)
+        
+        server.drop_connections()
+        assert fakes.wait_for(lambda: not stream.synced.is_set(), 5)
+        events_before = stream.events_received
+        server.push_state(switch, "on")   # No subscriber: only a resync can bring this in
+        
+        assert fakes.wait_for(lambda: stream.synced.is_set() and stream.resyncs == 2, 10)
+        assert stream.reconnects >= 1
+        assert server.get_states_calls == 2
+        assert stream.events_received == events_before
+        assert {entity_id: state["state"] for entity_id, state in stream.snapshot().items()} == \
+            {sensor: "41", switch: "on"}
+    finally:
+        stream.stop()
+        server.close()
+
+################################################################################
+# TESTS: MQTT BROKER BENCHMARK
+# PSEUDO CODE:
+#   BROKER = the fake one, or a real one on MQTT_BROKER:MQTT_PORT (skipped if none)
+#   RUN one mqtt-bench scenario per QoS: every message delivered once,
+#     rates and latency percentiles filled in and ordered
+################################################################################
+
+@pytest.fixture(params=["fake", "local"])
+def broker(request):
+    """(host, port) of a broker to benchmark"""
+    if request.param == "fake":
+        fake = fakes.FakeMqttBroker()
+        yield "127.0.0.1", fake.port
+        fake.close()
+        return
+    try:
+        socket.create_connection((monitor.MQTT_BROKER, monitor.MQTT_PORT), timeout=1).close()
+    except OSError:
+        pytest.skip(f"no MQTT broker on {monitor.MQTT_BROKER}:{monitor.MQTT_PORT}")
+    yield monitor.MQTT_BROKER, monitor.MQTT_PORT
+
+
+@pytest.mark.parametrize("qos", [0, 1])
+def test_mqtt_bench_scenario_delivers_every_message(broker, qos):
+    host, port = broker
+    row = monitor.mqtt_bench_scenario(host, port, monitor.MQTT_USERNAME, monitor.MQTT_PASSWORD,
+                                      qos=qos, size=128, clients=3, messages=100, timeout=10)
+    
+    assert (row["sent"], row["delivered"], row["lost"], row["duplicates"]) == (300, 300, 0, 0)
+    assert row["publish_per_sec"] > 0 and row["delivered_per_sec"] > 0
+    latency = row["latency_ms"]
+    assert 0 <= latency["p50"] <= latency["p90"] <= latency["p99"] <= latency["max"]
+
+
+def test_mqtt_bench_scenario_without_broker_raises():
+    with socket.socket() as unused:
+        unused.bind(("127.0.0.1", 0))
+        port = unused.getsockname()[1]   # Nothing listens here
+    with pytest.raises(ConnectionError):
+        monitor.mqtt_bench_scenario("127.0.0.1", port, "", "", qos=0, size=64, clients=1, messages=1)
+
+################################################################################
+# TESTS: CHANGE TRACKING AND STATE CACHE
+# PSEUDO CODE:
+#   FIRST cycle -> every entity (and the overall status) listed as added
+#   ONE sensor changed -> only that sensor listed, unchanged checks shared
+#   CACHED healthy result -> reused until its TTL expires, problems never
+#   --changes-only -> first run lists everything, the next only what changed
+################################################################################
+
+def _finished_cycle(check, checks=("sensors", "switches", "automations")) -> list:
+    with contextlib.redirect_stdout(io.StringIO()):
+        check.run_checks(list(checks))
+        check.finish_cycle()
+    return check.changes
+
+
+def test_first_cycle_lists_every_entity(fleet):
+    check = _snapshot_monitor(fleet)
+
+    changes = _finished_cycle(check)
+
+    assert {change["change"] for change in changes} == {"added"}
+    assert {change["entity"] for change in changes} == {
+        "monitor.overall_status", "check.sensors", "check.switches", "check.automations",
+        SNAPSHOT_SENSOR, SNAPSHOT_SWITCH, SNAPSHOT_AUTOMATION}
+    check.close()
+
+
+def test_single_changed_entity_is_the_only_change(fleet):
+    check = _snapshot_monitor(fleet)
+    _finished_cycle(check)
+    previous = check.snapshot
+    fleet.set_state(SNAPSHOT_SENSOR, "35")
+
+    changes = _finished_cycle(check)
+
+    assert changes == [{"timestamp": check.results["timestamp"], "change": "changed", "check": "sensors",
+                        "entity": SNAPSHOT_SENSOR, "status": "OK", "value": 35.0,
+                        "previous_status": "OK", "previous_value": 42.0}]
+    assert check.snapshot.checks["switches"] is previous.checks["switches"]
+    assert check.snapshot.checks["sensors"]["check.sensors"] is previous.checks["sensors"]["check.sensors"]
+    assert monitor.CycleSnapshot.format_change(changes[0]).endswith(f"~ {SNAPSHOT_SENSOR}: OK -> OK (42.0 -> 35.0)")
+    check.close()
+
+
+def test_cached_result_expires_after_ttl(tmp_path):
+    cache = monitor.ResultCache(str(tmp_path), ttl=60)
+    results = {"timestamp": "2024-06-01T06:00:00", "overall_status": "DEGRADED", "checks": {
+        "sensors": {"status": "OK", "sensors": {}},
+        "switches": {"status": "ERROR", "switches": {}}}}
+    cache.save(results, monitor.CycleSnapshot.from_results(results), now=1000)
+
+    reloaded = monitor.ResultCache(str(tmp_path), ttl=60)
+    reused = {"timestamp": "2024-06-01T06:00:30", "checks": {}}
+    reloaded.reuse(reused, reloaded.fresh(["sensors"], now=1030), now=1030)
+
+    assert reloaded.fresh(["sensors", "switches"], now=1059) == ["sensors"]   # Problems are re-checked
+    assert reloaded.fresh(["sensors"], now=1060) == []
+    assert reused["checks"]["sensors"]["cached_seconds"] == 30
+    assert monitor.ResultCache(str(tmp_path), ttl=0).fresh(["sensors"], now=1000) == []
+
+    reloaded.save(reused, monitor.CycleSnapshot.from_results(reused), now=1030)
+    assert reloaded.previous["checked_at"]["sensors"] == 1000   # Reuse does not extend the TTL
+
+
+def test_changes_only_output(fleet, tmp_path, monkeypatch, capsys):
+    _snapshot_monitor(fleet).close()
+    stdout = sys.stdout
+
+    def run(*options) -> list:
+        monkeypatch.setattr(sys, "stdout", stdout)   # main() moves progress output to stderr
+        monkeypatch.setattr(sys, "argv", ["monitor.py", "--ha-url", fleet.url, "--ha-token", "test-token",
+                                          "--checks", "sensors", "--state-dir", str(tmp_path),
+                                          "--cache-ttl", "0", "--changes-only", *options])
+        with pytest.raises(SystemExit):
+            monitor.main()
+        return capsys.readouterr().out.splitlines()
+
+    first = run()
+    fleet.set_state(SNAPSHOT_SENSOR, "35")
+    second = run("--json")
+    unchanged = run()
+
+    assert any(f"+ {SNAPSHOT_SENSOR}: OK (42.0)" in line for line in first)
+    assert any("+ check.sensors:" in line for line in first)
+    assert [json.loads(line)["entity"] for line in second] == [SNAPSHOT_SENSOR]
+    assert json.loads(second[0])["previous_value"] == 42.0
+    assert unchanged == []
+
+################################################################################
+# TESTS: METRICS EXPORTER
+# PSEUDO CODE:
+#   DEFAULT listen address -> localhost only
+#   ONE scrape after a cycle -> valid Prometheus text exposition format
+################################################################################
+
+METRIC_SAMPLE = re.compile(r'([a-zA-Z_:][a-zA-Z0-9_:]*)(\{([a-zA-Z_]\w*="(\\.|[^"\\])*",?)*\})? '
+                           r'(-?[0-9.e+-]+|\+Inf|-Inf|NaN)')
+
+
+def test_metrics_scrape_is_valid_exposition_format(fleet):
+    import urllib.error
+    import urllib.request
+
+    check = _snapshot_monitor(fleet)
+    exporter = monitor.MetricsExporter()
+    check.cycle_hooks.append(exporter.update)
+    _finished_cycle(check)
+    with contextlib.redirect_stdout(io.StringIO()):
+        exporter.serve(0)
+    host, port = exporter.server.server_address
+
+    with urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=5) as response:
+        content_type = response.headers["Content-Type"]
+        lines = response.read().decode().splitlines()
+    with pytest.raises(urllib.error.HTTPError):
+        urllib.request.urlopen(f"http://{host}:{port}/", timeout=5)
+
+    assert host == "127.0.0.1"
+    assert content_type.startswith("text/plain; version=0.0.4")
+    types = {}
+    for line in lines:
+        if line.startswith("# HELP "):
+            continue
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            assert kind in ("counter", "gauge", "histogram") and name not in types
+            types[name] = kind
+            continue
+        match = METRIC_SAMPLE.fullmatch(line)
+        assert match, line
+        name = match.group(1)
+        assert name in types or re.sub(r"_(bucket|sum|count)$", "", name) in types, line
+    assert f'garden_sensor_value{{entity_id="{SNAPSHOT_SENSOR}"}} 42.0' in lines
+    assert "garden_monitor_cycles_total 1" in lines
+    exporter.server.shutdown()
+    exporter.server.server_close()
+    check.close()
+
+################################################################################
+# TESTS: LAZY IMPORTS
+# PSEUDO CODE:
+#   FRESH interpreter runs `--checks ha` -> requests loaded, paho and
+#   asyncio never executed (still lazy placeholders)
+################################################################################
+
+LAZY_STATE = """
+import importlib.util, runpy, sys
+sys.argv = ["monitor.py"] + sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+except SystemExit:
+    pass
+print({name: name in sys.modules and type(sys.modules[name]) is not importlib.util._LazyModule
+       for name in ("requests", "paho.mqtt.client", "asyncio")}, file=sys.stderr)
+"""
+
+
+def test_ha_check_does_not_load_paho_or_asyncio(fleet):
+    import ast
+    import subprocess
+
+    scripts = Path(monitor.__file__).parent
+    process = subprocess.run([sys.executable, "-c", LAZY_STATE, "--ha-url", fleet.url, "--ha-token", "test-token",
+                              "--checks", "ha"], cwd=scripts, capture_output=True, text=True, timeout=60)
+
+    assert "Home Assistant" in process.stdout
+    assert ast.literal_eval(process.stderr.strip().splitlines()[-1]) == {
+        "requests": True, "paho.mqtt.client": False, "asyncio": False}
+
+################################################################################
+# TESTS: CYCLE TRACE FILE
+# PSEUDO CODE:
+#   TWO cycles appended to one --trace file -> loads as a trace-event JSON
+#   array (closing ] optional, as Chrome and Perfetto allow), each cycle's
+#   complete events present and in time order
+################################################################################
+
+def test_trace_file_over_two_cycles_is_valid_trace_json(fleet, tmp_path):
+    path = tmp_path / "trace.json"
+    check = _snapshot_monitor(fleet)
+    writer = monitor.TraceFileWriter(str(path))
+    check.cycle_hooks.append(lambda results: writer.write(check.trace.chrome_events()))
+
+    _finished_cycle(check)
+    first_cycle = len(json.loads(path.read_text() + "]"))
+    _finished_cycle(check)
+    text = path.read_text()
+
+    assert text.startswith("[\n") and not text.rstrip().endswith(",")
+    events = json.loads(text + "]")
+    assert json.loads(text + "\n]") == events
+    assert 0 < first_cycle < len(events)
+    for event in events:
+        assert event["ph"] == "X" and isinstance(event["name"], str) and isinstance(event["args"], dict)
+        assert all(isinstance(event[key], int) and event[key] >= 0 for key in ("ts", "dur", "pid", "tid"))
+    first, second = events[:first_cycle], events[first_cycle:]
+    assert max(event["ts"] + event["dur"] for event in first) <= min(event["ts"] for event in second)
+    for cycle in (first, second):
+        assert sorted(event["name"] for event in cycle if event["cat"] == "check") == \
+            ["automations", "sensors", "state_snapshot", "switches"]
+    check.close()
+
+################################################################################
+# TESTS: MULTI-SITE FLEET
+# PSEUDO CODE:
+#   sites.yaml.example -> defaults merged, ${VARIABLES} expanded
+#   ONE site's HA failing -> only that site's breaker opens and it alone
+#     is reported unhealthy
+#   run_sites_command -> site threads muted, sys.stdout restored afterwards
+################################################################################
+
+def _site(name: str, server) -> dict:
+    return {"name": name, "ha_url": server.url, "ha_token": "test-token", "mqtt_broker": "127.0.0.1",
+            "mqtt_port": 1, "esp32_devices": [], "critical_sensors": [SNAPSHOT_SENSOR],
+            "critical_switches": [SNAPSHOT_SWITCH], "critical_automations": [SNAPSHOT_AUTOMATION]}
+
+
+def _site_server():
+    server = fakes.FakeFleetServer([])
+    server.set_state(SNAPSHOT_SENSOR, "42")
+    server.set_state(SNAPSHOT_SWITCH, "off")
+    server.set_state(SNAPSHOT_AUTOMATION, "on")
+    return server
+
+
+def test_example_sites_file_loads(monkeypatch):
+    monkeypatch.setenv("HOME_HA_TOKEN", "home-token")
+    monkeypatch.setenv("LAKE_HA_TOKEN", "lake-token")
+
+    sites = {site["name"]: site for site in
+             monitor.load_sites_config(str(Path(monitor.__file__).with_name("sites.yaml.example")))}
+
+    assert sites["home"]["ha_token"] == "home-token" and sites["lake-house"]["ha_token"] == "lake-token"
+    assert sites["home"]["esp32_devices"] == monitor.ESP32_DEVICES
+    assert sites["lake-house"]["esp32_devices"] == ["esp32-garden-zone-a", "esp32-utility-control"]
+    assert sites["lake-house"]["mqtt_port"] == 1883
+
+
+def test_failing_site_does_not_affect_the_others(monkeypatch):
+    monkeypatch.setattr(monitor, "HTTP_RETRY_BACKOFF", 0)
+    healthy, failing = _site_server(), _site_server()
+    failing.error_rate = 1.0
+    fleet = monitor.FleetMonitor([_site("healthy", healthy), _site("failing", failing)])
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = fleet.run_cycle()
+
+    assert fleet.monitors["healthy"].breaker.state == monitor.CircuitBreaker.CLOSED
+    assert fleet.monitors["failing"].breaker.state == monitor.CircuitBreaker.OPEN
+    assert results["sites"]["healthy"]["circuit_breaker"] == "CLOSED"
+    assert not any(SNAPSHOT_SENSOR in problem for problem in results["sites"]["healthy"]["problems"])
+    assert any("skipped: upstream down" in problem for problem in results["sites"]["failing"]["problems"])
+    fleet.close()
+    healthy.close()
+    failing.close()
+
+
+def test_sites_command_mutes_site_threads_and_restores_stdout(tmp_path, capsys):
+    server = _site_server()
+    path = tmp_path / "sites.yaml"
+    path.write_text(json.dumps({"sites": [_site("garden", server)]}))   # JSON is valid YAML
+    stdout = sys.stdout
+
+    monitor.run_sites_command(argparse.Namespace(sites=str(path), json=False, continuous=False, interval=0))
+
+    assert sys.stdout is stdout
+    output = capsys.readouterr().out
+    assert "GARDEN FLEET HEALTH REPORT" in output
+    assert "Checking" not in output   # Per-site check progress stays muted
+    server.close()
+
+################################################################################
+# TESTS: HISTORY STORE
+# PSEUDO CODE:
+#   _parse_duration -> every unit, decimals, bad input rejected
+#   NEW database -> entities + samples tables; reopening keeps entity keys
+#   APPEND cycles -> numeric, text and status rows round-trip through query
+#   history --since/--until -> only samples inside the window are printed
+################################################################################
+
+def _history_results(when: datetime, moisture: str, valve: str = "off") -> dict:
+    return {
+        "timestamp": when.isoformat(),
+        "overall_status": "HEALTHY",
+        "checks": {
+            "sensors": {"status": "HEALTHY", "sensors": {
+                SNAPSHOT_SENSOR: {"value": moisture, "age_seconds": 30.0, "status": "OK"}}},
+            "switches": {"status": "HEALTHY", "switches": {
+                SNAPSHOT_SWITCH: {"state": valve, "status": "OK"}}},
+        },
+    }
+
+
+@pytest.mark.parametrize("text, seconds", [
+    ("90s", 90), ("15m", 900), ("12h", 43200), ("7d", 604800), ("2w", 1209600), (" 1.5h ", 5400)])
+def test_parse_duration_units(text, seconds):
+    assert monitor._parse_duration(text).total_seconds() == seconds
+
+
+@pytest.mark.parametrize("text", ["", "7", "d", "7y", "-1d", "1d2h"])
+def test_parse_duration_rejects_bad_input(text):
+    with pytest.raises(ValueError, match="Invalid duration"):
+        monitor._parse_duration(text)
+
+
+def test_history_store_schema_and_reopen(tmp_path):
+    path = str(tmp_path / "history.db")
+    store = monitor.HistoryStore(path)
+    store.append(_history_results(datetime.now() - timedelta(minutes=5), "41"))
+    tables = {name for (name,) in store.db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    keys = dict(store._entity_ids)
+    store.close()
+
+    reopened = monitor.HistoryStore(path)
+
+    assert {"entities", "samples"} <= tables
+    assert reopened._entity_ids == keys
+    assert len(reopened.query(SNAPSHOT_SENSOR, datetime.now() - timedelta(hours=1))) == 1
+    reopened.close()
+
+
+def test_history_store_round_trip(tmp_path):
+    store = monitor.HistoryStore(str(tmp_path / "history.db"))
+    start = datetime.now().replace(microsecond=0) - timedelta(hours=3)
+    for hour, (moisture, valve) in enumerate([("41", "off"), ("38.5", "on"), ("unavailable", "off")]):
+        store.append(_history_results(start + timedelta(hours=hour), moisture, valve))
+
+    sensor = store.query(SNAPSHOT_SENSOR, start)
+    window = store.query(SNAPSHOT_SENSOR, start + timedelta(minutes=30),
+                         start + timedelta(minutes=90))
+
+    assert [sample["value"] for sample in sensor] == [41.0, 38.5, "unavailable"]
+    assert sensor[0] == {"timestamp": start.isoformat(), "value": 41.0, "age_seconds": 30.0, "status": "OK"}
+    assert [sample["value"] for sample in store.query(SNAPSHOT_SWITCH, start)] == ["off", "on", "off"]
+    assert [sample["status"] for sample in store.query("check.sensors", start)] == ["HEALTHY"] * 3
+    assert [sample["value"] for sample in window] == [38.5]
+    assert store.query("sensor.never_recorded", start) == []
+    store.close()
+
+
+def test_history_command_since_until(tmp_path, capsys):
+    path = str(tmp_path / "history.db")
+    store = monitor.HistoryStore(path)
+    now = datetime.now().replace(microsecond=0)
+    for hours_ago, moisture in [(30, "20"), (10, "30"), (5, "40"), (1, "50")]:
+        store.append(_history_results(now - timedelta(hours=hours_ago), moisture))
+    store.close()
+
+    def history(**options) -> str:
+        args = argparse.Namespace(entity=SNAPSHOT_SENSOR, db=path, since="1d", until=None, json=False)
+        vars(args).update(options)
+        assert monitor.run_history_command(args) == 0
+        return capsys.readouterr().out
+
+    assert "3 samples  min 30  max 50  avg 40.00" in history()
+    assert "2 samples  min 30  max 40  avg 35.00" in history(until="2h")
+    assert [sample["value"] for sample in json.loads(history(since="2d", json=True))] == [20.0, 30.0, 40.0, 50.0]
+    assert "No history for" in history(since="30m")
+    assert monitor.run_history_command(argparse.Namespace(
+        entity=SNAPSHOT_SENSOR, db=path, since="soon", until=None, json=False)) == 1
+    assert "Invalid duration 'soon'" in capsys.readouterr().out
+    assert monitor.run_history_command(argparse.Namespace(
+        entity=SNAPSHOT_SENSOR, db=str(tmp_path / "missing.db"), since="1d", until=None, json=False)) == 1
+
+################################################################################
+# TESTS: ANALYZE ARGUMENTS
+# PSEUDO CODE:
+#   BAD --period -> error message and exit code 1, no traceback
+#   --step 0 -> rejected by argparse before any grid is built
+#   HISTORY GRID: last value carried forward, across chunks too
+#   ZONE METRICS: liters, sessions, moisture gain and recovery per period
+################################################################################
+
+@pytest.mark.parametrize("period", ["bogus", "0d"])
+def test_analyze_bad_period_is_an_error_not_a_traceback(period, capsys):
+    pytest.importorskip("numpy")
+    args = argparse.Namespace(since="7d", until=None, period=period, step=monitor.ANALYZE_STEP_SECONDS,
+                              entity=[], recorder_db=None, ha_url="http://127.0.0.1:1", ha_token="", json=False)
+    
+    assert monitor.run_analyze_command(args) == 1
+    assert capsys.readouterr().out.startswith("ERROR: Invalid")
+
+
+@pytest.mark.parametrize("step", ["0", "-5", "ten"])
+def test_analyze_step_must_be_positive(step):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--step", type=monitor._positive_int)
+    
+    with pytest.raises(SystemExit):
+        parser.parse_args(["--step", step])
+    assert parser.parse_args(["--step", "60"]).step == 60
+
+
+def test_history_grid_carries_last_value_across_chunks():
+    np = pytest.importorskip("numpy")
+    grid = monitor.HistoryGrid(["sensor.a", "sensor.b"], 0, 600, 60)
+
+    grid.add_chunk(0, 300, {"sensor.a": (np.array([130.0, 0.0]), np.array([2.0, 1.0]))})
+    grid.add_chunk(300, 600, {"sensor.b": (np.array([400.0]), np.array([5.0]))})
+
+    assert grid.series("sensor.a").tolist() == [1, 1, 1, 2, 2, 2, 2, 2, 2, 2]
+    assert np.isnan(grid.series("sensor.b")[:7]).all()
+    assert grid.series("sensor.b")[7:].tolist() == [5, 5, 5]
+
+
+def test_analyze_zone_measures_sessions_per_period():
+    np = pytest.importorskip("numpy")
+    day, zone = 86400.0, monitor.ANALYZE_ZONES["zone_a"]
+    grid = monitor.HistoryGrid(list(zone.values()), 0, 2 * day, 60)
+    changes = {zone["valve"]: [(0, 0)], zone["flow"]: [(0, 0)], zone["moisture"]: [(0, 30)]}
+    for start in (6 * 3600, day + 6 * 3600):   # 06:00-06:30 at 10 L/min, moisture 30 -> 40 at 06:30
+        changes[zone["valve"]] += [(start, 1), (start + 1800, 0)]
+        changes[zone["flow"]] += [(start, 10), (start + 1800, 0)]
+        changes[zone["moisture"]] += [(start + 1800, 40), (start + 6 * 3600 + 60, 30)]
+    grid.add_chunk(0, 2 * day, {entity_id: (np.array([at for at, _ in points], dtype=float),
+                                            np.array([value for _, value in points], dtype=float))
+                                for entity_id, points in changes.items()})
+
+    metrics = monitor.analyze_zone(grid, zone, day)
+
+    assert metrics["liters"] == 600 and metrics["watering_minutes"] == 60 and metrics["sessions"] == 2
+    assert metrics["moisture_gain_per_liter"] == pytest.approx(10 / 300, abs=0.001)
+    assert metrics["recovery_minutes"] == 30
+    assert [(period["liters"], period["sessions"]) for period in metrics["periods"]] == [(300, 1), (300, 1)]
+